@@ -0,0 +1,47 @@
+import logging
+import time
+
+from renormalizer import Model, Mps, Mpo, optimize_mps
+from renormalizer.model import h_qc
+from renormalizer.utils import log
+from renormalizer.utils.log import package_logger as logger
+
+'''
+The time and the energy error of DMRG with the early sweeps in single precision
+against DMRG in double precision, for water sto-3g (10e,7o) in h2o_qc.py
+'''
+
+FCI_E = -75.008697516450
+
+
+def run(precision, mps, mpo, procedure):
+    mps = mps.copy()
+    mps.optimize_config.procedure = procedure
+    mps.optimize_config.method = "2site"
+    mps.optimize_config.precision = precision
+    time1 = time.perf_counter()
+    energies, mps = optimize_mps(mps, mpo)
+    time2 = time.perf_counter()
+    # the energy of the last sweep, in the final precision
+    return energies[-1], time2 - time1
+
+
+if __name__ == "__main__":
+
+    log.set_stream_level(logging.INFO)
+
+    spatial_norbs = 7
+    h1e, h2e, nuc = h_qc.read_fcidump("h2o_fcidump.txt", spatial_norbs)
+    basis, ham_terms = h_qc.qc_model(h1e, h2e)
+
+    model = Model(basis, ham_terms)
+    mpo = Mpo(model)
+
+    nelec = [5, 5]
+    M = 50
+    procedure = [[M, 0.4], [M, 0.2], [M, 0.1], [M, 0], [M, 0], [M, 0], [M, 0]]
+    mps = Mps.random(model, nelec, M, percent=1.0)
+
+    for precision in [None, ["float32"] * 4 + ["float64"] * 3]:
+        e, t = run(precision, mps, mpo, procedure)
+        logger.info(f"precision: {precision}, energy error: {e + nuc - FCI_E}, time: {t:.3f}s")
@@ -0,0 +1,38 @@
+import time
+
+from renormalizer import BasisHalfSpin, Op
+from renormalizer.utils.log import package_logger
+from renormalizer.tn import BasisTree, TTNO, TTNS
+from renormalizer.tn.gs import optimize_ttns
+
+# the ground state of the XXZ chain on a binary tree with and without the block sparse tensors.
+# The block sparse tensors pay off for large bond dimension
+
+logger = package_logger
+
+nspin = 16
+
+
+def build():
+    basis = [BasisHalfSpin(i, sigmaqn=[0, 1]) for i in range(nspin)]
+    ham_terms = []
+    for i in range(nspin - 1):
+        ham_terms.append(Op("sigma_z sigma_z", [i, i + 1], 0.25, qn=[0, 0]))
+        ham_terms.append(Op("sigma_+ sigma_-", [i, i + 1], 0.5, qn=[-1, 1]))
+        ham_terms.append(Op("sigma_- sigma_+", [i, i + 1], 0.5, qn=[1, -1]))
+    basis_tree = BasisTree.binary(basis)
+    return basis_tree, TTNO(basis_tree, ham_terms)
+
+
+if __name__ == "__main__":
+    basis_tree, ttno = build()
+    for m in [16, 64, 128]:
+        ttns0 = TTNS.random(basis_tree, qntot=nspin // 2, m_max=m)
+        procedure = [[m, 0.4], [m, 0.2], [m, 0]]
+        for block_sparse in [False, True]:
+            ttns = ttns0.copy()
+            ttns.block_sparse = block_sparse
+            time1 = time.perf_counter()
+            e = optimize_ttns(ttns, ttno, procedure)
+            time2 = time.perf_counter()
+            logger.info(f"M: {m}, block sparse: {block_sparse}, energy: {e[-1]}, time: {time2 - time1:.3f}s")
@@ -0,0 +1,55 @@
+import time
+
+from renormalizer.model import Op
+from renormalizer.model import basis as ba
+from renormalizer.sbm import ColeDavidsonSDF
+from renormalizer.utils.log import package_logger
+from renormalizer.tn import BasisTree, TTNO, TreeNodeBasis
+
+import numpy as np
+
+# the time of TTNO construction against the number of modes for the spin-boson model
+# with the tree of sbm_zt.py
+
+logger = package_logger
+
+ita = 1
+eps = 0
+Delta = 1
+omega_c = 1
+beta = 0.5
+upper_limit = 30
+Ms = 20
+
+
+def build_ttno(nmodes):
+    sdf = ColeDavidsonSDF(ita, omega_c, beta, upper_limit)
+    w, c2 = sdf.Wang1(nmodes)
+    c = np.sqrt(c2)
+
+    ham_terms = [Op("sigma_z", "spin", factor=eps, qn=0), Op("sigma_x", "spin", factor=Delta, qn=0)]
+    for imode in range(nmodes):
+        ham_terms.append(Op(r"p^2", f"v_{imode}", factor=0.5, qn=0))
+        ham_terms.append(Op(r"x^2", f"v_{imode}", factor=0.5 * w[imode] ** 2, qn=0))
+        ham_terms.append(Op(r"sigma_z x", ["spin", f"v_{imode}"], factor=c[imode], qn=[0, 0]))
+
+    nbas = np.max([16 * c2 / w**3, np.ones(nmodes) * 4], axis=0)
+    nbas = np.round(nbas).astype(int)
+    basis = [ba.BasisHalfSpin("spin", [0, 0])]
+    for imode in range(nmodes):
+        basis.append(ba.BasisSHO(f"v_{imode}", w[imode], int(nbas[imode])))
+
+    root = BasisTree.binary_mctdh(basis[1:], contract_primitive=True, contract_label=nbas > Ms, dummy_label="n").root
+    root.add_child(TreeNodeBasis(basis[:1]))
+    basis_tree = BasisTree(root)
+
+    time1 = time.perf_counter()
+    ttno = TTNO(basis_tree, ham_terms)
+    time2 = time.perf_counter()
+    return ttno, time2 - time1
+
+
+if __name__ == "__main__":
+    for nmodes in [50, 100, 200, 500, 1000]:
+        ttno, t = build_ttno(nmodes)
+        logger.info(f"nmodes: {nmodes}, nodes: {len(ttno)}, max bond dimension: {max(ttno.bond_dims)}, time: {t:.3f}s")
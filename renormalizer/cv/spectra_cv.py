@@ -4,6 +4,7 @@
 import numpy as np
 from multiprocessing import Pool
 import multiprocessing
+import queue
 from renormalizer.mps import Mpo
 from renormalizer.utils import Quantity, CompressCriteria, CompressConfig
 from renormalizer.utils.elementop import construct_e_op_dict, ph_op_matrix
@@ -14,37 +15,110 @@ from typing import List
 
 logger = logging.getLogger(__name__)
 
-def batch_run(freq_reg, cores, obj, filename=None):
+# the calculation object of the worker process. Set once by ``_init_worker``
+# so that the Hamiltonian MPO, the B-MPS and so on are not pickled for every frequency
+_worker_obj = None
+_worker_init_cv_mps = None
+# the finished frequencies are sent back through the queue one by one
+_worker_queue = None
+
+
+def _init_worker(obj, init_cv_mps, result_queue):
+    global _worker_obj, _worker_init_cv_mps, _worker_queue
+    _worker_obj = obj
+    _worker_init_cv_mps = init_cv_mps
+    _worker_queue = result_queue
+
+
+def _solve(obj, omega, init_cv_mps=None):
+    # without ``init_cv_mps`` the X-MPS of the last frequency solved by ``obj``
+    # is used as the initial guess (warm start)
+    if init_cv_mps is not None:
+        obj.cv_mps = init_cv_mps.copy()
+    return obj.cv_solve(omega)
+
+
+def _worker_solve(args):
+    # ``args`` is a contiguous range of the sorted frequencies
+    for i, omega in args:
+        _worker_queue.put((i, _solve(_worker_obj, omega, _worker_init_cv_mps)))
+
+
+def batch_run(freq_reg, cores, obj, filename=None, warm_start=True):
     """
     batch run of cv calculation
     freq_reg: list object, frequecny windown
     cores: number of cores to be used in multiprocessing calculation
     obj: SpectraZtCV or SpectraFtCV
+    filename: the results are saved to ``filename`` by ``np.save`` after all frequencies are finished.
+        Each finished frequency is also written to ``{filename}.dat`` as a line of ``omega result``
+        as soon as it is finished. The file is overwritten in a new run.
+    warm_start: the sorted frequencies are split into ``cores`` contiguous ranges and each
+        process calculates its range in ascending order, so the converged X-MPS of the
+        neighboring lower frequency is used as the initial guess. The first frequency of
+        each range starts from the initial guess of ``obj``.
+        If ``False``, the initial guess of ``obj`` is used for every frequency.
+
+    The object is sent to each worker process only once.
     """
     logger.info(f"{len(freq_reg)} total frequency points to do")
-    spectra = []
+    spectra = [None] * len(freq_reg)
     obj.batch_run = True
+    # neighboring frequencies are calculated successively for warm start
+    order = np.argsort(freq_reg, kind="stable")
+    if warm_start:
+        init_cv_mps = None
+    else:
+        init_cv_mps = obj.cv_mps.copy()
 
-    if cores > 1:
-        # multiprocessing
-        if importlib.util.find_spec("cupy"):
-            multiprocessing.set_start_method('forkserver', force=True)
-        pool = Pool(processes=cores)
-        logger.info(f"{cores} multiprocess parallelization activated")
-        for i_spec in pool.imap(obj.cv_solve, freq_reg):
-            spectra.append(i_spec)
-            if filename is not None:
-                np.save(f"{filename}", spectra)
-        pool.close()
-        pool.join()
-    elif cores == 1:
-        # single process
-        for omega in freq_reg:
-            spectra.append(obj.cv_solve(omega))
-            if filename is not None:
-                np.save(f"{filename}", spectra)
+    if filename is not None:
+        fout = open(f"{filename}.dat", "w")
     else:
-        assert False
+        fout = None
+
+    def record(i, i_spec):
+        spectra[i] = i_spec
+        if fout is not None:
+            # the finished results are never rewritten
+            values = " ".join(str(v) for v in np.ravel(i_spec))
+            fout.write(f"{freq_reg[i]} {values}\n")
+            fout.flush()
+
+    try:
+        if cores > 1:
+            # multiprocessing
+            if importlib.util.find_spec("cupy"):
+                multiprocessing.set_start_method('forkserver', force=True)
+            result_queue = multiprocessing.Queue()
+            pool = Pool(processes=cores, initializer=_init_worker, initargs=(obj, init_cv_mps, result_queue))
+            logger.info(f"{cores} multiprocess parallelization activated")
+            chunks = [chunk for chunk in np.array_split(order, cores) if len(chunk) != 0]
+            args = [[(i, freq_reg[i]) for i in chunk] for chunk in chunks]
+            async_result = pool.map_async(_worker_solve, args)
+            for _ in range(len(freq_reg)):
+                while True:
+                    try:
+                        i, i_spec = result_queue.get(timeout=1)
+                        break
+                    except queue.Empty:
+                        if async_result.ready():
+                            # raises the exception in the worker if any
+                            async_result.get()
+                record(i, i_spec)
+            pool.close()
+            pool.join()
+        elif cores == 1:
+            # single process
+            for i in order:
+                record(i, _solve(obj, freq_reg[i], init_cv_mps))
+        else:
+            assert False
+    finally:
+        if fout is not None:
+            fout.close()
+
+    if filename is not None:
+        np.save(f"{filename}", spectra)
 
     return spectra
 
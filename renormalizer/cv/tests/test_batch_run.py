@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from renormalizer.mps.backend import np
+from renormalizer.cv import batch_run
+
+
+class DummyMps:
+    def __init__(self, omega=-1):
+        self.omega = omega
+
+    def copy(self):
+        return DummyMps(self.omega)
+
+
+class DummyCv:
+    # records the initial guess of each frequency
+    def __init__(self):
+        self.cv_mps = DummyMps()
+        self.batch_run = False
+
+    def cv_solve(self, omega):
+        guess = self.cv_mps.omega
+        self.cv_mps = DummyMps(omega)
+        return omega, guess
+
+
+@pytest.mark.parametrize("cores", (1, 2))
+@pytest.mark.parametrize("warm_start", (True, False))
+def test_batch_run(cores, warm_start, tmp_path):
+    freq_reg = [0.3, 0.1, 0.4, 0.2]
+    filename = os.path.join(tmp_path, "spectra")
+    result = batch_run(freq_reg, cores, DummyCv(), filename, warm_start=warm_start)
+    assert [res[0] for res in result] == freq_reg
+    guesses = [res[1] for res in result]
+    if not warm_start:
+        assert guesses == [-1] * len(freq_reg)
+    elif cores == 1:
+        # warm start from the nearest finished frequency
+        assert guesses == [0.2, -1, 0.3, 0.1]
+    else:
+        # [0.1, 0.2] and [0.3, 0.4] are calculated by the two processes
+        assert guesses == [-1, -1, 0.3, 0.1]
+    assert np.allclose(np.load(filename + ".npy")[:, 0], freq_reg)
+    streamed = np.loadtxt(filename + ".dat")
+    assert sorted(streamed[:, 0]) == sorted(freq_reg)
+
+    # a new run does not append to the stale results
+    batch_run(freq_reg[:2], cores, DummyCv(), filename, warm_start=warm_start)
+    streamed = np.loadtxt(filename + ".dat")
+    assert sorted(streamed[:, 0]) == sorted(freq_reg[:2])
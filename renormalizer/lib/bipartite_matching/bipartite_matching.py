@@ -77,11 +77,11 @@ def bipartite_vertex_cover(bigraph, algo="Hopcroft-Karp"):
     :complexity: `O(\sqrt(|V|)*|E|)`
     """
     if algo == "Hopcroft-Karp":
-        coord = [(irow,icol) for irow,cols in enumerate(bigraph) for icol in cols]
-        coord = np.array(coord)
-        graph = csr_matrix((np.ones(coord.shape[0]),(coord[:,0],coord[:,1])))
+        rows = np.repeat(np.arange(len(bigraph)), [len(cols) for cols in bigraph])
+        cols = np.concatenate(bigraph).astype(int)
+        graph = csr_matrix((np.ones(len(rows)), (rows, cols)))
         matchV = maximum_bipartite_matching(graph, perm_type='row')
-        matchV = [None if x==-1 else x for x in matchV]
+        matchV = [None if x == -1 else x for x in matchV.tolist()]
         nU, nV = graph.shape
         assert len(matchV) == nV
     elif algo ==  "Hungarian":
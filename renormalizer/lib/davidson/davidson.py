@@ -23,11 +23,11 @@ Extension to scipy.linalg module
 import sys
 import warnings
 import tempfile
+from functools import lru_cache
 
 import numpy
 np = numpy
 import scipy.linalg
-import h5py
 
 from renormalizer.lib.davidson import logger
 
@@ -512,34 +512,45 @@ class LinearDependenceError(RuntimeError):
     pass
 
 
-class H5TmpFile(h5py.File):
-    '''Create and return an HDF5 temporary file.
-    Kwargs:
-        filename : str or None
-            If a string is given, an HDF5 file of the given filename will be
-            created. The temporary file will exist even if the H5TmpFile
-            object is released.  If nothing is specified, the HDF5 temporary
-            file will be deleted when the H5TmpFile object is released.
-    The return object is an h5py.File object. The file will be automatically
-    deleted when it is closed or the object is released (unless filename is
-    specified).
-    '''
-    def __init__(self, filename=None, mode='a', *args, **kwargs):
-        if filename is None:
-            tmpfile = tempfile.NamedTemporaryFile(dir=".")
-            filename = tmpfile.name
-        h5py.File.__init__(self, filename, mode, *args, **kwargs)
-#FIXME: Does GC flush/close the HDF5 file when releasing the resource?
-# To make HDF5 file reusable, file has to be closed or flushed
-    def __del__(self):
-        try:
-            self.close()
-        except AttributeError:  # close not defined in old h5py
-            pass
-        except ValueError:  # if close() is called twice
-            pass
-        except ImportError:  # exit program before de-referring the object
-            pass
+@lru_cache(None)
+def _h5tmpfile_class():
+    # h5py is imported only when the vectors are kept on disk
+    import h5py
+
+    class H5TmpFile(h5py.File):
+        '''Create and return an HDF5 temporary file.
+        Kwargs:
+            filename : str or None
+                If a string is given, an HDF5 file of the given filename will be
+                created. The temporary file will exist even if the H5TmpFile
+                object is released.  If nothing is specified, the HDF5 temporary
+                file will be deleted when the H5TmpFile object is released.
+        The return object is an h5py.File object. The file will be automatically
+        deleted when it is closed or the object is released (unless filename is
+        specified).
+        '''
+        def __init__(self, filename=None, mode='a', *args, **kwargs):
+            if filename is None:
+                tmpfile = tempfile.NamedTemporaryFile(dir=".")
+                filename = tmpfile.name
+            h5py.File.__init__(self, filename, mode, *args, **kwargs)
+        #FIXME: Does GC flush/close the HDF5 file when releasing the resource?
+        # To make HDF5 file reusable, file has to be closed or flushed
+        def __del__(self):
+            try:
+                self.close()
+            except AttributeError:  # close not defined in old h5py
+                pass
+            except ValueError:  # if close() is called twice
+                pass
+            except ImportError:  # exit program before de-referring the object
+                pass
+
+    return H5TmpFile
+
+
+def H5TmpFile(filename=None, mode='a', *args, **kwargs):
+    return _h5tmpfile_class()(filename, mode, *args, **kwargs)
 
 
 class _Xlist(list):
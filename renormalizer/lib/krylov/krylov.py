@@ -2,6 +2,8 @@
 # adopted from https://github.com/cmendl/pytenet/blob/master/pytenet/krylov.py
 
 import logging
+import threading
+from collections import OrderedDict
 
 from scipy.linalg import eigh_tridiagonal
 import numpy as np
@@ -12,7 +14,70 @@ from renormalizer.mps.backend import xp
 logger = logging.getLogger(__name__)
 
 
-def _expm_krylov(alpha, beta, V, v_norm, dt):
+class KrylovWorkspace:
+    """
+    Reusable memory for the Krylov vectors, keyed on the shape and the dtype of the vectors.
+    The buffers are reused across sites and time steps to avoid allocating the Krylov space
+    for every call of :func:`expm_krylov`.
+    The least recently used buffers are freed if the total size exceeds ``max_bytes``.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total size of the buffers in bytes.
+    """
+
+    def __init__(self, max_bytes: int = 2**30):
+        self.max_bytes = max_bytes
+        self._buffers = OrderedDict()
+
+    def get(self, nvec, shape, dtype):
+        # a buffer for at least ``nvec`` Krylov vectors. The content is undefined
+        key = (tuple(shape), np.dtype(dtype).str)
+        buffer = self._buffers.pop(key, None)
+        if buffer is None or len(buffer) < nvec:
+            buffer = xp.empty((nvec,) + tuple(shape), dtype=dtype)
+        self._store(key, buffer)
+        return buffer
+
+    def grow(self, buffer, nvec):
+        # a larger buffer with the content of ``buffer`` copied
+        key = (buffer.shape[1:], buffer.dtype.str)
+        new_buffer = xp.empty((nvec,) + buffer.shape[1:], dtype=buffer.dtype)
+        new_buffer[:len(buffer)] = buffer
+        self._buffers.pop(key, None)
+        self._store(key, new_buffer)
+        return new_buffer
+
+    def _store(self, key, buffer):
+        self._buffers[key] = buffer
+        # the buffer just stored is always kept
+        while self.max_bytes < self.nbytes and 1 < len(self._buffers):
+            self._buffers.popitem(last=False)
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def clear(self):
+        self._buffers.clear()
+
+
+# one workspace for each thread
+_local = threading.local()
+
+
+def get_workspace() -> KrylovWorkspace:
+    """
+    The default :class:`KrylovWorkspace` of the current thread.
+    """
+    if not hasattr(_local, "workspace"):
+        _local.workspace = KrylovWorkspace()
+    return _local.workspace
+
+
+def _krylov_coeff(alpha, beta, dt):
+    # the coefficients of `expm(dt*T) e_1` for the tridiagonal matrix T in the Krylov space
     # diagonalize Hessenberg matrix (tridiagonal matrix for hermitian matrix A)
     try:
         w_hess, u_hess = eigh_tridiagonal(alpha, beta)
@@ -21,10 +86,15 @@ def _expm_krylov(alpha, beta, V, v_norm, dt):
         h = np.diag(alpha) + np.diag(beta, k=-1) + np.diag(beta, k=1)
         w_hess, u_hess = np.linalg.eigh(h)
 
-    return V @ xp.asarray(u_hess @ (v_norm * np.exp(dt*w_hess) * u_hess[0]))
+    return u_hess @ (np.exp(dt*w_hess) * u_hess[0])
 
 
-def expm_krylov(Afunc, dt, vstart: xp.ndarray, block_size=50):
+def _expm_krylov(alpha, beta, V, v_norm, dt):
+    # ``V`` holds the Krylov vectors as rows
+    return xp.tensordot(xp.asarray(v_norm * _krylov_coeff(alpha, beta, dt)), V, axes=1)
+
+
+def expm_krylov(Afunc, dt, vstart: xp.ndarray, block_size=50, tol=1e-10, workspace: KrylovWorkspace=None):
     """
     Compute Krylov subspace approximation of the matrix exponential
     applied to input vector: `expm(dt*A)*v`.
@@ -33,52 +103,124 @@ def expm_krylov(Afunc, dt, vstart: xp.ndarray, block_size=50):
         M. Hochbruck and C. Lubich
         On Krylov subspace approximations to the matrix exponential operator
         SIAM J. Numer. Anal. 34, 1911 (1997)
-    """
-    if not np.iscomplex(dt):
-        dt = dt.real
-
-    # normalize starting vector
-    vstart = xp.asarray(vstart)
-    nrmv = float(xp.linalg.norm(vstart))
-    assert nrmv > 0
-    vstart = vstart / nrmv
-
-    alpha = np.zeros(block_size)
-    beta  = np.zeros(block_size - 1)
-
-    V = xp.empty((block_size, len(vstart)), dtype=vstart.dtype)
-    V[0] = vstart
-    res = None
 
+    The convergence is checked by the a posteriori error estimate
+    :math:`\\beta_j |e_j^T \\exp(dt T_j) e_1|` relative to the norm of ``vstart``
+    (Y. Saad, SIAM J. Numer. Anal. 29, 209 (1992)),
+    so the approximation is only formed once at the end.
+    The memory of the Krylov vectors is taken from ``workspace``,
+    which is by default shared by all calls in the same thread.
+    """
+    res, nvecs = expm_krylov_batch(
+        lambda vs: Afunc(vs[0])[None, :], dt, xp.asarray(vstart)[None, :], block_size, tol, workspace
+    )
+    return res[0], nvecs[0]
 
-    for j in range(len(vstart)):
-        
-        w = Afunc(V[j])
-        alpha[j] = xp.vdot(w, V[j]).real
 
-        if j == len(vstart)-1:
+def expm_krylov_batch(Afunc, dt, vstarts: xp.ndarray, block_size=50, tol=1e-10, workspace: KrylovWorkspace=None,
+                      with_index=False):
+    """
+    :func:`expm_krylov` for several independent vectors under the same matrix.
+    Each vector has its own Krylov space, but the matrix is applied to all unconverged vectors at once.
+
+    Parameters
+    ----------
+    Afunc : callable
+        Applies the matrix to a block of vectors with shape ``(nvectors, n)``.
+        If ``with_index`` is ``True``, the indices of the vectors in ``vstarts`` are passed as the second argument,
+        so that each vector could be multiplied by a matrix of its own.
+    dt : float or complex
+        The time step.
+    vstarts : xp.ndarray
+        The vectors with shape ``(nvectors, n)``.
+
+    Returns
+    -------
+    res : xp.ndarray
+        `expm(dt*A)*v` of each vector.
+    nvecs : list of int
+        The number of Krylov vectors for each vector.
+    """
+    if not np.iscomplex(dt):
+        dt = dt.real
+    if workspace is None:
+        workspace = get_workspace()
+
+    # normalize starting vectors
+    vstarts = xp.asarray(vstarts)
+    nbatch, n = vstarts.shape
+    nrmv = np.array([float(xp.linalg.norm(v)) for v in vstarts])
+    assert np.all(nrmv > 0)
+
+    alpha = np.zeros((nbatch, block_size))
+    beta = np.zeros((nbatch, block_size - 1))
+
+    V = workspace.get(block_size, (nbatch, n), vstarts.dtype)
+    V[0] = vstarts / xp.asarray(nrmv)[:, None]
+
+    # The logarithm of the leading Taylor term of the error estimate, |dt|^j / j! * prod(beta[:j+1]).
+    # Updated for each iteration at little cost and used to decide when to check the error estimate
+    log_est = np.zeros(nbatch)
+    log_dt = np.log(abs(dt)) if dt != 0 else -np.inf
+    log_tol = np.log(tol)
+
+    res = [None] * nbatch
+    nvecs = [None] * nbatch
+    # the vectors not converged
+    active = list(range(nbatch))
+
+    def converge(i, j):
+        res[i] = _expm_krylov(alpha[i, :j+1], beta[i, :j], V[:j+1, i], nrmv[i], dt)
+        nvecs[i] = j + 1
+
+    for j in range(n):
+
+        if len(active) == nbatch:
+            w = Afunc(V[j], active) if with_index else Afunc(V[j])
+        else:
+            w = Afunc(V[j, active], active) if with_index else Afunc(V[j, active])
+        for k, i in enumerate(active):
+            alpha[i, j] = xp.vdot(w[k], V[j, i]).real
+
+        if j == n-1:
             #logger.debug("the krylov subspace is equal to the full space")
-            return _expm_krylov(alpha[:j+1], beta[:j], V[:j+1, :].T, nrmv, dt), j+1
-        
+            for i in active:
+                converge(i, j)
+            break
+
+        if alpha.shape[1] == j+1:
+            alpha = np.concatenate([alpha, np.zeros((nbatch, block_size))], axis=1)
+            beta = np.concatenate([beta, np.zeros((nbatch, block_size))], axis=1)
+        # the buffer from the workspace may be larger than required
         if len(V) == j+1:
-            V, old_V = xp.empty((len(V) + block_size, len(vstart)), dtype=vstart.dtype), V
-            V[:len(old_V)] = old_V
-            del old_V
-            alpha = np.concatenate([alpha, np.zeros(block_size)])
-            beta = np.concatenate([beta, np.zeros(block_size)])
-
-        w -= alpha[j]*V[j] + (beta[j-1]*V[j-1] if j > 0 else 0)
-        beta[j] = xp.linalg.norm(w)
-        if beta[j] < 100*len(vstart)*np.finfo(float).eps:
-            # logger.warning(f'beta[{j}] ~= 0 encountered during Lanczos iteration.')
-            return _expm_krylov(alpha[:j+1], beta[:j], V[:j+1, :].T, nrmv, dt), j+1
-
-        if 3 < j and j % 2 == 0:
-            new_res = _expm_krylov(alpha[:j+1], beta[:j], V[:j+1].T, nrmv, dt)
-            if res is not None and xp.allclose(res, new_res):
-                return new_res, j+1
-            else:
-                res = new_res
-        V[j + 1] = w / beta[j]
-
-
+            V = workspace.grow(V, alpha.shape[1])
+
+        new_active = []
+        for k, i in enumerate(active):
+            wi = w[k]
+            wi -= alpha[i, j]*V[j, i] + (beta[i, j-1]*V[j-1, i] if j > 0 else 0)
+            beta[i, j] = xp.linalg.norm(wi)
+            if beta[i, j] < 100*n*np.finfo(float).eps:
+                # logger.warning(f'beta[{j}] ~= 0 encountered during Lanczos iteration.')
+                converge(i, j)
+                continue
+
+            log_est[i] += np.log(beta[i, j]) + (log_dt - np.log(j) if j > 0 else 0)
+            if 3 < j and log_est[i] < log_tol:
+                # the a posteriori error estimate, which requires diagonalizing the tridiagonal matrix.
+                # Only performed if the Taylor term indicates convergence
+                coeff = _krylov_coeff(alpha[i, :j+1], beta[i, :j], dt)
+                err = beta[i, j] * abs(coeff[-1])
+                if err < tol:
+                    converge(i, j)
+                    continue
+                # the Taylor term underestimates the error. Continue from the actual error
+                log_est[i] = np.log(err)
+            V[j + 1, i] = wi / beta[i, j]
+            new_active.append(i)
+
+        active = new_active
+        if not active:
+            break
+
+    return xp.stack(res), nvecs
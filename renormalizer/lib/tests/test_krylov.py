@@ -2,7 +2,7 @@
 
 
 from renormalizer.mps.backend import xp
-from renormalizer.lib import expm_krylov
+from renormalizer.lib import expm_krylov, expm_krylov_batch, KrylovWorkspace
 from renormalizer.mps.matrix import asxp
 import pytest
 import numpy as np
@@ -37,3 +37,60 @@ def test_expm(N, imag, block_size):
     res1 = x @ np.diag(np.exp(w)) @ x.conj().T @ v
     res2, _ = expm_krylov(lambda x: a2.dot(x), 1, xp.array(v), block_size)
     assert xp.allclose(res1, res2)
+
+
+@pytest.mark.parametrize("N", (1, 10, 200))
+def test_expm_batch(N):
+    a1 = np.random.rand(N, N) / N
+    a1 += a1.T
+    a2 = xp.array(a1)
+    # vectors with different convergence
+    vs = np.random.rand(3, N)
+    vs[1] = 1
+    w, x = eigh(a1)
+    res1 = [x @ np.diag(np.exp(-1j * w)) @ x.T @ v for v in vs]
+
+    workspace = KrylovWorkspace()
+    res2, nvecs = expm_krylov_batch(lambda y: y @ a2.T, -1j, xp.array(vs), 3, workspace=workspace)
+    assert xp.allclose(asxp(np.array(res1)), res2)
+    for v, r, nvec in zip(vs, res2, nvecs):
+        r1, nvec1 = expm_krylov(lambda y: a2.dot(y), -1j, xp.array(v), 3, workspace=workspace)
+        assert xp.allclose(r, r1)
+        assert nvec == nvec1
+    # the buffers are reused
+    nbytes = workspace.nbytes
+    expm_krylov_batch(lambda y: y @ a2.T, -1j, xp.array(vs), 3, workspace=workspace)
+    assert workspace.nbytes == nbytes
+    # each vector with a matrix of its own
+    scales = xp.array([1, 2, 3])
+    res3, _ = expm_krylov_batch(
+        lambda y, index: scales[index, None] * (y @ a2.T), -1j, xp.array(vs), 3, with_index=True
+    )
+    for v, r, scale in zip(vs, res3, [1, 2, 3]):
+        assert xp.allclose(r, expm_krylov(lambda y: scale * a2.dot(y), -1j, xp.array(v), 3)[0])
+
+
+@pytest.mark.parametrize("dt", (1, -1j, -5j))
+def test_expm_error_check(dt, monkeypatch):
+    # the tridiagonal matrix is diagonalized only a few times
+    from renormalizer.lib.krylov import krylov
+    calls = []
+
+    def krylov_coeff(*args):
+        calls.append(len(args[0]))
+        return _krylov_coeff(*args)
+
+    _krylov_coeff = krylov._krylov_coeff
+    monkeypatch.setattr(krylov, "_krylov_coeff", krylov_coeff)
+
+    N = 400
+    a = np.random.rand(N, N)
+    a = (a + a.T) / N * 10
+    v = np.random.rand(N)
+    w, x = eigh(a)
+    res1 = x @ (np.exp(dt * w) * (x.T @ v))
+    res2, nvec = expm_krylov(lambda y: a.dot(y), dt, xp.array(v))
+    assert xp.allclose(asxp(res1), res2)
+    assert 10 <= nvec
+    # the checks and the final result
+    assert len(calls) <= 4
@@ -3,14 +3,47 @@ from renormalizer.model import Op
 from typing import Union, List
 import scipy.linalg
 import scipy.special
-import itertools
 import logging
-import sympy as sp
-import scipy.integrate
+from functools import wraps
+
+from renormalizer.utils.utils import lazy_import
+
+# only required by the quadrature of BasisSineDVR
+sp = lazy_import("sympy")
+integrate = lazy_import("scipy.integrate")
 
 logger = logging.getLogger(__name__)
 
 
+def _cached_op_mat(op_mat):
+    # Memoize the matrix representation of the operators without the factor.
+    # The key is the symbol (and the DoF names for basis sets containing multiple DoFs)
+    # and the factor is applied afterwards.
+    # The operators in the model and in the MPO construction are repeated many times,
+    # so in most cases the matrices are calculated only once for each basis set.
+    @wraps(op_mat)
+    def wrapper(self, op):
+        if not isinstance(op, Op):
+            op = Op(op, None)
+        if self.multi_dof:
+            key = (op.symbol, tuple(op.dofs))
+        else:
+            key = op.symbol
+        # the matrix may depend on whether it's called by the user or by the recursion
+        # (``dvr`` rotation of ``BasisSineDVR``)
+        # and on the attributes of the basis set which could be modified after construction
+        state = tuple(getattr(self, attr) for attr in self._op_mat_state_attrs)
+        key = (key, getattr(self, "_recursion_flag", 0) == 0, state)
+        cache = self.__dict__.setdefault("_op_mat_cache", {})
+        mat = cache.get(key)
+        if mat is None:
+            mat = op_mat(self, Op(op.symbol, op.dofs))
+            mat.flags.writeable = False
+            cache[key] = mat
+        return mat * op.factor
+    return wrapper
+
+
 class BasisSet:
     r"""
     the parent class for local basis set
@@ -27,6 +60,9 @@ class BasisSet:
 
     #: If the basis set represent electronic DoF.
     is_electron = False
+
+    # the attributes that the operator matrices depend on. Part of the key of the cached matrices
+    _op_mat_state_attrs = ("nbas",)
     #: If the basis set represent vibrational DoF.
     is_phonon = False
     #: If the basis set represent spin DoF.
@@ -60,6 +96,8 @@ class BasisSet:
         """
         Matrix representation under the basis set of the input operator.
         The factor is included.
+        The matrices are cached for each symbol in the basis set,
+        so the basis set should not be modified after the first call.
 
         Parameters
         ----------
@@ -125,6 +163,8 @@ class BasisSHO(BasisSet):
 
     is_phonon = True
 
+    _op_mat_state_attrs = ("nbas", "omega", "x0", "dvr", "general_xp_power")
+
     def __init__(self, dof, omega, nbas, x0=0., dvr=False, general_xp_power=False):
         self.omega = omega
         self.x0 = x0  # origin = x0
@@ -145,6 +185,7 @@ class BasisSHO(BasisSet):
     def __str__(self):
         return f"BasisSHO(dof: {self.dof}, x0: {self.x0}, omega: {self.omega}, nbas: {self.nbas})"
 
+    @_cached_op_mat
     def op_mat(self, op: Union[Op, str]):
         if not isinstance(op, Op):
             op = Op(op, None)
@@ -243,10 +284,9 @@ class BasisSHO(BasisSet):
                 assert np.allclose(moment, round(moment))
                 moment = round(moment)
                 mat = np.zeros((self.nbas, self.nbas))
-                for imoment in range(moment+1):
+                for imoment, y_mat in enumerate(x_power_series(moment, self.nbas)):
                     factor = scipy.special.comb(moment, imoment) * np.sqrt(1/self.omega) ** imoment
-                    for i,j in itertools.product(range(self.nbas), repeat=2):
-                        mat[i,j] += factor * x_power_k(imoment, i, j) * self.x0**(moment-imoment)
+                    mat += factor * y_mat * self.x0**(moment-imoment)
 
             else:
                 mat = np.diag(self.dvr_x ** moment)
@@ -280,18 +320,9 @@ class BasisSHO(BasisSet):
             # the moment for p should be integer
             assert np.allclose(moment, round(moment))
             moment = round(moment)
+            mat = p_power_k_mat(moment, self.nbas) * np.sqrt(self.omega) ** moment
             if moment % 2 == 0:
-                dtype = np.float64
-            else:
-                dtype = np.complex128
-            mat = np.zeros((self.nbas, self.nbas), dtype=dtype)
-
-            for i,j in itertools.product(range(self.nbas), repeat=2):
-                res = p_power_k(moment, i, j) * np.sqrt(self.omega) ** moment
-                if moment % 2 == 0:
-                    mat[i,j] = np.real(res)
-                else:
-                    mat[i,j] = res
+                mat = mat.real
 
             if self.dvr:
                 mat = self.dvr_v.T @ mat @ self.dvr_v
@@ -421,6 +452,8 @@ class BasisSineDVR(BasisSet):
     """
     is_phonon = True
     
+    _op_mat_state_attrs = ("nbas", "xi", "xf", "quadrature", "dvr")
+
     def __init__(self, dof, nbas, xi, xf, endpoint=False, quadrature=False,
             dvr=False):
 
@@ -449,6 +482,7 @@ class BasisSineDVR(BasisSet):
     def __str__(self):
         return f"BasisSineDVR(xi: {self.xi}, xf: {self.xf}, nbas: {self.nbas})"
 
+    @_cached_op_mat
     def op_mat(self, op: Union[Op, str]):
         
         if not isinstance(op, Op):
@@ -645,7 +679,7 @@ class BasisSineDVR(BasisSet):
         mat = np.zeros((self.nbas, self.nbas))
         for ibas in range(self.nbas):
             for jbas in range(self.nbas):
-                val, error = scipy.integrate.quad(lambda x: expr(x, ibas, jbas), 
+                val, error = integrate.quad(lambda x: expr(x, ibas, jbas), 
                         self.xi, self.xf)
                 mat[ibas, jbas] = val
         return mat
@@ -774,6 +808,7 @@ class BasisMultiElectron(BasisSet):
         self.dof_name_map = {name: i for i, name in enumerate(dof)}
         super().__init__(dof, len(dof), sigmaqn)
 
+    @_cached_op_mat
     def op_mat(self, op: Op):
 
         op_symbol, op_factor = op.split_symbol, op.factor
@@ -834,6 +869,7 @@ class BasisMultiElectronVac(BasisSet):
         self.dof_name_map = {k: v + 1 for v, k in enumerate(dof)}
         super().__init__(dof, len(dof) + 1, sigmaqn)
 
+    @_cached_op_mat
     def op_mat(self, op: Op):
 
         op_symbol, op_factor = op.split_symbol, op.factor
@@ -905,6 +941,7 @@ class BasisSimpleElectron(BasisSet):
             sigmaqn = [0, 1]
         super().__init__(dof, 2, sigmaqn)
 
+    @_cached_op_mat
     def op_mat(self, op):
         if not isinstance(op, Op):
             op = Op(op, None)
@@ -960,6 +997,7 @@ class BasisHalfSpin(BasisSet):
             sigmaqn = [0, 0]
         super().__init__(dof, 2, sigmaqn)
 
+    @_cached_op_mat
     def op_mat(self, op: Union[Op, str]):
         if not isinstance(op, Op):
             op = Op(op, None)
@@ -1046,3 +1084,36 @@ def x_power_k(k, m, n):
 def p_power_k(k,m,n):
 # <m|p^k|n>
     return x_power_k(k,m,n) * (1j)**(m-n)
+
+
+def x_power_series(k, nbas):
+    r"""
+    The matrices :math:`\langle m|X^{i}|n\rangle` for :math:`i=0,1,\cdots,k`
+    in the first ``nbas`` SHO basis, where :math:`X=(b^\dagger+b)/\sqrt{2}`.
+    Equivalent to :func:`x_power_k` for all matrix elements.
+
+    The powers are calculated by matrix multiplication in ``nbas + k`` SHO basis,
+    which is exact for the first ``nbas`` basis because
+    :math:`X` only couples the neighbouring basis.
+    """
+    assert type(k) is int and 0 <= k
+    dim = nbas + k
+    sqrt_n = np.sqrt(np.arange(1, dim) / 2)
+    x_mat = np.diag(sqrt_n, k=1) + np.diag(sqrt_n, k=-1)
+    res = [np.eye(nbas)]
+    power = np.eye(dim)[:, :nbas]
+    for _ in range(k):
+        power = x_mat @ power
+        res.append(power[:nbas])
+    return res
+
+
+def x_power_k_mat(k, nbas):
+    # <m|X^k|n> for all m, n < nbas
+    return x_power_series(k, nbas)[-1]
+
+
+def p_power_k_mat(k, nbas):
+    # <m|P^k|n> for all m, n < nbas
+    idx = np.arange(nbas)
+    return x_power_k_mat(k, nbas) * (1j) ** (idx[:, None] - idx[None, :])
@@ -181,6 +181,10 @@ def qc_model(h1e, h2e, stacked=False, conserve_qn=True):
                     local_ham_terms.append(op * h2e[p, q, r, s])
             ham_terms.append(local_ham_terms)
 
+    return _qc_basis(norbs, conserve_qn), ham_terms
+
+
+def _qc_basis(norbs, conserve_qn):
     basis = []
     for iorb in range(norbs):
         if conserve_qn:
@@ -192,5 +196,94 @@ def qc_model(h1e, h2e, stacked=False, conserve_qn=True):
             sigmaqn = [0, 0]
         b = BasisHalfSpin(iorb, sigmaqn=sigmaqn)
         basis.append(b)
-    return basis, ham_terms
+    return basis
+
+
+
+def qc_table(h1e, h2e, conserve_qn=True):
+    """
+    Ab initio electronic Hamiltonian in spin-orbitals as an operator table.
+    The vectorized counterpart of :func:`qc_model` that skips the construction of
+    :class:`~renormalizer.model.Op` for each term. The MPO is then constructed by
+    :meth:`renormalizer.mps.Mpo.from_table`.
+
+    h1e: sh above
+    h2e: aseri above
+    return basis, table, primary_ops, factor
+    """
+    norbs = h1e.shape[0]
+    logger.info(f"spin norbs: {norbs}")
+    assert np.all(np.array(h1e.shape) == norbs)
+    assert np.all(np.array(h2e.shape) == norbs)
+
+    basis = _qc_basis(norbs, conserve_qn)
 
+    if conserve_qn:
+        qn_size = 2
+    else:
+        qn_size = 1
+    # the identities are the first `norbs` primary operators
+    primary_ops = [Op.identity(iorb, qn_size=qn_size) for iorb in range(norbs)]
+    symbol_to_idx = [dict() for _ in range(norbs)]
+
+    tables = []
+    factors = []
+    # 1-e terms: a^\dagger_p a_q; 2-e terms: a^\dagger_p a^\dagger_q a_r a_s
+    for h, dagger in [(h1e, [True, False]), (h2e, [True, True, False, False])]:
+        idx = np.argwhere(h != 0)
+        if len(idx) == 0:
+            continue
+        table, sign = _ladder_table(idx, dagger, norbs, conserve_qn, primary_ops, symbol_to_idx)
+        tables.append(table)
+        factors.append(sign * h[tuple(idx.T)])
+
+    if not tables:
+        # all integrals are zero
+        return basis, np.zeros((0, norbs), dtype=np.uint16), primary_ops, np.zeros(0, dtype=h1e.dtype)
+    return basis, np.concatenate(tables), primary_ops, np.concatenate(factors)
+
+
+def _ladder_table(idx, dagger, norbs, conserve_qn, primary_ops, symbol_to_idx):
+    # Table of the products of the ladder operators in the Jordan-Wigner transformation.
+    # The rules are the same as `simplify_op`.
+    # On each site the symbols are determined by which ladder operators are on the site (``eq``)
+    # and the parity of the sigma_z string from the ladder operators on the right (``gt``).
+    # All terms with the same pattern share the same local operator
+    n_ladder = len(dagger)
+    table = np.zeros((len(idx), norbs), dtype=np.uint16)
+    n_permute = np.zeros(len(idx), dtype=int)
+    weight = 2 ** np.arange(n_ladder)
+    for iorb in range(norbs):
+        eq = idx == iorb
+        gt = idx > iorb
+        # number of non-sigma_z symbols before each sigma_z
+        n_before = np.cumsum(eq, axis=1) - eq
+        n_permute += (gt * n_before).sum(axis=1)
+        pattern = eq @ weight + (gt.sum(axis=1) % 2) * 2 ** n_ladder
+        unique_pattern, inverse = np.unique(pattern, return_inverse=True)
+        site_op_idx = []
+        for p in unique_pattern:
+            new_symbol = ["-" if dagger[k] else "+" for k in range(n_ladder) if p & (1 << k)]
+            if p >> n_ladder:
+                new_symbol.insert(0, "Z")
+            site_op_idx.append(_primary_op_idx(new_symbol, iorb, conserve_qn, primary_ops, symbol_to_idx))
+        table[:, iorb] = np.array(site_op_idx, dtype=np.uint16)[inverse]
+    return table, (-1) ** n_permute
+
+
+def _primary_op_idx(new_symbol, iorb, conserve_qn, primary_ops, symbol_to_idx):
+    # this op is identity
+    if not new_symbol:
+        return iorb
+    symbol = " ".join(new_symbol)
+    if symbol not in symbol_to_idx[iorb]:
+        if conserve_qn:
+            if iorb % 2 == 0:
+                qn_dict = {"+": [-1, 0], "-": [1, 0], "Z": [0, 0]}
+            else:
+                qn_dict = {"+": [0, -1], "-": [0, 1], "Z": [0, 0]}
+        else:
+            qn_dict = {"+": 0, "-": 0, "Z": 0}
+        symbol_to_idx[iorb][symbol] = len(primary_ops)
+        primary_ops.append(Op(symbol, iorb, qn=[qn_dict[s] for s in new_symbol]))
+    return symbol_to_idx[iorb][symbol]
@@ -5,11 +5,13 @@ from collections import OrderedDict
 from typing import List
 
 import numpy as np
-from scipy.stats import binom
 
 from renormalizer.utils import Quantity
+from renormalizer.utils.utils import lazy_import
 from renormalizer.utils.elementop import construct_ph_op_dict
 
+stats = lazy_import("scipy.stats")
+
 
 def all_positive_or_all_negative(array):
     if (np.logical_or(array <= 0, np.isclose(array, np.zeros_like(array)))).all():
@@ -95,7 +97,7 @@ class Phonon(object):
 
     def split(self, n=2, width: Quantity=Quantity(10, "cm-1")) -> List["Phonon"]:
         assert self.is_simple
-        rv = binom(n-1, 0.5)
+        rv = stats.binom(n-1, 0.5)
         width = width.as_au()
         step = 2 * width / (n - 1)
         omegas = np.linspace(self.omega[0] - width, self.omega[0] + width + step, n)
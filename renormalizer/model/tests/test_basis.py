@@ -39,6 +39,62 @@ def test_high_moment():
     assert np.allclose(sho.op_mat("p^3"), sho.op_mat("p p p"))
 
 
+def test_xp_power_series():
+    nbas = 8
+    for k in range(6):
+        x_std = np.array([[Ba.x_power_k(k, m, n) for n in range(nbas)] for m in range(nbas)])
+        p_std = np.array([[Ba.p_power_k(k, m, n) for n in range(nbas)] for m in range(nbas)])
+        assert np.allclose(Ba.x_power_k_mat(k, nbas), x_std)
+        assert np.allclose(Ba.p_power_k_mat(k, nbas), p_std)
+
+
+@pytest.mark.parametrize("basis", (
+        Ba.BasisSHO("v", 0.1, 10, x0=1),
+        Ba.BasisSHO("v", 0.1, 10, dvr=True),
+        Ba.BasisSineDVR("v", 10, 1, 7, dvr=True),
+        Ba.BasisHalfSpin("v"),
+        Ba.BasisMultiElectron(["e0", "e1"], [0, 0]),
+))
+def test_op_mat_cache(basis):
+    if basis.multi_dof:
+        op = Op(r"a^\dagger a", ["e0", "e1"], factor=0.5)
+        other_op = Op(r"a^\dagger a", ["e1", "e0"], factor=0.5)
+    elif basis.is_spin:
+        op = Op("X Z", "v", factor=0.5)
+        other_op = Op("Z X", "v", factor=0.5)
+    else:
+        op = Op("x^3", "v", factor=0.5)
+        other_op = Op("x dx", "v", factor=0.5)
+    mat1 = basis.op_mat(op)
+    mat2 = basis.op_mat(op * 4)
+    assert np.allclose(mat2, mat1 * 4)
+    assert not np.allclose(basis.op_mat(other_op), mat1)
+    # the returned matrices are not shared with the cache
+    mat1[0, 0] += 1
+    assert np.allclose(basis.op_mat(op) * 4, mat2)
+    # the cached matrices are the same as those calculated from scratch
+    new_basis = basis.copy(basis.dof)
+    if isinstance(basis, Ba.BasisSineDVR):
+        new_basis.dvr = True
+    assert np.allclose(new_basis.op_mat(op), basis.op_mat(op))
+
+
+def test_op_mat_cache_state():
+    # the cached matrices are not reused after the attributes of the basis are changed
+    basis = Ba.BasisSineDVR("v", 10, 1, 7)
+    mat = basis.op_mat("x^2")
+    basis.dvr = True
+    assert np.allclose(basis.op_mat("x^2"), Ba.BasisSineDVR("v", 10, 1, 7, dvr=True).op_mat("x^2"))
+    assert not np.allclose(basis.op_mat("x^2"), mat)
+    basis.dvr = False
+    assert np.allclose(basis.op_mat("x^2"), mat)
+
+    basis = Ba.BasisSHO("v", 0.1, 10)
+    mat = basis.op_mat("x")
+    basis.x0 = 1
+    assert np.allclose(basis.op_mat("x"), mat + np.eye(10))
+
+
 @pytest.mark.parametrize("basistype", ("SHO", "SHODVR", "SineDVR"))
 def test_VibBasis(basistype):
     nv = 2
@@ -3,11 +3,12 @@
 import os
 import logging
 import random
-import subprocess
 
 import numpy as np
 
 from renormalizer.utils.utils import sizeof_fmt
+# re-exported, ``get_git_commit_hash`` used to be defined here
+from renormalizer.utils.utils import get_git_commit_hash  # noqa: F401
 
 try:
     import primme
@@ -50,15 +51,6 @@ def try_import_cupy():
     logger.info(f"Using GPU: {GPU_ID}")
     return True, cp
 
-def get_git_commit_hash():
-    try:
-        commit_hash = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.PIPE)
-        return commit_hash.strip().decode('utf-8')
-    # FileNotFoundError for windows
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return "Unknown"
-
-
 USE_GPU, xp = try_import_cupy()
 
 
@@ -83,7 +75,6 @@ else:
     logger.info(f"cupy random seed is {xpseed}")
     OE_BACKEND = "cupy"
 logger.info(f"random seed is {randomseed}")
-logger.info("Git Commit Hash: %s", get_git_commit_hash())
 
 
 if USE_GPU:
@@ -180,11 +171,7 @@ class Backend:
         mp.check_left_canonical, mp.ensure_left_canonical
         and their right counterparts
         '''
-        return (
-            self._canonical_atol
-            if hasattr(self, "_canonical_atol")
-            else (1e-4 if self.is_32bits else 1e-8)
-        )
+        return self.get_canonical_atol()
 
     @property
     def canonical_rtol(self):
@@ -193,11 +180,29 @@ class Backend:
         mp.check_left_canonical, mp.ensure_left_canonical
         and their right counterparts
         '''
-        return (
-            self._canonical_rtol
-            if hasattr(self, "_canonical_rtol")
-            else (1e-2 if self.is_32bits else 1e-5)
-        )
+        return self.get_canonical_rtol()
+
+    def get_canonical_atol(self, dtype=None):
+        '''
+        ``canonical_atol`` for the arrays of ``dtype``, which may differ from the backend
+        in the sweeps of reduced precision. Default is the dtype of the backend.
+        '''
+        if hasattr(self, "_canonical_atol"):
+            return self._canonical_atol
+        return 1e-4 if self._is_32bits(dtype) else 1e-8
+
+    def get_canonical_rtol(self, dtype=None):
+        '''
+        ``canonical_rtol`` for the arrays of ``dtype``. Default is the dtype of the backend.
+        '''
+        if hasattr(self, "_canonical_rtol"):
+            return self._canonical_rtol
+        return 1e-2 if self._is_32bits(dtype) else 1e-5
+
+    def _is_32bits(self, dtype):
+        if dtype is None:
+            return self.is_32bits
+        return np.finfo(dtype).dtype == np.float32
 
     @canonical_atol.setter
     def canonical_atol(self, value):
@@ -0,0 +1,677 @@
+# -*- coding: utf-8 -*-
+r"""
+Block-sparse tensors with abelian (U(1)^n) quantum number symmetry.
+
+Every leg of a :class:`BlockSparseTensor` carries a quantum number for each of its indices
+and a sign (``+1`` for incoming and ``-1`` for outgoing). Only the blocks satisfying
+
+.. math::
+    \sum_i s_i q_i = Q_\textrm{tot}
+
+are stored, each as a dense array. The memory cost and the contraction cost
+therefore scale with the sum of the block sizes rather than the full dimension.
+
+The convention for the sites of a matrix product (see :meth:`renormalizer.mps.mp.MatrixProduct.to_block_sparse`)
+is that all virtual bonds carry the quantum number of the L-block,
+the left virtual bond and the (up) physical bond are incoming and the right virtual bond is outgoing.
+The tensors are always stored with NumPy.
+"""
+
+import itertools
+import logging
+import math
+from typing import Dict, List, Tuple, Sequence
+
+import opt_einsum as oe
+
+from renormalizer.mps.backend import np
+from renormalizer.mps.oe_contract_wrap import path_cache, update_kwargs
+
+logger = logging.getLogger(__name__)
+
+
+def _leg_sectors(qn: np.ndarray) -> Dict[Tuple, np.ndarray]:
+    # map each quantum number of the leg to the indices with that quantum number
+    unique_qn, inverse = np.unique(qn, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(unique_qn) + 1))
+    return {tuple(q.tolist()): order[bounds[i]:bounds[i+1]] for i, q in enumerate(unique_qn)}
+
+
+class BlockSparseTensor:
+    r"""
+    Tensor stored as a dictionary of dense blocks labeled by quantum numbers.
+
+    Parameters
+    ----------
+    blocks : dict
+        The dense blocks. The keys are tuples of the quantum number (as tuples) of each leg.
+        The shape of each block is the number of indices of the corresponding quantum number on each leg.
+    qns : list of np.ndarray
+        The quantum number of each leg with shape ``(dim, qn_size)``.
+    signs : list of int
+        The direction of each leg. ``+1`` for incoming and ``-1`` for outgoing.
+    qntot : np.ndarray
+        The total quantum number (flux) of the tensor.
+    dtype :
+        The data type of the tensor. Inferred from the blocks if not provided.
+    """
+
+    def __init__(self, blocks: Dict[Tuple, np.ndarray], qns: List[np.ndarray], signs: Sequence[int], qntot, dtype=None):
+        assert len(qns) == len(signs)
+        self.qns: List[np.ndarray] = [np.asarray(qn, dtype=int).reshape(len(qn), -1) for qn in qns]
+        self.signs: Tuple[int] = tuple(int(s) for s in signs)
+        assert set(self.signs) <= {1, -1}
+        self.qntot: np.ndarray = np.asarray(qntot, dtype=int).reshape(-1)
+        self.blocks: Dict[Tuple, np.ndarray] = blocks
+        if dtype is None:
+            if blocks:
+                dtype = np.result_type(*blocks.values())
+            else:
+                dtype = np.float64
+        self.dtype = np.dtype(dtype)
+        self._sectors = [None] * len(qns)
+
+    @classmethod
+    def from_dense(cls, array: np.ndarray, qns: List[np.ndarray], signs: Sequence[int], qntot, atol: float = None):
+        r"""
+        Construct the block sparse tensor from a dense array.
+        Elements violating the symmetry are discarded.
+
+        Parameters
+        ----------
+        array : np.ndarray
+            The dense array.
+        qns : list of np.ndarray
+            The quantum number of each leg.
+        signs : list of int
+            The direction of each leg.
+        qntot : np.ndarray
+            The total quantum number.
+        atol : float, optional
+            If set, blocks with all elements smaller than ``atol`` are not stored.
+        """
+        array = np.asarray(array)
+        assert array.ndim == len(qns)
+        res = cls({}, qns, signs, qntot, dtype=array.dtype)
+        for key in res.allowed_keys():
+            idx = [res.sectors(i)[q] for i, q in enumerate(key)]
+            block = array[np.ix_(*idx)]
+            if atol is not None and not np.any(np.abs(block) > atol):
+                continue
+            res.blocks[key] = block
+        return res
+
+    @classmethod
+    def zeros(cls, qns: List[np.ndarray], signs: Sequence[int], qntot, dtype=np.float64):
+        """
+        The block sparse tensor with all blocks allowed by the symmetry set to zero.
+        Useful as the template of :meth:`to_vector` and :meth:`from_vector`.
+        """
+        res = cls({}, qns, signs, qntot, dtype=dtype)
+        for key in res.allowed_keys():
+            shape = [len(res.sectors(i)[q]) for i, q in enumerate(key)]
+            res.blocks[key] = np.zeros(shape, dtype=dtype)
+        return res
+
+    @classmethod
+    def ones_like_boundary(cls, qns: List[np.ndarray], signs: Sequence[int], dtype):
+        # the sentinel used at the boundary of environments. All legs have dimension 1.
+        qns = [np.asarray(qn, dtype=int).reshape(1, -1) for qn in qns]
+        res = cls({}, qns, signs, np.zeros(qns[0].shape[1], dtype=int), dtype=dtype)
+        key = tuple(tuple(qn[0].tolist()) for qn in qns)
+        if res.is_allowed(key):
+            res.blocks[key] = np.ones([1] * len(qns), dtype=dtype)
+        return res
+
+    def sectors(self, i: int) -> Dict[Tuple, np.ndarray]:
+        # lazily evaluated because most of the tensors are contracted only once
+        if self._sectors[i] is None:
+            self._sectors[i] = _leg_sectors(self.qns[i])
+        return self._sectors[i]
+
+    def is_allowed(self, key: Tuple) -> bool:
+        total = sum(s * np.array(q) for s, q in zip(self.signs, key))
+        return np.array_equal(total, self.qntot)
+
+    def allowed_keys(self) -> List[Tuple]:
+        """
+        All combinations of the quantum numbers of the legs that satisfy the symmetry.
+        """
+        if self.ndim == 0:
+            return [()]
+        keys = []
+        last_sectors = self.sectors(self.ndim - 1)
+        last_sign = self.signs[-1]
+        for partial_key in itertools.product(*[self.sectors(i).keys() for i in range(self.ndim - 1)]):
+            partial = sum((s * np.array(q) for s, q in zip(self.signs, partial_key)), np.zeros_like(self.qntot))
+            last_q = tuple((last_sign * (self.qntot - partial)).tolist())
+            if last_q in last_sectors:
+                keys.append(partial_key + (last_q,))
+        return keys
+
+    @property
+    def shape(self) -> Tuple[int]:
+        return tuple(len(qn) for qn in self.qns)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.qns)
+
+    @property
+    def size(self) -> int:
+        # number of stored elements
+        return sum(b.size for b in self.blocks.values())
+
+    @property
+    def nbytes(self) -> int:
+        return sum(b.nbytes for b in self.blocks.values())
+
+    @property
+    def qn_size(self) -> int:
+        return len(self.qntot)
+
+    def todense(self) -> np.ndarray:
+        array = np.zeros(self.shape, dtype=self.dtype)
+        for key, block in self.blocks.items():
+            idx = [self.sectors(i)[q] for i, q in enumerate(key)]
+            array[np.ix_(*idx)] = block
+        return array
+
+    def _new(self, blocks, qns=None, signs=None, qntot=None, dtype=None):
+        if qns is None:
+            qns = self.qns
+        if signs is None:
+            signs = self.signs
+        if qntot is None:
+            qntot = self.qntot
+        if dtype is None:
+            dtype = self.dtype
+        new = self.__class__(blocks, qns, signs, qntot, dtype)
+        if qns is self.qns:
+            new._sectors = list(self._sectors)
+        return new
+
+    def copy(self) -> "BlockSparseTensor":
+        return self._new({k: v.copy() for k, v in self.blocks.items()})
+
+    def astype(self, dtype) -> "BlockSparseTensor":
+        return self._new({k: v.astype(dtype) for k, v in self.blocks.items()}, dtype=dtype)
+
+    def conj(self) -> "BlockSparseTensor":
+        """
+        Complex conjugate. The directions of the legs and the total quantum number are reversed.
+        """
+        new = self._new({k: v.conj() for k, v in self.blocks.items()},
+                        signs=[-s for s in self.signs], qntot=-self.qntot)
+        return new
+
+    def flip_signs(self) -> "BlockSparseTensor":
+        """
+        Reverse the directions of the legs without conjugating the data.
+        Used for tensors that have already been conjugated numerically, such as ``mps.conj()``.
+        """
+        return self._new(self.blocks, signs=[-s for s in self.signs], qntot=-self.qntot)
+
+    def transpose(self, *axes) -> "BlockSparseTensor":
+        if len(axes) == 1 and isinstance(axes[0], (list, tuple)):
+            axes = axes[0]
+        if len(axes) == 0:
+            axes = tuple(range(self.ndim))[::-1]
+        blocks = {tuple(k[i] for i in axes): v.transpose(axes) for k, v in self.blocks.items()}
+        new = self._new(blocks, [self.qns[i] for i in axes], [self.signs[i] for i in axes])
+        new._sectors = [self._sectors[i] for i in axes]
+        return new
+
+    def flip_leg(self, i: int, shift) -> "BlockSparseTensor":
+        r"""
+        Reverse the direction of the ``i`` th leg by relabeling its quantum number :math:`q`
+        to :math:`\textrm{shift} - q`. The data is not changed.
+
+        For example, the outgoing bond of a site with the L-block quantum number becomes
+        an incoming bond with the R-block quantum number if ``shift`` is the total quantum number,
+        which is the super-block convention of :func:`~renormalizer.mps.svd_qn.svd_qn`.
+        """
+        i = i % self.ndim
+        shift = np.asarray(shift, dtype=int).reshape(-1)
+        sign = self.signs[i]
+        blocks = {}
+        for key, block in self.blocks.items():
+            key = list(key)
+            key[i] = tuple((shift - np.array(key[i])).tolist())
+            blocks[tuple(key)] = block
+        qns = list(self.qns)
+        qns[i] = shift - qns[i]
+        signs = list(self.signs)
+        signs[i] = -sign
+        return self._new(blocks, qns, signs, self.qntot - sign * shift)
+
+    def norm(self) -> float:
+        return float(np.sqrt(sum(np.vdot(b, b).real for b in self.blocks.values())))
+
+    def block_keys(self) -> List[Tuple]:
+        # a deterministic ordering of the stored blocks
+        return sorted(self.blocks.keys())
+
+    def to_vector(self, template: "BlockSparseTensor" = None) -> np.ndarray:
+        """
+        Concatenate the stored blocks into a 1D array. The order is defined by :meth:`block_keys`.
+        If ``template`` is provided, the blocks are ordered by the blocks of ``template``
+        and the blocks missing in ``self`` are filled with zero.
+        """
+        if template is None:
+            template = self
+        keys = template.block_keys()
+        if not keys:
+            return np.zeros(0, dtype=self.dtype)
+        vectors = []
+        for k in keys:
+            block = self.blocks.get(k)
+            if block is None:
+                vectors.append(np.zeros(template.blocks[k].size, dtype=self.dtype))
+            else:
+                vectors.append(block.ravel())
+        return np.concatenate(vectors)
+
+    def from_vector(self, vector: np.ndarray) -> "BlockSparseTensor":
+        """
+        The inverse of :meth:`to_vector`. The block structure of ``self`` is used as the template.
+        """
+        blocks = {}
+        offset = 0
+        for k in self.block_keys():
+            shape = self.blocks[k].shape
+            size = int(np.prod(shape))
+            blocks[k] = vector[offset:offset+size].reshape(shape)
+            offset += size
+        assert offset == len(vector)
+        return self._new(blocks, dtype=vector.dtype)
+
+    def _binary_op(self, other, op):
+        assert isinstance(other, BlockSparseTensor)
+        assert self.signs == other.signs and np.array_equal(self.qntot, other.qntot)
+        blocks = {}
+        zero = np.zeros(1, dtype=self.dtype)[0]
+        for key in set(self.blocks) | set(other.blocks):
+            a = self.blocks.get(key)
+            b = other.blocks.get(key)
+            if a is None:
+                a = zero
+            if b is None:
+                b = zero
+            blocks[key] = op(a, b)
+        return self._new(blocks, dtype=np.result_type(self.dtype, other.dtype))
+
+    def __add__(self, other):
+        return self._binary_op(other, np.add)
+
+    def __sub__(self, other):
+        return self._binary_op(other, np.subtract)
+
+    def __mul__(self, other):
+        assert np.isscalar(other)
+        blocks = {k: v * other for k, v in self.blocks.items()}
+        return self._new(blocks, dtype=np.result_type(self.dtype, other))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return self * (1 / other)
+
+    def __repr__(self):
+        return f"<BlockSparseTensor at 0x{id(self):x} {self.shape} {self.dtype}, {len(self.blocks)} blocks>"
+
+    def tensordot(self, other: "BlockSparseTensor", axes) -> "BlockSparseTensor":
+        return tensordot(self, other, axes)
+
+    def matrix_sectors(self, nleft: int):
+        """
+        Iterate over the symmetry sectors of the tensor reshaped into a matrix, with the first ``nleft``
+        legs as the row and the other legs as the column.
+
+        Yields
+        ------
+        nl : np.ndarray
+            The quantum number of the row (sum of the signed quantum numbers of the first ``nleft`` legs).
+        nr : np.ndarray
+            The quantum number of the column, ``nl + nr == qntot``.
+        lset : np.ndarray
+            The indices of the rows in the reshaped dense matrix.
+        rset : np.ndarray
+            The indices of the columns in the reshaped dense matrix.
+        block : np.ndarray
+            The dense matrix of the sector.
+        """
+        assert 0 < nleft < self.ndim
+        left_groups = self._fused_groups(range(nleft))
+        right_groups = self._fused_groups(range(nleft, self.ndim))
+        for nl in sorted(left_groups):
+            nr = tuple((self.qntot - np.array(nl)).tolist())
+            if nr not in right_groups:
+                continue
+            lgroup, rgroup = left_groups[nl], right_groups[nr]
+            row_offsets = np.cumsum([0] + [len(flat) for _, flat in lgroup])
+            col_offsets = np.cumsum([0] + [len(flat) for _, flat in rgroup])
+            block = np.zeros((row_offsets[-1], col_offsets[-1]), dtype=self.dtype)
+            for (lkey, _), r0, r1 in zip(lgroup, row_offsets[:-1], row_offsets[1:]):
+                for (rkey, _), c0, c1 in zip(rgroup, col_offsets[:-1], col_offsets[1:]):
+                    b = self.blocks.get(lkey + rkey)
+                    if b is not None:
+                        block[r0:r1, c0:c1] = b.reshape(r1 - r0, c1 - c0)
+            lset = np.concatenate([flat for _, flat in lgroup])
+            rset = np.concatenate([flat for _, flat in rgroup])
+            yield nl, np.array(nr), lset, rset, block
+
+    def _fused_groups(self, legs):
+        # group the combinations of quantum numbers of `legs` by their signed sum
+        legs = list(legs)
+        shape = [self.shape[i] for i in legs]
+        groups = {}
+        for key in itertools.product(*[sorted(self.sectors(i).keys()) for i in legs]):
+            q = sum(self.signs[i] * np.array(k) for i, k in zip(legs, key))
+            idx = np.ix_(*[self.sectors(i)[k] for i, k in zip(legs, key)])
+            flat = np.ravel_multi_index(np.broadcast_arrays(*idx), shape).ravel()
+            groups.setdefault(tuple(q.tolist()), []).append((key, flat))
+        return groups
+
+
+def tensordot(a: BlockSparseTensor, b: BlockSparseTensor, axes) -> BlockSparseTensor:
+    r"""
+    Blockwise tensor contraction with the same semantics as ``np.tensordot``.
+    The contracted legs should have the same quantum numbers and opposite directions.
+    """
+    axes_a, axes_b = _normalize_axes(a, b, axes)
+    return _tensordot(a, b, axes_a, axes_b)
+
+
+def _normalize_axes(a: BlockSparseTensor, b: BlockSparseTensor, axes):
+    if isinstance(axes, int):
+        axes_a = list(range(a.ndim - axes, a.ndim))
+        axes_b = list(range(axes))
+    else:
+        axes_a, axes_b = axes
+        if isinstance(axes_a, int):
+            axes_a = [axes_a]
+        if isinstance(axes_b, int):
+            axes_b = [axes_b]
+        axes_a = [i % a.ndim for i in axes_a]
+        axes_b = [i % b.ndim for i in axes_b]
+    assert len(axes_a) == len(axes_b)
+    for i, j in zip(axes_a, axes_b):
+        if a.signs[i] != -b.signs[j]:
+            raise ValueError(f"Contracted legs must have opposite directions. Got {a.signs[i]} and {b.signs[j]}")
+        if a.qns[i] is not b.qns[j] and not np.array_equal(a.qns[i], b.qns[j]):
+            raise ValueError("Contracted legs have different quantum numbers")
+    return axes_a, axes_b
+
+
+def _tensordot(a: BlockSparseTensor, b: BlockSparseTensor, axes_a, axes_b, a_groups=None, b_groups=None):
+    # ``a_groups`` and ``b_groups`` are the results of ``_group_blocks``,
+    # which could be computed in advance if the tensor is constant
+    free_a = [i for i in range(a.ndim) if i not in axes_a]
+    free_b = [i for i in range(b.ndim) if i not in axes_b]
+    dtype = np.result_type(a.dtype, b.dtype)
+
+    # The blocks are grouped by the quantum number flowing through the contracted legs.
+    # For each flux, the blocks are assembled into matrices and multiplied once,
+    # which is much faster than contracting the (usually small) blocks pair by pair
+    signs_c = [a.signs[i] for i in axes_a]
+    if a_groups is None:
+        a_groups = _group_blocks(a, free_a, axes_a, signs_c)
+    if b_groups is None:
+        b_groups = _group_blocks(b, free_b, axes_b, signs_c)
+
+    blocks = {}
+    for flux, a_rows in a_groups.items():
+        if flux not in b_groups:
+            continue
+        b_rows = b_groups[flux]
+        # the contracted keys present in both tensors
+        ckeys = sorted(set(k for row in a_rows.values() for k in row) & set(k for row in b_rows.values() for k in row))
+        if not ckeys:
+            continue
+        a_matrix, a_offsets = _assemble_matrix(a_rows, ckeys, dtype)
+        b_matrix, b_offsets = _assemble_matrix(b_rows, ckeys, dtype)
+        res = a_matrix @ b_matrix.T
+        for fkey_a, (r0, r1, shape_a) in a_offsets.items():
+            for fkey_b, (c0, c1, shape_b) in b_offsets.items():
+                blocks[fkey_a + fkey_b] = res[r0:r1, c0:c1].reshape(shape_a + shape_b)
+
+    qns = [a.qns[i] for i in free_a] + [b.qns[j] for j in free_b]
+    signs = [a.signs[i] for i in free_a] + [b.signs[j] for j in free_b]
+    res = BlockSparseTensor(blocks, qns, signs, a.qntot + b.qntot, dtype=dtype)
+    res._sectors = [a._sectors[i] for i in free_a] + [b._sectors[j] for j in free_b]
+    return res
+
+
+def _group_blocks(t: BlockSparseTensor, free, contracted, signs_c):
+    # flux -> free key -> contracted key -> block with the free legs first
+    # and reshaped to a matrix
+    groups = {}
+    axes = free + contracted
+    zero = tuple(0 for _ in t.qntot)
+    # many blocks share the same contracted key
+    fluxes = {}
+    for key, block in t.blocks.items():
+        ckey = tuple(key[i] for i in contracted)
+        flux = fluxes.get(ckey)
+        if flux is None:
+            flux = zero
+            for s, q in zip(signs_c, ckey):
+                flux = tuple(f + s * x for f, x in zip(flux, q))
+            fluxes[ckey] = flux
+        fkey = tuple(key[i] for i in free)
+        fshape = tuple(block.shape[i] for i in free)
+        block = block.transpose(axes).reshape(math.prod(fshape), -1)
+        groups.setdefault(flux, {}).setdefault(fkey, {})[ckey] = (fshape, block)
+    return groups
+
+
+def _assemble_matrix(rows, ckeys, dtype):
+    # the matrix of one flux with the free keys as the rows and the contracted keys as the columns.
+    # The missing blocks are zero
+    col_dims = {}
+    for row in rows.values():
+        for ckey, (_, block) in row.items():
+            col_dims[ckey] = block.shape[1]
+    col_offsets = {}
+    ncol = 0
+    for ckey in ckeys:
+        dim = col_dims.get(ckey, 0)
+        col_offsets[ckey] = (ncol, ncol + dim)
+        ncol += dim
+    row_offsets = {}
+    nrow = 0
+    for fkey in sorted(rows):
+        fshape = next(iter(rows[fkey].values()))[0]
+        dim = math.prod(fshape)
+        row_offsets[fkey] = (nrow, nrow + dim, fshape)
+        nrow += dim
+    matrix = np.zeros((nrow, ncol), dtype=dtype)
+    for fkey, row in rows.items():
+        r0, r1, _ = row_offsets[fkey]
+        for ckey, (_, block) in row.items():
+            if ckey in col_offsets:
+                c0, c1 = col_offsets[ckey]
+                matrix[r0:r1, c0:c1] = block
+    return matrix, row_offsets
+
+
+def contract_expression(*args, constants=None):
+    r"""
+    Blockwise contraction in the interleaved format of ``opt_einsum``, i.e.,
+    ``tensor1, indices1, tensor2, indices2, ..., output_indices``.
+    The contraction path is searched based on the dense shapes and cached.
+
+    Every index should appear exactly twice in the operands and the output,
+    so that the contraction is a sequence of pairwise :func:`tensordot`.
+
+    Parameters
+    ----------
+    args :
+        The block sparse tensors and their indices in the interleaved format.
+    constants : list of int
+        The positions of the constant tensors. The other tensors only serve as templates
+        and are provided in order when calling the expression. Default is all tensors are constant.
+
+    Returns
+    -------
+    expr : callable
+        The function to perform the contraction with the non-constant tensors as the arguments.
+    """
+    operands = list(args[:-1:2])
+    indices = [tuple(idx) for idx in args[1::2]]
+    output_indices = tuple(args[-1])
+    assert len(operands) == len(indices) and len(args) % 2 == 1
+    if constants is None:
+        constants = list(range(len(operands)))
+    variables = [i for i in range(len(operands)) if i not in constants]
+
+    counts = {}
+    for idx in indices + [output_indices]:
+        for i in idx:
+            counts[i] = counts.get(i, 0) + 1
+    if set(counts.values()) != {2}:
+        raise NotImplementedError("Every index should appear exactly twice in the operands and the output")
+
+    if len(operands) == 1:
+        path = []
+    else:
+        subscripts, _ = oe.parser.convert_interleaved_input(args)
+        shapes = tuple(t.shape for t in operands)
+        kwargs = {}
+        update_kwargs(args, kwargs)
+        path = path_cache.get(
+            ("block_sparse", subscripts, shapes, kwargs["optimize"]),
+            lambda: oe.contract_path(subscripts, *shapes, shapes=True, optimize=kwargs["optimize"])[0]
+        )
+
+    # Build the sequence of the pairwise contractions.
+    # The contractions involving only the constant tensors are carried out once here
+    values = {i: operands[i] for i in constants}
+    slots = list(range(len(operands)))
+    slot_indices = list(indices)
+    steps = []
+    for pair in path:
+        assert len(pair) == 2
+        i, j = sorted(pair, reverse=True)
+        id_a, idx_a = slots.pop(i), slot_indices.pop(i)
+        id_b, idx_b = slots.pop(j), slot_indices.pop(j)
+        shared = [k for k in idx_a if k in idx_b]
+        axes = ([idx_a.index(k) for k in shared], [idx_b.index(k) for k in shared])
+        new_id = len(operands) + len(steps)
+        if id_a in values and id_b in values:
+            values[new_id] = tensordot(values[id_a], values[id_b], axes)
+        steps.append((id_a, id_b, axes, new_id))
+        slots.append(new_id)
+        slot_indices.append(tuple(k for k in idx_a if k not in shared) + tuple(k for k in idx_b if k not in shared))
+    # The steps depending on the variables.
+    # The blocks of the constant operands are grouped in advance
+    var_steps = []
+    for id_a, id_b, (axes_a, axes_b), new_id in steps:
+        if new_id in values:
+            continue
+        a_groups = b_groups = None
+        if id_a in values:
+            a = values[id_a]
+            free_a = [i for i in range(a.ndim) if i not in axes_a]
+            a_groups = _group_blocks(a, free_a, axes_a, [a.signs[i] for i in axes_a])
+        if id_b in values:
+            b = values[id_b]
+            free_b = [i for i in range(b.ndim) if i not in axes_b]
+            b_groups = _group_blocks(b, free_b, axes_b, [-b.signs[i] for i in axes_b])
+        var_steps.append((id_a, id_b, axes_a, axes_b, a_groups, b_groups, new_id))
+    res_id = slots[0]
+    transpose_axes = [slot_indices[0].index(k) for k in output_indices]
+
+    def expr(*tensors):
+        assert len(tensors) == len(variables)
+        tensor_dict = values.copy()
+        for i, tensor in zip(variables, tensors):
+            assert tensor.shape == operands[i].shape
+            tensor_dict[i] = tensor
+        for id_a, id_b, axes_a, axes_b, a_groups, b_groups, new_id in var_steps:
+            tensor_dict[new_id] = _tensordot(tensor_dict[id_a], tensor_dict[id_b], axes_a, axes_b, a_groups, b_groups)
+        return tensor_dict[res_id].transpose(transpose_axes)
+
+    return expr
+
+
+def contract(*args):
+    """
+    Blockwise contraction in the interleaved format of ``opt_einsum``. See :func:`contract_expression`.
+    """
+    return contract_expression(*args)()
+
+
+def contract_into(template: BlockSparseTensor, *args) -> BlockSparseTensor:
+    r"""
+    Contraction in the interleaved format of ``opt_einsum`` with the result in the block structure of ``template``.
+    Unlike :func:`contract_expression`, an index may appear any number of times,
+    so the diagonal of the operands can be taken, such as the diagonal elements of the Hamiltonian
+    ``tensor1, ("a", "b", "a"), tensor2, ("b", "c", "c", "d"), ..., ("a", "c", ...)``.
+
+    For each block of ``template``, the output legs of the operands are restricted to the sectors of the block
+    and the blocks of the operands are assembled into dense arrays over the other legs
+    before the contraction. The other legs should therefore be small, such as the bonds of an MPO.
+
+    Parameters
+    ----------
+    template : BlockSparseTensor
+        The block structure of the result.
+    args :
+        The block sparse tensors and their indices in the interleaved format.
+        The output indices correspond to the legs of ``template``.
+
+    Returns
+    -------
+    The result with the blocks of ``template``. The blocks where any of the operands vanishes are not stored.
+    """
+    operands = list(args[:-1:2])
+    indices = [tuple(idx) for idx in args[1::2]]
+    output_indices = tuple(args[-1])
+    assert len(output_indices) == template.ndim
+    output_pos = {k: i for i, k in enumerate(output_indices)}
+    dtype = np.result_type(*[t.dtype for t in operands])
+
+    plans = []
+    for t, idx in zip(operands, indices):
+        # the legs of the operand corresponding to the output legs
+        out_legs = [(leg, output_pos[k]) for leg, k in enumerate(idx) if k in output_pos]
+        groups = {}
+        for key, block in t.blocks.items():
+            groups.setdefault(tuple(key[leg] for leg, _ in out_legs), []).append((key, block))
+        plans.append((t, out_legs, groups, {}))
+
+    blocks = {}
+    for key in template.block_keys():
+        sub_args = []
+        for (t, out_legs, groups, cache), idx in zip(plans, indices):
+            sub_key = tuple(key[i] for _, i in out_legs)
+            if sub_key not in cache:
+                # the operand with the output legs in the sectors of the block
+                entries = groups.get(sub_key)
+                if not entries:
+                    cache[sub_key] = None
+                else:
+                    shape = list(t.shape)
+                    for leg, i in out_legs:
+                        shape[leg] = template.blocks[key].shape[i]
+                    array = np.zeros(shape, dtype=t.dtype)
+                    out_leg_set = {leg for leg, _ in out_legs}
+                    for k, block in entries:
+                        ix = [np.arange(shape[leg]) if leg in out_leg_set else t.sectors(leg)[k[leg]]
+                              for leg in range(t.ndim)]
+                        array[np.ix_(*ix)] = block
+                    cache[sub_key] = array
+            array = cache[sub_key]
+            if array is None:
+                # the block vanishes
+                break
+            sub_args.extend([array, idx])
+        else:
+            sub_args.append(output_indices)
+            blocks[key] = oe.contract(*sub_args)
+    return template._new(blocks, dtype=dtype)
+
@@ -15,15 +15,18 @@ import logging
 import numpy as np
 import scipy
 
-from renormalizer.lib import davidson
+from renormalizer.lib import davidson1
 from renormalizer.model.h_qc import qc_model, int_to_h, generate_ladder_operator, simplify_op
 from renormalizer.model import Model, Op
-from renormalizer.mps.backend import xp, OE_BACKEND, primme, IMPORT_PRIMME_EXCEPTION
+from renormalizer.mps.backend import backend, xp, OE_BACKEND, primme, IMPORT_PRIMME_EXCEPTION
 from renormalizer.mps.matrix import multi_tensor_contract, tensordot, asnumpy, asxp
 from renormalizer.mps.hop_expr import  hop_expr
 from renormalizer.mps.svd_qn import get_qn_mask
 from renormalizer.mps import Mpo, Mps, StackedMpo
 from renormalizer.mps.lib import Environ, cvec2cmat
+from renormalizer.mps.sparse_mo import SparseMo
+from renormalizer.mps import block_sparse
+from renormalizer.mps.block_sparse import BlockSparseTensor
 from renormalizer.mps.oe_contract_wrap import oe_contract
 from renormalizer.utils import Quantity, CompressConfig, CompressCriteria
 
@@ -102,18 +105,38 @@ def optimize_mps(mps: Mps, mpo: Union[Mpo, StackedMpo], omega: float = None) ->
 
     compress_config_bk = mps.compress_config
 
-    # construct the environment matrix
     if omega is not None:
         if isinstance(mpo, StackedMpo):
             raise NotImplementedError("StackedMPO + omega is not implemented yet")
         identity = Mpo.identity(mpo.model)
         mpo = mpo.add(identity.scale(-omega))
+
+    # the precision of each sweep
+    sweep_dtypes = [
+        mps.optimize_config.sweep_dtype(isweep, backend.real_dtype)
+        for isweep in range(len(mps.optimize_config.procedure))
+    ]
+    if len(set(sweep_dtypes)) > 1 and mps.compress_config.ofs is not None:
+        raise NotImplementedError("OFS with sweeps in different precisions is not implemented yet")
+    # the MPO in the original precision
+    mpo_bk = mpo
+    dtype = sweep_dtypes[0] if sweep_dtypes else backend.real_dtype
+    if dtype != backend.real_dtype:
+        logger.info(f"sweep precision: {np.dtype(dtype)}")
+        mps.astype(dtype, inplace=True)
+        mpo = _mpo_astype(mpo_bk, dtype)
+
+    # construct the environment matrix
+    if omega is not None:
         environ = Environ(mps, [mpo, mpo], env)
     else:
         if isinstance(mpo, StackedMpo):
             environ = [Environ(mps, item, env) for item in mpo.mpos]
         else:
-            environ = Environ(mps, mpo, env)
+            if mps.optimize_config.sparse_mpo and mps.optimize_config.block_sparse:
+                raise ValueError("sparse_mpo and block_sparse can not be set at the same time")
+            environ = Environ(mps, mpo, env, block_sparse=mps.optimize_config.block_sparse,
+                              sparse_mpo=mps.optimize_config.sparse_mpo)
 
     macro_iteration_result = []
     # Idx of the active site with lowest energy for each sweep
@@ -123,6 +146,15 @@ def optimize_mps(mps: Mps, mpo: Union[Mpo, StackedMpo], omega: float = None) ->
     for isweep, (compress_config, percent) in enumerate(mps.optimize_config.procedure):
         logger.debug(f"isweep: {isweep}")
 
+        if sweep_dtypes[isweep] != dtype:
+            # promote (or demote) the MPS, the MPO and the environments
+            dtype = sweep_dtypes[isweep]
+            logger.info(f"sweep precision: {np.dtype(dtype)}")
+            mps.astype(dtype, inplace=True)
+            mpo = _mpo_astype(mpo_bk, dtype)
+            for environ_item in (environ if isinstance(environ, list) else [environ]):
+                environ_item.astype(dtype)
+
         if isinstance(compress_config, CompressConfig):
             mps.compress_config = compress_config
         elif isinstance(compress_config, int):
@@ -143,9 +175,10 @@ def optimize_mps(mps: Mps, mpo: Union[Mpo, StackedMpo], omega: float = None) ->
         logger.debug(
             f"{isweep+1} sweeps are finished, lowest energy = {min(macro_iteration_result)}"
         )
-        # check if convergence
-        if isweep > 0 and percent == 0:
-            v1, v2 = sorted(macro_iteration_result)[:2]
+        # check if convergence. Only the sweeps in the final precision are compared
+        final_result = [e for e, d in zip(macro_iteration_result, sweep_dtypes) if d == sweep_dtypes[-1]]
+        if isweep > 0 and percent == 0 and dtype == sweep_dtypes[-1] and len(final_result) > 1:
+            v1, v2 = sorted(final_result)[:2]
             if np.allclose(
                 v1, v2, rtol=mps.optimize_config.e_rtol, atol=mps.optimize_config.e_atol
             ):
@@ -156,6 +189,11 @@ def optimize_mps(mps: Mps, mpo: Union[Mpo, StackedMpo], omega: float = None) ->
         logger.info(f"The lowest two energies: {sorted(macro_iteration_result)[:2]}.")
 
     assert res_mps is not None
+    if dtype != backend.real_dtype:
+        if mps.optimize_config.nroots == 1:
+            res_mps = res_mps.astype(backend.real_dtype)
+        else:
+            res_mps = [mp.astype(backend.real_dtype) for mp in res_mps]
     # remove the redundant basis near the edge
     # and restore the original compress_config of the input mps
     if mps.optimize_config.nroots == 1:
@@ -171,6 +209,14 @@ def optimize_mps(mps: Mps, mpo: Union[Mpo, StackedMpo], omega: float = None) ->
     return macro_iteration_result, res_mps
 
 
+def _mpo_astype(mpo: Union[Mpo, StackedMpo], dtype):
+    if dtype == backend.real_dtype:
+        return mpo
+    if isinstance(mpo, StackedMpo):
+        return StackedMpo([item.astype(dtype) for item in mpo.mpos])
+    return mpo.astype(dtype)
+
+
 def single_sweep(
     mps: Mps,
     mpo: Union[Mpo, StackedMpo],
@@ -230,34 +276,59 @@ def single_sweep(
         else:
             ltensor = environ.GetLR("L", lidx, mps, operator, itensor=None, method=lmethod)
             rtensor = environ.GetLR("R", ridx, mps, operator, itensor=None, method=rmethod)
+            # the environment required by the next site
+            if mps.to_right:
+                environ.prefetch("R", ridx + 1)
+            else:
+                environ.prefetch("L", lidx - 1)
 
         # get the quantum number pattern
         qnbigl, qnbigr, qnmat = mps._get_big_qn(cidx)
         qn_mask = get_qn_mask(qnmat, mps.qntot)
         cshape = qn_mask.shape
 
+        use_direct_eigh = np.prod(cshape) < 1000 or mps.optimize_config.algo == "direct"
+        if isinstance(ltensor, BlockSparseTensor) and use_direct_eigh:
+            # the direct eigensolver works with the dense tensors
+            ltensor, rtensor = asxp(ltensor.todense()), asxp(rtensor.todense())
+
         # center mo
         if isinstance(mpo, StackedMpo):
             cmo = [[asxp(mpo_item[idx]) for idx in cidx] for mpo_item in mpo.mpos]
+        elif isinstance(ltensor, BlockSparseTensor):
+            cmo = [mpo.to_block_sparse(idx) for idx in cidx]
+        elif mps.optimize_config.sparse_mpo and omega is None and method == "1site" and not use_direct_eigh:
+            cmo = [mpo.to_sparse(idx) for idx in cidx]
         else:
             cmo = [asxp(mpo[idx]) for idx in cidx]
 
-        use_direct_eigh = np.prod(cshape) < 1000 or mps.optimize_config.algo == "direct"
+        if isinstance(ltensor, BlockSparseTensor):
+            # the vectors are the concatenation of the blocks of the center sites
+            template = get_block_sparse_template(mps, ltensor, rtensor, cmo)
+        else:
+            template = None
+
         if use_direct_eigh:
             e, c = eigh_direct(mps, qn_mask, ltensor, rtensor, cmo, omega)
         else:
             # the iterative approach
             # generate initial guess
             if nroots == 1:
-                if method == "1site":
-                    # initial guess   b-S-c
-                    #                   a
-                    raw_cguess = mps[cidx[0]]
+                if template is not None:
+                    raw_cguess = mps.to_block_sparse(cidx[0])
+                    if method == "2site":
+                        raw_cguess = block_sparse.tensordot(raw_cguess, mps.to_block_sparse(cidx[1]), 1)
+                    cguess = [raw_cguess.to_vector(template)]
                 else:
-                    # initial guess b-S-c-S-e
-                    #                 a   d
-                    raw_cguess = tensordot(mps[cidx[0]], mps[cidx[1]], axes=1)
-                cguess = [asnumpy(raw_cguess)[qn_mask]]
+                    if method == "1site":
+                        # initial guess   b-S-c
+                        #                   a
+                        raw_cguess = mps[cidx[0]]
+                    else:
+                        # initial guess b-S-c-S-e
+                        #                 a   d
+                        raw_cguess = tensordot(mps[cidx[0]], mps[cidx[1]], axes=1)
+                    cguess = [asnumpy(raw_cguess)[qn_mask]]
             else:
                 cguess = []
                 for ms in averaged_ms:
@@ -268,13 +339,19 @@ def single_sweep(
                             raw_cguess = tensordot(ms, mps[cidx[1]], axes=1)
                         else:
                             raw_cguess = tensordot(mps[cidx[0]], ms, axes=1)
-                    cguess.append(asnumpy(raw_cguess)[qn_mask])
+                    if template is not None:
+                        raw_cguess = BlockSparseTensor.from_dense(
+                            asnumpy(raw_cguess), template.qns, template.signs, template.qntot
+                        )
+                        cguess.append(raw_cguess.to_vector(template))
+                    else:
+                        cguess.append(asnumpy(raw_cguess)[qn_mask])
 
             guess_dim = np.sum(qn_mask)
             cguess.extend(
                 [np.random.rand(guess_dim) - 0.5 for i in range(len(cguess), nroots)]
             )
-            e, c = eigh_iterative(mps, qn_mask, ltensor, rtensor, cmo, omega, cguess)
+            e, c = eigh_iterative(mps, qn_mask, ltensor, rtensor, cmo, omega, cguess, template)
 
         # if multi roots, both davidson and primme return np.ndarray
         if nroots > 1:
@@ -282,7 +359,16 @@ def single_sweep(
         logger.debug(f"energy: {e}")
         micro_iteration_result.append((e, cidx))
 
-        cstruct = cvec2cmat(c, qn_mask, nroots=nroots)
+        if template is not None and not use_direct_eigh:
+            if nroots == 1:
+                cstruct = template.from_vector(c)
+            else:
+                # the state-averaged update works with the dense arrays
+                if type(c) is not list:
+                    c = [c[:, iroot] for iroot in range(c.shape[1])]
+                cstruct = [template.from_vector(ic).todense() for ic in c]
+        else:
+            cstruct = cvec2cmat(c, qn_mask, nroots=nroots)
 
         # store the "optimal" mps (usually in the middle of each sweep)
         if cidx == last_opt_e_idx:
@@ -297,6 +383,10 @@ def single_sweep(
                     )
 
         averaged_ms = mps._update_mps(cstruct, cidx, qnbigl, qnbigr, percent)
+        if template is not None:
+            # the optimized sites are stored as the blocks
+            for idx in cidx:
+                mps[idx] = mps.to_block_sparse(idx)
         if mps.compress_config.ofs is not None:
             mpo.try_swap_site(mps.model, mps.compress_config.ofs_swap_jw)
 
@@ -416,13 +506,35 @@ def get_ham_iterative(
     omega: float,
 ):
     # iterative algorithm
-    method = mps.optimize_config.method
-    inverse = mps.optimize_config.inverse
+    hdiag = get_hdiag(mps, qn_mask, ltensor, rtensor, cmo, omega)
+
+    # Define the H operator
+
+    # contraction expression
+    cshape = qn_mask.shape
+    expr = hop_expr(ltensor, rtensor, cmo, cshape, omega is not None)
+    # for a block of vectors
+    batch_expr = hop_expr(ltensor, rtensor, cmo, cshape, omega is not None, batch=True)
+    return hdiag, expr, batch_expr
+
 
+def get_hdiag(
+    mps: Mps,
+    qn_mask: np.ndarray,
+    ltensor: xp.ndarray,
+    rtensor: xp.ndarray,
+    cmo: List[xp.ndarray],
+    omega: float,
+):
     # diagonal elements of H for preconditioning
+    method = mps.optimize_config.method
+    inverse = mps.optimize_config.inverse
     if omega is None:
         tmp_ltensor = xp.einsum("aba -> ba", ltensor)
-        tmp_cmo0 = xp.einsum("abbc -> abc", cmo[0])
+        if isinstance(cmo[0], SparseMo):
+            tmp_cmo0 = cmo[0].diagonal()
+        else:
+            tmp_cmo0 = xp.einsum("abbc -> abc", cmo[0])
         tmp_rtensor = xp.einsum("aba -> ba", rtensor)
         if method == "1site":
             #   S-a c f-S
@@ -467,14 +579,60 @@ def get_ham_iterative(
                 backend=OE_BACKEND,
             )
 
-    hdiag = asnumpy(hdiag[qn_mask] * inverse)
+    return asnumpy(hdiag[qn_mask] * inverse)
 
-    # Define the H operator
 
-    # contraction expression
-    cshape = qn_mask.shape
-    expr = hop_expr(ltensor, rtensor, cmo, cshape, omega is not None)
-    return hdiag, expr
+def get_block_sparse_template(
+    mps: Mps,
+    ltensor: BlockSparseTensor,
+    rtensor: BlockSparseTensor,
+    cmo: List[BlockSparseTensor],
+):
+    # the block structure of the center sites following the convention of ``MatrixProduct.to_block_sparse``
+    qns = [ltensor.qns[2]] + [mo.qns[1] for mo in cmo] + [rtensor.qns[2]]
+    signs = [1] * (len(cmo) + 1) + [-1]
+    return BlockSparseTensor.zeros(qns, signs, np.zeros(mps.model.qn_size, dtype=int))
+
+
+def get_ham_block_sparse(
+    mps: Mps,
+    template: BlockSparseTensor,
+    ltensor: BlockSparseTensor,
+    rtensor: BlockSparseTensor,
+    cmo: List[BlockSparseTensor],
+):
+    # the diagonal elements of H and the H operator on the vectors of the blocks of ``template``.
+    # Both are evaluated blockwise without the dense intermediates
+    inverse = mps.optimize_config.inverse
+    #   S-a c   d f-S
+    #   O-b-O-e-O-g-O
+    #   S-a c   d f-S
+    nsite = len(cmo)
+    args = [ltensor, ("l", "w0", "l")]
+    for i, mo in enumerate(cmo):
+        args.extend([mo, (f"w{i}", f"p{i}", f"p{i}", f"w{i+1}")])
+    args.extend([rtensor, ("r", f"w{nsite}", "r")])
+    args.append(("l",) + tuple(f"p{i}" for i in range(nsite)) + ("r",))
+    hdiag = block_sparse.contract_into(template, *args).to_vector(template) * inverse
+
+    expr = hop_expr(ltensor, rtensor, cmo, template.shape)
+    batch_expr = hop_expr(ltensor, rtensor, cmo, template.shape, batch=True)
+    # the templates with the vectors stacked along an extra leg of zero quantum number
+    batch_templates = {}
+
+    def hop(x):
+        if x.ndim == 1:
+            return expr(template.from_vector(x)).to_vector(template)
+        # a block of vectors
+        nvec = x.shape[1]
+        if nvec not in batch_templates:
+            qns = template.qns + [np.zeros((nvec, template.qn_size), dtype=int)]
+            batch_templates[nvec] = BlockSparseTensor.zeros(qns, template.signs + (1,), template.qntot)
+        batch_template = batch_templates[nvec]
+        res = batch_expr(batch_template.from_vector(np.ascontiguousarray(x).ravel()))
+        return res.to_vector(batch_template).reshape(-1, nvec)
+
+    return hdiag, hop
 
 
 def func_sum(funcs):
@@ -491,41 +649,50 @@ def eigh_iterative(
     cmo: List[xp.ndarray],
     omega: float,
     cguess: List[np.ndarray],
+    template: BlockSparseTensor = None,
 ):
-    # iterative algorithm
+    # iterative algorithm.
+    # For the block sparse environments, the vectors are the concatenation of the blocks of ``template``
     inverse = mps.optimize_config.inverse
     if isinstance(ltensor, list):
         assert isinstance(rtensor, list)
         assert len(ltensor) == len(rtensor)
         ham = [get_ham_iterative(mps, qn_mask, ltensor_item, rtensor_item, cmo_item, omega) for ltensor_item, rtensor_item, cmo_item in zip(ltensor, rtensor, cmo)]
-        hdiag = sum([hdiag_item for hdiag_item, expr_item in ham])
-        expr = func_sum([expr_item for hdiag_item, expr_item in ham])
+        hdiag = sum([ham_item[0] for ham_item in ham])
+        expr = func_sum([ham_item[1] for ham_item in ham])
+        batch_expr = func_sum([ham_item[2] for ham_item in ham])
+    elif isinstance(ltensor, BlockSparseTensor):
+        hdiag, block_sparse_expr = get_ham_block_sparse(mps, template, ltensor, rtensor, cmo)
     else:
-        hdiag, expr = get_ham_iterative(mps, qn_mask, ltensor, rtensor, cmo, omega)
+        hdiag, expr, batch_expr = get_ham_iterative(mps, qn_mask, ltensor, rtensor, cmo, omega)
 
     count = 0
+    # the vectors are applied in the precision of the sweep
+    real_dtype = np.finfo(mps.dtype).dtype
 
     def hop(x):
         nonlocal count
-        count += 1
-        clist = []
+        x = x.astype(np.result_type(real_dtype, np.complex64) if np.iscomplexobj(x) else real_dtype, copy=False)
+        if isinstance(ltensor, BlockSparseTensor):
+            count += 1 if x.ndim == 1 else x.shape[1]
+            return block_sparse_expr(x) * inverse
         if x.ndim == 1:
-            clist.append(x)
-        else:
-            for icol in range(x.shape[1]):
-                clist.append(x[:, icol])
-        res = []
-        for c in clist:
+            count += 1
             # convert c to initial structure according to qn pattern
-            cstruct = asxp(cvec2cmat(c, qn_mask))
+            cstruct = asxp(cvec2cmat(x, qn_mask))
             cout = expr(cstruct) * inverse
             # convert structure c to 1d according to qn
-            res.append(asnumpy(cout)[qn_mask])
-
-        if len(res) == 1:
-            return res[0]
-        else:
-            return np.stack(res, axis=1)
+            return asnumpy(cout)[qn_mask]
+        count += x.shape[1]
+        # the vectors are stacked along the last index and contracted together
+        cstruct = np.zeros(qn_mask.shape + (x.shape[1],), dtype=x.dtype)
+        cstruct[qn_mask] = x
+        cout = batch_expr(asxp(cstruct)) * inverse
+        return asnumpy(cout)[qn_mask]
+
+    def block_hop(xs):
+        # all trial vectors of the Davidson subspace expansion in one block
+        return list(np.ascontiguousarray(hop(np.stack(xs, axis=1)).T))
 
     # Find the eigenvectors
     algo = mps.optimize_config.algo
@@ -533,10 +700,14 @@ def eigh_iterative(
     if algo == "davidson":
         precond = lambda x, e, *args: x / (hdiag - e + 1e-4)
 
-        e, c = davidson(
-            hop, cguess, precond, max_cycle=100, nroots=nroots, max_memory=64000
+        # the energy can not converge beyond the precision of the sweep
+        tol = max(1e-12, 10 * np.finfo(real_dtype).eps)
+        _, e, c = davidson1(
+            block_hop, cguess, precond, tol=tol, max_cycle=100, nroots=nroots, max_memory=64000
         )
-        # if one root, davidson return e as np.float
+        # if one root, return e as np.float
+        if nroots == 1:
+            e, c = e[0], c[0]
 
     # elif algo == "arpack":
     #    # scipy arpack solver : much slower than pyscf/davidson
@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 
+from renormalizer.mps.backend import xp
 from renormalizer.mps.matrix import asxp
-from renormalizer.mps.oe_contract_wrap import oe_contract_expression
+from renormalizer.mps.oe_contract_wrap import oe_contract_expression, oe_contract
+from renormalizer.mps.block_sparse import BlockSparseTensor, tensordot
+from renormalizer.mps.sparse_mo import SparseMo
 
 
-def hop_expr(ltensor, rtensor, cmo, cshape, twolayer:bool=False):
+def hop_expr(ltensor, rtensor, cmo, cshape, twolayer:bool=False, batch:bool=False, ensemble:bool=False):
+    # If ``batch`` is ``True``, the returned function accepts a block of vectors
+    # stacked along an extra last index and contracts them in a single call.
+    # If ``ensemble`` is ``True``, the environments of several wavefunctions are also stacked
+    # along an extra last index and each vector is contracted with its own environments.
+    # The returned function then optionally accepts the indices of the environments to use
 
     nsite = len(cmo)
     # whether have the ancilla
@@ -12,6 +20,24 @@ def hop_expr(ltensor, rtensor, cmo, cshape, twolayer:bool=False):
     if not ancilla:
         assert nsite + 2 == len(cshape)
 
+    if ensemble and (batch or isinstance(ltensor, BlockSparseTensor) or any(isinstance(mo, SparseMo) for mo in cmo)):
+        raise NotImplementedError("Ensemble hop is only implemented for dense environments and operators")
+
+    if isinstance(ltensor, BlockSparseTensor):
+        if twolayer or ancilla:
+            raise NotImplementedError("Block sparse hop is only implemented for single layer MPS")
+        return _block_sparse_hop(ltensor, rtensor, cmo, batch)
+
+    if any(isinstance(mo, SparseMo) for mo in cmo):
+        if nsite == 1 and not twolayer:
+            # loop over the local operators of the site
+            hop = lambda c: cmo[0].hop(ltensor, rtensor, c)
+            if batch:
+                return _loop_batch(hop)
+            return hop
+        # not implemented for the other cases. Fall back to the dense sites
+        cmo = [mo.todense() if isinstance(mo, SparseMo) else mo for mo in cmo]
+
     ltensor = asxp(ltensor)
     rtensor = asxp(rtensor)
     for i in range(len(cmo)):
@@ -32,10 +58,10 @@ def hop_expr(ltensor, rtensor, cmo, cshape, twolayer:bool=False):
             #   |   f   |
             #   O-c-O-i-O
             #   S-d h k-S
-            expr = oe_contract_expression(
+            expr = _contract_expression(
                 "abcd, befg, cfhi, jgik, aej -> dhk",
                 ltensor, cmo[0], cmo[0], rtensor, cshape,
-                constants=[0, 1, 2, 3]
+                constants=[0, 1, 2, 3], batch=batch, ensemble=ensemble,
             )
         else:
             #   S-a e   j o-S
@@ -43,10 +69,10 @@ def hop_expr(ltensor, rtensor, cmo, cshape, twolayer:bool=False):
             #   |   f   k   |
             #   O-c-O-i-O-n-O
             #   S-d h   m p-S
-            expr = oe_contract_expression(
+            expr = _contract_expression(
                 "abcd, befg, cfhi, gjkl, ikmn, olnp, aejo -> dhmp",
                 ltensor, cmo[0], cmo[0], cmo[1], cmo[1], rtensor, cshape,
-                constants=[0, 1, 2, 3, 4, 5],
+                constants=[0, 1, 2, 3, 4, 5], batch=batch, ensemble=ensemble,
             )
         # early return
         return expr
@@ -60,10 +86,10 @@ def hop_expr(ltensor, rtensor, cmo, cshape, twolayer:bool=False):
         # O-b - b-O
         #
         # S-c   k-S
-        expr = oe_contract_expression(
+        expr = _contract_expression(
             "abc, lbk, ck -> al",
             ltensor, rtensor, cshape,
-            constants=[0, 1],
+            constants=[0, 1], batch=batch, ensemble=ensemble,
         )
     elif nsite == 1:
         if not ancilla:
@@ -72,10 +98,10 @@ def hop_expr(ltensor, rtensor, cmo, cshape, twolayer:bool=False):
             # O-b-O-f-O
             #     e
             # S-c   k-S
-            expr = oe_contract_expression(
+            expr = _contract_expression(
                 "abc, bdef, lfk, cek -> adl",
                 ltensor, cmo[0], rtensor, cshape,
-                constants=[0, 1, 2],
+                constants=[0, 1, 2], batch=batch, ensemble=ensemble,
             )
         else:
             # S-a   l-S
@@ -84,10 +110,10 @@ def hop_expr(ltensor, rtensor, cmo, cshape, twolayer:bool=False):
             #     e
             # S-c   k-S
             #     g
-            expr = oe_contract_expression(
+            expr = _contract_expression(
                 "abc, bdef, lfk, cegk -> adgl",
                 ltensor, cmo[0], rtensor, cshape,
-                constants=[0, 1, 2],
+                constants=[0, 1, 2], batch=batch, ensemble=ensemble,
             )
     else:
         if not ancilla:
@@ -96,10 +122,10 @@ def hop_expr(ltensor, rtensor, cmo, cshape, twolayer:bool=False):
             # O-b-O-f-O-j-O
             #     e   h
             # S-c       k-S
-            expr = oe_contract_expression(
+            expr = _contract_expression(
                 "abc, bdef, fghj, ljk, cehk -> adgl",
                 ltensor, cmo[0], cmo[1], rtensor, cshape,
-                constants=[0, 1, 2, 3],
+                constants=[0, 1, 2, 3], batch=batch, ensemble=ensemble,
             )
         else:
             # S-a       l-S
@@ -108,10 +134,90 @@ def hop_expr(ltensor, rtensor, cmo, cshape, twolayer:bool=False):
             #     e   h
             # S-c       k-S
             #     m   n
-            expr = oe_contract_expression(
+            expr = _contract_expression(
                 "abc, bdef, fghj, ljk, cemhnk -> admgnl",
                 ltensor, cmo[0], cmo[1], rtensor, cshape,
-                constants=[0, 1, 2, 3],
+                constants=[0, 1, 2, 3], batch=batch, ensemble=ensemble,
             )
 
-    return expr
\ No newline at end of file
+    return expr
+
+
+def _contract_expression(subscripts, *operands, constants, batch, ensemble=False):
+    # the last operand is the shape of the vector
+    if ensemble:
+        return _ensemble_expression(subscripts, *operands)
+    if not batch:
+        return oe_contract_expression(subscripts, *operands, constants=constants)
+    # the vectors are stacked along an extra last index "z"
+    inputs, output = subscripts.split("->")
+    batch_subscripts = f"{inputs.strip()}z -> {output.strip()}z"
+    tensors = operands[:-1]
+    assert len(tensors) == len(constants)
+    # the contraction path is cached for each number of vectors
+    return lambda c: oe_contract(batch_subscripts, *tensors, c)
+
+
+def _ensemble_expression(subscripts, *operands):
+    # the environments, which are the first and the last tensors, and the vectors
+    # are stacked along an extra last index "z"
+    inputs, output = subscripts.split("->")
+    inputs = [i.strip() for i in inputs.split(",")]
+    for i in [0, -2, -1]:
+        inputs[i] += "z"
+    ensemble_subscripts = f"{', '.join(inputs)} -> {output.strip()}z"
+    tensors = operands[:-1]
+    nz = tensors[0].shape[-1]
+
+    def expr(c, index=None):
+        ltensor, rtensor = tensors[0], tensors[-1]
+        if index is not None and len(index) != nz:
+            ltensor, rtensor = ltensor[..., index], rtensor[..., index]
+        # the contraction path is cached for each number of vectors
+        return oe_contract(ensemble_subscripts, ltensor, *tensors[1:-1], rtensor, c)
+
+    return expr
+
+
+def _loop_batch(hop):
+    # apply ``hop`` to each of the vectors in the block
+    return lambda c: xp.stack([hop(c[..., i]) for i in range(c.shape[-1])], axis=-1)
+
+
+def _block_sparse_hop(ltensor, rtensor, cmo, batch=False):
+    # the same contractions as the single layer case of ``hop_expr``
+    # performed by a sequence of blockwise ``tensordot``.
+    # The indices of the intermediate tensors are noted in the comments.
+    # If ``batch`` is ``True``, the vectors are stacked along an extra last leg "z"
+    # with zero quantum number, which is carried along by the contractions
+    nsite = len(cmo)
+    assert isinstance(rtensor, BlockSparseTensor)
+    assert all(isinstance(mo, BlockSparseTensor) for mo in cmo)
+    # shift of the indices behind the stacked leg
+    nz = int(batch)
+
+    def hop(c):
+        assert isinstance(c, BlockSparseTensor)
+        # abc, c...(z) -> ab...(z)
+        res = tensordot(ltensor, c, ([2], [0]))
+        if nsite == 0:
+            # abk(z), lbk -> a(z)l
+            res = tensordot(res, rtensor, ([1, 2], [1, 2]))
+        elif nsite == 1:
+            # abek(z), bdef -> ak(z)df
+            res = tensordot(res, cmo[0], ([1, 2], [0, 2]))
+            # ak(z)df, lfk -> a(z)dl
+            res = tensordot(res, rtensor, ([1, 3 + nz], [2, 1]))
+        else:
+            # abehk(z), bdef -> ahk(z)df
+            res = tensordot(res, cmo[0], ([1, 2], [0, 2]))
+            # ahk(z)df, fghj -> ak(z)dgj
+            res = tensordot(res, cmo[1], ([4 + nz, 1], [0, 2]))
+            # ak(z)dgj, ljk -> a(z)dgl
+            res = tensordot(res, rtensor, ([1, 4 + nz], [2, 1]))
+        if batch:
+            # move the stacked leg to the end
+            res = res.transpose([0] + list(range(2, res.ndim)) + [1])
+        return res
+
+    return hop
@@ -1,35 +1,208 @@
 # -*- coding: utf-8 -*-
 # Author: Jiajun Ren <jiajunren0522@gmail.com>
 
+import os
+import pickle
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
-from collections import deque
+from collections import deque, OrderedDict
 
 from renormalizer.mps.backend import np, backend, xp
 from renormalizer.mps.matrix import (Matrix, multi_tensor_contract, asxp,
     asnumpy, tensordot)
+from renormalizer.mps.block_sparse import BlockSparseTensor
+from renormalizer.mps.sparse_mo import SparseMo
+
+logger = logging.getLogger(__name__)
+
+
+class EnvironStore:
+    """
+    Dict-like storage of the environments with a memory limit.
+
+    The environments are kept in memory in LRU order. When the total size exceeds ``mem_limit``,
+    the least recently used environments are dumped to the disk and loaded back upon access.
+    :meth:`prefetch` loads a dumped environment in a background thread
+    so that the loading overlaps with the computation.
+
+    Parameters
+    ----------
+    mem_limit : int or float
+        The maximum total bytes of the environments in memory. The most recently used environment
+        is always kept in memory. ``np.inf`` means no limit.
+    dump_dir : str
+        The directory to dump the environments. A temporary sub directory is created
+        and removed when the store is garbage-collected.
+    """
+
+    def __init__(self, mem_limit=np.inf, dump_dir="./"):
+        self.mem_limit = mem_limit
+        self.dump_dir = dump_dir
+        self._memory = OrderedDict()
+        self._nbytes = 0
+        # key -> dumped file name
+        self._disk = {}
+        # key -> future of the loaded tensor
+        self._prefetched = {}
+        self._lock = threading.RLock()
+        self._dir_with_id = None
+        self._executor = None
+
+    def __contains__(self, key):
+        return key in self._memory or key in self._disk
+
+    def __len__(self):
+        return len(set(self._memory) | set(self._disk))
+
+    def keys(self):
+        return set(self._memory) | set(self._disk)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __setitem__(self, key, tensor):
+        with self._lock:
+            self._discard(key)
+            self._memory[key] = tensor
+            self._nbytes += tensor.nbytes
+            self._evict()
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            future = self._prefetched.pop(key, None)
+        if future is not None:
+            tensor = future.result()
+        else:
+            tensor = self._load(self._disk[key])
+        with self._lock:
+            # the dumped file is kept until the key is overwritten
+            if key in self._disk and key not in self._memory:
+                self._memory[key] = tensor
+                self._nbytes += tensor.nbytes
+                self._evict()
+        return tensor
+
+    def prefetch(self, key):
+        """
+        Load the environment in a background thread if it has been dumped to the disk.
+        """
+        with self._lock:
+            if key in self._memory or key not in self._disk or key in self._prefetched:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            self._prefetched[key] = self._executor.submit(self._load, self._disk[key])
+
+    def _discard(self, key):
+        if key in self._memory:
+            self._nbytes -= self._memory.pop(key).nbytes
+        self._prefetched.pop(key, None)
+        fname = self._disk.pop(key, None)
+        if fname is not None:
+            try:
+                os.remove(fname)
+            except OSError:
+                logger.exception(f"Remove {fname} failed")
+
+    def _evict(self):
+        while self.mem_limit < self._nbytes and 1 < len(self._memory):
+            key, tensor = self._memory.popitem(last=False)
+            self._nbytes -= tensor.nbytes
+            if key not in self._disk:
+                self._disk[key] = self._dump(key, tensor)
+
+    def _dump(self, key, tensor):
+        if self._dir_with_id is None:
+            self._dir_with_id = tempfile.mkdtemp(prefix="environ_", dir=self.dump_dir)
+        fname = os.path.join(self._dir_with_id, "_".join(map(str, key)))
+        if isinstance(tensor, np.ndarray):
+            fname += ".npy"
+            np.save(fname, tensor)
+        else:
+            fname += ".pickle"
+            with open(fname, "wb") as fout:
+                pickle.dump(tensor, fout)
+        return fname
+
+    @staticmethod
+    def _load(fname):
+        if fname.endswith(".npy"):
+            return np.load(fname)
+        with open(fname, "rb") as fin:
+            return pickle.load(fin)
+
+    def __del__(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self._dir_with_id is not None and os.path.exists(self._dir_with_id):
+            try:
+                shutil.rmtree(self._dir_with_id)
+            except OSError:
+                logger.exception(f"Removing temperary dump dir {self._dir_with_id} failed")
 
 
 class Environ:
-    def __init__(self, mps, mpo, domain=None, mps_conj=None):
-        # todo: real disk and other backend
+    def __init__(self, mps, mpo, domain=None, mps_conj=None, block_sparse=False, sparse_mpo=False):
+        # todo: other backend
         # todo: contract_one_site_multi_mpo could generalize contract_one_site,
         # we could unify them in the future.
 
         # idx indicates the exact position of L or R, like
         # L(idx-1) - mpo(idx) - R(idx+1)
-        self._virtual_disk = {}
+        # the environments exceeding the memory limit are dumped to the disk
+        self._virtual_disk = EnvironStore(
+            mps.compress_config.environ_mem_limit, mps.compress_config.dump_matrix_dir
+        )
         if type(mpo) is list:
             ndim = len(mpo) + 2
         else:
             ndim = 3
-        self.sentinel = xp.ones([1,]*ndim, dtype=backend.real_dtype)
+        # if `block_sparse` is set, the environments are stored as `BlockSparseTensor`
+        # and only the symmetry allowed blocks are contracted.
+        self.block_sparse = block_sparse
+        # if `sparse_mpo` is set, the MPO sites are contracted as `SparseMo`
+        # by looping over the non-zero local operators.
+        self.sparse_mpo = sparse_mpo
+        # the precision of the environments follows the MPS
+        self.dtype = np.finfo(mps.dtype).dtype.type
+        if not block_sparse:
+            self.sentinel = xp.ones([1,]*ndim, dtype=self.dtype)
+        else:
+            self.sentinel = None
+            self._block_sentinel = self._construct_block_sentinel(mps, mpo, mps_conj)
         self._construct(mps, mpo, domain, mps_conj)
 
+    def _construct_block_sentinel(self, mps, mpo, mps_conj):
+        if mps_conj is None:
+            mps_conj = mps
+        mpo_list = mpo if type(mpo) is list else [mpo]
+        mps_list = [mps_conj] + mpo_list + [mps]
+        res = {}
+        for domain, bond_idx, sign in [("L", 0, 1), ("R", len(mps), -1)]:
+            qns = [mp._get_l_qn(bond_idx) for mp in mps_list]
+            # the bra (first leg) is in the opposite direction
+            signs = [sign] + [-sign] * (len(mps_list) - 1)
+            res[domain] = BlockSparseTensor.ones_like_boundary(qns, signs, self.dtype)
+        return res
+
+    def get_sentinel(self, domain):
+        if not self.block_sparse:
+            return self.sentinel
+        return self._block_sentinel[domain]
+
     def _construct(self, mps, mpo, domain=None, mps_conj=None):
 
         assert domain in ["L", "R", None]
 
-        if mps_conj is None:
+        if mps_conj is None and not self.block_sparse:
             mps_conj = mps.conj()
 
         if domain is None:
@@ -43,21 +216,66 @@ class Environ:
         self.write_l_sentinel(mps)
         self.write_r_sentinel(mps)
 
-        tensor = self.sentinel
+        tensor = self.get_sentinel(domain)
         for idx in range(start, end, inc):
+            tensor = self._contract_one_site(tensor, mps, mpo, mps_conj, idx, domain)
+            self.write(domain, idx, tensor)
+
+    def _contract_one_site(self, environ, mps, mpo, mps_conj, idx, domain):
+        if mps_conj is None:
+            ms_conj = None
+        else:
+            ms_conj = mps_conj[idx]
+        if self.block_sparse:
+            ms = mps.to_block_sparse(idx)
+            if ms_conj is None:
+                ms_conj = ms.conj()
+            else:
+                # `mps_conj` is already conjugated
+                ms_conj = mps_conj.to_block_sparse(idx).flip_signs()
             if type(mpo) is list:
-                # a list of mpos
-                tensor = contract_one_site_multi_mpo(tensor, mps[idx], [mp[idx] for mp in mpo], domain, ms_conj=mps_conj[idx])
+                mo = [mp.to_block_sparse(idx) for mp in mpo]
             else:
-                # one single mpo
-                tensor = contract_one_site(tensor, mps[idx], mpo[idx], domain, ms_conj=mps_conj[idx])
-            self.write(domain, idx, tensor)
+                mo = mpo.to_block_sparse(idx)
+        else:
+            ms = mps[idx]
+            if type(mpo) is list:
+                mo = [mp[idx] for mp in mpo]
+            elif self.sparse_mpo:
+                mo = mpo.to_sparse(idx)
+            else:
+                mo = mpo[idx]
+        if type(mpo) is list:
+            # a list of mpos
+            return contract_one_site_multi_mpo(environ, ms, mo, domain, ms_conj=ms_conj)
+        else:
+            # one single mpo
+            return contract_one_site(environ, ms, mo, domain, ms_conj=ms_conj)
+
+    def astype(self, real_dtype):
+        """
+        Cast the environments to the precision of ``real_dtype`` in place.
+        Used when the precision of the sweeps is changed.
+        """
+        self.dtype = np.dtype(real_dtype).type
+        if not self.block_sparse:
+            self.sentinel = self.sentinel.astype(real_dtype)
+        else:
+            self._block_sentinel = {k: v.astype(real_dtype) for k, v in self._block_sentinel.items()}
+        for key in self._virtual_disk.keys():
+            tensor = self._virtual_disk[key]
+            if np.issubdtype(tensor.dtype, np.complexfloating):
+                dtype = np.result_type(real_dtype, np.complex64)
+            else:
+                dtype = real_dtype
+            self._virtual_disk[key] = tensor.astype(dtype)
+        return self
 
     def write_l_sentinel(self, mps):
-        self.write("L", -1, self.sentinel)
+        self.write("L", -1, self.get_sentinel("L"))
 
     def write_r_sentinel(self, mps):
-        self.write("R", len(mps), self.sentinel)
+        self.write("R", len(mps), self.get_sentinel("R"))
 
     def GetLR(
         self, domain, siteidx, mps, mpo, itensor=None, method="Scratch", mps_conj=None):
@@ -72,50 +290,48 @@ class Environ:
 
         assert domain in ["L", "R"]
         assert method in ["Enviro", "System", "Scratch"]
-        if mps_conj is None:
+        if mps_conj is None and not self.block_sparse:
             # provide a dummy value. Creating conjugation of a whole MPS should be avoided when possible
             # since the operation is actually rather expensive.
             mps_conj = [None] * len(mps)
 
         if siteidx not in range(len(mps)):
-            return self.sentinel
+            return self.get_sentinel(domain)
 
         if method == "Scratch":
-            itensor = self.sentinel
+            itensor = self.get_sentinel(domain)
             if domain == "L":
                 sitelist = range(siteidx + 1)
             else:
                 sitelist = range(len(mps) - 1, siteidx - 1, -1)
             for imps in sitelist:
-                if type(mpo) is list:
-                    itensor = contract_one_site_multi_mpo(itensor, mps[imps],
-                            [mp[imps] for mp in mpo], domain,
-                            ms_conj=mps_conj[imps])
-                else:
-                    itensor = contract_one_site(itensor, mps[imps], mpo[imps],
-                        domain, ms_conj=mps_conj[imps])
+                itensor = self._contract_one_site(itensor, mps, mpo, mps_conj, imps, domain)
         elif method == "Enviro":
             itensor = self.read(domain, siteidx)
         elif method == "System":
             if itensor is None:
                 offset = -1 if domain == "L" else 1
                 itensor = self.read(domain, siteidx + offset)
-            if type(mpo) is list:
-                itensor = contract_one_site_multi_mpo(itensor, mps[siteidx],
-                        [mp[siteidx] for mp in mpo],
-                        domain, mps_conj[siteidx])
-            else:
-                itensor = contract_one_site(itensor, mps[siteidx], mpo[siteidx],
-                        domain, mps_conj[siteidx])
+            itensor = self._contract_one_site(itensor, mps, mpo, mps_conj, siteidx, domain)
             self.write(domain, siteidx, itensor)
 
         return itensor
 
     def write(self, domain, siteidx, tensor):
-        self._virtual_disk[(domain, siteidx)] = asnumpy(tensor)
+        if not self.block_sparse:
+            tensor = asnumpy(tensor)
+        self._virtual_disk[(domain, siteidx)] = tensor
 
     def read(self, domain: str, siteidx: int):
-        return asxp(self._virtual_disk[(domain, siteidx)])
+        tensor = self._virtual_disk[(domain, siteidx)]
+        if self.block_sparse:
+            return tensor
+        return asxp(tensor)
+
+    def prefetch(self, domain: str, siteidx: int):
+        # load the environment in background if it has been dumped to the disk.
+        # Should be called along the sweep direction
+        self._virtual_disk.prefetch((domain, siteidx))
 
 
 def contract_one_site_multi_mpo(environ, ms, mos, domain, ms_conj=None):
@@ -181,6 +397,10 @@ def contract_one_site(environ, ms, mo, domain, ms_conj=None):
         ms = ms.array
     if isinstance(mo, Matrix):
         mo = mo.array
+    if isinstance(ms_conj, Matrix):
+        ms_conj = ms_conj.array
+    if isinstance(mo, SparseMo):
+        return mo.contract_one_site(environ, ms, domain, ms_conj)
     if ms_conj is None:
         ms_conj = ms.conj()
     if domain == "L":
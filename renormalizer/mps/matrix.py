@@ -6,6 +6,7 @@ import logging
 from typing import List, Union
 
 from renormalizer.mps.backend import np, backend, xp, USE_GPU
+from renormalizer.mps import block_sparse
 
 logger = logging.getLogger(__name__)
 
@@ -14,20 +15,73 @@ class Matrix:
 
     def __init__(self, array, dtype=None):
         assert array is not None
-        array = asnumpy(array)
+        if isinstance(array, block_sparse.BlockSparseTensor):
+            # only the blocks are stored. The dense array is created when first accessed
+            blocks = array
+            array = None
+            iscomplex = np.iscomplexobj(np.zeros(0, dtype=blocks.dtype))
+        else:
+            blocks = None
+            array = asnumpy(array)
+            iscomplex = np.iscomplexobj(array)
         if dtype == backend.real_dtype:
             # forbid unchecked casting
-            assert not np.iscomplexobj(array)
+            assert not iscomplex
         if dtype is None:
-            if np.iscomplexobj(array):
+            if iscomplex:
                 dtype = backend.complex_dtype
             else:
                 dtype = backend.real_dtype
-        self.array: np.ndarray = np.asarray(array, dtype=dtype)
-        self.original_shape = self.array.shape
+        if blocks is None:
+            self.array: np.ndarray = np.asarray(array, dtype=dtype)
+        else:
+            self._array = None
+            if blocks.dtype != dtype:
+                blocks = blocks.astype(dtype)
+        self.original_shape = self.shape if blocks is None else blocks.shape
         self.sigmaqn = None
+        # the block sparse form of the array, see ``MatrixProduct.to_block_sparse``
+        self.block_sparse_cache = blocks
         backend.running = True
 
+    @property
+    def array(self) -> np.ndarray:
+        # use ``__dict__`` to prevent infinite recursion with ``__getattr__`` during multi-processing
+        array = self.__dict__.get("_array")
+        if array is None:
+            blocks = self.__dict__.get("block_sparse_cache")
+            if blocks is None:
+                raise AttributeError("array")
+            array = blocks.todense()
+            self._array = array
+        return array
+
+    @array.setter
+    def array(self, array):
+        self._array = array
+
+    @property
+    def is_dense(self) -> bool:
+        # whether the dense array has been created
+        return self.__dict__.get("_array") is not None
+
+    @property
+    def shape(self):
+        if self.is_dense:
+            return self.array.shape
+        return self.block_sparse_cache.shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        # the memory actually used
+        if self.is_dense:
+            return self.array.nbytes
+        return self.block_sparse_cache.nbytes
+
     def __getattr__(self, item):
         # use this way to obtain ``array`` to prevent infinite recursion during multi-processing
         # see https://stackoverflow.com/questions/22781872/python-pickle-got-acycle-recursion-with-getattr
@@ -50,11 +104,16 @@ class Matrix:
     # for debugging purpose (let it shown in debuggers)
     @property
     def dtype(self):
-        return self.array.dtype
+        if self.is_dense:
+            return self.array.dtype
+        return self.block_sparse_cache.dtype
 
     def astype(self, dtype):
         assert not (self.dtype == backend.complex_dtype and dtype == backend.real_dtype)
-        self.array = np.asarray(self.array, dtype=dtype)
+        if self.is_dense:
+            self.array = np.asarray(self.array, dtype=dtype)
+        if self.block_sparse_cache is not None and self.block_sparse_cache.dtype != dtype:
+            self.block_sparse_cache = self.block_sparse_cache.astype(dtype)
         return self
 
     def abs(self):
@@ -95,9 +154,9 @@ class Matrix:
         check L-orthogonal
         """
         if atol is None:
-            atol = backend.canonical_atol
+            atol = backend.get_canonical_atol(self.dtype)
         if rtol is None:
-            rtol = backend.canonical_rtol
+            rtol = backend.get_canonical_rtol(self.dtype)
         tensm = asxp(self.array.reshape([np.prod(self.shape[:-1]), self.shape[-1]]))
         s = tensm.T.conj() @ tensm
         return xp.allclose(s, xp.eye(s.shape[0]), rtol=rtol, atol=atol)
@@ -107,9 +166,9 @@ class Matrix:
         check R-orthogonal
         """
         if atol is None:
-            atol = backend.canonical_atol
+            atol = backend.get_canonical_atol(self.dtype)
         if rtol is None:
-            rtol = backend.canonical_rtol
+            rtol = backend.get_canonical_rtol(self.dtype)
         tensm = asxp(self.array.reshape([self.shape[0], np.prod(self.shape[1:])]))
         s = tensm @ tensm.T.conj()
         return xp.allclose(s, xp.eye(s.shape[0]), rtol=rtol, atol=atol)
@@ -120,7 +179,10 @@ class Matrix:
         return np.array(self.array, dtype=backend.complex_dtype)
 
     def copy(self):
-        new = self.__class__(self.array.copy(), self.array.dtype)
+        if self.is_dense:
+            new = self.__class__(self.array.copy(), self.array.dtype)
+        else:
+            new = self.__class__(self.block_sparse_cache.copy(), self.dtype)
         new.original_shape = self.original_shape
         new.sigmaqn = self.sigmaqn
         return new
@@ -146,6 +208,7 @@ class Matrix:
         if isinstance(value, Matrix):
             value = value.array
         self.array[key] = value
+        self.block_sparse_cache = None
 
     def __add__(self, other):
         if isinstance(other, Matrix):
@@ -208,6 +271,8 @@ def einsum(subscripts, *operands):
 
 
 def tensordot(a: Union[Matrix, np.ndarray], b: Union[Matrix, np.ndarray, xp.ndarray], axes) -> xp.ndarray:
+    if isinstance(a, block_sparse.BlockSparseTensor):
+        return block_sparse.tensordot(a, b, axes)
     return xp.tensordot(asxp(a), asxp(b), axes)
 
 
@@ -25,27 +25,35 @@ from renormalizer.mps.lib import (
     Environ,
     select_basis,
     )
+from renormalizer.mps.block_sparse import BlockSparseTensor
 from renormalizer.mps.hop_expr import hop_expr
 from renormalizer.utils import sizeof_fmt, CompressConfig, CompressCriteria, OFS, calc_vn_entropy
 
 logger = logging.getLogger(__name__)
 
+# the header file of the matrix product dumped into a directory
+MP_HEADER = "header.npz"
+
 
 class MatrixProduct:
 
     @classmethod
     def load(cls, model: Model, fname: str):
-        npload = np.load(fname, allow_pickle=True)
+        """
+        Load the matrix product dumped by :meth:`dump`.
+
+        Parameters
+        ----------
+        model : :class:`~renormalizer.model.Model`
+            The model of the matrix product.
+        fname : str
+            The ``.npz`` file, or the directory if the matrix product is dumped with ``fmt="dir"``.
+            For the directory format, the matrices are memory-mapped and read from the disk on access.
+        """
         mp = cls()
         mp.model = model
-        nsites = int(npload["nsites"])
-        for i in range(nsites):
-            mt = npload[f"mt_{i}"]
-            if np.iscomplexobj(mt):
-                mp.dtype = backend.complex_dtype
-            else:
-                mp.dtype = backend.real_dtype
-            mp.append(mt)
+        npload = mp._load_mp(fname)
+        nsites = len(mp)
 
         mp.qn = []
         for i in range(nsites+1):
@@ -103,7 +111,7 @@ class MatrixProduct:
 
     @property
     def is_complex(self):
-        return self.dtype == backend.complex_dtype
+        return np.issubdtype(self.dtype, np.complexfloating)
 
     @property
     def bond_dims(self) -> List:
@@ -351,6 +359,54 @@ class MatrixProduct:
         qnmat = add_outer(qnbigl, qnbigr)
         return qnbigl, qnbigr, qnmat
 
+    def _get_l_qn(self, bond_idx: int) -> np.ndarray:
+        # the L-block quantum number at the bond.
+        # The bonds on the right hand side of ``qnidx`` store the R-block quantum number
+        qn = np.array(self.qn[bond_idx])
+        if self.qnidx < bond_idx:
+            qn = np.array(self.qntot) - qn
+        return qn
+
+    def to_block_sparse(self, idx: int) -> BlockSparseTensor:
+        r""" The local site as a :class:`~renormalizer.mps.block_sparse.BlockSparseTensor`.
+
+        All virtual bonds carry the L-block quantum number. The left virtual bond and
+        the (up) physical bond are incoming, the right virtual bond and the down physical bond
+        of MPO are outgoing. The ancillary bond of MPDM has zero quantum number.
+        The result is cached on the site until the site or the quantum numbers of its bonds change.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the site.
+
+        Returns
+        -------
+        block_tensor : BlockSparseTensor
+            The local site with only the blocks satisfying the symmetry.
+        """
+        sigmaqn = self.model.basis[idx].sigmaqn
+        if self.is_mpdm:
+            phys_qns, phys_signs = [sigmaqn, np.zeros_like(sigmaqn)], [1, 1]
+        elif self.is_mpo:
+            phys_qns, phys_signs = [sigmaqn, sigmaqn], [1, -1]
+        else:
+            assert self.is_mps
+            phys_qns, phys_signs = [sigmaqn], [1]
+        qns = [self._get_l_qn(idx)] + phys_qns + [self._get_l_qn(idx + 1)]
+        signs = [1] + phys_signs + [-1]
+        mt = self._mp[idx]
+        if isinstance(mt, Matrix) and mt.block_sparse_cache is not None:
+            cached = mt.block_sparse_cache
+            if cached.signs == tuple(signs) and \
+                    all(np.array_equal(np.reshape(qn, q.shape), q) for qn, q in zip(qns, cached.qns)):
+                return cached
+        qntot = np.zeros(self.model.qn_size, dtype=int)
+        block_tensor = BlockSparseTensor.from_dense(self[idx].array, qns, signs, qntot)
+        if isinstance(mt, Matrix):
+            mt.block_sparse_cache = block_tensor
+        return block_tensor
+
     @property
     def mp_norm(self) -> float:
         # the fast version in the comment rarely makes sense because in a lot of cases
@@ -473,6 +529,34 @@ class MatrixProduct:
         for idx in self.iter_idx_list(full=False):
             mt: Matrix = self[idx]
             qnbigl, qnbigr, _ = self._get_big_qn([idx])
+
+            if temp_m_trunc is None:
+                max_m = None
+            elif isinstance(temp_m_trunc, (list, tuple, np.ndarray)):
+                max_m = temp_m_trunc[idx + 1 if self.to_right else idx]
+            else:
+                max_m = temp_m_trunc
+
+            def m_trunc(sigma):
+                # record the singular values before truncation
+                s_list.append(sigma)
+                if max_m is None:
+                    return self.compress_config.compute_m_trunc(
+                        sigma, idx, self.to_right
+                    )
+                return max_m
+
+            rank = None
+            if self.compress_config.svd_method == "randomized":
+                # only the leading singular values are computed,
+                # so ``s_list`` only contains the leading singular values
+                if max_m is None:
+                    rank = self.compress_config.max_m_trunc(idx, self.to_right)
+                else:
+                    rank = max_m
+
+            # the truncation is done within the decomposition
+            # so that the discarded singular vectors are never formed
             u, sigma, qnlset, v, sigma, qnrset = svd_qn.svd_qn(
                 mt.array,
                 qnbigl,
@@ -480,21 +564,12 @@ class MatrixProduct:
                 self.qntot,
                 system=system,
                 full_matrices=False,
+                m_trunc=m_trunc,
+                rank=rank,
             )
             vt = v.T
-            s_list.append(sigma)
-            if temp_m_trunc is None:
-                m_trunc = self.compress_config.compute_m_trunc(
-                    sigma, idx, self.to_right
-                )
-            else:
-                if isinstance(temp_m_trunc, (list, tuple, np.ndarray)):
-                    m_trunc = temp_m_trunc[idx + 1 if self.to_right else idx]
-                else:
-                    m_trunc = temp_m_trunc
-                m_trunc = min(m_trunc, len(sigma))
             self._update_ms(
-                idx, u, vt, sigma, qnlset, qnrset, m_trunc
+                idx, u, vt, sigma, qnlset, qnrset
             )
 
         self._switch_direction()
@@ -654,8 +729,9 @@ class MatrixProduct:
 
         Parameters
         ---------
-        cstruct : ndarray, List[ndarray]
-            The active site coefficient.
+        cstruct : ndarray, BlockSparseTensor, List[ndarray]
+            The active site coefficient. A ``BlockSparseTensor`` follows the convention
+            of :meth:`to_block_sparse`.
         cidx : list
             The List of active site index.
         qnbigl : ndarray
@@ -685,13 +761,21 @@ class MatrixProduct:
         if self.compress_config.bonddim_should_set:
             self.compress_config.set_bonddim(len(self)+1)
 
+        if isinstance(cstruct, BlockSparseTensor):
+            if self.compress_config.ofs is None:
+                # the super-block convention of ``svd_qn``: the right bond is incoming with the R-block quantum number
+                cstruct = cstruct.flip_leg(-1, self.qntot)
+            else:
+                cstruct = cstruct.todense()
+
         # step 1: get the selected U, S, V
         if type(cstruct) is not list:
             if self.compress_config.ofs is None:
                 # SVD method
                 # full_matrices = True here to enable increase the bond dimension
                 Uset, SUset, qnlnew, Vset, SVset, qnrnew = svd_qn.svd_qn(
-                    asnumpy(cstruct), qnbigl, qnbigr, self.qntot, system=system
+                    cstruct if isinstance(cstruct, BlockSparseTensor) else asnumpy(cstruct),
+                    qnbigl, qnbigr, self.qntot, system=system
                 )
             else:
                 if isinstance(self.model, HolsteinModel):
@@ -1006,6 +1090,25 @@ class MatrixProduct:
             new_mp[i] = mt.to_complex()
         return new_mp
 
+    def astype(self, real_dtype, inplace=False):
+        """
+        Cast the matrices to the precision of ``real_dtype``. Complex matrices stay complex.
+        Used for the sweeps in reduced precision.
+        """
+        if inplace:
+            new_mp = self
+        else:
+            new_mp = self.metacopy()
+        if self.is_complex:
+            new_mp.dtype = np.result_type(real_dtype, np.complex64).type
+        else:
+            new_mp.dtype = np.dtype(real_dtype).type
+        for i, mt in enumerate(self):
+            if mt is None:
+                continue
+            new_mp[i] = mt.array
+        return new_mp
+
     def distance(self, other) -> float:
         l1 = self.conj().dot(self)
         l2 = other.conj().dot(other)
@@ -1045,7 +1148,8 @@ class MatrixProduct:
         return new
 
     def _array2mt(self, array, idx, allow_dump=True):
-        # convert dtype
+        # convert dtype. A BlockSparseTensor following the convention of ``to_block_sparse``
+        # is stored as the blocks until the dense array is required
         if isinstance(array, Matrix):
             mt = array.astype(self.dtype)
         else:
@@ -1057,8 +1161,8 @@ class MatrixProduct:
 
         # array too large. Should be stored in disk
         # use ``while`` to handle the multiple-exit logic
-        while allow_dump and self.compress_config.dump_matrix_size < mt.array.nbytes:
-            dir_with_id = os.path.join(self.compress_config.dump_matrix_dir, str(id(self)))
+        while allow_dump and self.compress_config.dump_matrix_size < mt.nbytes:
+            dir_with_id = self._dump_dir
             if not os.path.exists(dir_with_id):
                 try:
                     os.mkdir(dir_with_id)
@@ -1067,11 +1171,7 @@ class MatrixProduct:
                     break
             dump_name = os.path.join(dir_with_id, f"{idx}.npy")
             try:
-                array = mt.array
-                if not array.flags.c_contiguous and not array.flags.f_contiguous:
-                    # for faster dump (3x). Costs more memory.
-                    array = np.ascontiguousarray(array)
-                np.save(dump_name, array)
+                _save_array(dump_name, mt.array)
             except:
                 logger.exception("Save matrix to disk failed. Working with the matrix in memory.")
                 break
@@ -1079,10 +1179,67 @@ class MatrixProduct:
 
         return mt
 
+    @property
+    def _dump_dir(self):
+        # the directory for the matrices that are too large to be kept in memory
+        return os.path.join(self.compress_config.dump_matrix_dir, str(id(self)))
+
+    def _load_mp(self, fname):
+        # load the matrices and return the other dumped data
+        if not os.path.isdir(fname):
+            npload = np.load(fname, allow_pickle=True)
+            for i in range(int(npload["nsites"])):
+                mt = npload[f"mt_{i}"]
+                if np.iscomplexobj(mt):
+                    self.dtype = backend.complex_dtype
+                else:
+                    self.dtype = backend.real_dtype
+                self.append(mt)
+            return npload
+
+        # the directory format. The matrices are memory-mapped and read from the disk on access.
+        # The mapping keeps the content even if the files are replaced by another dump later
+        fname = os.path.abspath(fname)
+        npload = np.load(os.path.join(fname, MP_HEADER), allow_pickle=True)
+        if bool(npload["is_complex"]):
+            self.dtype = backend.complex_dtype
+        else:
+            self.dtype = backend.real_dtype
+        last_shape = None
+        for i in range(int(npload["nsites"])):
+            array = _load_array(os.path.join(fname, f"mt_{i}.npy"))
+            shape = array.shape
+            if shape[1] != self.pbond_list[i]:
+                raise ValueError("Matrix physical bond dimension does not match system information")
+            if last_shape is not None:
+                assert shape[0] == last_shape[-1]
+            last_shape = shape
+            mt = Matrix(array, dtype=self.dtype)
+            mt.sigmaqn = self._get_sigmaqn(i)
+            self._mp.append(mt)
+        return npload
+
     def build_empty_mp(self, num):
         self._mp = [[None]] * num
 
-    def dump(self, fname, other_attrs=None):
+    def dump(self, fname, other_attrs=None, fmt="npz"):
+        """
+        Dump the matrix product to the disk.
+
+        Parameters
+        ----------
+        fname : str
+            The file name or the directory name.
+        other_attrs : list of str, optional
+            Other attributes to dump.
+        fmt : str
+            ``"npz"``: all data in a single ``.npz`` file.
+            ``"dir"``: one ``.npy`` file for each matrix and a ``header.npz`` for the other data in the directory.
+            The matrices are then loaded lazily by :meth:`load`, which is useful for matrix products
+            larger than the memory.
+        """
+        if fmt not in ["npz", "dir"]:
+            raise ValueError(f"Unknown dump format: {fmt}")
 
         if other_attrs is None:
             other_attrs = []
@@ -1094,8 +1251,11 @@ class MatrixProduct:
         # version of the protocol
         data_dict["version"] = "0.4"
         data_dict["nsites"] = self.site_num
-        for idx, mt in enumerate(self):
-            data_dict[f"mt_{idx}"] = mt.array
+        if fmt == "npz":
+            for idx, mt in enumerate(self):
+                data_dict[f"mt_{idx}"] = mt.array
+        else:
+            data_dict["is_complex"] = self.dtype == backend.complex_dtype
 
         for attr in ["qnidx", "qntot", "qn", "to_right"] + other_attrs:
             data_dict[attr] = getattr(self, attr)
@@ -1108,7 +1268,14 @@ class MatrixProduct:
             data_dict[f"subqn_{i}"] = qn[i]
 
         try:
-            np.savez(fname, **data_dict)
+            if fmt == "npz":
+                np.savez(fname, **data_dict)
+            else:
+                os.makedirs(fname, exist_ok=True)
+                for idx in range(self.site_num):
+                    _save_array(os.path.join(fname, f"mt_{idx}.npy"), self[idx].array)
+                # the header is written last
+                np.savez(os.path.join(fname, MP_HEADER), **data_dict)
         except Exception:
             logger.exception(f"Dump MP failed.")
 
@@ -1151,14 +1318,12 @@ class MatrixProduct:
         mt_or_str_or_list = self._mp[item]
         if isinstance(mt_or_str_or_list, list):
             assert isinstance(item, slice)
-            for elem in mt_or_str_or_list:
-                if isinstance(elem, str):
-                    # load all matrices to memory will make
-                    # the dump mechanism pointless
-                    raise IndexError("Can't slice on dump matrices.")
+            if any(isinstance(elem, str) for elem in mt_or_str_or_list):
+                # the matrices on the disk are memory-mapped and not read into the memory
+                return [self[i] for i in range(len(self))[item]]
         if isinstance(mt_or_str_or_list, str):
             try:
-                mt = Matrix(np.load(mt_or_str_or_list), dtype=self.dtype)
+                mt = Matrix(_load_array(mt_or_str_or_list), dtype=self.dtype)
                 mt.sigmaqn = self._get_sigmaqn(item)
             except:
                 logger.exception(f"Can't load matrix from {mt_or_str_or_list}")
@@ -1171,7 +1336,8 @@ class MatrixProduct:
 
     def __setitem__(self, key, array):
         old_mt = self._mp[key]
-        if isinstance(old_mt, str):
+        # matrices loaded from a dumped directory are not removed
+        if isinstance(old_mt, str) and os.path.dirname(old_mt) == self._dump_dir:
             try:
                 os.remove(old_mt)
             except:
@@ -1205,7 +1371,7 @@ class MatrixProduct:
         return template_str.format(string, sizeof_fmt(self.total_bytes), self.bond_dims,)
 
     def __del__(self):
-        dir_with_id = os.path.join(self.compress_config.dump_matrix_dir, str(id(self)))
+        dir_with_id = self._dump_dir
         if os.path.exists(dir_with_id):
             try:
                 shutil.rmtree(dir_with_id)
@@ -1225,3 +1391,21 @@ class MatrixProduct:
             mp.append(mt)
         mp.build_empty_qn()
         return mp
+
+
+def _save_array(fname, array):
+    if not array.flags.c_contiguous and not array.flags.f_contiguous:
+        # for faster dump (3x). Costs more memory.
+        array = np.ascontiguousarray(array)
+    # The file might be memory-mapped by other matrix products (or by the array itself).
+    # Don't overwrite the file inplace
+    assert fname.endswith(".npy")
+    tmp_fname = fname[:-len(".npy")] + ".tmp.npy"
+    np.save(tmp_fname, array)
+    os.replace(tmp_fname, fname)
+
+
+def _load_array(fname):
+    # The data is read from the disk on access.
+    # Copy-on-write so that the array could be updated inplace without changing the file
+    return np.load(fname, mmap_mode="c")
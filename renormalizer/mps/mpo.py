@@ -9,12 +9,14 @@ import scipy.sparse
 
 from renormalizer.model import Model, HolsteinModel
 from renormalizer.mps.backend import xp
-from renormalizer.mps.matrix import moveaxis, tensordot
+from renormalizer.mps.matrix import moveaxis, tensordot, asnumpy
 from renormalizer.mps.mp import MatrixProduct
 from renormalizer.mps.svd_qn import add_outer
 from renormalizer.mps import svd_qn
 from renormalizer.mps.lib import update_cv
-from renormalizer.mps.symbolic_mpo import construct_symbolic_mpo, _terms_to_table, symbolic_mo_to_numeric_mo, swap_site
+from renormalizer.mps.symbolic_mpo import construct_symbolic_mpo, _terms_to_table, _deduplicate_table, \
+    symbolic_mo_to_numeric_mo, swap_site
+from renormalizer.mps.sparse_mo import SparseMo
 from renormalizer.utils import Quantity
 from renormalizer.model.op import Op
 from renormalizer.utils.elementop import (
@@ -272,6 +274,51 @@ class Mpo(MatrixProduct):
             raise ValueError("Terms all have factor 0.")
 
         table, primary_ops, factor = _terms_to_table(model, terms, -self.offset)
+        self._construct(model, table, primary_ops, factor, algo)
+
+    @classmethod
+    def from_table(cls, model: Model, table: np.ndarray, primary_ops: List[Op], factor: np.ndarray, algo="qr"):
+        r""" Construct MPO from the operator table, bypassing the construction of :class:`~renormalizer.model.Op`
+        for each term. Useful for Hamiltonians with a huge number of terms,
+        such as the ab initio Hamiltonian from :func:`renormalizer.model.h_qc.qc_table`.
+
+        Parameters
+        ----------
+        model : :class:`~renormalizer.model.Model`
+            The model. Only the basis is used.
+        table : np.ndarray
+            Integer array with shape ``(nterms, nsites)``.
+            Each entry is the index of the local operator in ``primary_ops``.
+            The same terms are combined.
+        primary_ops : list of :class:`~renormalizer.model.Op`
+            The local operators. The factors should be 1.
+        factor : np.ndarray
+            The factor of each term.
+        algo : str
+            The algorithm to construct the symbolic MPO.
+
+        Returns
+        -------
+        mpo : Mpo
+            The constructed MPO.
+        """
+        table = np.asarray(table)
+        factor = np.asarray(factor)
+        if table.ndim != 2 or table.shape[1] != len(model.basis):
+            raise ValueError(f"The table should have shape (nterms, {len(model.basis)}). Got {table.shape}.")
+        if len(table) != len(factor):
+            raise ValueError(f"Inconsistent number of terms in table and factor: {len(table)} and {len(factor)}")
+        if len(primary_ops) >= np.iinfo(np.uint16).max:
+            raise ValueError(f"Too many primary operators: {len(primary_ops)}")
+        table, factor = _deduplicate_table(table.astype(np.uint16), factor)
+        if len(table) == 0:
+            raise ValueError("Terms all have factor 0.")
+        mpo = cls()
+        mpo.offset = 0
+        mpo._construct(model, table, primary_ops, factor, algo)
+        return mpo
+
+    def _construct(self, model, table, primary_ops, factor, algo):
 
         self.dtype = factor.dtype
 
@@ -288,6 +335,8 @@ class Mpo(MatrixProduct):
         for impo, mo in enumerate(self.symbolic_mpo):
             mo_mat = symbolic_mo_to_numeric_mo(model.basis[impo], mo, self.dtype)
             self.append(mo_mat)
+        # the sites evaluated from the symbolic mpo, see ``to_sparse``
+        self._symbolic_mts = list(self._mp)
 
 
     def _get_sigmaqn(self, idx):
@@ -315,6 +364,38 @@ class Mpo(MatrixProduct):
                 setattr(new, attr, deepcopy(getattr(self, attr)))
         return new
 
+    def to_sparse(self, idx: int) -> SparseMo:
+        r""" The local site as a :class:`~renormalizer.mps.sparse_mo.SparseMo`,
+        a list of the non-zero ``(row, col, local operator)`` entries.
+        If the site is not modified after the construction, the entries are
+        evaluated from the symbolic MPO, otherwise they are extracted from the dense site.
+        The result is cached until the site is replaced.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the site.
+
+        Returns
+        -------
+        sparse_mo : SparseMo
+            The operator-valued site.
+        """
+        if not hasattr(self, "_sparse_mo_cache"):
+            self._sparse_mo_cache = {}
+        mt = self._mp[idx]
+        cached = self._sparse_mo_cache.get(idx)
+        if cached is not None and cached[0] is mt:
+            return cached[1]
+        symbolic_mts = getattr(self, "_symbolic_mts", None)
+        if symbolic_mts is not None and len(symbolic_mts) == len(self) and symbolic_mts[idx] is mt:
+            sparse_mo = SparseMo.from_symbolic(self.model.basis[idx], self.symbolic_mpo[idx], self.dtype)
+        else:
+            sparse_mo = SparseMo.from_dense(self[idx].array)
+        if not isinstance(mt, str):
+            self._sparse_mo_cache[idx] = (mt, sparse_mo)
+        return sparse_mo
+
     @property
     def dummy_qn(self):
         return [np.zeros((dim, self.model.qn_size), dtype=int) for dim in self.bond_dims]
@@ -388,15 +469,21 @@ class Mpo(MatrixProduct):
             new_mps.canonicalise()
         return new_mps
 
-    def contract(self, mps, algo="svd"):
+    def contract(self, mps, algo=None):
         r""" an approximation of mpo @ mps/mpdm/mpo
 
         Parameters
         ----------
         mps : `Mps`, `Mpo`, `MpDm`
         algo: str, optional
-            The algorithm to compress mpo @ mps/mpdm/mpo.  It could be ``svd``
-            (default) and ``variational``.
+            The algorithm to compress mpo @ mps/mpdm/mpo.  It could be ``svd``,
+            ``variational``, ``zipup`` and ``density_matrix``.
+            Default is ``mps.compress_config.contract_algo``.
+            ``zipup`` and ``density_matrix`` truncate site by site during the contraction
+            so that the MPS with the inflated bond dimension is never formed.
+            ``zipup`` has the lowest memory cost. ``density_matrix`` is more accurate
+            at the price of the environments of :math:`\langle \psi | \hat O^\dagger \hat O | \psi \rangle`.
+            See E. M. Stoudenmire and S. R. White, New J. Phys. 12, 055026 (2010).
 
         Returns
         -------
@@ -412,6 +499,8 @@ class Mpo(MatrixProduct):
 
 
         """
+        if algo is None:
+            algo = mps.compress_config.contract_algo
         if algo == "svd":
             # mapply->canonicalise->compress
             new_mps = self.apply(mps)
@@ -419,11 +508,119 @@ class Mpo(MatrixProduct):
             new_mps.compress()
         elif algo == "variational":
             new_mps = mps.variational_compress(self)
+        elif algo == "zipup":
+            new_mps = self._contract_zipup(mps)
+        elif algo == "density_matrix":
+            new_mps = self._contract_density_matrix(mps)
         else:
             assert False
 
         return new_mps
 
+    def _contract_site(self, carry, mp: MatrixProduct, idx: int):
+        # carry (chi, w, m) x mpo (w, p, q, w') x mp (m, q, [r], m') -> (chi, p, [r], w', m')
+        res = tensordot(carry, mp[idx].array, axes=([2], [0]))
+        res = tensordot(res, self[idx].array, axes=([1, 2], [0, 2]))
+        return xp.moveaxis(res, [-2, -1], [1, -2])
+
+    def _contract_qn(self, mp: MatrixProduct):
+        # the L-block quantum number of the right bond of each site in the product
+        # and the quantum number of the product
+        qntot = self.qntot + mp.qntot
+        qnbigr_list = []
+        for idx in range(1, len(self) + 1):
+            qnbigr_list.append(qntot - add_outer(self._get_l_qn(idx), mp._get_l_qn(idx)))
+        return qnbigr_list, qntot
+
+    def _contract_sweep(self, mp: MatrixProduct, decompose):
+        # contract from left to right. ``decompose(idx, tensor, qnbigl, qnbigr, qntot)`` truncates
+        # the contracted ``tensor`` (chi, p, [r], w', m') into the new site and the carry (chi', w', m').
+        # The result is left-canonical
+        assert self.site_num == mp.site_num
+        qnbigr_list, qntot = self._contract_qn(mp)
+        new_mp = mp.metacopy()
+        new_mp.qn = [np.zeros((1, len(qntot)), dtype=int)]
+        carry = xp.ones((1, 1, 1))
+        for idx in range(len(mp)):
+            tensor = self._contract_site(carry, mp, idx)
+            if idx == len(mp) - 1:
+                new_mp[idx] = asnumpy(tensor).reshape(tensor.shape[:-2] + (1,))
+                break
+            qnbigl = add_outer(new_mp.qn[-1], mp._get_sigmaqn(idx))
+            u, qnl, carry = decompose(idx, asnumpy(tensor), qnbigl, qnbigr_list[idx], qntot)
+            new_mp[idx] = u.reshape(tensor.shape[:-2] + (-1,))
+            new_mp.qn.append(np.array(qnl))
+        # the R-block quantum number of the last bond
+        new_mp.qn.append(np.zeros((1, len(qntot)), dtype=int))
+        new_mp.qntot = qntot
+        new_mp.qnidx = len(mp) - 1
+        new_mp.to_right = False
+        return new_mp
+
+    def _contract_zipup(self, mp: MatrixProduct) -> MatrixProduct:
+        # zip-up algorithm. The truncation during the zip-up is looser because the basis
+        # on the right hand side is not orthonormal. The final bond dimension is determined by the
+        # SVD compression sweep afterwards
+        mp = self.promote_mt_type(mp.copy()).ensure_right_canonical()
+        compress_config = mp.compress_config
+        if compress_config.bonddim_should_set:
+            compress_config.set_bonddim(len(mp) + 1)
+
+        def decompose(idx, tensor, qnbigl, qnbigr, qntot):
+            def m_trunc(sigma):
+                return min(2 * compress_config.compute_m_trunc(sigma, idx, True), len(sigma))
+            u, s, qnl, v, s, qnr = svd_qn.svd_qn(
+                tensor.reshape(np.prod(tensor.shape[:-2]), -1),
+                qnbigl,
+                qnbigr,
+                qntot,
+                system="L",
+                full_matrices=False,
+                m_trunc=m_trunc,
+            )
+            carry = (s.reshape(-1, 1) * v.T).reshape((-1,) + tensor.shape[-2:])
+            return u, qnl, carry
+
+        new_mp = self._contract_sweep(mp, decompose)
+        return new_mp.compress()
+
+    def _contract_density_matrix(self, mp: MatrixProduct) -> MatrixProduct:
+        # density matrix algorithm. The reduced density matrix of the product
+        # is diagonalized site by site with the environment of <mp|mpo^\dagger mpo|mp>
+        mp = self.promote_mt_type(mp.copy())
+        compress_config = mp.compress_config
+        if compress_config.bonddim_should_set:
+            compress_config.set_bonddim(len(mp) + 1)
+
+        # the right environment (m, w, w_conj, m_conj) of each bond
+        environ = [None] * len(mp) + [xp.ones((1, 1, 1, 1))]
+        for idx in range(len(mp) - 1, 0, -1):
+            mt = mp[idx].array
+            mt = mt.reshape(mt.shape[0], mt.shape[1], -1, mt.shape[-1])
+            mo = self[idx].array
+            # (m, q, r, w', w_conj', m_conj')
+            res = tensordot(mt, environ[idx + 1], axes=([3], [0]))
+            # (w, p, m, r, w_conj', m_conj')
+            res = tensordot(mo, res, axes=([2, 3], [1, 3]))
+            # (w, p, m, w_conj', m_conj, q_conj)
+            res = tensordot(res, mt.conj(), axes=([3, 5], [2, 3]))
+            # (w, m, m_conj, w_conj)
+            res = tensordot(res, mo.conj(), axes=([1, 5, 3], [1, 2, 3]))
+            environ[idx] = res.transpose(1, 0, 3, 2)
+
+        def decompose(idx, tensor, qnbigl, qnbigr, qntot):
+            tensor = tensor.reshape(np.prod(tensor.shape[:-2]), *tensor.shape[-2:])
+            dm = tensordot(tensor, environ[idx + 1], axes=([1, 2], [1, 0]))
+            dm = asnumpy(tensordot(dm, tensor.conj(), axes=([1, 2], [1, 2])))
+            u, s, qn = svd_qn.eigh_qn(dm, qnbigl, qnbigr, qntot, system="L")
+            order = np.argsort(s)[::-1]
+            order = order[:compress_config.compute_m_trunc(s[order], idx, True)]
+            u = u[:, order]
+            carry = asnumpy(tensordot(u.conj(), tensor, axes=([0], [0])))
+            return u, [qn[i] for i in order], carry
+
+        return self._contract_sweep(mp, decompose)
+
     def try_swap_site(self, new_model: Model, swap_jw: bool, algo="Hopcroft-Karp"):
         # in place swapping.
         # if swap_jw is set to True, then self.primary_ops is modified in place
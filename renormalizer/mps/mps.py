@@ -1,16 +1,17 @@
 # -*- encoding: utf-8 -*-
 
 import logging
-from collections import Counter, deque
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps, reduce
-from typing import Union, List, Dict
+from typing import Union, List, Dict, Tuple
 import itertools
 
 
 import scipy
-from scipy import stats
 
-from renormalizer.lib import solve_ivp, expm_krylov
+from renormalizer.lib import solve_ivp, expm_krylov, expm_krylov_batch
 from renormalizer.model import Model, Op, OpSum, basis as ba
 from renormalizer.mps import svd_qn
 from renormalizer.mps.svd_qn import add_outer, get_qn_mask
@@ -19,7 +20,6 @@ from renormalizer.mps.lib import (
     Environ,
     select_basis,
     compressed_sum,
-    contract_one_site,
     cvec2cmat
 )
 from renormalizer.mps.matrix import (
@@ -32,13 +32,16 @@ from renormalizer.mps.matrix import (
 from renormalizer.mps.mp import MatrixProduct
 from renormalizer.mps.hop_expr import hop_expr
 from renormalizer.mps.mpo import Mpo
+from renormalizer.mps.observable_plan import ObservablePlan
 from renormalizer.utils import (
     OptimizeConfig,
     CompressCriteria,
     EvolveConfig,
     EvolveMethod
 )
-from renormalizer.utils.utils import calc_vn_entropy, calc_vn_entropy_dm
+from renormalizer.utils.utils import calc_vn_entropy, iter_vn_entropy, lazy_import
+
+stats = lazy_import("scipy.stats")
 
 logger = logging.getLogger(__name__)
 
@@ -351,18 +354,10 @@ class Mps(MatrixProduct):
 
     @classmethod
     def load(cls, model: Model, fname: str):
-        npload = np.load(fname, allow_pickle=True)
         mp = cls()
         mp.model = model
-        nsites = int(npload["nsites"])
-        for i in range(nsites):
-            mt = npload[f"mt_{i}"]
-            if np.iscomplexobj(mt):
-                mp.dtype = backend.complex_dtype
-            else:
-                mp.dtype = backend.real_dtype
-            mp.append(mt)
-        
+        npload = mp._load_mp(fname)
+
         version = npload["version"]
         mp.qn = npload["qn"]
         mp.qnidx = int(npload["qnidx"])
@@ -524,55 +519,29 @@ class Mps(MatrixProduct):
         # This is time and memory consuming
         # return self_conj.dot(mpo.apply(self)).real
 
-    def expectations(self, mpos: Union[List[Union[Mpo, Op, OpSum]]], self_conj:"Mps"=None, opt:bool=True) -> np.ndarray:
-        new_mpos = []
-        for mpo in mpos:
-            # Convert Op/OpSum to MPO if needed
-            if isinstance(mpo, (Op, OpSum)):
-                mpo = Mpo(self.model, mpo)
-            new_mpos.append(mpo)
-        mpos = new_mpos
+    def expectations(self, mpos: Union[List[Union[Mpo, Op, OpSum]], ObservablePlan], self_conj:"Mps"=None, opt:bool=True) -> np.ndarray:
+        if isinstance(mpos, ObservablePlan):
+            # compiled plan that can be reused for different MPS
+            plan = mpos
+            mpos = plan.mpos
+        else:
+            plan = None
+            new_mpos = []
+            for mpo in mpos:
+                # Convert Op/OpSum to MPO if needed
+                if isinstance(mpo, (Op, OpSum)):
+                    mpo = Mpo(self.model, mpo)
+                new_mpos.append(mpo)
+            mpos = new_mpos
 
         if not opt:
             # the naive way, slow and time consuming. Yet predictable and reliable
             return np.array([self.expectation(mpo, self_conj) for mpo in mpos])
 
-        # optimized way, cache for intermediates
-        # hash is used as indices of the matrices.
-        # The chance for collision (the same hash for two different matrices) is
-        # about 1-0.99999999999997 in 1000 matrices.
-        # In which case a RuntimeError is raised and rerun the job should solve the problem
-        hash_to_obj = dict()
-        mpos_hash: List[List] = []
-        for mpo in mpos:
-            mpo_hash = []
-            for m in mpo:
-                m_hash = hash(m)
-                if m_hash not in hash_to_obj:
-                    hash_to_obj[m_hash] = m
-                else:
-                    if not np.allclose(hash_to_obj[m_hash], m.array):
-                        raise RuntimeError("Rare hash collision")
-                mpo_hash.append(m_hash)
-            mpos_hash.append(mpo_hash)
-
-        if self_conj is None:
-            self_conj = self._expectation_conj()
-        l_environ_dict = _construct_freq_environ(mpos_hash, hash_to_obj, self, "L", self_conj)
-        r_environ_dict = _construct_freq_environ(mpos_hash, hash_to_obj, self, "R", self_conj)
-        results = []
-        for mpo in mpos:
-            l_environ, l_idx = _get_freq_environ(l_environ_dict, mpo, "L", np.inf)
-            r_environ, r_idx = _get_freq_environ(r_environ_dict, mpo, "R", len(mpo)-l_idx-1)
-            for i in range(l_idx+1, r_idx):
-                l_environ = contract_one_site(l_environ, self[i], mpo[i], "L", self_conj[i])
-            results.append(complex(l_environ.flatten() @ r_environ.flatten()))  # cast to python type
-
-        results = np.array(results)
-        if np.allclose(results.imag, 0):
-            return results.real
-        else:
-            return results
+        # optimized way, the environments shared by the MPOs are calculated only once
+        if plan is None:
+            plan = ObservablePlan(self.model, mpos)
+        return plan.evaluate(self, self_conj)
 
     @property
     def ph_occupations(self):
@@ -586,6 +555,7 @@ class Mps(MatrixProduct):
             mpos = []
             for dof in self.model.v_dofs:
                 mpos.append(Mpo(self.model, Op("n", dof)))
+            mpos = ObservablePlan(self.model, mpos)
             self.model.mpos[key] = mpos
         else:
             mpos = self.model.mpos[key]
@@ -603,6 +573,7 @@ class Mps(MatrixProduct):
             mpos = []
             for dof in self.model.e_dofs:
                 mpos.append(Mpo(self.model, Op(r"a^\dagger a", dof)))
+            mpos = ObservablePlan(self.model, mpos)
             self.model.mpos[key] = mpos
         else:
             mpos = self.model.mpos[key]
@@ -654,11 +625,7 @@ class Mps(MatrixProduct):
             EvolveMethod.tdvp_ps2: self._evolve_tdvp_ps2
         }[self.evolve_config.method]
         new_mps = method(mpo, evolve_dt)
-        if normalize:
-            if np.iscomplex(evolve_dt):
-                new_mps.normalize("mps_and_coeff")
-            else:
-                new_mps.normalize("mps_only")
+        _normalize_evolved(new_mps, evolve_dt, normalize)
         return new_mps
     
     def _evolve_prop_and_compress_tdrk4(self, mpo, evolve_dt) -> "Mps":
@@ -935,7 +902,15 @@ class Mps(MatrixProduct):
             position.append(position[-1]+np.sum(qn_mask))
 
         sw_min_list = []
-        
+
+        n_threads = self.evolve_config.vmf_n_threads
+        if 1 < n_threads:
+            executor = ThreadPoolExecutor(max_workers=n_threads)
+            submit = executor.submit
+        else:
+            executor = None
+            submit = _run_now
+
         def func_vmf(t,y):
             
             sw_min_list.clear()
@@ -977,26 +952,29 @@ class Mps(MatrixProduct):
                 S_L_list = [None,] * (mps.site_num + 1)
                 S_L_inv_list = [None,] * (mps.site_num + 1)
 
+            def site_derivative(imps, ltensor, rtensor, S_inv, islast):
+                # the time derivative of a site. Independent of the other sites
+                shape = list(mps[imps].shape)
+                hop = hop_expr(ltensor, rtensor, [asxp(mpo[imps])], shape)
+                func = integrand_func_factory(shape, hop, islast, S_inv, True,
+                        coef, ovlp_inv1=S_L_inv_list[imps+1],
+                        ovlp_inv0=S_L_inv_list[imps], ovlp0=S_L_list[imps])
+                return func(0, asxp(mps[imps].array.ravel())).reshape(shape)[qn_mask_list[imps]]
+
             # calculate hop_y: from right to left
             hop_y = xp.empty_like(y)
+            # the site derivatives are evaluated by the workers
+            # while the sweep of the R environments goes on
+            derivs = []
 
             for imps in mps.iter_idx_list(full=True):
-                shape = list(mps[imps].shape)
                 ltensor = asxp(environ.read("L", imps - 1))
 
                 if imps == self.site_num - 1:
                     # the coefficient site
                     rtensor = xp.ones((1, 1, 1), dtype=mps.dtype)
-                    hop =hop_expr(ltensor, rtensor, [asxp(mpo[imps])], shape)
-
                     S_inv = xp.diag(xp.ones(1,dtype=mps.dtype))
-                    func = integrand_func_factory(shape, hop, True, S_inv, True,
-                            coef, ovlp_inv1=S_L_inv_list[imps+1],
-                            ovlp_inv0=S_L_inv_list[imps], ovlp0=S_L_list[imps])
-
-                    hop_y[position[imps]:position[imps+1]] = func(0,
-                            mps[imps].array.ravel()).reshape(mps[imps].shape)[qn_mask_list[imps]]
-
+                    derivs.append((imps, submit(site_derivative, imps, ltensor, rtensor, S_inv, True)))
                     continue
 
                 if self.evolve_config.method == EvolveMethod.tdvp_mu_vmf:
@@ -1047,27 +1025,27 @@ class Mps(MatrixProduct):
                     # S_inv is (#.conj, #)
                     S_inv = u.dot(xp.diag(1.0 / w)).dot(u.T.conj()).T
 
-                hop = hop_expr(ltensor, rtensor, [asxp(mpo[imps])], shape)
+                derivs.append((imps, submit(site_derivative, imps, ltensor, rtensor, S_inv, False)))
 
-                func = integrand_func_factory(shape, hop, False, S_inv, True,
-                        coef, ovlp_inv1=S_L_inv_list[imps+1],
-                        ovlp_inv0=S_L_inv_list[imps], ovlp0=S_L_list[imps])
-
-                hop_y[position[imps]:position[imps+1]] = func(0,
-                        asxp(mps[imps].array.ravel())).reshape(mps[imps].shape)[qn_mask_list[imps]]
+            for imps, deriv in derivs:
+                hop_y[position[imps]:position[imps+1]] = deriv.result()
 
             return hop_y
 
         init_y = xp.concatenate([asxp(ms.array[qn_mask_list[ims]]) for ims, ms in enumerate(mps)])
         # the ivp local error, please refer to the Scipy default setting
-        sol = solve_ivp(
-            func_vmf,
-            (0, evolve_dt),
-            init_y,
-            method="RK45",
-            rtol=self.evolve_config.ivp_rtol,
-            atol=self.evolve_config.ivp_atol,
-        )
+        try:
+            sol = solve_ivp(
+                func_vmf,
+                (0, evolve_dt),
+                init_y,
+                method="RK45",
+                rtol=self.evolve_config.ivp_rtol,
+                atol=self.evolve_config.ivp_atol,
+            )
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
         # update mps: from left to right
         for imps in range(mps.site_num):
@@ -1269,141 +1247,8 @@ class Mps(MatrixProduct):
         # PhysRevB.94.165116
         # TDVP projector splitting
         # one-site
-        if np.iscomplex(evolve_dt):
-            mps = self.copy()
-            if self.evolve_config.ivp_solver != "krylov":
-                evolve_dt = -evolve_dt.imag
-                # used in calculating derivatives
-                coef = -1
-        else:
-            mps = self.to_complex()
-            if self.evolve_config.ivp_solver != "krylov":
-                coef = 1j
-
-        # construct the environment matrix
-        # almost half is not used. Not a big deal.
-        environ = Environ(mps, mpo)
-
-        # statistics for debug output
-        local_steps = []
-        # sweep for 2 rounds
-        for i in range(2):
-            for imps in mps.iter_idx_list(full=True):
-                system = "L" if mps.to_right else "R"
-                l_array = environ.read("L", imps - 1)
-                r_array = environ.read("R", imps + 1)
-
-                shape = list(mps[imps].shape)
-                hop = hop_expr(l_array, r_array, [asxp(mpo[imps].array)], shape)
+        return _evolve_tdvp_ps_lockstep([self], mpo, evolve_dt)[0]
 
-                if self.evolve_config.ivp_solver == "krylov":
-                    mps_t, j = expm_krylov(
-                        lambda y: hop(y.reshape(shape)).ravel(),
-                        -1j * evolve_dt / 2, mps[imps].ravel().array
-                    )
-                else:
-                    sol = solve_ivp(
-                        lambda t, y: hop(y.reshape(shape)).ravel() / coef,
-                        (0, evolve_dt/2),
-                        mps[imps].ravel().array,
-                        method=self.evolve_config.ivp_solver,
-                        rtol=self.evolve_config.ivp_rtol,
-                        atol=self.evolve_config.ivp_atol,
-                    )
-                    mps_t, j = sol.y, sol.nfev
-
-                local_steps.append(j)
-                mps_t = mps_t.reshape(shape)
-
-                qnbigl, qnbigr, _ = mps._get_big_qn([imps])
-                u, qnlset, v, qnrset = svd_qn.svd_qn(
-                    asnumpy(mps_t),
-                    qnbigl,
-                    qnbigr,
-                    mps.qntot,
-                    QR=True,
-                    system=system,
-                    full_matrices=False,
-                )
-                vt = v.T
-
-                if not mps.to_right and imps != 0:
-                    mps[imps] = vt.reshape([-1] + shape[1:])
-                    mps.qn[imps] = qnrset
-                    mps.qnidx = imps-1
-
-                    r_array = environ.GetLR(
-                        "R", imps, mps, mpo, itensor=r_array, method="System"
-                    )
-
-                    # reverse update u site
-                    shape_u = u.shape
-                    hop_u = hop_expr(l_array, r_array, [], shape_u)
-                    if self.evolve_config.ivp_solver == "krylov":
-                        mps_t, j = expm_krylov(
-                            lambda y: hop_u(y.reshape(shape_u)).ravel(),
-                            1j * evolve_dt / 2, u.ravel()
-                        )
-                    else:
-                        sol = solve_ivp(
-                            lambda t, y: hop_u(y.reshape(shape_u)).ravel() / -coef,
-                            (0, evolve_dt/2),
-                            u.ravel(),
-                            method=self.evolve_config.ivp_solver,
-                            rtol=self.evolve_config.ivp_rtol,
-                            atol=self.evolve_config.ivp_atol,
-                        )
-                        mps_t, j = sol.y, sol.nfev
-
-                    local_steps.append(j)
-                    mps_t = mps_t.reshape(shape_u)
-
-                    mps[imps - 1] = tensordot(mps[imps - 1].array, mps_t, axes=(-1, 0),)
-
-                elif mps.to_right and imps != len(mps) - 1:
-                    mps[imps] = u.reshape(shape[:-1] + [-1])
-                    mps.qn[imps + 1] = qnlset
-                    mps.qnidx = imps+1
-
-                    l_array = environ.GetLR(
-                        "L", imps, mps, mpo, itensor=l_array, method="System"
-                    )
-
-                    # reverse update svt site
-                    shape_svt = vt.shape
-                    hop_svt = hop_expr(l_array, r_array, [], shape_svt)
-                    if self.evolve_config.ivp_solver == "krylov":
-                        mps_t, j = expm_krylov(
-                            lambda y: hop_svt(y.reshape(shape_svt)).ravel(),
-                            1j * evolve_dt / 2, vt.ravel()
-                        )
-                    else:
-                        sol = solve_ivp(
-                            lambda t, y: hop_svt(y.reshape(shape_svt)).ravel() / -coef,
-                            (0, evolve_dt/2),
-                            vt.ravel(),
-                            method=self.evolve_config.ivp_solver,
-                            rtol=self.evolve_config.ivp_rtol,
-                            atol=self.evolve_config.ivp_atol,
-                        )
-                        mps_t, j = sol.y, sol.nfev
-
-                    local_steps.append(j)
-                    mps_t = mps_t.reshape(shape_svt)
-
-                    mps[imps + 1] = tensordot(mps_t, mps[imps + 1].array, axes=(1, 0),)
-
-                else:
-                    mps[imps] = mps_t
-            mps._switch_direction()
-
-        steps_stat = stats.describe(local_steps)
-        logger.debug(f"TDVP-PS Krylov space: {steps_stat}")
-        mps.evolve_config.stat = steps_stat
-
-        return mps
-
-    @adaptive_tdvp
     def _evolve_tdvp_ps2(self, mpo, evolve_dt) -> "Mps":
         # PhysRevB.94.165116
         # TDVP projector splitting
@@ -1441,6 +1286,10 @@ class Mps(MatrixProduct):
 
                 l_array = environ.read("L", lidx)
                 r_array = environ.read("R", ridx)
+                if mps.to_right:
+                    environ.prefetch("R", ridx + 1)
+                else:
+                    environ.prefetch("L", lidx - 1)
 
                 # the two-site matrix state
                 ms2 = tensordot(mps[cidx0], mps[cidx1], axes=1)
@@ -1597,25 +1446,62 @@ class Mps(MatrixProduct):
 
         return rdm
     
-    def calc_2site_rdm(self):
-        r""" Calculate 2-site reduced density matrix
-        
-        :math:`\rho_{ij} = \textrm{Tr}_{k \neq i, k \neq j} | \Psi \rangle \langle \Psi |`.
-        
-        Returns
-        -------
-        rdm: Dict
-            :math:`\{(0,1):\rho_{01}, (0,2):\rho_{02}, \cdots\}`. The key is a tuple of index of the site.
+    def iter_2site_rdm(self, pairs: List[Tuple[int, int]]=None, max_distance: int=None):
+        r""" Iterate over 2-site reduced density matrices in sweep order
+        :math:`(0,1), (0,2), \cdots, (1,2), \cdots`.
+
+        The reduced density matrices are generated one by one and not stored,
+        so the memory cost is :math:`O(N)` rather than :math:`O(N^2)`.
+
+        Parameters
+        ----------
+        pairs : list of tuple, optional
+            The pairs of site indices to calculate. Default is None, which means all pairs.
+        max_distance : int, optional
+            Only calculate the pairs :math:`(i, j)` with :math:`j - i \le` ``max_distance``.
+
+        Yields
+        ------
+        key : tuple
+            The pair of site indices :math:`(i, j)` with :math:`i < j`.
+        rdm : np.ndarray
+            The 2-site reduced density matrix :math:`\rho_{ij}`.
         """
-        
+        # the sites paired with each site on the right
+        partners = [[] for _ in range(self.site_num)]
+        if pairs is None:
+            for ims, jms in itertools.combinations(range(self.site_num), 2):
+                partners[ims].append(jms)
+        else:
+            for pair in set(tuple(sorted(pair)) for pair in pairs):
+                ims, jms = pair
+                assert ims != jms
+                partners[ims].append(jms)
+        for ims in range(self.site_num):
+            partners[ims] = sorted(jms for jms in partners[ims] if max_distance is None or jms - ims <= max_distance)
+        required_r = set(itertools.chain.from_iterable(partners))
+
         identity = Mpo.identity(self.model)
         environ_R = Environ(self, identity, "R")
         environ_L = Environ(self, identity, "L")
-        L_component = []
-        R_component = []
-        rdm = {}
-        # first construct 1-site environment
+        # the right 1-site environments. O(N) memory
+        R_component = {}
+        for jms in required_r:
+            ms = self[jms]
+            rtensor = environ_R.GetLR("R", jms+1, self, identity,
+                    itensor=None, method="Enviro")
+            rtensor = rtensor.reshape(rtensor.shape[0], rtensor.shape[-1])
+            tensor = tensordot(ms.conj(), rtensor, ([-1],[0]))
+            if ms.ndim == 3:
+                tensor = tensordot(tensor, ms, ([-1],[-1]))
+            elif ms.ndim == 4:
+                tensor = tensordot(tensor, ms, ([2,-1],[2,-1]))
+            R_component[jms] = tensor.transpose((0,2,1,3))
+
         for ims, ms in enumerate(self):
+            if not partners[ims]:
+                continue
+            # the left 1-site environment
             ltensor = environ_L.GetLR("L", ims-1, self, identity,
                     itensor=None, method="Enviro")
             ltensor = ltensor.reshape(ltensor.shape[0], ltensor.shape[-1])
@@ -1624,35 +1510,45 @@ class Mps(MatrixProduct):
                 tensor = tensordot(tensor, ms, ([0],[0]))
             elif ms.ndim == 4:
                 tensor = tensordot(tensor, ms, ([0,2],[0,2]))
-            L_component.append(tensor.transpose((0,2,1,3)))
-            
-            rtensor = environ_R.GetLR("R", ims+1, self, identity,
-                    itensor=None, method="Enviro")
-            rtensor = rtensor.reshape(rtensor.shape[0], rtensor.shape[-1])
-            tensor = tensordot(ms.conj(), rtensor, ([-1],[0]))
-            if ms.ndim == 3:
-                tensor = tensordot(tensor, ms, ([-1],[-1]))
-            elif ms.ndim == 4:
-                tensor = tensordot(tensor, ms, ([2,-1],[2,-1]))
-            R_component.append(tensor.transpose((0,2,1,3)))
-        
-        # merge two 1-site environment together
-        for ims in range(self.site_num):
-            tensor = L_component[ims]
-            for jms in range(ims+1, self.site_num):
-                if jms != ims+1:
-                    kms = jms - 1
+            tensor = tensor.transpose((0,2,1,3))
+
+            # merge the two 1-site environments together
+            kms = ims + 1
+            for jms in partners[ims]:
+                # extend the left part to the site before ``jms``
+                while kms < jms:
                     tensor = tensordot(tensor, self[kms].conj(), ([2],[0]))
                     if self[kms].ndim == 3:
                         tensor = tensordot(tensor, self[kms], ([2,3],[0,1]))
                     elif self[kms].ndim == 4:
                         tensor = tensordot(tensor, self[kms], ([2,3,4],[0,1,2]))
-                
-                rtensor = R_component[jms]
-                res = tensordot(tensor, rtensor,
+                    kms += 1
+                res = tensordot(tensor, R_component[jms],
                         ([2,3],[0,1])).transpose(0,2,1,3)
-                rdm[(ims, jms)] = asnumpy(res.reshape(res.shape[0]*res.shape[1],-1))
-        return rdm
+                yield (ims, jms), asnumpy(res.reshape(res.shape[0]*res.shape[1],-1))
+
+    def calc_2site_rdm(self, pairs: List[Tuple[int, int]]=None, max_distance: int=None):
+        r""" Calculate 2-site reduced density matrix
+        
+        :math:`\rho_{ij} = \textrm{Tr}_{k \neq i, k \neq j} | \Psi \rangle \langle \Psi |`.
+
+        Parameters
+        ----------
+        pairs : list of tuple, optional
+            The pairs of site indices to calculate. Default is None, which means all pairs.
+        max_distance : int, optional
+            Only calculate the pairs :math:`(i, j)` with :math:`j - i \le` ``max_distance``.
+
+        Returns
+        -------
+        rdm: Dict
+            :math:`\{(0,1):\rho_{01}, (0,2):\rho_{02}, \cdots\}`. The key is a tuple of index of the site.
+
+        See Also
+        --------
+        iter_2site_rdm : generate the reduced density matrices without storing them.
+        """
+        return dict(self.iter_2site_rdm(pairs, max_distance))
     
     def calc_edof_rdm(self) -> np.ndarray:
         r"""Calculate the reduced density matrix of electronic DoF
@@ -1674,6 +1570,7 @@ class Mps(MatrixProduct):
                     op = Op(r"a^\dagger a", [dof1, dof2])
                     mpo = Mpo(self.model, terms=op)
                     mpos.append(mpo)
+            mpos = ObservablePlan(self.model, mpos)
             self.model.mpos[key] = mpos
         else:
             mpos = self.model.mpos[key]
@@ -1715,13 +1612,10 @@ class Mps(MatrixProduct):
 
         if entropy_type in ["1site", "2site"]:
             if entropy_type == "1site":
-                rdm = self.calc_1site_rdm()
+                rdm = self.calc_1site_rdm().items()
             else:
-                rdm = self.calc_2site_rdm()
-            
-            entropy = {}
-            for key, dm in rdm.items():
-                entropy[key] = calc_vn_entropy_dm(dm)
+                rdm = self.iter_2site_rdm()
+            entropy = dict(iter_vn_entropy(rdm))
 
         elif entropy_type == "mutual":
             entropy = self.calc_2site_mutual_entropy()
@@ -1731,28 +1625,44 @@ class Mps(MatrixProduct):
             raise ValueError(f"unsupported entropy type {entropy_type}")
         return entropy
     
-    def calc_2site_mutual_entropy(self) -> np.ndarray:
+    def calc_2site_mutual_entropy(self, pairs: List[Tuple[int, int]]=None, max_distance: int=None,
+                                  batch_size: int=256) -> np.ndarray:
         r""" 
         Calculate mutual entropy between two sites. Also known as mutual information
         
         :math:`m_{ij} = (s_i + s_j - s_{ij})/2`
             
         See Chemical Physics 323 (2006) 519–531
-        
+
+        The 2-site reduced density matrices are generated by :meth:`iter_2site_rdm`
+        and diagonalized in batches, so they are never stored at the same time.
+
+        Parameters
+        ----------
+        pairs : list of tuple, optional
+            The pairs of site indices to calculate. Default is None, which means all pairs.
+        max_distance : int, optional
+            Only calculate the pairs :math:`(i, j)` with :math:`|j - i| \le` ``max_distance``.
+        batch_size : int
+            The number of 2-site reduced density matrices diagonalized together.
+
         Returns
         -------
         mutual_entropy : 2d np.ndarry
-            mutual entropy with shape (nsite, nsite)
+            mutual entropy with shape (nsite, nsite). The pairs not calculated are set to 0.
 
         """
-        entropy_1site = self.calc_entropy("1site")
-        entropy_2site = self.calc_entropy("2site")
         nsites = self.site_num
+        if pairs is None:
+            sites = None
+        else:
+            sites = sorted(set(itertools.chain.from_iterable(pairs)))
+        entropy_1site = dict(iter_vn_entropy(self.calc_1site_rdm(sites).items()))
+
         mut_entropy = np.zeros((nsites, nsites))
-        for isite, jsite in itertools.combinations(range(nsites),2):
-            key = (isite, jsite) if (isite, jsite) in entropy_2site.keys() else (jsite, isite)
-            mut_entropy[isite, jsite] = (entropy_1site[isite] + entropy_1site[jsite] -
-                    entropy_2site[key]) / 2
+        rdm_2site = self.iter_2site_rdm(pairs, max_distance)
+        for (isite, jsite), entropy in iter_vn_entropy(rdm_2site, batch_size):
+            mut_entropy[isite, jsite] = (entropy_1site[isite] + entropy_1site[jsite] - entropy) / 2
         mut_entropy += mut_entropy.T
         return mut_entropy
 
@@ -1792,8 +1702,8 @@ class Mps(MatrixProduct):
             s_array = self.calc_bond_singular_values()
         return np.array([calc_vn_entropy(sigma ** 2) for sigma in s_array])
 
-    def dump(self, fname):
-        super().dump(fname, other_attrs=["coeff"])
+    def dump(self, fname, fmt="npz"):
+        super().dump(fname, other_attrs=["coeff"], fmt=fmt)
 
     def __setitem__(self, key, value):
         return super().__setitem__(key, value)
@@ -1846,6 +1756,13 @@ def projector(
     return proj
 
 
+def _run_now(func, *args):
+    # call ``func`` in the current thread. The same interface as ``ThreadPoolExecutor.submit``
+    future = Future()
+    future.set_result(func(*args))
+    return future
+
+
 def integrand_func_factory(
     shape,
     hop,
@@ -2058,6 +1975,249 @@ def normalize(tn, kind):
 
     return tn
 
+
+def evolve_ensemble(mps_list: List["Mps"], mpo, evolve_dt, n_threads: int = None, normalize=True) -> List["Mps"]:
+    r""" Evolve several independent MPS (or MPDM) under the same MPO for one time step.
+
+    With the TDVP-PS method (``EvolveMethod.tdvp_ps``), the members are evolved in lock-step.
+    They are swept together, and at each site the local problems of the members with the same shapes
+    are solved by one batched Krylov propagation (:func:`~renormalizer.lib.expm_krylov_batch`),
+    in which the effective Hamiltonians of all members are applied by a single contraction
+    with the environments stacked along an extra index.
+    This requires the members to share the evolve method and the ODE solver, and to be at the same position
+    of the sweep, which is the case for the members evolved together from the start.
+    Otherwise, the members are evolved independently, optionally in a thread pool.
+    Members that appear more than once in ``mps_list`` are evolved only once.
+    The results are the same as calling :meth:`Mps.evolve` for each member.
+
+    Parameters
+    ----------
+    mps_list : list of :class:`Mps`
+        The wavefunctions to evolve.
+    mpo : :class:`~renormalizer.mps.Mpo` or callable
+        The Hamiltonian.
+    evolve_dt : float or complex
+        The time step.
+    n_threads : int
+        The number of threads if the members are evolved independently. Each thread uses the BLAS threads of its own,
+        and possibly the threads of the VMF solver set by ``EvolveConfig.vmf_n_threads``.
+        By default the members are evolved one by one, unless the environment variable ``RENO_NUM_THREADS``
+        is set, in which case ``cpu_count // RENO_NUM_THREADS`` threads are used so that the cores are not oversubscribed.
+    normalize : bool
+        Passed to :meth:`Mps.evolve`.
+
+    Returns
+    -------
+    The evolved wavefunctions in the same order as ``mps_list``.
+    """
+    members = list({id(mps): mps for mps in mps_list}.values())
+    if _lockstep(members, evolve_dt):
+        evolved = _evolve_tdvp_ps_lockstep(members, mpo, evolve_dt)
+        for mps in evolved:
+            _normalize_evolved(mps, evolve_dt, normalize)
+        evolved = {id(mps): new_mps for mps, new_mps in zip(members, evolved)}
+        return [evolved[id(mps)] for mps in mps_list]
+    if n_threads is None:
+        n_threads = _default_ensemble_threads()
+    # the optimal fermion sorting swaps the sites of the MPO during the evolution
+    ofs = any(mps.compress_config.ofs is not None for mps in members)
+    if n_threads <= 1 or len(members) == 1 or ofs:
+        submit = _run_now
+        executor = None
+    else:
+        executor = ThreadPoolExecutor(min(n_threads, len(members)))
+        submit = executor.submit
+    try:
+        futures = {id(mps): submit(mps.evolve, mpo, evolve_dt, normalize) for mps in members}
+        evolved = {key: future.result() for key, future in futures.items()}
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return [evolved[id(mps)] for mps in mps_list]
+
+
+def _lockstep(members: List["Mps"], evolve_dt) -> bool:
+    # whether the members could be evolved by ``_evolve_tdvp_ps_lockstep``.
+    # For the real time step all members are converted to complex
+    mps0 = members[0]
+    if len(members) == 1 or mps0.evolve_config.method != EvolveMethod.tdvp_ps:
+        return False
+    for mps in members:
+        if mps.compress_config.ofs is not None:
+            return False
+        if np.iscomplex(evolve_dt) and mps.is_complex != mps0.is_complex:
+            return False
+        if mps.evolve_config.method != mps0.evolve_config.method \
+                or mps.evolve_config.ivp_solver != mps0.evolve_config.ivp_solver:
+            return False
+        if mps.site_num != mps0.site_num or mps.to_right != mps0.to_right or mps.qnidx != mps0.qnidx:
+            return False
+    return True
+
+
+def _evolve_tdvp_ps_lockstep(mps_list: List["Mps"], mpo, evolve_dt) -> List["Mps"]:
+    # PhysRevB.94.165116
+    # TDVP projector splitting
+    # one-site
+    # The members are swept together. At each site the local problems of the members with the same shapes
+    # are solved under one hop expression, with the environments stacked along an extra index
+    evolve_config = mps_list[0].evolve_config
+    if np.iscomplex(evolve_dt):
+        members = [mps.copy() for mps in mps_list]
+        if evolve_config.ivp_solver != "krylov":
+            evolve_dt = -evolve_dt.imag
+            # used in calculating derivatives
+            coef = -1
+    else:
+        members = [mps.to_complex() for mps in mps_list]
+        if evolve_config.ivp_solver != "krylov":
+            coef = 1j
+
+    # construct the environment matrix
+    # almost half is not used. Not a big deal.
+    environs = [Environ(mps, mpo) for mps in members]
+
+    # statistics for debug output
+    local_steps = [[] for _ in members]
+
+    def propagate(l_arrays, r_arrays, cmo, vectors, sign):
+        # evolve the local tensors for half a time step.
+        # ``sign`` is -1 for the sites and 1 for the bonds that are evolved backward
+        results = [None] * len(vectors)
+        groups = {}
+        for k, (l_array, r_array, vector) in enumerate(zip(l_arrays, r_arrays, vectors)):
+            groups.setdefault((l_array.shape, r_array.shape, vector.shape), []).append(k)
+        for (_, _, shape), index in groups.items():
+            shape = list(shape)
+            if evolve_config.ivp_solver == "krylov" and len(index) > 1:
+                hop = hop_expr(
+                    xp.stack([l_arrays[k] for k in index], axis=-1),
+                    xp.stack([r_arrays[k] for k in index], axis=-1),
+                    cmo, shape, ensemble=True,
+                )
+                # the vectors are the rows of the block
+                def afunc(y, active):
+                    y = y.T.reshape(shape + [len(active)])
+                    return hop(y, active).reshape(-1, len(active)).T
+                mps_ts, js = expm_krylov_batch(
+                    afunc, sign * 1j * evolve_dt / 2, xp.stack([asxp(vectors[k]).ravel() for k in index]),
+                    with_index=True,
+                )
+                for k, mps_t, j in zip(index, mps_ts, js):
+                    results[k] = mps_t.reshape(shape)
+                    local_steps[k].append(j)
+                continue
+            for k in index:
+                hop = hop_expr(l_arrays[k], r_arrays[k], cmo, shape)
+                if evolve_config.ivp_solver == "krylov":
+                    mps_t, j = expm_krylov(
+                        lambda y: hop(y.reshape(shape)).ravel(),
+                        sign * 1j * evolve_dt / 2, vectors[k].ravel()
+                    )
+                else:
+                    sol = solve_ivp(
+                        lambda t, y: hop(y.reshape(shape)).ravel() / (-sign * coef),
+                        (0, evolve_dt/2),
+                        vectors[k].ravel(),
+                        method=evolve_config.ivp_solver,
+                        rtol=evolve_config.ivp_rtol,
+                        atol=evolve_config.ivp_atol,
+                    )
+                    mps_t, j = sol.y, sol.nfev
+                results[k] = mps_t.reshape(shape)
+                local_steps[k].append(j)
+        return results
+
+    # sweep for 2 rounds
+    for i in range(2):
+        mps0 = members[0]
+        for imps in mps0.iter_idx_list(full=True):
+            system = "L" if mps0.to_right else "R"
+            l_arrays = [environ.read("L", imps - 1) for environ in environs]
+            r_arrays = [environ.read("R", imps + 1) for environ in environs]
+            for environ in environs:
+                if mps0.to_right:
+                    environ.prefetch("R", imps + 2)
+                else:
+                    environ.prefetch("L", imps - 2)
+
+            mps_ts = propagate(l_arrays, r_arrays, [asxp(mpo[imps].array)], [mps[imps].array for mps in members], -1)
+
+            if (not mps0.to_right and imps == 0) or (mps0.to_right and imps == len(mps0) - 1):
+                for mps, mps_t in zip(members, mps_ts):
+                    mps[imps] = mps_t
+                continue
+
+            bonds = []
+            for k, (mps, mps_t) in enumerate(zip(members, mps_ts)):
+                shape = list(mps_t.shape)
+                qnbigl, qnbigr, _ = mps._get_big_qn([imps])
+                u, qnlset, v, qnrset = svd_qn.svd_qn(
+                    asnumpy(mps_t),
+                    qnbigl,
+                    qnbigr,
+                    mps.qntot,
+                    QR=True,
+                    system=system,
+                    full_matrices=False,
+                )
+                vt = v.T
+
+                if not mps.to_right:
+                    mps[imps] = vt.reshape([-1] + shape[1:])
+                    mps.qn[imps] = qnrset
+                    mps.qnidx = imps-1
+
+                    r_arrays[k] = environs[k].GetLR(
+                        "R", imps, mps, mpo, itensor=r_arrays[k], method="System"
+                    )
+                    # reverse update u site
+                    bonds.append(u)
+                else:
+                    mps[imps] = u.reshape(shape[:-1] + [-1])
+                    mps.qn[imps + 1] = qnlset
+                    mps.qnidx = imps+1
+
+                    l_arrays[k] = environs[k].GetLR(
+                        "L", imps, mps, mpo, itensor=l_arrays[k], method="System"
+                    )
+                    # reverse update svt site
+                    bonds.append(vt)
+
+            mps_ts = propagate(l_arrays, r_arrays, [], bonds, 1)
+
+            for mps, mps_t in zip(members, mps_ts):
+                if not mps.to_right:
+                    mps[imps - 1] = tensordot(mps[imps - 1].array, mps_t, axes=(-1, 0),)
+                else:
+                    mps[imps + 1] = tensordot(mps_t, mps[imps + 1].array, axes=(1, 0),)
+        for mps in members:
+            mps._switch_direction()
+
+    for mps, steps in zip(members, local_steps):
+        steps_stat = stats.describe(steps)
+        logger.debug(f"TDVP-PS Krylov space: {steps_stat}")
+        mps.evolve_config.stat = steps_stat
+
+    return members
+
+
+def _normalize_evolved(new_mps: "Mps", evolve_dt, normalize: bool):
+    if normalize:
+        if np.iscomplex(evolve_dt):
+            new_mps.normalize("mps_and_coeff")
+        else:
+            new_mps.normalize("mps_only")
+
+
+def _default_ensemble_threads():
+    # The BLAS libraries use all cores by default. Then the members are evolved one by one
+    reno_num_threads = os.environ.get("RENO_NUM_THREADS")
+    if reno_num_threads is None:
+        return 1
+    return max(1, (os.cpu_count() or 1) // max(1, int(reno_num_threads)))
+
+
 class BraKetPair:
     def __init__(self, bra_mps, ket_mps, mpo=None):
         self.bra_mps = bra_mps
@@ -2098,72 +2258,3 @@ def min_abs(t1, t2):
         return t1
     else:
         return t2
-
-
-def _construct_freq_environ(mpos_hash: List[List[int]], hash_to_obj: Dict[int, Matrix], mps: Mps, domain: str, mps_conj):
-    """
-    Construct environment tensors that are most frequently shown in the group of MPOs
-    """
-    assert domain in ["L", "R"]
-    # count mpo sequence frequency
-    counter = Counter()
-    for mpo_hash in mpos_hash:
-        for i in range(1, len(mpo_hash)+1):
-            if domain == "L":
-                mpo_seq = mpo_hash[:i]
-            else:
-                mpo_seq = reversed(mpo_hash[-i:])
-            counter.update([tuple(mpo_seq)])
-
-    # transform the counter into a list of matrices.
-    # The most frequent sequences first. If the same freq, then shorter sequences first
-    # Note that shorter sequences are not less frequent than longer sequences
-    most_common = list(counter.items())
-    most_common.sort(key=lambda x: (-x[1], len(x[0])))
-    matrices_list = []
-    hash_list = []
-    for hashes, n in most_common:
-        # discard unique ones because they do not need to be cached
-        if n == 1:
-            break
-        # cache ``len(mps)`` sequences
-        # sequences with the same length may be treated differently.
-        if len(mps) < len(matrices_list):
-            break
-        hash_list.append(hashes)
-        matrices_list.append(list(map(hash_to_obj.get, hashes)))
-
-    # contract the tensors
-    result = {(): xp.ones((1, 1, 1), dtype=backend.real_dtype)}
-    for m_hashes, matrices in zip(hash_list, matrices_list):
-        environ = result[tuple(m_hashes[:-1])]
-        if domain == "L":
-            idx = len(matrices)-1
-        else:
-            idx = -len(matrices)
-        ms, ms_conj = mps[idx], mps_conj[idx]
-        result[tuple(m_hashes)] = contract_one_site(environ, ms, matrices[-1], domain=domain, ms_conj=ms_conj)
-    return result
-
-
-def _get_freq_environ(environ_dict, mpo, domain, max_length):
-    assert domain in ["L", "R"]
-
-    if domain == "L":
-        it = mpo
-    else:
-        it = reversed(mpo)
-
-    hashes = []
-    for mo in it:
-        hashes.append(hash(mo))
-        if (not tuple(hashes) in environ_dict) or (max_length < len(hashes)):
-            hashes.pop()
-            break
-    if domain == "L":
-        i = len(hashes) - 1
-    else:
-        i = len(mpo) - len(hashes)
-
-    environ = environ_dict[tuple(hashes)]
-    return environ, i
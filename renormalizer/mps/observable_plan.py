@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from collections import Counter
+from typing import List, Union, Tuple
+
+from renormalizer.model import Model, Op, OpSum
+from renormalizer.mps.backend import backend, np, xp
+from renormalizer.mps.lib import contract_one_site
+from renormalizer.mps.mpo import Mpo
+
+logger = logging.getLogger(__name__)
+
+
+class ObservablePlan:
+    r"""
+    Compiled plan to evaluate the expectation values of a fixed set of observables.
+
+    The local sites of the MPOs are labeled by structural IDs (identical sites share the same ID).
+    The prefixes (L) and the suffixes (R) of the ID sequences that are shared by
+    more than one observable form two tries. The environments of the nodes in the tries
+    are calculated once for each MPS and then reused by all observables, so the cost of
+    evaluating many local observables is roughly one left and one right environment sweep.
+    The environments are freed as soon as all observables depending on them are evaluated.
+
+    The plan only depends on the observables and can be reused for the MPS at different time steps.
+
+    Parameters
+    ----------
+    model : :class:`~renormalizer.model.Model`
+        The model of the MPS. Used to construct MPOs from :class:`~renormalizer.model.Op`.
+    observables : list
+        The observables as a list of :class:`~renormalizer.mps.Mpo`,
+        :class:`~renormalizer.model.Op` or :class:`~renormalizer.model.OpSum`.
+
+    Examples
+    --------
+    >>> from renormalizer import Mps, Model, Op, BasisHalfSpin
+    >>> from renormalizer.mps.observable_plan import ObservablePlan
+    >>> model = Model([BasisHalfSpin(i) for i in range(3)], [])
+    >>> plan = ObservablePlan(model, [Op("Z", i) for i in range(3)])
+    >>> mps = Mps.hartree_product_state(model, condition={1: [0, 1]})
+    >>> plan.evaluate(mps)
+    array([ 1., -1.,  1.])
+    """
+
+    def __init__(self, model: Model, observables: List[Union[Mpo, Op, OpSum]]):
+        self.model = model
+        self.mpos: List[Mpo] = []
+        for mpo in observables:
+            if isinstance(mpo, (Op, OpSum)):
+                mpo = Mpo(model, mpo)
+            self.mpos.append(mpo)
+
+        # the unique local sites. The index is the structural ID
+        self.mos: List[np.ndarray] = []
+        self.mpos_id: List[Tuple[int]] = []
+        mo_to_id = dict()
+        for mpo in self.mpos:
+            mpo_id = []
+            for mo in mpo:
+                array = mo.array
+                key = (array.shape, array.dtype.str, array.tobytes())
+                if key not in mo_to_id:
+                    mo_to_id[key] = len(self.mos)
+                    self.mos.append(array)
+                mpo_id.append(mo_to_id[key])
+            self.mpos_id.append(tuple(mpo_id))
+
+        self.l_nodes = self._shared_nodes("L")
+        self.r_nodes = self._shared_nodes("R")
+
+        # how each observable is evaluated: the length of the cached prefix and suffix.
+        # The sites in between are contracted explicitly
+        self.splits: List[Tuple[int, int]] = []
+        l_node_set = set(self.l_nodes)
+        r_node_set = set(self.r_nodes)
+        for mpo_id in self.mpos_id:
+            l_len = 0
+            while l_len < len(mpo_id) and mpo_id[:l_len+1] in l_node_set:
+                l_len += 1
+            r_len = 0
+            while l_len + r_len < len(mpo_id) and _suffix(mpo_id, r_len+1) in r_node_set:
+                r_len += 1
+            self.splits.append((l_len, r_len))
+
+        # The observables are evaluated in the lexicographic order of the IDs, which is the
+        # depth-first order of the L trie. The environments are calculated when first required and
+        # freed after all of their consumers (the child nodes and the observables) are evaluated,
+        # so the number of cached L environments is bounded by the number of sites
+        self.order: List[int] = sorted(range(len(self.mpos_id)), key=lambda i: self.mpos_id[i])
+        self.l_refcount = self._refcount([mpo_id[:l_len] for mpo_id, (l_len, _) in zip(self.mpos_id, self.splits)])
+        self.r_refcount = self._refcount([_suffix(mpo_id, r_len) for mpo_id, (_, r_len) in zip(self.mpos_id, self.splits)])
+
+    @staticmethod
+    def _refcount(used_nodes) -> Counter:
+        # the number of consumers of each node in the tries that is actually used
+        needed = set()
+        for node in used_nodes:
+            for i in range(len(node) + 1):
+                needed.add(node[:i])
+        refcount = Counter(used_nodes)
+        for node in needed:
+            if node:
+                refcount[node[:-1]] += 1
+        return refcount
+
+    def _shared_nodes(self, domain) -> List[Tuple[int]]:
+        # the prefixes/suffixes shared by at least two observables.
+        # The parent of a node always comes before the node
+        counter = Counter()
+        for mpo_id in self.mpos_id:
+            for i in range(1, len(mpo_id) + 1):
+                if domain == "L":
+                    counter[mpo_id[:i]] += 1
+                else:
+                    counter[_suffix(mpo_id, i)] += 1
+        nodes = [node for node, n in counter.items() if 1 < n]
+        nodes.sort(key=len)
+        return nodes
+
+    @property
+    def n_contractions(self) -> int:
+        """
+        The number of site contractions required to evaluate the plan for an MPS.
+        """
+        n_middle = sum(len(mpo_id) - l_len - r_len for mpo_id, (l_len, r_len) in zip(self.mpos_id, self.splits))
+        n_l = sum(1 for node in self.l_refcount if node)
+        n_r = sum(1 for node in self.r_refcount if node)
+        return n_l + n_r + n_middle
+
+    def __len__(self):
+        return len(self.mpos)
+
+    def evaluate(self, mps, mps_conj=None) -> np.ndarray:
+        """
+        Evaluate the expectation values of all observables.
+
+        Parameters
+        ----------
+        mps : :class:`~renormalizer.mps.Mps` or :class:`~renormalizer.mps.MpDm`
+            The (ket) state.
+        mps_conj : :class:`~renormalizer.mps.Mps` or :class:`~renormalizer.mps.MpDm`, optional
+            The conjugated bra state. Default is the conjugate of ``mps``.
+
+        Returns
+        -------
+        expectations : np.ndarray
+            The expectation values. Real if the imaginary parts are negligible.
+        """
+        if not self.mpos_id:
+            return np.zeros(0)
+        if mps_conj is None:
+            mps_conj = mps._expectation_conj()
+        nsite = len(mps)
+        sentinel = xp.ones((1, 1, 1), dtype=backend.real_dtype)
+        # the environments of the nodes in the tries
+        l_environ = {(): sentinel}
+        r_environ = {(): sentinel}
+        l_refcount = self.l_refcount.copy()
+        r_refcount = self.r_refcount.copy()
+
+        def release(environ, refcount, node):
+            refcount[node] -= 1
+            if refcount[node] == 0:
+                del environ[node]
+
+        def get_environ(environ, refcount, node, domain):
+            # calculate the missing environments from the closest calculated ancestor
+            length = len(node)
+            while node[:length] not in environ:
+                length -= 1
+            for i in range(length, len(node)):
+                parent = node[:i]
+                idx = i if domain == "L" else nsite - i - 1
+                environ[node[:i+1]] = contract_one_site(
+                    environ[parent], mps[idx], self.mos[node[i]], domain, mps_conj[idx]
+                )
+                release(environ, refcount, parent)
+            return environ[node]
+
+        results = [None] * len(self.mpos_id)
+        for iobs in self.order:
+            mpo_id = self.mpos_id[iobs]
+            l_len, r_len = self.splits[iobs]
+            assert len(mpo_id) == nsite
+            l_node = mpo_id[:l_len]
+            r_node = _suffix(mpo_id, r_len)
+            environ = get_environ(l_environ, l_refcount, l_node, "L")
+            r = get_environ(r_environ, r_refcount, r_node, "R")
+            release(l_environ, l_refcount, l_node)
+            release(r_environ, r_refcount, r_node)
+            for i in range(l_len, nsite - r_len):
+                environ = contract_one_site(environ, mps[i], self.mos[mpo_id[i]], "L", mps_conj[i])
+            results[iobs] = complex(environ.flatten() @ r.flatten())  # cast to python type
+        assert len(l_environ) == len(r_environ) == 0
+
+        results = np.array(results)
+        if np.allclose(results.imag, 0):
+            return results.real
+        else:
+            return results
+
+
+def _suffix(mpo_id, length) -> Tuple[int]:
+    # the last ``length`` IDs, from right to left
+    return tuple(reversed(mpo_id[len(mpo_id)-length:]))
@@ -1,5 +1,8 @@
 # wraps opt_einsum contraction to show memory errors
+# and caches the contraction paths
 import logging
+import threading
+from collections import OrderedDict
 
 import opt_einsum as oe
 
@@ -9,6 +12,55 @@ from renormalizer.mps.backend import MEMORY_ERRORS, ARRAY_TYPES, xp
 logger = logging.getLogger(__name__)
 
 
+class ContractPathCache:
+    """
+    LRU cache of the contraction paths (and contraction expressions)
+    keyed on the subscripts, the shapes and the dtypes of the operands.
+    The path searching (``optimal`` by default) is then carried out only once
+    for the same contraction during the sweeps.
+
+    Parameters
+    ----------
+    maxsize : int
+        The maximum number of cached items.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            self.misses += 1
+        value = factory()
+        with self._lock:
+            self._cache[key] = value
+            while self.maxsize < len(self._cache):
+                self._cache.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "maxsize": self.maxsize}
+
+
+path_cache = ContractPathCache()
+
+
 def log_error(e, args, kwargs):
     logger.exception(e)
     logger.fatal("The arguments are:")
@@ -34,9 +86,47 @@ def update_kwargs(args, kwargs):
         # modify in-place
         kwargs["optimize"] = algo
 
+
+def _hashable(arg):
+    # convert the (nested) lists in the interleaved format into tuples
+    if isinstance(arg, (list, tuple)):
+        return tuple(_hashable(a) for a in arg)
+    return arg
+
+
+def _cache_key(args, kwargs):
+    # returns None if the arguments can not be cached
+    if not isinstance(kwargs["optimize"], str):
+        # the path is explicitly provided
+        return None
+    key = []
+    for arg in args:
+        if isinstance(arg, ARRAY_TYPES):
+            key.append(("array", arg.shape, arg.dtype.str))
+        else:
+            key.append(_hashable(arg))
+    key.append(tuple(sorted((k, _hashable(v)) for k, v in kwargs.items())))
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _path_kwargs(kwargs):
+    # the arguments of `oe.contract_path`
+    return {k: v for k, v in kwargs.items() if k in ["optimize", "memory_limit"]}
+
+
 def oe_contract(*args, **kwargs):
     update_kwargs(args, kwargs)
     try:
+        key = _cache_key(args, kwargs)
+        if key is not None:
+            path = path_cache.get(("contract",) + key, lambda: oe.contract_path(*args, **_path_kwargs(kwargs))[0])
+            kwargs = kwargs.copy()
+            kwargs["optimize"] = path
         return oe.contract(*args, **kwargs)
     except MEMORY_ERRORS as e:
         logger.fatal("Out of memory error calling oe.contract")
@@ -44,9 +134,30 @@ def oe_contract(*args, **kwargs):
         raise e
 
 
+def _contract_expression(*args, **kwargs):
+    # contract expression with the cached path
+    key = _cache_key(args, kwargs)
+    if key is None:
+        return oe.contract_expression(*args, **kwargs)
+    constants = kwargs.get("constants")
+    if not constants:
+        # the expression is independent of the operands and can be reused
+        return path_cache.get(("expression",) + key, lambda: oe.contract_expression(*args, **kwargs))
+
+    def get_path():
+        subscripts, operands = args[0], args[1:]
+        shapes = [op.shape if isinstance(op, ARRAY_TYPES) else op for op in operands]
+        return oe.contract_path(subscripts, *shapes, shapes=True, **_path_kwargs(kwargs))[0]
+
+    path = path_cache.get(("expression_path",) + key, get_path)
+    kwargs = kwargs.copy()
+    kwargs["optimize"] = path
+    return oe.contract_expression(*args, **kwargs)
+
+
 def oe_contract_expression(*args, **kwargs):
     update_kwargs(args, kwargs)
-    expr = oe.contract_expression(*args, **kwargs)
+    expr = _contract_expression(*args, **kwargs)
     def expr_wrapped(matrix: xp.ndarray, *args2, **kwargs2):
         try:
             return expr(matrix, *args2, **kwargs2)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+r"""
+Operator-valued representation of an MPO site.
+
+An MPO site :math:`W_{b b'}^{\sigma \sigma'}` constructed from the symbolic MPO usually has
+only a few non-zero :math:`(b, b')` entries and many of the non-zero entries
+are the identity or diagonal local operators.
+:class:`SparseMo` stores the site as a list of ``(row, col, local operator)`` entries
+and the environment update and the :math:`H \psi` product loop over the entries,
+similar to the block DMRG codes. The cost scales with the number of non-trivial entries
+rather than ``bond_l * bond_r * pdim ** 2``.
+"""
+
+import logging
+from collections import defaultdict
+from typing import List, Tuple
+
+from renormalizer.mps.backend import np, xp
+from renormalizer.mps.matrix import asnumpy, asxp
+
+logger = logging.getLogger(__name__)
+
+IDENTITY = "identity"
+DIAGONAL = "diagonal"
+DENSE = "dense"
+
+
+def _classify(mat: np.ndarray, atol: float):
+    # identity: stored as the scalar factor; diagonal: stored as the diagonal elements
+    diag = np.diag(mat)
+    # no relative tolerance, so large diagonal elements that differ are not taken as the identity
+    if np.allclose(mat - np.diag(diag), 0, rtol=0, atol=atol):
+        if np.allclose(diag, diag[0], rtol=0, atol=atol):
+            return IDENTITY, diag[0]
+        return DIAGONAL, diag
+    return DENSE, mat
+
+
+class SparseMo:
+    r"""
+    MPO site stored as a list of local operators.
+
+    Parameters
+    ----------
+    entries : list
+        Each entry is a tuple of ``(row, col, flag, op)``.
+        ``flag`` is one of ``"identity"``, ``"diagonal"`` and ``"dense"``,
+        and ``op`` is accordingly a scalar factor, the diagonal elements or the dense local operator.
+    shape : tuple
+        The shape of the site in the dense form, ``(bond_l, pdim, pdim, bond_r)``.
+    dtype :
+        The data type of the site.
+    """
+
+    def __init__(self, entries: List[Tuple], shape: Tuple[int], dtype):
+        assert len(shape) == 4
+        self.entries = entries
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def from_dense(cls, array: np.ndarray, atol: float = 0):
+        """
+        Construct from a dense ``(bond_l, pdim, pdim, bond_r)`` array.
+        Entries with all elements no larger than ``atol`` are discarded.
+        """
+        array = asnumpy(array)
+        assert array.ndim == 4
+        entries = []
+        for row, col in zip(*np.nonzero(np.any(np.abs(array) > atol, axis=(1, 2)))):
+            flag, op = _classify(array[row, :, :, col], atol)
+            entries.append((int(row), int(col), flag, op))
+        return cls(entries, array.shape, array.dtype)
+
+    @classmethod
+    def from_symbolic(cls, basis, mo, dtype):
+        """
+        Construct from a symbolic matrix operator, the sparse counterpart
+        of :func:`renormalizer.mps.symbolic_mpo.symbolic_mo_to_numeric_mo`.
+        """
+        pdim = basis.nbas
+        entries = []
+        for (row, col), terms in np.ndenumerate(mo):
+            if len(terms) == 0:
+                continue
+            mat = np.zeros((pdim, pdim), dtype=dtype)
+            for term in terms:
+                mat += basis.op_mat(term)
+            flag, op = _classify(mat, 0)
+            entries.append((row, col, flag, op))
+        return cls(entries, (mo.shape[0], pdim, pdim, mo.shape[1]), dtype)
+
+    @property
+    def ndim(self) -> int:
+        return 4
+
+    @property
+    def n_entries(self) -> int:
+        return len(self.entries)
+
+    @property
+    def flag_count(self):
+        res = defaultdict(int)
+        for entry in self.entries:
+            res[entry[2]] += 1
+        return dict(res)
+
+    def todense(self) -> np.ndarray:
+        pdim = self.shape[1]
+        res = np.zeros(self.shape, dtype=self.dtype)
+        for row, col, flag, op in self.entries:
+            if flag == IDENTITY:
+                res[row, :, :, col] = op * np.eye(pdim)
+            elif flag == DIAGONAL:
+                res[row, :, :, col] = np.diag(op)
+            else:
+                res[row, :, :, col] = op
+        return res
+
+    def diagonal(self):
+        r"""
+        The diagonal of the local operators with shape ``(bond_l, pdim, bond_r)``,
+        the same as ``np.einsum("abbc -> abc", self.todense())``.
+        """
+        pdim = self.shape[1]
+        res = np.zeros((self.shape[0], pdim, self.shape[3]), dtype=self.dtype)
+        for row, col, flag, op in self.entries:
+            if flag == DENSE:
+                res[row, :, col] = np.diag(op)
+            else:
+                res[row, :, col] = op
+        return asxp(res)
+
+    def conj(self) -> "SparseMo":
+        entries = [(row, col, flag, np.conj(op)) for row, col, flag, op in self.entries]
+        return self.__class__(entries, self.shape, self.dtype)
+
+    def _apply(self, flag, op, tensor):
+        # apply the local operator on the first physical index (axis 1) of ``tensor``
+        if flag == IDENTITY:
+            return op * tensor
+        elif flag == DIAGONAL:
+            shape = [1] * tensor.ndim
+            shape[1] = -1
+            return asxp(op).reshape(shape) * tensor
+        else:
+            return xp.moveaxis(xp.tensordot(asxp(op), tensor, axes=([1], [1])), 0, 1)
+
+    def _accumulate(self, environ, ket):
+        # contract the environment with the ket for each row of the entries
+        # and accumulate the results for each column
+        contracted = {}
+        acc = {}
+        for row, col, flag, op in self.entries:
+            if row not in contracted:
+                # (a, b, c), (c, e, ..., k) -> (a, e, ..., k)
+                contracted[row] = xp.tensordot(environ[:, row, :], ket, axes=([1], [0]))
+            tmp = self._apply(flag, op, contracted[row])
+            if col in acc:
+                acc[col] = acc[col] + tmp
+            else:
+                acc[col] = tmp
+        return acc
+
+    def contract_one_site(self, environ, ms, domain, ms_conj=None):
+        """
+        The environment update with the same conventions as :func:`renormalizer.mps.lib.contract_one_site`.
+        """
+        assert domain in ["L", "R"]
+        environ = asxp(environ)
+        ms = asxp(ms)
+        if ms_conj is None:
+            ms_conj = ms.conj()
+        else:
+            ms_conj = asxp(ms_conj)
+        if ms.ndim not in [3, 4]:
+            raise ValueError(f"MPS ndim is not 3 or 4, got {ms.ndim}")
+
+        if domain == "R":
+            # reverse the direction so the same code is used for both domains.
+            # by swapping the first and the last virtual bond of the bra and the ket
+            axes = [ms.ndim - 1] + list(range(1, ms.ndim - 1)) + [0]
+            ms = ms.transpose(axes)
+            ms_conj = ms_conj.transpose(axes)
+            # and the rows and the columns of the entries are swapped.
+            # The physical indices are not transposed
+            mo = SparseMo([(col, row, flag, op) for row, col, flag, op in self.entries],
+                          (self.shape[3], self.shape[1], self.shape[2], self.shape[0]), self.dtype)
+        else:
+            mo = self
+
+        out_dim = mo.shape[3]
+        res = xp.zeros((ms_conj.shape[-1], out_dim, ms.shape[-1]),
+                       dtype=np.result_type(environ.dtype, ms.dtype, ms_conj.dtype, self.dtype))
+        nphys = ms.ndim - 2
+        for col, tensor in mo._accumulate(environ, ms).items():
+            # (a, d, ..., h), (a, d, ..., f) -> (f, h)
+            res[:, col, :] = xp.tensordot(ms_conj, tensor, axes=(list(range(nphys + 1)),) * 2)
+        return res
+
+    def hop(self, ltensor, rtensor, c):
+        r"""
+        The :math:`H \psi` product of the single site, with the same conventions as
+        :func:`renormalizer.mps.hop_expr.hop_expr`.
+        """
+        ltensor = asxp(ltensor)
+        rtensor = asxp(rtensor)
+        c = asxp(c)
+        res = None
+        for col, tensor in self._accumulate(ltensor, c).items():
+            # (a, d, ..., k), (l, k) -> (a, d, ..., l)
+            tmp = xp.tensordot(tensor, rtensor[:, col, :], axes=([-1], [1]))
+            res = tmp if res is None else res + tmp
+        if res is None:
+            shape = list(c.shape)
+            shape[0], shape[-1] = ltensor.shape[0], rtensor.shape[0]
+            res = xp.zeros(shape, dtype=c.dtype)
+        return res
+
+    def __repr__(self):
+        return f"SparseMo(shape={self.shape}, entries={self.flag_count})"
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 # Author: Jiajun Ren <jiajunren0522@gmail.com>
 import logging
+from typing import Union, Callable
 
 import scipy.linalg
 
 from renormalizer.mps.backend import np, backend
+from renormalizer.mps.block_sparse import BlockSparseTensor
 
 logger = logging.getLogger(__name__)
 
@@ -49,17 +51,48 @@ def optimized_svd(a, full_matrices, opt_full_matrices):
     return U, S, Vt
 
 
+def randomized_svd(a, rank, oversample=10, n_iter=2, flat_ratio=0.5, seed=0):
+    r""" Truncated SVD of ``a`` by randomized range finding with power iterations.
+
+    Reference: N. Halko, P. G. Martinsson and J. A. Tropp, SIAM Rev. 53, 217 (2011).
+
+    ``rank + oversample`` singular values are returned. If the spectrum is flat around
+    the ``rank``-th singular value, i.e. the smallest singular value obtained is larger than
+    ``flat_ratio`` times the ``rank``-th one, the randomized approximation is not reliable
+    and the exact SVD is performed instead.
+
+    The random test matrix is drawn from a local generator seeded by ``seed``,
+    so the result is reproducible and the global random state is not consumed.
+    """
+    k = rank + oversample
+    m, n = a.shape
+    if min(m, n) <= 2 * k:
+        # the exact SVD is cheaper
+        return optimized_svd(a, full_matrices=False, opt_full_matrices=False)
+    omega = np.random.default_rng(seed).standard_normal((n, k)).astype(a.dtype)
+    q, _ = scipy.linalg.qr(a @ omega, mode="economic")
+    for _ in range(n_iter):
+        # re-orthonormalize between the applications to avoid the loss of precision
+        z, _ = scipy.linalg.qr(a.T.conj() @ q, mode="economic")
+        q, _ = scipy.linalg.qr(a @ z, mode="economic")
+    u, s, vt = optimized_svd(q.T.conj() @ a, full_matrices=False, opt_full_matrices=False)
+    if s[rank-1] * flat_ratio < s[-1]:
+        logger.debug(f"flat spectrum in randomized SVD for {a.shape} matrix with rank {rank}. Fallback to exact SVD")
+        return optimized_svd(a, full_matrices=False, opt_full_matrices=False)
+    return q @ u, s, vt
+
+
 def add_orthonormal_basis(u):
     # add `n` basis. `n` is empirical
     m, n = u.shape
     assert 2 * n < m
-    assert np.allclose(u.T.conj() @ u, np.eye(n), atol=backend.canonical_atol)
+    assert np.allclose(u.T.conj() @ u, np.eye(n), atol=backend.get_canonical_atol(u.dtype))
     a = np.random.rand(m,n)
     a = a - u @ (u.T.conj() @ a)
     q, _ = scipy.linalg.qr(a, mode='economic')
     res = np.concatenate([u, q], axis=1)
 
-    assert np.allclose(res.T.conj() @ res, np.eye(2 * n), atol=backend.canonical_atol)
+    assert np.allclose(res.T.conj() @ res, np.eye(2 * n), atol=backend.get_canonical_atol(u.dtype))
     return res
 
 
@@ -104,15 +137,23 @@ def svd_qn(
         QR: bool=False,
         system: str=None,
         full_matrices: bool=True,
-        opt_full_matrices: bool=True
+        opt_full_matrices: bool=True,
+        m_trunc: Union[int, Callable[[np.ndarray], int]]=None,
+        rank: int=None,
 ):
     r""" Block decompose the coefficient array (l, sigmal, sigmar, r) or (l,sigma,r) by SVD/QR according to
     the quantum number.
 
+    The row and column indices are grouped by quantum number once, and the blocks of all sectors
+    are decomposed before the results are written into ``U`` and ``V`` allocated in one go.
+
     Parameters
     ----------
-    coef_array : np.ndarray
-        The coefficient array to be decomposed
+    coef_array : Union[np.ndarray, BlockSparseTensor]
+        The coefficient array to be decomposed. If a
+        :class:`~renormalizer.mps.block_sparse.BlockSparseTensor` is provided,
+        the blocks are taken directly from the tensor. In this case the legs of the tensor
+        should follow the super-block convention: all legs incoming and the total quantum number is ``qntot``.
     qnbigl : np.ndarray
         Quantum number of the left side (aka the super-L-block quantum number).
         Corresponds to the first index (or indices) of ``cstruct``.
@@ -137,6 +178,18 @@ def svd_qn(
         The optimized version does not calculate full matrices but adds a limited amount of
         additional orthonormal basis (in contrast to all of the basis when ``full_matrices=True``)
         to the decomposition.
+    m_trunc: int or callable
+        The number of singular values to keep, or a function that accepts all singular values in descending
+        order and returns the number, such as :meth:`~renormalizer.utils.configs.CompressConfig.compute_m_trunc`.
+        Only valid for SVD with ``full_matrices=False``. The singular vectors discarded are never written
+        to the output. Default is ``None``, which means no truncation.
+    rank: int
+        The maximum number of singular values to be kept, if known in advance.
+        If set, the blocks are decomposed by :func:`randomized_svd` so that only
+        approximately ``rank`` singular values are computed for each block, and ``m_trunc`` is applied
+        to the singular values obtained. So ``m_trunc`` should not depend on the discarded singular values,
+        such as the norm of all singular values. Only valid for SVD with ``full_matrices=False``.
+        Default is ``None``, which means the exact SVD of all blocks.
 
     Returns
     -------
@@ -154,43 +207,32 @@ def svd_qn(
         New quantum number for V (super-R-block).
     """
     SVD = not QR
-    coef_matrix = coef_array.reshape((np.prod(qnbigl.shape[:-1]), np.prod(qnbigr.shape[:-1])))
-
-    assert qntot.ndim == 1
-    qn_size = len(qntot)
-    localqnl = qnbigl.reshape(-1, qn_size)
-    localqnr = qnbigr.reshape(-1, qn_size)
-
-    block_u_list = []  # corresponds to nonzero svd value
-    block_u_list0 = []  # corresponds to zero svd value
-    block_v_list = []   # the same hereinafter
-    block_v_list0 = []
-    block_s_list = []
-    block_su_list0 = []
-    block_sv_list0 = []
-    qnl_list = []
-    qnl_list0 = []
-    qnr_list = []
-    qnr_list0 = []
-
-    # loop through each set of valid quantum numbers
-    for nl in set([tuple(t) for t in localqnl]):
-        nr = qntot - nl
-        rset = np.where(get_qn_mask(localqnr, nr))[0]
-        if len(rset) == 0:
-            continue
-        lset = np.where(get_qn_mask(localqnl, nl))[0]
-        block = coef_matrix.ravel().take(
-            (lset * coef_matrix.shape[1]).reshape(-1, 1) + rset
-        )
-        dim = min(block.shape)
-        if SVD:
+    if m_trunc is not None or rank is not None:
+        assert SVD and not full_matrices
+    if isinstance(coef_array, BlockSparseTensor):
+        # the blocks are gathered directly from the block sparse tensor
+        # and the symmetry forbidden elements are never touched
+        assert np.array_equal(coef_array.qntot, qntot)
+        nleft = qnbigl.ndim - 1
+        coef_shape = (np.prod(coef_array.shape[:nleft]), np.prod(coef_array.shape[nleft:]))
+        sectors = coef_array.matrix_sectors(nleft)
+    else:
+        coef_matrix = coef_array.reshape((np.prod(qnbigl.shape[:-1]), np.prod(qnbigr.shape[:-1])))
+        coef_shape = coef_matrix.shape
+        sectors = _dense_matrix_sectors(coef_matrix, qnbigl, qnbigr, qntot)
+
+    # decompose the block of each set of valid quantum numbers
+    # (nl, nr, lset, rset, u, s, v)
+    blocks = []
+    for nl, nr, lset, rset, block in sectors:
+        if SVD and rank is not None:
+            block_u, block_s, block_vt = randomized_svd(block, rank)
+        elif SVD:
             block_u, block_s, block_vt = optimized_svd(
                 block,
                 full_matrices=full_matrices,
                 opt_full_matrices=opt_full_matrices
             )
-            block_s_list.append(block_s)
         else:
             if full_matrices:
                 mode = "full"
@@ -202,44 +244,108 @@ def svd_qn(
                 block_u, block_vt = scipy.linalg.qr(block, mode=mode)
             else:
                 assert False
+            block_s = None
+        blocks.append((nl, nr, lset, rset, block_u, block_s, block_vt.T))
 
-        blockappend(
-            block_u_list, block_u_list0, qnl_list, qnl_list0, block_su_list0,
-            block_u, nl, dim, lset, coef_matrix.shape[0], full_matrices=full_matrices,
-        )
-        blockappend(
-            block_v_list, block_v_list0, qnr_list, qnr_list0, block_sv_list0,
-            block_vt.T, nr, dim, rset, coef_matrix.shape[1], full_matrices=full_matrices,
-        )
+    if len(blocks) == 0:
+        raise ValueError("Invalid quantum number")
 
-    # sanity check
+    dtype = np.result_type(*[b[4] for b in blocks], *[b[6] for b in blocks])
+    if SVD and not full_matrices:
+        # the singular vectors are sorted by the singular values across all blocks
+        s_all = np.concatenate([b[5] for b in blocks])
+        s_order = np.argsort(s_all)[::-1]
+        if m_trunc is None:
+            m = len(s_all)
+        elif callable(m_trunc):
+            m = m_trunc(s_all[s_order])
+        else:
+            m = m_trunc
+        m = int(min(m, len(s_all)))
+        # the position in the output of each singular vector. -1 for discarded
+        position = np.full(len(s_all), -1)
+        position[s_order[:m]] = np.arange(m)
+        u = np.zeros((coef_shape[0], m), dtype=dtype)
+        v = np.zeros((coef_shape[1], m), dtype=dtype)
+        new_qnl = [None] * m
+        new_qnr = [None] * m
+        offset = 0
+        for nl, nr, lset, rset, block_u, block_s, block_v in blocks:
+            block_position = position[offset:offset+len(block_s)]
+            offset += len(block_s)
+            kept = np.where(block_position != -1)[0]
+            if len(kept) == 0:
+                continue
+            cols = block_position[kept]
+            u[np.ix_(lset, cols)] = block_u[:, kept]
+            v[np.ix_(rset, cols)] = block_v[:, kept]
+            for col in cols:
+                new_qnl[col] = nl
+                new_qnr[col] = nr
+        s = s_all[s_order[:m]]
+        new_qnl = np.array(new_qnl).reshape(m, -1).tolist()
+        new_qnr = np.array(new_qnr).reshape(m, -1).tolist()
+        return u, s, new_qnl, v, s, new_qnr
+
+    # the vectors corresponding to nonzero svd value come first, followed by those for zero svd value
+    dims = [min(len(b[2]), len(b[3])) for b in blocks]
+    u, new_qnl, su = _scatter_blocks([(b[0], b[2], b[4], b[5]) for b in blocks], dims, coef_shape[0], dtype)
+    v, new_qnr, sv = _scatter_blocks([(b[1], b[3], b[6], b[5]) for b in blocks], dims, coef_shape[1], dtype)
     if not full_matrices:
-        for l in [block_u_list0, block_v_list0, block_su_list0, block_sv_list0, qnl_list0, qnr_list0]:
-            assert len(l) == 0
-    if len(block_u_list) + len(block_u_list0) == 0 or len(block_v_list) + len(block_v_list0) == 0:
-        raise ValueError("Invalid quantum number")
-    # concatenate the blocks and return them
-    u = np.concatenate(block_u_list + block_u_list0, axis=1)
-    v = np.concatenate(block_v_list + block_v_list0, axis=1)
-    new_qnl = qnl_list + qnl_list0
-    new_qnr = qnr_list + qnr_list0
+        # sanity check
+        assert u.shape[1] == v.shape[1]
     if QR:
         return u, new_qnl, v, new_qnr
-
-    su = np.concatenate(block_s_list + block_su_list0)
-    sv = np.concatenate(block_s_list + block_sv_list0)
-    if not full_matrices:
-        # sort the singular values
-        assert np.allclose(su, sv)
-        s_order = np.argsort(su)[::-1]
-        u = u[:, s_order]
-        v = v[:, s_order]
-        su = sv = su[s_order]
-        new_qnl = np.array(new_qnl)[s_order].tolist()
-        new_qnr = np.array(new_qnr)[s_order].tolist()
     return u, su, new_qnl, v, sv, new_qnr
 
 
+def _scatter_blocks(blocks, dims, nrow, dtype):
+    # write the blocks of U (or V) into one matrix.
+    # The first ``dims`` columns of each block are put in the front
+    ncol = sum(block_u.shape[1] for _, _, block_u, _ in blocks)
+    u = np.zeros((nrow, ncol), dtype=dtype)
+    qn_list = []
+    s_list = []
+    col = 0
+    for (n, lset, block_u, s), dim in zip(blocks, dims):
+        u[lset, col:col+dim] = block_u[:, :dim]
+        qn_list += [n] * dim
+        if s is not None:
+            s_list.append(s)
+        col += dim
+    for (n, lset, block_u, s), dim in zip(blocks, dims):
+        ncol0 = block_u.shape[1] - dim
+        u[lset, col:col+ncol0] = block_u[:, dim:]
+        qn_list += [n] * ncol0
+        s_list.append(np.zeros(ncol0))
+        col += ncol0
+    return u, qn_list, np.concatenate(s_list)
+
+
+def _qn_groups(localqn):
+    # group the indices by the quantum number with a single sort
+    unique, inverse = np.unique(localqn, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind="stable")
+    split = np.cumsum(np.bincount(inverse, minlength=len(unique)))[:-1]
+    return {tuple(qn): indices for qn, indices in zip(unique.tolist(), np.split(order, split))}
+
+
+def _dense_matrix_sectors(coef_matrix, qnbigl, qnbigr, qntot):
+    # gather the blocks of each set of valid quantum numbers from the dense matrix
+    assert qntot.ndim == 1
+    qn_size = len(qntot)
+    lgroups = _qn_groups(qnbigl.reshape(-1, qn_size))
+    rgroups = _qn_groups(qnbigr.reshape(-1, qn_size))
+
+    for nl, lset in lgroups.items():
+        nr = qntot - np.array(nl)
+        rset = rgroups.get(tuple(nr.tolist()))
+        if rset is None:
+            continue
+        yield nl, nr, lset, rset, coef_matrix[np.ix_(lset, rset)]
+
+
 def eigh_qn(dm, qnbigl, qnbigr, qntot, system):
     r""" Diagonalization of the reduced density matrix for multistate algorithms.
 
@@ -274,19 +380,17 @@ def eigh_qn(dm, qnbigl, qnbigr, qntot, system):
     del qnbigl, qnbigr
     qn_size = len(qntot)
     localqn = qnbig.reshape(-1, qn_size)
+    comp_groups = _qn_groups(comp_qnbig.reshape(-1, qn_size))
 
     block_u_list = []
     block_s_list = []
     new_qn = []
 
-    for nl in set([tuple(t) for t in localqn]):
-        nr = qntot - nl
-        if np.sum(get_qn_mask(comp_qnbig, nr)) == 0:
+    for nl, lset in _qn_groups(localqn).items():
+        nr = qntot - np.array(nl)
+        if tuple(nr.tolist()) not in comp_groups:
             continue
-        lset = rset = np.where(get_qn_mask(localqn, nl))[0]
-        block = dm.ravel().take(
-            (lset * len(localqn)).reshape(-1, 1) + rset
-        )
+        block = dm.reshape(len(localqn), len(localqn))[np.ix_(lset, lset)]
         block_s2, block_u = scipy.linalg.eigh(block)
         # numerical error for eigenvalue < 0
         block_s2[block_s2 < 0] = 0
@@ -188,21 +188,11 @@ def _construct_symbolic_mpo(table, in_ops, factor, primary_ops, algo="qr"):
 
 def _construct_symbolic_mpo_one_site(table_row, table_col, in_ops_list, factor, primary_ops, algo, k=1):
     # split table into the row and col part
-    term_row, row_unique_inverse = np.unique(table_row, axis=0, return_inverse=True)
+    term_row, row_unique_inverse = _unique_rows(table_row)
     assert len(in_ops_list) + k == term_row.shape[1]
 
-    # faster version of the following code
-    # term_col, col_unique_inverse = np.unique(table_col, axis=0, return_inverse=True)
-    term_col = {}
-    col_unique_inverse = []
-    for row in table_col:
-        row_bytes = row.tobytes()
-        i_and_row = term_col.get(row_bytes)
-        if i_and_row is None:
-            i_and_row = (len(term_col), row)
-            term_col[row_bytes] = i_and_row
-        col_unique_inverse.append(i_and_row[0])
-    term_col = [v[1] for v in term_col.values()]
+    # the order of the first occurrence is kept for the col part
+    term_col, col_unique_inverse = _unique_rows(table_col, sort=False)
 
     non_red = scipy.sparse.coo_matrix((np.arange(len(factor)) + 1, (row_unique_inverse, col_unique_inverse))).tocsr()
 
@@ -212,6 +202,34 @@ def _construct_symbolic_mpo_one_site(table_row, table_col, in_ops_list, factor,
         return _decompose_qr(term_row, term_col, non_red, in_ops_list, factor, primary_ops, algo, k)
 
 
+def _unique_rows(table, sort=True):
+    r"""
+    Unique rows of an integer table, the vectorized counterpart of ``np.unique(table, axis=0, return_inverse=True)``.
+    Each row is viewed as a single byte string
+    and in big-endian the byte order is the same as the lexicographical order of the row.
+
+    If ``sort`` is ``False``, the unique rows are in the order of their first occurrence.
+    """
+    table = np.asarray(table)
+    assert table.ndim == 2
+    if len(table) == 0:
+        return table, np.zeros(0, dtype=int)
+    if table.shape[1] == 0:
+        # all rows are the same empty row
+        return table[:1], np.zeros(len(table), dtype=int)
+    assert 0 <= table.min() and table.max() <= np.iinfo(np.uint32).max
+    b = np.ascontiguousarray(table, dtype=">u4")
+    rows = b.view(np.dtype((np.void, b.itemsize * b.shape[1]))).ravel()
+    _, first_idx, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    if not sort:
+        order = np.argsort(first_idx)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        first_idx = first_idx[order]
+        inverse = rank[inverse]
+    return table[first_idx], inverse
+
 
 def _decompose_graph(term_row, term_col, non_red, in_ops_list, factor, primary_ops, algo, k=1):
     bigraph = []
@@ -249,26 +267,27 @@ def _decompose_graph(term_row, term_col, non_red, in_ops_list, factor, primary_o
         out_op = OpTuple(symbol, qn, factor=1.0)
         out_ops.append([out_op])
 
-        col_link = non_red.indices[non_red.indptr[row_idx]:non_red.indptr[row_idx + 1]]
-        stack = np.array([len(out_ops) - 1] * len(col_link), dtype=np.uint16).reshape(-1, 1)
-        new_table.append(np.hstack((stack, [term_col[i] for i in col_link])))
-        new_factor.append(factor[non_red[row_idx, col_link].toarray() - 1])
-        non_red.data[non_red.indptr[row_idx]:non_red.indptr[row_idx + 1]] = 0
+        row_slice = slice(non_red.indptr[row_idx], non_red.indptr[row_idx + 1])
+        col_link = non_red.indices[row_slice]
+        stack = np.full((len(col_link), 1), len(out_ops) - 1, dtype=np.uint16)
+        new_table.append(np.hstack((stack, term_col[col_link])))
+        new_factor.append(factor[non_red.data[row_slice] - 1])
+        non_red.data[row_slice] = 0
 
     non_red.eliminate_zeros()
+    non_red_csc = non_red.tocsc()
 
-    nonzero_row_idx, nonzero_col_idx = non_red.nonzero()
     for col_idx in col_select:
 
         out_ops.append([])
         # complementary operator
         # dealing with column (right side of the table). One col correspond to multiple rows.
         # Produce multiple out operators and one new_table entry
-        non_red_one_col = non_red[:, col_idx].toarray().flatten()
-        for i in nonzero_row_idx[np.nonzero(nonzero_col_idx == col_idx)[0]]:
+        col_slice = slice(non_red_csc.indptr[col_idx], non_red_csc.indptr[col_idx + 1])
+        for i, term_idx in zip(non_red_csc.indices[col_slice], non_red_csc.data[col_slice]):
             symbol = term_row[i]
             qn = _compute_qn(in_ops_list, symbol, primary_ops, k)
-            out_op = OpTuple(symbol, qn, factor=factor[non_red_one_col[i] - 1])
+            out_op = OpTuple(symbol, qn, factor=factor[term_idx - 1])
             out_ops[-1].append(out_op)
 
         new_table.append(np.array([len(out_ops) - 1] + list(term_col[col_idx]), dtype=np.uint16).reshape(1, -1))
@@ -343,7 +362,7 @@ def _decompose_qr(term_row, term_col, non_red, in_ops_list, factor, primary_ops,
     # a+b  y  1/2
     # a-b  x  -1/2
     # a-b  y  -1/2
-    new_table = np.concatenate([idx1.reshape(-1, 1), [term_col[i] for i in idx2]], axis=1)
+    new_table = np.concatenate([idx1.reshape(-1, 1), term_col[idx2]], axis=1)
     return out_ops, new_table, new_factor
 
 
@@ -423,16 +442,17 @@ def _deduplicate_table(table, factor):
     assert table.shape[0] < np.iinfo(np.uint32).max
 
     # combine the same terms but with different factors(add them together)
-    new_table, unique_inverse = np.unique(table, axis=0, return_inverse=True)
-    # it is efficient to vectorize the operation that moves the rows and cols
-    # and sum them together
-    coord = np.array([[newidx, oldidx] for oldidx, newidx in enumerate(unique_inverse)])
-    mask = scipy.sparse.csr_matrix((np.ones(len(coord)), (coord[:, 0], coord[:, 1])))
-    factor = mask.dot(factor)
+    new_table, unique_inverse = _unique_rows(table)
+    factor = np.asarray(factor)
+    if np.iscomplexobj(factor):
+        factor = np.bincount(unique_inverse, weights=factor.real, minlength=len(new_table)) \
+            + 1j * np.bincount(unique_inverse, weights=factor.imag, minlength=len(new_table))
+    else:
+        factor = np.bincount(unique_inverse, weights=factor, minlength=len(new_table))
 
     # remove zeros
     mask = np.abs(factor) > (np.max(np.abs(factor)) * 1e-15)
-    new_table = np.array(new_table)[mask]
+    new_table = new_table[mask]
     factor = factor[mask]
 
     return new_table, factor
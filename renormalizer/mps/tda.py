@@ -7,9 +7,9 @@ import numpy as np
 import scipy
 
 from renormalizer.mps.matrix import tensordot, multi_tensor_contract, asnumpy, asxp
-from renormalizer.mps.backend import xp, USE_GPU, primme, IMPORT_PRIMME_EXCEPTION
+from renormalizer.mps.backend import xp, OE_BACKEND, primme, IMPORT_PRIMME_EXCEPTION
 from renormalizer.mps import Mps
-from renormalizer.mps.lib import Environ, compressed_sum
+from renormalizer.mps.lib import compressed_sum, contract_one_site
 from renormalizer.mps.oe_contract_wrap import oe_contract
 from renormalizer.lib import davidson
 
@@ -57,6 +57,7 @@ class TDA(object):
         self.e = None
         # wavefunction: [mps_l_cano, mps_r_cano, tangent_u, tda_coeff_list]
         self.wfn = None
+        self.tangent_space: TangentSpace = None
         self.configs = defaultdict(list)
 
     def kernel(self, restart=False, include_psi0=False):
@@ -130,122 +131,26 @@ class TDA(object):
                 cguess.append(x)
             cguess = np.stack(cguess, axis=1)
 
-        xshape = [] 
-        xsize = 0
-        for ims in range(site_num):
-            if tangent_u[ims] is None:
-                xshape.append((0,0))
-            else:
-                if ims == site_num-1:
-                    xshape.append((tangent_u[ims].shape[-1], 1))
-                else:    
-                    xshape.append((tangent_u[ims].shape[-1], mps_r_cano[ims+1].shape[0]))
-                xsize += np.prod(xshape[-1])
-        
-        logger.debug(f"DMRG-TDA H dimension: {xsize}")
-        
-        if USE_GPU:
-            oe_backend = "cupy"
+        if restart and self._tangent_space_valid():
+            # reuse the environments
+            tangent_space = self.tangent_space
         else:
-            oe_backend = "numpy"
-        
-        mps_tangent = mps_r_cano.copy()
-        environ = Environ(mps_tangent, mpo, "R")
-        hdiag = []
-        for ims in range(site_num):
-            ltensor = environ.GetLR(
-                "L", ims-1, mps_tangent, mpo, itensor=None,
-                method="System"
-            )
-            rtensor = environ.GetLR(
-                "R", ims+1, mps_tangent, mpo, itensor=None,
-                method="Enviro"
-            )
-            if tangent_u[ims] is not None:
-                u = asxp(tangent_u[ims])
-                tmp = oe_contract("abc, ded, bghe, agl, chl -> ld", ltensor, rtensor,
-                        asxp(mpo[ims]), u, u, backend=oe_backend)   
-                hdiag.append(asnumpy(tmp))
-            mps_tangent[ims] = mps_l_cano[ims]
-        hdiag = np.concatenate(hdiag, axis=None)
-    
+            tangent_space = TangentSpace(mpo, mps_l_cano, mps_r_cano, tangent_u)
+            self.tangent_space = tangent_space
+        xsize = tangent_space.xsize
+        reshape_x = tangent_space.reshape_x
+        logger.debug(f"DMRG-TDA H dimension: {xsize}")
+
+        hdiag = tangent_space.hdiag()
+
         count = 0
-        
-        # recover the vector-like x back to the ndarray tda_coeff
-        def reshape_x(x):
-            tda_coeff = []
-            offset = 0
-            for shape in xshape:
-                if shape == (0,0):
-                    tda_coeff.append(None)
-                else:
-                    size = np.prod(shape)
-                    tda_coeff.append(x[offset:size+offset].reshape(shape))
-                    offset += size
-            
-            assert offset == xsize
-            return tda_coeff
-            
+
         def hop(x):
             # H*X
             nonlocal count
             count += 1
-            
-            assert len(x) == xsize
-            tda_coeff = reshape_x(x)
-    
-            res = [np.zeros_like(coeff) if coeff is not None else None for coeff in tda_coeff]
-            
-            # fix ket and sweep bra and accumulate into res
-            for ims in range(site_num):
-                if tda_coeff[ims] is None:
-                    assert tangent_u[ims] is None
-                    continue
-                
-                # mix-canonical mps
-                mps_tangent = merge(mps_l_cano, mps_r_cano, ims+1)
-                mps_tangent[ims] = tensordot(tangent_u[ims], tda_coeff[ims], (-1, 0))
-                
-                mps_tangent_conj = mps_r_cano.copy()
-                environ = Environ(mps_tangent, mpo, "R", mps_conj=mps_tangent_conj)
-                
-                for ims_conj in range(site_num):
-                    ltensor = environ.GetLR(
-                        "L", ims_conj-1, mps_tangent, mpo, itensor=None,
-                        mps_conj=mps_tangent_conj,
-                        method="System"
-                    )
-                    rtensor = environ.GetLR(
-                        "R", ims_conj+1, mps_tangent, mpo, itensor=None,
-                        mps_conj=mps_tangent_conj,
-                        method="Enviro"
-                    )
-                    if tda_coeff[ims_conj] is not None:
-                        # S-a   l-S
-                        #     d
-                        # O-b-O-f-O
-                        #     e
-                        # S-c   k-S
-    
-                        path = [
-                            ([0, 1], "abc, cek -> abek"),
-                            ([2, 0], "abek, bdef -> akdf"),
-                            ([1, 0], "akdf, lfk -> adl"),
-                        ]
-                        out = multi_tensor_contract(
-                            path, ltensor, asxp(mps_tangent[ims_conj]),
-                            asxp(mpo[ims_conj]), rtensor
-                        )
-                        res[ims_conj] += asnumpy(tensordot(tangent_u[ims_conj], out,
-                            ([0,1], [0,1])))
-                    
-                    # mps_conj combine 
-                    mps_tangent_conj[ims_conj] = mps_l_cano[ims_conj]    
-            
-            res = [mat for mat in res if mat is not None]
-    
-            return np.concatenate(res, axis=None)
-        
+            return tangent_space.hop(x)
+
         if algo == "davidson":
             if restart:
                 cguess = [cguess[:,i] for i in range(cguess.shape[1])]
@@ -351,6 +256,18 @@ class TDA(object):
             tda_coeff_list.append(tda_coeff)
 
         self.wfn = [mps_l_cano, mps_r_cano, tangent_u, tda_coeff_list]
+        # the environments are calculated on demand
+        self.tangent_space = TangentSpace(self.hmpo, mps_l_cano, mps_r_cano, tangent_u)
+
+    def _tangent_space_valid(self):
+        return self.tangent_space is not None and self.tangent_space.mpo is self.hmpo \
+            and self.tangent_space.mps_l_cano is self.wfn[0]
+
+    def _get_tangent_space(self):
+        if not self._tangent_space_valid():
+            mps_l_cano, mps_r_cano, tangent_u, _ = self.wfn
+            self.tangent_space = TangentSpace(self.hmpo, mps_l_cano, mps_r_cano, tangent_u)
+        return self.tangent_space
  
 
     def analysis_1ordm(self):
@@ -358,6 +275,7 @@ class TDA(object):
         """
         
         mps_l_cano, mps_r_cano, tangent_u, tda_coeff_list = self.wfn
+        tangent_space = self._get_tangent_space()
         for iroot in range(self.nroots):
             tda_coeff = tda_coeff_list[iroot]
             rdm = None
@@ -365,8 +283,7 @@ class TDA(object):
                 if tangent_u[ims] is None:
                     assert tda_coeff[ims] is None
                     continue
-                mps_tangent = merge(mps_l_cano, mps_r_cano, ims+1) 
-                mps_tangent[ims] = tensordot(tangent_u[ims], tda_coeff[ims],[-1,0]) 
+                mps_tangent = tangent_space.tangent_mps(ims, tda_coeff[ims])
                 rdm_increment = mps_tangent.calc_1ordm()
 
                 if rdm is None:
@@ -420,7 +337,8 @@ class TDA(object):
         """
 
         mps_l_cano, mps_r_cano, tangent_u, tda_coeff_list = self.wfn
-            
+        tangent_space = self._get_tangent_space()
+
         if alias is not None:
             assert len(alias) == mps_l_cano.site_num
         
@@ -435,10 +353,7 @@ class TDA(object):
                     assert tda_coeff[ims] is None
                     continue
                 weight.append(np.sum(tda_coeff[ims]**2))
-                mps_tangent = merge(mps_l_cano, mps_r_cano, ims+1) 
-                mps_tangent[ims] = asnumpy(tensordot(tangent_u[ims],
-                    tda_coeff[ims],[-1,0]))
-                mps_tangent_list.append(mps_tangent)
+                mps_tangent_list.append(tangent_space.tangent_mps(ims, tda_coeff[ims]))
             
             assert np.allclose(np.sum(weight), 1)
             # sort the mps_tangent from large weight to small weight
@@ -505,7 +420,186 @@ class TDA(object):
             logger.info(f"coeff_square_sum: {coeff_square_sum}")
         
         return self.configs, compressed_mps
-        
+
+
+class TangentSpace:
+    r""" The first order tangent space of the reference MPS in :class:`TDA`.
+    A tangent vector is :math:`\sum_i A_1 \cdots A_{i-1} U_i X_i B_{i+1} \cdots B_N`,
+    where :math:`A` and :math:`B` are the left and right canonical sites and
+    :math:`U_i` spans the orthogonal complement of :math:`A_i`.
+
+    The environments of the canonical MPSs are calculated only once. To apply
+    the Hamiltonian, the cross terms are accumulated with one right sweep and one left sweep
+    of the environments with a single tangent site in the ket,
+    so the cost of :math:`HX` is linear to the number of sites.
+
+    Parameters
+    ----------
+    mpo: renormalizer.mps.Mpo
+        mpo of Hamiltonian
+    mps_l_cano: renormalizer.mps.Mps
+        left canonical form of the reference mps
+    mps_r_cano: renormalizer.mps.Mps
+        right canonical form of the reference mps
+    tangent_u: list
+        :math:`U_i` of each site. ``None`` if the tangent space of the site is empty.
+    """
+
+    def __init__(self, mpo, mps_l_cano, mps_r_cano, tangent_u):
+        self.mpo = mpo
+        self.mps_l_cano = mps_l_cano
+        self.mps_r_cano = mps_r_cano
+        self.tangent_u = tangent_u
+        self.site_num = mpo.site_num
+
+        self.xshape = []
+        self.xsize = 0
+        for ims in range(self.site_num):
+            if tangent_u[ims] is None:
+                self.xshape.append((0,0))
+            else:
+                if ims == self.site_num-1:
+                    self.xshape.append((tangent_u[ims].shape[-1], 1))
+                else:
+                    self.xshape.append((tangent_u[ims].shape[-1], mps_r_cano[ims+1].shape[0]))
+                self.xsize += np.prod(self.xshape[-1])
+
+        # the environments of the left canonical sites from the left
+        # and the environments of the right canonical sites from the right.
+        # calculated on demand
+        self._l_environ = None
+        self._r_environ = None
+
+    def _build_environ(self):
+        if self._l_environ is not None:
+            return
+        sentinel = xp.ones((1, 1, 1))
+        self._l_environ = [sentinel]
+        for ims in range(self.site_num):
+            ms = asxp(self.mps_l_cano[ims])
+            self._l_environ.append(
+                contract_one_site(self._l_environ[-1], ms, asxp(self.mpo[ims]), "L", ms.conj())
+            )
+        self._r_environ = [sentinel] * (self.site_num + 1)
+        for ims in range(self.site_num - 1, -1, -1):
+            ms = asxp(self.mps_r_cano[ims])
+            self._r_environ[ims] = contract_one_site(
+                self._r_environ[ims+1], ms, asxp(self.mpo[ims]), "R", ms.conj()
+            )
+
+    def reshape_x(self, x):
+        r""" recover the vector-like x back to the ndarray tda_coeff
+        """
+        tda_coeff = []
+        offset = 0
+        for shape in self.xshape:
+            if shape == (0,0):
+                tda_coeff.append(None)
+            else:
+                size = np.prod(shape)
+                tda_coeff.append(x[offset:size+offset].reshape(shape))
+                offset += size
+
+        assert offset == self.xsize
+        return tda_coeff
+
+    def tangent_mps(self, ims, coeff):
+        r""" the mixed-canonical mps with the tangent site at ``ims``
+        """
+        mps_tangent = merge(self.mps_l_cano, self.mps_r_cano, ims+1)
+        mps_tangent[ims] = asnumpy(tensordot(self.tangent_u[ims], coeff, [-1,0]))
+        return mps_tangent
+
+    def hdiag(self):
+        r""" the diagonal elements of the Hamiltonian for preconditioning
+        """
+        self._build_environ()
+        hdiag = []
+        for ims in range(self.site_num):
+            if self.tangent_u[ims] is None:
+                continue
+            u = asxp(self.tangent_u[ims])
+            tmp = oe_contract("abc, ded, bghe, agl, chl -> ld", self._l_environ[ims],
+                    self._r_environ[ims+1], asxp(self.mpo[ims]), u.conj(), u, backend=OE_BACKEND)
+            hdiag.append(asnumpy(tmp))
+        return np.concatenate(hdiag, axis=None)
+
+    def hop(self, x):
+        r""" H*X
+        """
+        self._build_environ()
+        assert len(x) == self.xsize
+        tda_coeff = self.reshape_x(x)
+        site_num = self.site_num
+        l_environ, r_environ = self._l_environ, self._r_environ
+
+        # the tangent sites of the ket
+        tangent_ms = [None] * site_num
+        for ims, coeff in enumerate(tda_coeff):
+            if coeff is not None:
+                tangent_ms[ims] = tensordot(asxp(self.tangent_u[ims]), asxp(coeff), (-1, 0))
+
+        # the right environments with one tangent site in the ket. The bra is right canonical
+        r_defect = [None] * (site_num + 1)
+        for ims in range(site_num - 1, 0, -1):
+            mo = asxp(self.mpo[ims])
+            ms_conj = asxp(self.mps_r_cano[ims]).conj()
+            environ = None
+            if r_defect[ims+1] is not None:
+                # the left canonical site left to the tangent site
+                environ = contract_one_site(r_defect[ims+1], asxp(self.mps_l_cano[ims]), mo, "R", ms_conj)
+            if tangent_ms[ims] is not None:
+                tmp = contract_one_site(r_environ[ims+1], tangent_ms[ims], mo, "R", ms_conj)
+                environ = tmp if environ is None else environ + tmp
+            r_defect[ims] = environ
+
+        # sweep from the left and accumulate into res
+        res = []
+        # the left environment with one tangent site in the ket. The bra is left canonical
+        l_defect = None
+        for ims in range(site_num):
+            mo = asxp(self.mpo[ims])
+            if tda_coeff[ims] is not None:
+                # the tangent site at ``ims``
+                out = _apply_site(l_environ[ims], tangent_ms[ims], mo, r_environ[ims+1])
+                if l_defect is not None:
+                    # the tangent site at the left side
+                    out += _apply_site(l_defect, asxp(self.mps_r_cano[ims]), mo, r_environ[ims+1])
+                if r_defect[ims+1] is not None:
+                    # the tangent site at the right side
+                    out += _apply_site(l_environ[ims], asxp(self.mps_l_cano[ims]), mo, r_defect[ims+1])
+                u = asxp(self.tangent_u[ims])
+                res.append(asnumpy(tensordot(u.conj(), out, ([0,1], [0,1]))))
+
+            if ims == site_num - 1:
+                break
+            ms_conj = asxp(self.mps_l_cano[ims]).conj()
+            environ = None
+            if l_defect is not None:
+                # the right canonical site right to the tangent site
+                environ = contract_one_site(l_defect, asxp(self.mps_r_cano[ims]), mo, "L", ms_conj)
+            if tangent_ms[ims] is not None:
+                tmp = contract_one_site(l_environ[ims], tangent_ms[ims], mo, "L", ms_conj)
+                environ = tmp if environ is None else environ + tmp
+            l_defect = environ
+
+        return np.concatenate(res, axis=None)
+
+
+def _apply_site(ltensor, ms, mo, rtensor):
+    # S-a   l-S
+    #     d
+    # O-b-O-f-O
+    #     e
+    # S-c   k-S
+    path = [
+        ([0, 1], "abc, cek -> abek"),
+        ([2, 0], "abek, bdef -> akdf"),
+        ([1, 0], "akdf, lfk -> adl"),
+    ]
+    return multi_tensor_contract(path, ltensor, ms, mo, rtensor)
+
+
 def merge(mpsl, mpsr, idx):
     """ merge two mps (mpsl, mpsr) at dix
         idx belongs mpsr, the other attributes are the same aas mpsl
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from renormalizer.mps import Mps, Mpo
+from renormalizer.mps.block_sparse import BlockSparseTensor, tensordot, contract_into
+from renormalizer.mps.gs import get_ham_block_sparse, get_block_sparse_template
+from renormalizer.mps.hop_expr import hop_expr
+from renormalizer.mps.lib import Environ
+from renormalizer.mps.svd_qn import svd_qn, randomized_svd
+from renormalizer.tests.parameter import holstein_model
+from renormalizer.utils import CompressConfig
+
+
+def random_block_tensor(qns, signs, qntot):
+    array = np.random.rand(*[len(qn) for qn in qns])
+    return BlockSparseTensor.from_dense(array, qns, signs, qntot)
+
+
+def test_tensordot():
+    qn1 = np.array([[0], [1], [1], [2]])
+    qn2 = np.array([[0], [1], [0]])
+    qn3 = np.array([[1], [0], [2], [1], [0]])
+    a = random_block_tensor([qn1, qn2, qn3], [1, 1, -1], [0])
+    b = random_block_tensor([qn3, qn2], [1, -1], [0])
+    # the forbidden elements are zero
+    assert np.allclose(BlockSparseTensor.from_dense(a.todense(), a.qns, a.signs, a.qntot).todense(), a.todense())
+    assert a.size < np.prod(a.shape)
+
+    res = tensordot(a, b, ([2], [0]))
+    assert np.allclose(res.todense(), np.tensordot(a.todense(), b.todense(), ([2], [0])))
+    assert np.allclose(res.transpose(2, 0, 1).todense(), res.todense().transpose(2, 0, 1))
+
+    with pytest.raises(ValueError):
+        tensordot(a, b.conj(), ([2], [0]))
+
+
+@pytest.mark.parametrize("mpo_type", ["mpo", "identity"])
+def test_environ(mpo_type):
+    mps = Mps.random(holstein_model, 1, 10)
+    if mpo_type == "mpo":
+        mpo = Mpo(holstein_model)
+    else:
+        mpo = Mpo.identity(holstein_model)
+    environ = Environ(mps, mpo, "L")
+    block_environ = Environ(mps, mpo, "L", block_sparse=True)
+    for i in range(len(mps) - 1):
+        dense = environ.read("L", i)
+        block = block_environ.read("L", i)
+        assert isinstance(block, BlockSparseTensor)
+        assert np.allclose(block.todense(), dense)
+    block = block_environ.GetLR("L", len(mps) - 1, mps, mpo, method="System")
+    assert block.todense().ravel()[0] == pytest.approx(mps.expectation(mpo))
+
+
+def test_hop():
+    mps = Mps.random(holstein_model, 1, 10)
+    mpo = Mpo(holstein_model)
+    environ = Environ(mps, mpo, "R", block_sparse=True)
+    dense_environ = Environ(mps, mpo, "R")
+    ltensor = environ.get_sentinel("L")
+    rtensor = environ.read("R", 1)
+    # the block sparse environment is compatible with the dense one
+    assert np.allclose(rtensor.todense(), dense_environ.read("R", 1))
+
+    c = mps.to_block_sparse(0)
+    hop = hop_expr(ltensor, rtensor, [mpo.to_block_sparse(0)], c.shape)
+    dense_hop = hop_expr(
+        np.ones((1, 1, 1)), dense_environ.read("R", 1), [mpo[0].array], c.shape
+    )
+    res = hop(c)
+    assert isinstance(res, BlockSparseTensor)
+    assert np.allclose(res.todense(), dense_hop(mps[0].array))
+
+
+def test_contract_into():
+    qn1 = np.array([[0], [1], [1], [2]])
+    qn2 = np.array([[0], [1], [0]])
+    a = random_block_tensor([qn1, qn2, qn1], [-1, 1, 1], [0])
+    b = random_block_tensor([qn2, qn1, qn1], [-1, 1, -1], [0])
+    template = BlockSparseTensor.zeros([qn1, qn1], [1, -1], [0])
+    res = contract_into(template, a, ("a", "b", "a"), b, ("b", "c", "c"), ("a", "c"))
+    std = np.einsum("aba, bcc -> ac", a.todense(), b.todense())
+    assert np.allclose(res.to_vector(template), BlockSparseTensor.from_dense(std, template.qns, [1, -1], [0]).to_vector())
+
+
+@pytest.mark.parametrize("nsite", (1, 2))
+def test_ham(nsite):
+    mps = Mps.random(holstein_model, 1, 10)
+    mpo = Mpo(holstein_model)
+    idx = 1
+    environ = Environ(mps, mpo, "R", block_sparse=True)
+    dense_environ = Environ(mps, mpo, "R")
+    ltensor = environ.GetLR("L", idx - 1, mps, mpo)
+    rtensor = environ.read("R", idx + nsite)
+    cmo = [mpo.to_block_sparse(i) for i in range(idx, idx + nsite)]
+    template = get_block_sparse_template(mps, ltensor, rtensor, cmo)
+    hdiag, hop = get_ham_block_sparse(mps, template, ltensor, rtensor, cmo)
+
+    ltensor, rtensor = dense_environ.GetLR("L", idx - 1, mps, mpo), dense_environ.read("R", idx + nsite)
+    if nsite == 1:
+        std = np.einsum("aba, bccg, fgf -> acf", ltensor, mpo[idx].array, rtensor)
+    else:
+        std = np.einsum("aba, bcce, eddg, fgf -> acdf", ltensor, mpo[idx].array, mpo[idx+1].array, rtensor)
+    std = BlockSparseTensor.from_dense(std, template.qns, template.signs, template.qntot)
+    assert np.allclose(hdiag, std.to_vector(template))
+
+    # a block of vectors is applied at once
+    x = np.random.rand(len(hdiag), 3)
+    std = np.stack([hop(x[:, i]) for i in range(3)], axis=1)
+    assert np.allclose(hop(x), std)
+
+
+def test_site_blocks():
+    mps = Mps.random(holstein_model, 1, 10)
+    dense = mps[1].array
+    block = mps.to_block_sparse(1)
+    # the site is stored as the blocks
+    mps[1] = block
+    assert not mps[1].is_dense
+    assert mps.to_block_sparse(1) is block
+    copied = mps.copy()
+    assert not copied[1].is_dense
+    assert np.allclose(mps[1].array, dense)
+    assert mps[1].is_dense
+
+
+def test_site_cache():
+    mps = Mps.random(holstein_model, 1, 10)
+    block = mps.to_block_sparse(1)
+    assert mps.to_block_sparse(1) is block
+    # in place modification
+    mps[1][0, 0, 0] += 1
+    block2 = mps.to_block_sparse(1)
+    assert block2 is not block
+    assert np.allclose(block2.todense(), mps[1].array)
+    # replaced site
+    mps[1] = mps[1].array * 2
+    assert np.allclose(mps.to_block_sparse(1).todense(), mps[1].array)
+
+
+@pytest.mark.parametrize("QR", [True, False])
+def test_svd_qn(QR):
+    mps = Mps.random(holstein_model, 1, 10)
+    idx = mps.qnidx
+    qnbigl, qnbigr, _ = mps._get_big_qn([idx])
+    dense = mps[idx].array
+    # the super-block convention: all legs incoming
+    qns = [mps.qn[idx], mps.model.basis[idx].sigmaqn, mps.qn[idx+1]]
+    block = BlockSparseTensor.from_dense(dense, qns, [1, 1, 1], mps.qntot)
+    if QR:
+        u1, qnl1, v1, qnr1 = svd_qn(dense, qnbigl, qnbigr, mps.qntot, QR=True, system="L", full_matrices=False)
+        u2, qnl2, v2, qnr2 = svd_qn(block, qnbigl, qnbigr, mps.qntot, QR=True, system="L", full_matrices=False)
+        assert np.allclose(u1 @ v1.T, u2 @ v2.T)
+    else:
+        u1, s1, qnl1, v1, _, qnr1 = svd_qn(dense, qnbigl, qnbigr, mps.qntot, full_matrices=False)
+        u2, s2, qnl2, v2, _, qnr2 = svd_qn(block, qnbigl, qnbigr, mps.qntot, full_matrices=False)
+        assert np.allclose(s1, s2)
+        assert np.allclose((u1 * s1) @ v1.T, (u2 * s2) @ v2.T)
+    assert sorted(map(tuple, np.array(qnl1))) == sorted(map(tuple, np.array(qnl2)))
+
+
+@pytest.mark.parametrize("m_trunc", [3, lambda s: int(np.sum(s > s[0] * 0.8))])
+def test_svd_qn_truncate(m_trunc):
+    mps = Mps.random(holstein_model, 1, 10)
+    idx = len(mps) // 2
+    mps.move_qnidx(idx)
+    qnbigl, qnbigr, _ = mps._get_big_qn([idx])
+    dense = mps[idx].array
+    u1, s1, qnl1, v1, _, qnr1 = svd_qn(dense, qnbigl, qnbigr, mps.qntot, full_matrices=False)
+    u2, s2, qnl2, v2, _, qnr2 = svd_qn(dense, qnbigl, qnbigr, mps.qntot, full_matrices=False, m_trunc=m_trunc)
+    m = m_trunc if isinstance(m_trunc, int) else m_trunc(s1)
+    assert m < len(s1)
+    # only the kept singular vectors are formed
+    assert u2.shape == (u1.shape[0], m) and v2.shape == (v1.shape[0], m)
+    assert np.allclose(s2, s1[:m])
+    assert np.allclose((u2 * s2) @ v2.T, (u1[:, :m] * s1[:m]) @ v1[:, :m].T)
+    assert qnl2 == qnl1[:m] and qnr2 == qnr1[:m]
+
+
+@pytest.mark.parametrize("decay", [True, False])
+def test_svd_qn_randomized(decay):
+    # two quantum number sectors of size 200 x 150
+    qnbigl = np.array([[0], [1]] * 200)
+    qnbigr = np.array([[0], [-1]] * 150)
+    a = np.zeros((400, 300))
+    for qn in [0, 1]:
+        u = np.linalg.qr(np.random.rand(200, 100))[0]
+        v = np.linalg.qr(np.random.rand(150, 100))[0]
+        s = np.exp(-np.arange(100) / 2) if decay else 1 - np.arange(100) / 1000
+        a[np.ix_(np.arange(qn, 400, 2), np.arange(qn, 300, 2))] = (u * s) @ v.T
+    u1, s1, qnl1, v1, _, qnr1 = svd_qn(a, qnbigl, qnbigr, np.array([0]), full_matrices=False, m_trunc=10)
+    u2, s2, qnl2, v2, _, qnr2 = svd_qn(a, qnbigl, qnbigr, np.array([0]), full_matrices=False, m_trunc=10, rank=10)
+    assert u2.shape == (400, 10)
+    assert np.allclose(s1, s2)
+    assert np.allclose((u1 * s1) @ v1.T, (u2 * s2) @ v2.T)
+    assert sorted(map(tuple, qnl1)) == sorted(map(tuple, qnl2))
+
+
+def test_randomized_svd_rng():
+    a = np.random.rand(300, 200)
+    state = np.random.get_state()
+    u1, s1, vt1 = randomized_svd(a, 10)
+    # the global random state is not consumed
+    assert np.array_equal(np.random.get_state()[1], state[1])
+    # reproducible
+    u2, s2, vt2 = randomized_svd(a, 10)
+    assert np.array_equal(s1, s2) and np.array_equal(u1, u2)
+
+
+@pytest.mark.parametrize("criteria, randomized", [("fixed", True), ("both", False), ("threshold", False)])
+def test_randomized_criteria(criteria, randomized):
+    config = CompressConfig(criteria, svd_method="randomized", max_bonddim=10)
+    config.set_bonddim(5)
+    # the threshold criteria requires all singular values, so the number to keep is not known in advance
+    assert (config.max_m_trunc(1, True) is not None) == randomized
@@ -2,6 +2,7 @@
 # Author: Jiajun Ren <jiajunren0522@gmail.com>
 
 import logging
+import os
 
 import qutip
 import pytest
@@ -9,7 +10,8 @@ import numpy as np
 
 from renormalizer.model import Model
 from renormalizer.mps.backend import backend
-from renormalizer.mps import Mps, Mpo, MpDm
+from renormalizer.mps import Mps, Mpo, MpDm, evolve_ensemble
+from renormalizer.mps.mps import _default_ensemble_threads, _lockstep
 from renormalizer.utils import EvolveMethod, EvolveConfig, CompressConfig, CompressCriteria, Quantity, OFS
 from renormalizer.tests.parameter_exact import qutip_clist, qutip_h, model
 
@@ -109,6 +111,43 @@ def test_tdvp_vmf(init_state, with_mu, force_ovlp, atol):
     check_result(mps, mpo, 0.5, 2, atol)
 
 
+@pytest.mark.parametrize("with_mu", (True, False))
+def test_tdvp_vmf_threads(with_mu):
+    method = EvolveMethod.tdvp_mu_vmf if with_mu else EvolveMethod.tdvp_vmf
+    mps_list = []
+    for n_threads in [1, 4]:
+        mps = init_mps.copy()
+        mps.evolve_config = EvolveConfig(method, ivp_rtol=1e-4, ivp_atol=1e-7)
+        mps.evolve_config.vmf_auto_switch = False
+        mps.evolve_config.vmf_n_threads = n_threads
+        mps_list.append(mps.evolve(mpo, 0.5))
+    assert np.allclose(mps_list[0].todense(), mps_list[1].todense())
+
+
+@pytest.mark.parametrize("method", (EvolveMethod.prop_and_compress, EvolveMethod.tdvp_ps, EvolveMethod.tdvp_ps2))
+@pytest.mark.parametrize("n_threads", (None, 3))
+def test_evolve_ensemble(method, n_threads):
+    members = []
+    for init_state in [init_mps, init_mpdm, init_mps.scale(1j)]:
+        mps = init_state.copy()
+        mps.evolve_config = EvolveConfig(method)
+        members.append(mps)
+    assert _lockstep(members, 0.4) == (method == EvolveMethod.tdvp_ps)
+    # duplicated members are evolved only once
+    evolved = evolve_ensemble(members + members[:1], mpo, 0.4, n_threads=n_threads)
+    assert evolved[0] is evolved[-1]
+    for mps, new_mps in zip(members, evolved):
+        assert np.allclose(mps.evolve(mpo, 0.4).todense(), new_mps.todense())
+
+
+def test_ensemble_threads(monkeypatch):
+    # serial by default to avoid oversubscribing the cores with the BLAS threads
+    monkeypatch.delenv("RENO_NUM_THREADS", raising=False)
+    assert _default_ensemble_threads() == 1
+    monkeypatch.setenv("RENO_NUM_THREADS", "1")
+    assert _default_ensemble_threads() == os.cpu_count()
+
+
 @pytest.mark.parametrize("init_state", (init_mps, init_mpdm))
 @pytest.mark.parametrize("tdvp_cmf_c_trapz", (True, False))
 @pytest.mark.parametrize("solver", ("krylov", "RK45"))
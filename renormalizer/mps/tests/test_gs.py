@@ -10,6 +10,8 @@ from renormalizer.model import Model, h_qc
 from renormalizer.mps.backend import primme
 from renormalizer.mps.gs import construct_mps_mpo, optimize_mps, DmrgFCISolver
 from renormalizer.mps import Mpo, Mps, StackedMpo
+from renormalizer.mps.hop_expr import hop_expr
+from renormalizer.mps.lib import Environ
 from renormalizer.tests.parameter import holstein_model
 from renormalizer.utils.configs import OFS
 from renormalizer.mps.tests import cur_dir
@@ -37,6 +39,51 @@ def test_optimization(scheme, method):
     assert mps_opt.expectation(mpo) == pytest.approx(GS_E, rel=1e-5)
 
 
+@pytest.mark.parametrize("method", (
+        "1site",
+        "2site",
+))
+def test_mixed_precision(method):
+    mps, mpo = construct_mps_mpo(holstein_model, procedure[0][0], nexciton)
+    mps.optimize_config.procedure = procedure + [[40, 0]]
+    mps.optimize_config.method = method
+    mps.optimize_config.precision = ["float32"] * 3 + ["float64"] * 3
+    energies, mps_opt = optimize_mps(mps.copy(), mpo)
+    assert energies[-1] == pytest.approx(GS_E, rel=1e-5)
+    assert mps_opt.expectation(mpo) == pytest.approx(GS_E, rel=1e-5)
+    # promoted to the precision of the backend
+    assert mps_opt.dtype == mps.dtype
+    assert mpo.dtype == mps.dtype
+
+
+@pytest.mark.parametrize("method", (
+        "1site",
+        "2site",
+))
+def test_sparse_mpo(method):
+    mps, mpo = construct_mps_mpo(holstein_model, procedure[0][0], nexciton)
+    mps.optimize_config.procedure = procedure
+    mps.optimize_config.method = method
+    mps.optimize_config.sparse_mpo = True
+    energies, mps_opt = optimize_mps(mps.copy(), mpo)
+    assert energies[-1] == pytest.approx(GS_E, rel=1e-5)
+    assert mps_opt.expectation(mpo) == pytest.approx(GS_E, rel=1e-5)
+
+
+@pytest.mark.parametrize("method", (
+        "1site",
+        "2site",
+))
+def test_block_sparse(method):
+    mps, mpo = construct_mps_mpo(holstein_model, procedure[0][0], nexciton)
+    mps.optimize_config.procedure = procedure
+    mps.optimize_config.method = method
+    mps.optimize_config.block_sparse = True
+    energies, mps_opt = optimize_mps(mps.copy(), mpo)
+    assert energies[-1] == pytest.approx(GS_E, rel=1e-5)
+    assert mps_opt.expectation(mpo) == pytest.approx(GS_E, rel=1e-5)
+
+
 @pytest.mark.parametrize("method", (
         "1site",
         "2site",
@@ -60,6 +107,27 @@ def test_multistate(method, algo):
     assert np.allclose(expectation, energy_std)
 
 
+@pytest.mark.parametrize("nsite", (0, 1, 2))
+@pytest.mark.parametrize("sparse", (False, True))
+def test_batch_hop(nsite, sparse):
+    mps = Mps.random(holstein_model, 1, 10)
+    mpo = Mpo(holstein_model)
+    environ = Environ(mps, mpo, "R")
+    idx = 1
+    ltensor = environ.GetLR("L", idx - 1, mps, mpo)
+    rtensor = environ.read("R", idx + nsite)
+    if sparse:
+        cmo = [mpo.to_sparse(i) for i in range(idx, idx + nsite)]
+    else:
+        cmo = [mpo[i].array for i in range(idx, idx + nsite)]
+    cshape = (mps[idx].shape[0],) + tuple(mpo.pbond_list[idx:idx+nsite]) + (mps[idx+nsite-1].shape[-1],)
+    hop = hop_expr(ltensor, rtensor, list(cmo), cshape)
+    batch_hop = hop_expr(ltensor, rtensor, list(cmo), cshape, batch=True)
+    c = np.random.rand(*cshape, 3)
+    std = np.stack([hop(c[..., i]) for i in range(3)], axis=-1)
+    assert np.allclose(batch_hop(c), std)
+
+
 @pytest.mark.parametrize("method", (
         "1site",
         "2site",
@@ -11,7 +11,8 @@ from renormalizer.mps.lib import Environ
 from renormalizer.tests.parameter import custom_model, holstein_model
 from renormalizer.utils import CompressCriteria
 
-def test_save_load():
+@pytest.mark.parametrize("fmt", ["npz", "dir"])
+def test_save_load(tmp_path, fmt):
     model = holstein_model
     mps = Mpo.onsite(model, r"a^\dagger", dof_set={0}) @ Mps.ground_state(model, False)
     mpo = Mpo(model)
@@ -19,12 +20,39 @@ def test_save_load():
     for i in range(2):
         mps1 = mps1.evolve(mpo, 10)
     mps2 = mps.evolve(mpo, 10)
-    fname = "test.npz"
-    mps2.dump(fname)
-    mps2 = Mps.load(model, fname)
-    mps2 = mps2.evolve(mpo, 10)
-    assert np.allclose(mps1.e_occupations, mps2.e_occupations)
-    os.remove(fname)
+    fname = str(tmp_path / f"test.{fmt}")
+    if fmt == "npz":
+        mps2.dump(fname)
+    else:
+        mps2.dump(fname, fmt=fmt)
+    mps3 = Mps.load(model, fname)
+    if fmt == "dir":
+        # the matrices are memory-mapped
+        assert all(isinstance(mt.array.base, np.memmap) for mt in mps3._mp)
+        assert np.allclose(mps3.calc_1site_rdm()[0], mps2.calc_1site_rdm()[0])
+        # dump to the same place
+        mps3.dump(fname, fmt=fmt)
+        mps3 = Mps.load(model, fname)
+    assert mps3.coeff == mps2.coeff
+    mps3 = mps3.evolve(mpo, 10)
+    assert np.allclose(mps1.e_occupations, mps3.e_occupations)
+
+
+def test_dump_dir_overwrite(tmp_path):
+    # dumping to the directory doesn't change the matrix products loaded from it
+    model = holstein_model
+    fname = str(tmp_path / "test.dir")
+    Mps.random(model, 1, 10).dump(fname, fmt="dir")
+    a = Mps.load(model, fname)
+    a0 = a[0].array.copy()
+    b = a.copy()
+    b[0] = np.random.rand(*a0.shape)
+    b.dump(fname, fmt="dir")
+    assert np.allclose(a[0].array, a0)
+    assert np.allclose(Mps.load(model, fname)[0].array, b[0].array)
+    # inplace update doesn't change the file
+    a[0].array[:] = 0
+    assert np.allclose(Mps.load(model, fname)[0].array, b[0].array)
 
 
 def check_distance(a: Mps, b: Mps):
@@ -59,6 +87,26 @@ def test_environ():
         e = complex(tensordot(l, r, axes=((0, 1, 2), (0, 1, 2)))).real
         assert pytest.approx(e) == mps.expectation(mpo)
 
+
+def test_environ_mem_limit():
+    mps = Mps.random(holstein_model, 1, 10)
+    mpo = Mpo(holstein_model)
+    mps = mps.evolve(mpo, 10)
+    environ = Environ(mps, mpo)
+    mps.compress_config.environ_mem_limit = 1
+    environ_dump = Environ(mps, mpo)
+    store = environ_dump._virtual_disk
+    # only the most recently used environment is kept in memory
+    assert store.nbytes <= max(environ.read("R", i).nbytes for i in range(1, len(mps)))
+    dump_dir = store._dir_with_id
+    assert len(os.listdir(dump_dir)) == len(store.keys()) - 1
+    for i in range(len(mps)-1):
+        environ_dump.prefetch("R", i+1)
+        assert np.allclose(environ_dump.read("L", i), environ.read("L", i))
+        assert np.allclose(environ_dump.read("R", i+1), environ.read("R", i+1))
+    del environ_dump, store
+    assert not os.path.exists(dump_dir)
+
 # multi_mpo routine for single mpo calculation
 @pytest.mark.parametrize("mpdm", (True, False))
 def test_environ_multi_mpo(mpdm):
@@ -83,7 +131,8 @@ def test_environ_multi_mpo(mpdm):
         "mpdm",
         "mpo",
 ))
-def test_svd_compress(comp, mp):
+@pytest.mark.parametrize("algo", ("svd", "zipup", "density_matrix"))
+def test_svd_compress(comp, mp, algo):
     
     if mp == "mpo":
         mps = Mpo(holstein_model)
@@ -107,7 +156,7 @@ def test_svd_compress(comp, mp):
     print(f"std_mps: {std_mps}")
     mps.compress_config.bond_dim_max_value = M
     mps.compress_config.criteria = CompressCriteria.fixed
-    svd_mps = mpo.contract(mps)
+    svd_mps = mpo.contract(mps, algo)
     dis = svd_mps.distance(std_mps)/std_mps.mp_norm
     print(f"svd_mps: {svd_mps}, dis: {dis}")
     assert np.allclose(dis, 0.0, atol=1e-3)
@@ -8,7 +8,7 @@ import pickle
 import numpy as np
 import pytest
 
-from renormalizer.model import Mol, Phonon, HolsteinModel, Model, Op
+from renormalizer.model import Mol, Phonon, HolsteinModel, Model, Op, h_qc
 from renormalizer.model.basis import BasisHalfSpin
 from renormalizer.mps import Mpo, Mps
 from renormalizer.mps.tests import cur_dir
@@ -41,6 +41,28 @@ def test_symbolic_mpo(nsites, nterms, algo):
     assert np.allclose(dense_mpo, qutip_ham.data.todense())
 
 
+@pytest.mark.parametrize("algo", ["Hopcroft-Karp", "qr"])
+@pytest.mark.parametrize("conserve_qn", [True, False])
+def test_qc_table(algo, conserve_qn):
+    spatial_norbs = 6
+    h1e, h2e, nuc = h_qc.read_fcidump(os.path.join(cur_dir, "H6.txt"), spatial_norbs)
+    basis, ham_terms = h_qc.qc_model(h1e, h2e, conserve_qn=conserve_qn)
+    mpo1 = Mpo(Model(basis, ham_terms), algo=algo)
+    basis, table, primary_ops, factor = h_qc.qc_table(h1e, h2e, conserve_qn=conserve_qn)
+    assert len(table) == len(ham_terms)
+    mpo2 = Mpo.from_table(Model(basis, []), table, primary_ops, factor, algo=algo)
+    assert mpo1.bond_dims == mpo2.bond_dims
+    assert np.allclose(mpo1.qntot, mpo2.qntot)
+    assert np.allclose(mpo1.todense(), mpo2.todense())
+
+
+def test_qc_table_empty():
+    norbs = 4
+    basis, table, primary_ops, factor = h_qc.qc_table(np.zeros((norbs, norbs)), np.zeros([norbs] * 4))
+    assert table.shape == (0, norbs)
+    assert factor.shape == (0,)
+
+
 @pytest.mark.parametrize("algo", ["qr", "Hopcroft-Karp"])
 def test_swap_symbolic_mpo(algo):
     if algo == "qr":
@@ -7,6 +7,7 @@ from renormalizer.model import Model
 from renormalizer.model.basis import BasisSHO, BasisMultiElectronVac, BasisMultiElectron, BasisSimpleElectron
 from renormalizer.model.op import Op
 from renormalizer.mps import Mps, Mpo
+from renormalizer.mps.observable_plan import ObservablePlan
 from renormalizer.tests import parameter
 
 
@@ -43,6 +44,22 @@ def test_expectations(mpos):
     assert np.allclose(e1, e2)
 
 
+def test_observable_plan():
+    model = parameter.holstein_model
+    mpos = [Mpo(model, Op("n", dof)) for dof in model.v_dofs] \
+        + [Mpo(model, Op(r"a^\dagger a", [dof1, dof2])) for dof1 in model.e_dofs for dof2 in model.e_dofs]
+    plan = ObservablePlan(model, mpos)
+    # much cheaper than calculating the MPOs one by one
+    assert plan.n_contractions < len(mpos) * len(model.basis) / 2
+    for i in range(2):
+        mps = Mps.random(model, 1, 20)
+        e1 = mps.expectations(plan)
+        e2 = mps.expectations(mpos, opt=False)
+        assert np.allclose(e1, e2)
+    # no observables
+    assert len(ObservablePlan(model, []).evaluate(mps)) == 0
+
+
 def check_reduced_density_matrix(basis):
     model = Model(basis, [])
     mps = Mps.random(model, 1, 20)
@@ -86,6 +103,31 @@ def test_site_entropy():
             (entropy_1site[0]+entropy_1site[1]-entropy_2site[(0,1)])/2)
 
 
+def test_2site_rdm_subset():
+    mps = Mps.random(parameter.holstein_model, 1, 20)
+    mps.canonicalise().normalize("mps_only")
+    rdm = mps.calc_2site_rdm()
+    nsite = mps.site_num
+    assert len(rdm) == nsite * (nsite - 1) // 2
+    # sweep order
+    assert list(rdm.keys()) == sorted(rdm.keys())
+    rdm_near = mps.calc_2site_rdm(max_distance=2)
+    assert set(rdm_near.keys()) == {(i, j) for (i, j) in rdm if j - i <= 2}
+    pairs = [(3, 1), (0, nsite-1), (2, 4)]
+    rdm_pairs = mps.calc_2site_rdm(pairs)
+    assert set(rdm_pairs.keys()) == {(1, 3), (0, nsite-1), (2, 4)}
+    for key, dm in list(rdm_near.items()) + list(rdm_pairs.items()):
+        assert np.allclose(dm, rdm[key])
+
+    mutual = mps.calc_2site_mutual_entropy()
+    mutual_near = mps.calc_2site_mutual_entropy(max_distance=2, batch_size=3)
+    mask = np.abs(np.subtract.outer(np.arange(nsite), np.arange(nsite))) <= 2
+    assert np.allclose(mutual_near, np.where(mask, mutual, 0))
+    mutual_pairs = mps.calc_2site_mutual_entropy(pairs)
+    assert np.allclose(mutual_pairs[1, 3], mutual[3, 1])
+    assert np.allclose(mutual_pairs[0, 1], 0)
+
+
 def test_load_from_dense_wfn():
     model = Model(basis=[BasisSimpleElectron(i) for i in range(5)], ham_terms=[])
     ref_mps = Mps.random(model, 1, 20)
@@ -1,7 +1,7 @@
 from unittest.mock import patch
 import pytest
 
-from renormalizer.mps.oe_contract_wrap import oe_contract, oe_contract_expression
+from renormalizer.mps.oe_contract_wrap import oe_contract, oe_contract_expression, path_cache
 from renormalizer.mps.backend import np, MEMORY_ERRORS
 
 
@@ -42,3 +42,32 @@ def test_oe_contract_expression():
             "Expected message not found in logger.fatal calls"
         )
 
+
+
+def test_path_cache():
+    path_cache.clear()
+    a = np.random.rand(3, 4)
+    b = np.random.rand(4, 5)
+    c = np.random.rand(5, 3)
+    for i in range(3):
+        res = oe_contract("ab, bc, ca ->", a, b, c)
+        assert np.allclose(res, np.trace(a @ b @ c))
+    assert path_cache.misses == 1
+    assert path_cache.hits == 2
+    # interleaved format
+    res = oe_contract(a, [(0, 0), (0, 1)], b, [(0, 1), (0, 2)], [(0, 0), (0, 2)])
+    assert np.allclose(res, a @ b)
+    assert path_cache.misses == 2
+    # contraction expressions with and without constants
+    for i in range(2):
+        expr = oe_contract_expression("ab, bc, ca ->", a, b, c.shape, constants=[0, 1])
+        assert np.allclose(expr(c), np.trace(a @ b @ c))
+        expr = oe_contract_expression("ab, bc, ca ->", a.shape, b.shape, c.shape)
+        assert np.allclose(expr(a, b, c), np.trace(a @ b @ c))
+    assert path_cache.misses == 4
+    assert path_cache.hits == 4
+
+    path_cache.maxsize = 1
+    oe_contract("ab, bc ->", a, b)
+    assert len(path_cache) == 1
+    path_cache.maxsize = 4096
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from renormalizer.mps import Mps, Mpo, MpDm
+from renormalizer.mps.hop_expr import hop_expr
+from renormalizer.mps.lib import Environ
+from renormalizer.mps.sparse_mo import SparseMo, _classify
+from renormalizer.mps.symbolic_mpo import symbolic_mo_to_numeric_mo
+from renormalizer.tests.parameter import holstein_model
+
+
+def test_construct():
+    mpo = Mpo(holstein_model)
+    for impo, mo in enumerate(mpo.symbolic_mpo):
+        basis = holstein_model.basis[impo]
+        sparse_mo = SparseMo.from_symbolic(basis, mo, mpo.dtype)
+        dense = symbolic_mo_to_numeric_mo(basis, mo, mpo.dtype)
+        assert np.allclose(sparse_mo.todense(), dense)
+        sparse_mo2 = mpo.to_sparse(impo)
+        assert np.allclose(sparse_mo2.todense(), dense)
+        assert sparse_mo2.n_entries == sparse_mo.n_entries <= np.prod(mo.shape)
+        assert mpo.to_sparse(impo) is sparse_mo2
+    n_entries = sum(mpo.to_sparse(i).n_entries for i in range(len(mpo)))
+    assert n_entries < sum(np.prod(mo.shape) for mo in mpo.symbolic_mpo)
+    # the identities are recognized
+    assert "identity" in mpo.to_sparse(0).flag_count
+
+
+def test_classify():
+    mat = np.diag([1e5, 1e5 + 0.9, 1e5 + 0.5])
+    flag, op = _classify(mat, 0)
+    assert flag == "diagonal"
+    assert np.allclose(op, np.diag(mat), rtol=0, atol=0)
+    flag, op = _classify(np.eye(3) * 1e5, 0)
+    assert flag == "identity"
+    assert op == 1e5
+    sparse_mo = SparseMo.from_dense(mat.reshape(1, 3, 3, 1))
+    assert np.array_equal(sparse_mo.todense(), mat.reshape(1, 3, 3, 1))
+    assert np.array_equal(sparse_mo.diagonal(), np.einsum("abbc -> abc", sparse_mo.todense()))
+
+
+def test_to_sparse_modified():
+    mpo = Mpo(holstein_model)
+    sparse_mo = mpo.to_sparse(1)
+    mpo[1] = mpo[1].array * 2
+    sparse_mo2 = mpo.to_sparse(1)
+    assert sparse_mo2 is not sparse_mo
+    assert np.allclose(sparse_mo2.todense(), 2 * sparse_mo.todense())
+
+
+@pytest.mark.parametrize("mpdm", [False, True])
+@pytest.mark.parametrize("domain", ["L", "R"])
+def test_environ(mpdm, domain):
+    if mpdm:
+        mps = MpDm.max_entangled_gs(holstein_model)
+    else:
+        mps = Mps.random(holstein_model, 1, 10)
+    mpo = Mpo(holstein_model)
+    environ = Environ(mps, mpo, domain)
+    sparse_environ = Environ(mps, mpo, domain, sparse_mpo=True)
+    for i in range(1, len(mps) - 1):
+        assert np.allclose(sparse_environ.read(domain, i), environ.read(domain, i))
+
+
+def test_hop():
+    mps = Mps.random(holstein_model, 1, 10)
+    mpo = Mpo(holstein_model)
+    environ = Environ(mps, mpo, "R")
+    idx = 1
+    ltensor = environ.GetLR("L", idx - 1, mps, mpo)
+    rtensor = environ.read("R", idx + 1)
+    shape = mps[idx].shape
+    sparse_hop = hop_expr(ltensor, rtensor, [mpo.to_sparse(idx)], shape)
+    dense_hop = hop_expr(ltensor, rtensor, [mpo[idx].array], shape)
+    assert np.allclose(sparse_hop(mps[idx].array), dense_hop(mps[idx].array))
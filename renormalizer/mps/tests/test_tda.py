@@ -115,3 +115,39 @@ def test_tda():
 
 
 
+
+
+def test_tangent_space_hop():
+    from renormalizer.tests.parameter import holstein_model
+    from renormalizer.mps.tda import TangentSpace
+
+    model = holstein_model
+    mpo = Mpo(model)
+    mps = Mps.random(model, 1, 5)
+    mps.optimize_config.procedure = [[5, 0.4], [5, 0.2], [5, 0]]
+    mps.optimize_config.method = "2site"
+    energies, mps = gs.optimize_mps(mps, mpo)
+    tda = TDA(model, mpo, mps, nroots=1, algo="davidson")
+    tda.kernel()
+    tangent_space = tda.tangent_space
+    assert isinstance(tangent_space, TangentSpace)
+
+    x = np.random.rand(tangent_space.xsize) - 0.5
+    y = np.random.rand(tangent_space.xsize) - 0.5
+    x_coeff = tangent_space.reshape_x(x)
+    y_coeff = tangent_space.reshape_x(y)
+    # the brute force <Y|H|X> with the mixed-canonical mps of each tangent site
+    std = 0
+    for i, coeff_i in enumerate(x_coeff):
+        if coeff_i is None:
+            continue
+        mps_i = tangent_space.tangent_mps(i, coeff_i)
+        for j, coeff_j in enumerate(y_coeff):
+            if coeff_j is None:
+                continue
+            std += mps_i.expectation(mpo, self_conj=tangent_space.tangent_mps(j, coeff_j))
+    assert np.allclose(y @ tangent_space.hop(x), std)
+
+    hmat = np.array([tangent_space.hop(e) for e in np.eye(tangent_space.xsize)])
+    assert np.allclose(hmat, hmat.T)
+    assert np.allclose(np.diag(hmat), tangent_space.hdiag())
@@ -154,7 +154,8 @@ def load_thermal_state(model, path: str):
 
     Args:
         model (:class:`MolList`): system information
-        path (str): the path to load thermal state from. Should be an numpy ``.npz`` file.
+        path (str): the path to load thermal state from. Should be an numpy ``.npz`` file
+            or a directory dumped with ``fmt="dir"``, in which case the matrices are memory-mapped.
     Returns: Loaded MpDm
     """
     try:
@@ -1,5 +1,6 @@
 from typing import Union, List, Dict
 from renormalizer.mps import Mpo, Mps, MpDm
+from renormalizer.mps.observable_plan import ObservablePlan
 
 class Property():
     '''
@@ -23,6 +24,14 @@ class Property():
         for prop_str in prop_strs:
             self.prop_res[prop_str] = []
 
+        # compiled plans of the list of mpos, reused at every time step
+        self.prop_plans: Dict[str, ObservablePlan] = {}
+
+    def get_plan(self, prop_str, model):
+        if prop_str not in self.prop_plans:
+            self.prop_plans[prop_str] = ObservablePlan(model, self.prop_mpos[prop_str])
+        return self.prop_plans[prop_str]
+
 
     def calc_properties_braketpair(self, mps):
         bra, ket = mps.bra_mps, mps.ket_mps
@@ -36,8 +45,9 @@ class Property():
                     res.append(ket.expectation(mpo, None))
                 elif isinstance(mpo, list):
                     # mpos
-                    res.append(bra.expectations(mpo))
-                    res.append(ket.expectations(mpo))
+                    plan = self.get_plan(prop_str, ket.model)
+                    res.append(bra.expectations(plan))
+                    res.append(ket.expectations(plan))
 
                 self.prop_res[prop_str].append(res)
             else:
@@ -68,7 +78,8 @@ class Property():
                 elif isinstance(mpo, list):
                     # mpos
                     assert mps_conj is None
-                    self.prop_res[prop_str].append(mps.expectations(mpo))
+                    plan = self.get_plan(prop_str, mps.model)
+                    self.prop_res[prop_str].append(mps.expectations(plan))
                 else:
                     assert False
             else:
@@ -6,9 +6,10 @@ import scipy
 
 from renormalizer.lib import davidson
 from renormalizer.mps.backend import primme, IMPORT_PRIMME_EXCEPTION, np
+from renormalizer.mps.block_sparse import BlockSparseTensor
 from renormalizer.mps.matrix import asnumpy, asxp
 from renormalizer.tn.node import TreeNodeTensor
-from renormalizer.tn.tree import TTNS, TTNO, TTNEnviron
+from renormalizer.tn.tree import TTNS, TTNO, TTNEnviron, environ_executor
 from renormalizer.tn.hop_expr import hop_expr2
 
 
@@ -18,7 +19,8 @@ logger = logging.getLogger(__name__)
 def optimize_ttns(ttns: TTNS, ttno: TTNO, procedure=None):
     if procedure is None:
         procedure = ttns.optimize_config.procedure
-    ttne = TTNEnviron(ttns, ttno)
+    with environ_executor(ttns.optimize_config.environ_n_threads) as executor:
+        ttne = TTNEnviron(ttns, ttno, executor=executor, block_sparse=ttns.block_sparse)
     e_list = []
     for m, percent in procedure:
         # todo: better converge condition
@@ -58,6 +60,8 @@ def optimize_recursion(
 
 
 def optimize_2site(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron):
+    if ttne.block_sparse:
+        return optimize_2site_block_sparse(snode, ttns, ttno, ttne)
     cguess = ttns.merge_with_parent(snode)
     qn_mask = ttns.get_qnmask(snode, include_parent=True)
     cguess = cguess[qn_mask].ravel()
@@ -76,6 +80,23 @@ def optimize_2site(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnvir
     return e, c
 
 
+def optimize_2site_block_sparse(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron):
+    # the vector is the concatenation of the blocks allowed by the symmetry
+    cguess = ttns.merge_with_parent(snode)
+    template = BlockSparseTensor.zeros(cguess.qns, cguess.signs, cguess.qntot)
+    # hdiag is computed blockwise
+    expr, hdiag = hop_expr2(snode, ttns, ttno, ttne)
+
+    def hop(x):
+        return expr(template.from_vector(x)).to_vector(template)
+
+    assert ttns.optimize_config.nroots == 1
+    algo: str = ttns.optimize_config.algo
+    e, c = eigh_iterative(hop, hdiag.to_vector(template), cguess.to_vector(template), algo)
+    c = template.from_vector(c)
+    return e, c
+
+
 def eigh_iterative(hop, hdiag, cguess, algo):
     hdiag = asnumpy(hdiag)
     cguess = asnumpy(cguess)
@@ -1,17 +1,22 @@
 import opt_einsum as oe
 
 from renormalizer.mps.backend import np
+from renormalizer.mps import block_sparse
+from renormalizer.mps.block_sparse import BlockSparseTensor
 from renormalizer.mps.matrix import asxp
 from renormalizer.mps.oe_contract_wrap import oe_contract, oe_contract_expression
 from renormalizer.tn.node import TreeNodeTensor
 from renormalizer.tn.tree import TTNS, TTNO, TTNEnviron
 
 
-def hop_expr0(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron):
+def hop_expr0(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron, return_template=False):
     # zero site, used in tdvp time evolution
-    # assuming the first index connects child and the second index connects parent
+    # assuming the first index connects child and the second index connects parent.
+    # If ``return_template`` is set, also return the block structure of the coefficient
+    # for the block sparse environments
     # #--------o---------#
     # child--coeff--parent
+    ttne.ensure_1bond(snode, ttns, ttno)
     enode = ttne.node_list[ttns.node_idx[snode]]
 
     args = []
@@ -38,13 +43,25 @@ def hop_expr0(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron):
     input_indices.append(indices[2])
     args.append(indices)
 
-    expr = _contract_expression(args, shape, input_indices, output_indices)
+    if ttne.block_sparse:
+        # the legs of the coefficient are contracted with the ket legs of the environments
+        environs = [args[0], args[2]]
+        qns = [environ.qns[2] for environ in environs]
+        signs = [-environ.signs[2] for environ in environs]
+        x_template = BlockSparseTensor.zeros(qns, signs, environs[0].qntot)
+    else:
+        x_template = None
+    expr = _contract_expression(args, shape, input_indices, output_indices, x_template)
 
-    return expr
+    if not return_template:
+        return expr
+    else:
+        return expr, x_template
 
 
 def hop_expr1(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron, return_hdiag=False):
     # build one site effective hamiltonian operator as an opt_einsum expression
+    ttne.ensure_1site(snode, ttns, ttno)
     enode = ttne.node_list[ttns.node_idx[snode]]
     onode = ttno.node_list[ttns.node_idx[snode]]
 
@@ -57,25 +74,31 @@ def hop_expr1(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron, r
     args.append(enode.environ_parent)
     args.append(ttne.get_parent_indices(enode, ttns, ttno))
     # operator
-    args.extend([onode.tensor, ttno.get_node_indices(onode)])
+    args.extend([_op_tensor(onode, ttno, ttne), ttno.get_node_indices(onode)])
 
     # input and output
     input_indices = ttns.get_node_indices(snode, ttno=ttno)
     output_indices = ttns.get_node_indices(snode, conj=True)
 
     shape = snode.shape
+    if ttne.block_sparse:
+        x = ttns.to_block_sparse(snode)
+        x_template = BlockSparseTensor.zeros(x.qns, x.signs, x.qntot)
+    else:
+        x_template = None
     # cache the contraction path
-    expr = _contract_expression(args, shape, input_indices, output_indices)
+    expr = _contract_expression(args, shape, input_indices, output_indices, x_template)
     if not return_hdiag:
         return expr
     else:
-        hdiag = _get_hdiag(args, input_indices)
+        hdiag = _get_hdiag(args, input_indices, x_template)
         return expr, hdiag
 
 
 def hop_expr2(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron):
     # build two-site effective hamiltonian operator as an opt_einsum expression
     sparent = snode.parent
+    ttne.ensure_2site(snode, ttns, ttno)
     enode = ttne.node_list[ttns.node_idx[snode]]
     eparent = ttne.node_list[ttns.node_idx[sparent]]
     onode = ttno.node_list[ttns.node_idx[snode]]
@@ -99,8 +122,8 @@ def hop_expr2(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron):
     args.append(ttne.get_parent_indices(eparent, ttns, ttno))
 
     # operator
-    args.extend([oparent.tensor, ttno.get_node_indices(oparent)])
-    args.extend([onode.tensor, ttno.get_node_indices(onode)])
+    args.extend([_op_tensor(oparent, ttno, ttne), ttno.get_node_indices(oparent)])
+    args.extend([_op_tensor(onode, ttno, ttne), ttno.get_node_indices(onode)])
 
     # input and output
     input_indices = ttns.get_node_indices(snode, include_parent=True, ttno=ttno)
@@ -111,14 +134,31 @@ def hop_expr2(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron):
     shape_parent = list(snode.parent.shape)
     del shape_parent[snode.parent.children.index(snode)]
     shape += shape_parent
+    if ttne.block_sparse:
+        # the legs of snode and its parent except the bond in between
+        x1, x2 = ttns.to_block_sparse(snode), ttns.to_block_sparse(sparent)
+        ichild = snode.idx_as_child
+        qns = x1.qns[:-1] + x2.qns[:ichild] + x2.qns[ichild+1:]
+        signs = x1.signs[:-1] + x2.signs[:ichild] + x2.signs[ichild+1:]
+        x_template = BlockSparseTensor.zeros(qns, signs, x1.qntot)
+    else:
+        x_template = None
     # cache the contraction path
-    expr = _contract_expression(args, shape, input_indices, output_indices)
-    hdiag = _get_hdiag(args, input_indices)
+    expr = _contract_expression(args, shape, input_indices, output_indices, x_template)
+    hdiag = _get_hdiag(args, input_indices, x_template)
     return expr, hdiag
 
 
-def _contract_expression(args, x_shape, x_indices, y_indices):
+def _op_tensor(onode: TreeNodeTensor, ttno: TTNO, ttne: TTNEnviron):
+    if ttne.block_sparse:
+        return ttno.to_block_sparse(onode)
+    return onode.tensor
+
+
+def _contract_expression(args, x_shape, x_indices, y_indices, x_template=None):
     # contract_expression in interleaved format
+    if x_template is not None:
+        return _block_contract_expression(args, x_template, x_indices, y_indices)
     args_fake = args.copy()
     args_fake.extend([np.empty(x_shape), x_indices])
     args_fake.append(y_indices)
@@ -132,9 +172,21 @@ def _contract_expression(args, x_shape, x_indices, y_indices):
     return expr
 
 
-def _get_hdiag(args, input_indices):
+def _block_contract_expression(args, x_template, x_indices, y_indices):
+    # blockwise contraction. The coefficient is a BlockSparseTensor with the structure of ``x_template``
+    return block_sparse.contract_expression(
+        *args, x_template, x_indices, y_indices, constants=list(range(len(args) // 2))
+    )
+
+
+def _get_hdiag(args, input_indices, x_template=None):
+    # the diagonal elements. For the block sparse environments,
+    # the result is a BlockSparseTensor with the structure of ``x_template``
     new_args = []
     for arg in args:
+        if isinstance(arg, BlockSparseTensor):
+            new_args.append(arg)
+            continue
         if not isinstance(arg, (tuple, list)):
             # tensors
             new_args.append(asxp(arg))
@@ -151,4 +203,6 @@ def _get_hdiag(args, input_indices):
             pass
         new_args.append(tuple(arg))
     new_args.append(input_indices)
+    if x_template is not None:
+        return block_sparse.contract_into(x_template, *new_args)
     return oe_contract(*new_args)
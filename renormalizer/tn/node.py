@@ -2,6 +2,7 @@ from typing import List, Dict, Union, Sequence
 
 from renormalizer.mps.backend import np, backend
 from renormalizer.mps.matrix import asnumpy
+from renormalizer.mps.block_sparse import BlockSparseTensor
 from renormalizer.model.basis import BasisSet, BasisDummy
 
 
@@ -142,29 +143,89 @@ class TreeNodeTensor(TreeNode):
 
         Parameters
         ----------
-        tensor: The numerical tensor
+        tensor: The numerical tensor. Could be a ``BlockSparseTensor``, which is then
+            stored as the blocks without the dense array.
         qn: The quantum number from the tensor to its parent.
         """
         super().__init__()
-        self.tensor: np.ndarray = tensor
+        # the tensor is stored either as the dense array or as the symmetry blocks.
+        # If stored as the dense array, the blocked form is cached. See ``to_block_sparse``
+        self._tensor: np.ndarray = None
+        self._block_tensor: BlockSparseTensor = None
+        # increased whenever the dense array might be modified,
+        # including the in-place modification after accessing ``self.tensor``
+        self._version = 0
+        self._block_version = None
+        self.tensor = tensor
         self.qn: np.ndarray = qn
 
     def check_canonical(self, atol=None, assertion=True):
         if atol is None:
             atol = backend.canonical_atol
-        tensor = self.tensor.reshape(-1, self.tensor.shape[-1])
+        tensor = self.tensor.reshape(-1, self.shape[-1])
         s = tensor.conj().T @ tensor
         res = np.allclose(s, np.eye(s.shape[0]), atol=atol)
         if assertion:
             assert res
         return res
 
+    def to_block_sparse(self, qns: List[np.ndarray], signs: Sequence[int], keep_dense: bool = True) -> BlockSparseTensor:
+        """
+        The tensor as a ``BlockSparseTensor``.
+        If the tensor is stored as the dense array, the blocked form is cached
+        until the tensor is accessed or the quantum numbers of the legs are changed.
+
+        Parameters
+        ----------
+        qns: The quantum numbers of the legs.
+        signs: The directions of the legs.
+        keep_dense: Whether keep the dense array. If ``False``, the tensor is stored
+            as the blocks afterwards.
+        """
+        # the dense array is read before the blocks. The environments of the same level
+        # may be built in threads, and the dense array is dropped only after the blocks are set
+        tensor = self._tensor
+        block_tensor = self._block_tensor
+        stale = block_tensor is None or block_tensor.signs != tuple(signs) \
+            or any(not np.array_equal(np.reshape(qn, q.shape), q) for qn, q in zip(qns, block_tensor.qns)) \
+            or (tensor is not None and self._block_version != self._version)
+        if stale:
+            if tensor is not None:
+                dense = tensor
+            else:
+                dense = block_tensor.todense()
+            qntot = np.zeros(np.asarray(qns[-1]).reshape(len(qns[-1]), -1).shape[1], dtype=int)
+            block_tensor = BlockSparseTensor.from_dense(dense, qns, signs, qntot)
+            self._block_tensor = block_tensor
+            self._block_version = self._version
+        if not keep_dense:
+            self._tensor = None
+        return block_tensor
+
     @property
     def shape(self):
-        return self.tensor.shape
+        if self._tensor is None:
+            return self._block_tensor.shape
+        return self._tensor.shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        if self._tensor is None:
+            return self._block_tensor.dtype
+        return self._tensor.dtype
 
     @property
     def tensor(self):
+        if self._tensor is None:
+            # switch to the dense storage
+            self._tensor = self._block_tensor.todense()
+            self._block_tensor = None
+        # the array might be modified in place
+        self._version += 1
         return self._tensor
 
     @tensor.setter
@@ -173,7 +234,15 @@ class TreeNodeTensor(TreeNode):
             dtype = backend.complex_dtype
         else:
             dtype = backend.real_dtype
-        self._tensor = np.asarray(asnumpy(tensor), dtype=dtype)
+        if isinstance(tensor, BlockSparseTensor):
+            self._tensor = None
+            if tensor.dtype != dtype:
+                tensor = tensor.astype(dtype)
+            self._block_tensor = tensor
+        else:
+            self._tensor = np.asarray(asnumpy(tensor), dtype=dtype)
+            self._block_tensor = None
+        self._version += 1
 
     # alias
     array = tensor
@@ -187,7 +256,7 @@ class TreeNodeTensor(TreeNode):
         self._qn = np.array(qn)
 
     def __str__(self):
-        content = str(self.shape) + "," + str(self.tensor.dtype)
+        content = str(self.shape) + "," + str(self.dtype)
         return f"{self.__class__.__name__}({content})"
 
     def __repr__(self):
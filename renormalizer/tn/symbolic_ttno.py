@@ -2,11 +2,13 @@ from itertools import chain
 import logging
 from typing import List
 
+import scipy.sparse
+
 from renormalizer.mps.backend import np
 from renormalizer import Op, Model
 from renormalizer.model.basis import BasisSet
 from renormalizer.tn.treebase import BasisTree
-from renormalizer.mps.symbolic_mpo import _terms_to_table, _construct_symbolic_mpo_one_site, OpTuple
+from renormalizer.mps.symbolic_mpo import _terms_to_table, _construct_symbolic_mpo_one_site, _unique_rows, OpTuple
 
 
 logger = logging.getLogger(__name__)
@@ -52,46 +54,128 @@ def symbolic_mo_to_numeric_mo_general(basis_sets: List[BasisSet], mo, dtype):
     return np.moveaxis(mo_tensor, mo.ndim - 1, -1)
 
 
-def construct_symbolic_ttno(tn: BasisTree, terms: List[Op], const: float = 0, algo: str = "qr"):
+def numeric_mo_general(basis_sets: List[BasisSet], in_ops_list, out_ops, primary_ops, dtype, op_mat_cache=None):
+    """
+    The numerical matrix operator of one node, equivalent to
+    ``symbolic_mo_to_numeric_mo_general(basis_sets, compose_symbolic_mo_general(...), dtype)``
+    but without the composed symbolic operators.
+    The local operator matrices of the distinct combinations of the primary operators are computed once
+    and the entries are scatter-added by a sparse matrix product.
+    """
+    if op_mat_cache is None:
+        op_mat_cache = {}
+    k = len(basis_sets)
+    m = len(in_ops_list)
+    out_idx = []
+    symbols = []
+    factors = []
+    for iop, out_op in enumerate(out_ops):
+        for composed_op in out_op:
+            out_idx.append(iop)
+            symbols.append(composed_op.symbol)
+            factors.append(composed_op.factor)
+    out_idx = np.array(out_idx)
+    symbols = np.array(symbols, dtype=np.int64).reshape(len(out_idx), -1)
+    factors = np.array(factors)
+
+    virtual_shape = [len(in_ops) for in_ops in in_ops_list] + [len(out_ops)]
+    virtual_idx = np.ravel_multi_index(tuple(symbols[:, :m].T) + (out_idx,), virtual_shape)
+    local_symbols, local_idx = _unique_rows(symbols[:, -k:])
+
+    pdims = [b.nbas for b in basis_sets]
+    local_mats = np.empty((len(local_symbols), int(np.prod(pdims)) ** 2))
+    for i, local_symbol in enumerate(local_symbols):
+        mat = np.ones(1)
+        for j, (s, b) in enumerate(zip(local_symbol, basis_sets)):
+            if (j, s) not in op_mat_cache:
+                op_mat = b.op_mat(primary_ops[s])
+                assert not np.iscomplexobj(op_mat), "complex operator not supported yet"
+                op_mat_cache[(j, s)] = op_mat
+            mat = np.multiply.outer(mat, op_mat_cache[(j, s)])
+        local_mats[i] = mat.ravel()
+    assert not np.iscomplexobj(factors), "complex operator not supported yet"
+
+    # duplicated entries are summed
+    weights = scipy.sparse.coo_matrix(
+        (factors, (virtual_idx, local_idx)), shape=(int(np.prod(virtual_shape)), len(local_symbols))
+    ).tocsr()
+    shape = virtual_shape + list(chain(*[[pdim, pdim] for pdim in pdims]))
+    mo_tensor = np.asarray(weights @ local_mats, dtype=dtype).reshape(shape)
+    return np.moveaxis(mo_tensor, m, -1)
+
+
+def _suffix_ids(table):
+    # ``ids[p][i] == ids[p][j]`` if and only if ``table[i, p:] == table[j, p:]``.
+    # ``first[p]`` is a row with the id
+    ids = [None] * (table.shape[1] + 1)
+    first = [None] * (table.shape[1] + 1)
+    ids[-1] = np.zeros(len(table), dtype=np.int64)
+    first[-1] = np.zeros(1, dtype=np.int64)
+    for p in reversed(range(table.shape[1])):
+        key = table[:, p].astype(np.int64) * len(table) + ids[p + 1]
+        _, first[p], ids[p] = np.unique(key, return_index=True, return_inverse=True)
+        ids[p] = ids[p].ravel()
+    return ids, first
+
+
+def _construct_ttno_ops(tn: BasisTree, terms: List[Op], const: float = 0, algo: str = "qr"):
+    # the out operators of each node in postorder
     nodes = tn.postorder_list()
+    node_idx = {node: i for i, node in enumerate(nodes)}
     basis = list(chain(*[n.basis_sets for n in nodes]))
     model = Model(basis, [])
     qn_size = model.qn_size
     table, primary_ops, factor = _terms_to_table(model, terms, const)
+    # The columns of the primary operators for the nodes not yet visited are not copied at every node.
+    # Rather, each row keeps a representative row of the original table with the same remaining primary operators,
+    # and the remaining primary operators are identified by the suffix id in the decomposition.
+    suffix_ids, suffix_first = _suffix_ids(table)
+    max_uint16 = np.iinfo(np.uint16).max
+    assert len(table) < max_uint16 ** 2
+    rep = np.arange(len(table))
+    # the out operators of the visited subtrees that are not yet connected, the latest first
+    open_table = np.zeros((len(table), 0), dtype=np.uint16)
 
     dummy_in_ops = [[OpTuple([0], qn=np.zeros(qn_size, dtype=int), factor=1)]]
     out_ops: List[List[OpTuple]]
     out_ops_list = []
 
+    offset = 0
     for i, node in enumerate(nodes):
         k = node.n_sets
+        m = len(node.children)
+        site_table = table[rep, offset : offset + k]
+        offset += k
         if not node.children:
-            ta = np.zeros((table.shape[0], 1), dtype=np.uint16)
-            table = np.concatenate((ta, table), axis=1)
-            table_row = table[:, : k + 1]
-            table_col = table[:, k + 1 :]
+            table_row = np.concatenate((np.zeros((len(rep), 1), dtype=np.uint16), site_table), axis=1)
             in_ops_list = [dummy_in_ops]
         else:
-            # the children must have been visited
-            children_idx = [nodes.index(n) for n in node.children]
-            assert np.all(np.array(children_idx) < i)
-            in_ops_list = [out_ops_list[i] for i in children_idx]
-            m = len(node.children)
-            # roll relevant columns to the front
-            table = np.roll(table, m, axis=1)
-            table_row = table[:, : m + k]
-            table_col = table[:, m + k :]
-        out_ops, table, factor = _construct_symbolic_mpo_one_site(
+            # the children must have been visited and are the latest open subtrees
+            assert all(node_idx[n] < i for n in node.children)
+            table_row = np.concatenate((open_table[:, m - 1 :: -1], site_table), axis=1)
+            in_ops_list = [out_ops_list[node_idx[n]] for n in node.children]
+        # the suffix id in two uint16 columns
+        high, low = np.divmod(suffix_ids[offset][rep], max_uint16 + 1)
+        table_col = np.concatenate((open_table[:, m:], high[:, None], low[:, None]), axis=1).astype(np.uint16)
+        out_ops, new_table, factor = _construct_symbolic_mpo_one_site(
             table_row, table_col, in_ops_list, factor, primary_ops, algo, k
         )
-        # move the new column at the first index to the last index
-        table = np.roll(table, -1, axis=1)
+        # the new column of the out operator is the first one
+        open_table = new_table[:, :-2]
+        ids = new_table[:, -2].astype(np.int64) * (max_uint16 + 1) + new_table[:, -1]
+        rep = suffix_first[offset][ids]
         out_ops_list.append(out_ops)
+    assert offset == table.shape[1] and open_table.shape[1] == 1
+
+    return nodes, node_idx, out_ops_list, primary_ops
+
+
+def construct_symbolic_ttno(tn: BasisTree, terms: List[Op], const: float = 0, algo: str = "qr"):
+    nodes, node_idx, out_ops_list, primary_ops = _construct_ttno_ops(tn, terms, const, algo)
 
     mpo = []
     for i, node in enumerate(nodes):
-        children_idx = [nodes.index(n) for n in node.children]
-        in_ops_list = [out_ops_list[i] for i in children_idx]
+        in_ops_list = [out_ops_list[node_idx[n]] for n in node.children]
         mo = compose_symbolic_mo_general(in_ops_list, out_ops_list[i], primary_ops, node.n_sets)
         mpo.append(mo)
 
@@ -101,3 +185,20 @@ def construct_symbolic_ttno(tn: BasisTree, terms: List[Op], const: float = 0, al
         mpoqn.append(qn)
 
     return mpo, mpoqn
+
+
+def construct_numeric_ttno(tn: BasisTree, terms: List[Op], dtype, const: float = 0, algo: str = "qr"):
+    """
+    Construct the numerical tensors of the TTNO in postorder
+    without the intermediate symbolic matrix operators of :func:`construct_symbolic_ttno`.
+    """
+    nodes, node_idx, out_ops_list, primary_ops = _construct_ttno_ops(tn, terms, const, algo)
+
+    mpo = []
+    mpoqn = []
+    for i, node in enumerate(nodes):
+        in_ops_list = [out_ops_list[node_idx[n]] for n in node.children]
+        mpo.append(numeric_mo_general(node.basis_sets, in_ops_list, out_ops_list[i], primary_ops, dtype))
+        mpoqn.append(np.array([out_op[0].qn for out_op in out_ops_list[i]]))
+
+    return mpo, mpoqn
@@ -1,4 +1,3 @@
-import os
 from  typing import List
 
 import pytest
@@ -79,13 +78,15 @@ def check_result(ttns: TTNS, ttno: TTNO, time_step: float, final_time: float, op
     return ttns
 
 
+@pytest.mark.parametrize("n_threads", [1, 4])
 @pytest.mark.parametrize("ttns_and_ttno", [init_chain, init_tree, init_tree_mctdh])
-def test_tdvp_vmf(ttns_and_ttno):
+def test_tdvp_vmf(ttns_and_ttno, n_threads):
     ttns, ttno, op_n_list = ttns_and_ttno
     # expand bond dimension
     ttns = ttns + ttns.random(ttns.basis, 1, 5).scale(1e-5, inplace=True)
     ttns.canonicalise()
     ttns.evolve_config = EvolveConfig(EvolveMethod.tdvp_vmf, ivp_rtol=1e-4, ivp_atol=1e-7, force_ovlp=False)
+    ttns.evolve_config.vmf_n_threads = n_threads
     check_result(ttns, ttno, 0.5, 2, op_n_list)
 
 
@@ -100,7 +101,9 @@ def test_pc(ttns_and_ttno):
 
 @pytest.mark.parametrize("ttns_and_ttno", [init_chain, init_tree, init_tree_mctdh])
 @pytest.mark.parametrize("method", [EvolveMethod.tdvp_ps, EvolveMethod.tdvp_ps2])
-def test_tdvp_ps(ttns_and_ttno, method):
+@pytest.mark.parametrize("block_sparse", [False, True])
+@pytest.mark.parametrize("n_threads", [1, 4])
+def test_tdvp_ps(ttns_and_ttno, method, block_sparse, n_threads):
     ttns, ttno, op_n_list = ttns_and_ttno
     if ttns_and_ttno is init_chain:
         ttns = ttns.copy()
@@ -108,7 +111,9 @@ def test_tdvp_ps(ttns_and_ttno, method):
         # expand bond dimension
         ttns = ttns + ttns.random(ttns.basis, 1, 5).scale(1e-5, inplace=True)
         ttns.canonicalise()
+    ttns.block_sparse = block_sparse
     ttns.evolve_config = EvolveConfig(method)
+    ttns.evolve_config.environ_n_threads = n_threads
     ttns.compress_config = CompressConfig(CompressCriteria.fixed)
     if method is EvolveMethod.tdvp_ps:
         check_result(ttns, ttno, 0.4, 5, op_n_list)
@@ -151,8 +156,9 @@ def test_thermalprop():
     assert np.allclose(e, etot_std, rtol=rtol)
 
 
+@pytest.mark.parametrize("fmt", ["npz", "dir"])
 @pytest.mark.parametrize("ttns_and_ttno", [init_chain, init_tree, init_tree_mctdh])
-def test_save_load(ttns_and_ttno):
+def test_save_load(ttns_and_ttno, fmt, tmp_path):
     ttns, ttno, op_n_list = ttns_and_ttno
     ttns = ttns + ttns.random(ttns.basis, 1, 5).scale(1e-5, inplace=True)
     ttns.canonicalise()
@@ -162,11 +168,14 @@ def test_save_load(ttns_and_ttno):
         ttns1 = ttns1.evolve(ttno, tau)
     exp1 = [ttns1.expectation(o) for o in op_n_list]
     ttns2 = ttns.evolve(ttno, tau)
-    fname = f"{id(ttns2)}.npz"
-    ttns2.dump(fname)
+    fname = str(tmp_path / f"{id(ttns2)}.{fmt}")
+    ttns2.dump(fname, fmt=fmt)
     ttns2 = TTNS.load(ttns.basis, fname)
+    if fmt == "dir":
+        # dump to the same place
+        ttns2.dump(fname, fmt=fmt)
+        ttns2 = TTNS.load(ttns.basis, fname)
     ttns2 = ttns2.evolve(ttno, tau)
     assert ttns2.coeff == ttns1.coeff
     exp2 = [ttns2.expectation(o) for o in op_n_list]
     np.testing.assert_allclose(exp2, exp1, atol=1e-7)
-    os.remove(fname)
@@ -1,13 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
 from renormalizer import BasisHalfSpin, Model, Mpo, Mps, Op
 from renormalizer import optimize_mps
 from renormalizer.mps.backend import np
+from renormalizer.mps.block_sparse import BlockSparseTensor
 from renormalizer.model.model import heisenberg_ops
 from renormalizer.tn.node import TreeNodeBasis
-from renormalizer.tn.tree import TTNO, TTNS, TTNEnviron, from_mps
+from renormalizer.tn.tree import TTNO, TTNS, TTNEnviron, from_mps, environ_executor
+from renormalizer.tn.symbolic_ttno import symbolic_mo_to_numeric_mo_general
 from renormalizer.tn.treebase import BasisTree
 from renormalizer.tn.gs import optimize_ttns
+from renormalizer.tn.hop_expr import hop_expr2
 from renormalizer.tests.parameter import holstein_model
 from renormalizer.tests.parameter_exact import model
 from renormalizer.utils import CompressConfig, CompressCriteria
@@ -59,6 +64,15 @@ def test_ttno(basis):
     np.testing.assert_allclose(dense, dense2, atol=1e-15)
 
 
+@pytest.mark.parametrize("algo", ["qr", "Hopcroft-Karp"])
+def test_numeric_ttno(algo):
+    basis = holstein_scheme3()
+    ttno = TTNO(basis, holstein_model.ham_terms, algo=algo)
+    for node, node_basis, mo in zip(ttno.postorder_list(), basis.postorder_list(), ttno.symbolic_ttno):
+        mo_mat = symbolic_mo_to_numeric_mo_general(node_basis.basis_sets, mo, node.tensor.dtype)
+        np.testing.assert_allclose(node.tensor, mo_mat)
+
+
 @pytest.mark.parametrize("basis", [basis_binary, basis_multi_basis])
 def test_ttns(basis):
     ham_terms = heisenberg_ops(nspin)
@@ -78,6 +92,84 @@ def test_ttns(basis):
             np.testing.assert_allclose(e3, e2)
 
 
+@pytest.mark.parametrize("basis", [basis_binary, basis_multi_basis])
+def test_environ_update(basis):
+    ttns = TTNS.random(basis, 0, 5, 1)
+    ttno = TTNO(basis, heisenberg_ops(nspin))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        env = TTNEnviron(ttns, ttno, executor=executor)
+    env_ref = TTNEnviron(ttns, ttno)
+    for enode, enode_ref in zip(env.node_list, env_ref.node_list):
+        np.testing.assert_allclose(enode.environ_parent, enode_ref.environ_parent)
+        for environ, environ_ref in zip(enode.environ_children, enode_ref.environ_children):
+            np.testing.assert_allclose(environ, environ_ref)
+
+    # the environments are rebuilt lazily after the update
+    ttns.push_cano_to_child(ttns.root, 0)
+    env.update_1bond(ttns.root.children[0], ttns, ttno)
+    snode = ttns.node_list[-1]
+    env.ensure_2site(snode, ttns, ttno)
+    env_ref = TTNEnviron(ttns, ttno)
+    enode = env.node_list[-1]
+    enode_ref = env_ref.node_list[-1]
+    for e, e_ref in [(enode, enode_ref), (enode.parent, enode_ref.parent)]:
+        for environ, environ_ref in zip(e.environ_children, e_ref.environ_children):
+            np.testing.assert_allclose(environ, environ_ref)
+    np.testing.assert_allclose(enode.parent.environ_parent, enode_ref.parent.environ_parent)
+
+
+@pytest.mark.parametrize("basis", [basis_binary, basis_multi_basis])
+@pytest.mark.parametrize("n_threads", [1, 4])
+def test_environ_block_sparse(basis, n_threads):
+    ttns = TTNS.random(basis, 0, 5, 1)
+    ttno = TTNO(basis, heisenberg_ops(nspin))
+    env_ref = TTNEnviron(ttns, ttno)
+    # the nodes are converted to the blocks in the threads
+    ttns.block_sparse = True
+    with environ_executor(n_threads) as executor:
+        env = TTNEnviron(ttns, ttno, executor=executor, block_sparse=True)
+    for enode, enode_ref in zip(env.node_list, env_ref.node_list):
+        np.testing.assert_allclose(enode.environ_parent.todense(), enode_ref.environ_parent, atol=1e-12)
+        for environ, environ_ref in zip(enode.environ_children, enode_ref.environ_children):
+            np.testing.assert_allclose(environ.todense(), environ_ref, atol=1e-12)
+
+
+@pytest.mark.parametrize("basis", [basis_binary, basis_multi_basis])
+def test_hdiag_block_sparse(basis):
+    ttns = TTNS.random(basis, 0, 5, 1)
+    ttno = TTNO(basis, heisenberg_ops(nspin))
+    env_ref = TTNEnviron(ttns, ttno)
+    env = TTNEnviron(ttns, ttno, block_sparse=True)
+    for snode in ttns:
+        if snode.parent is None:
+            continue
+        _, hdiag_ref = hop_expr2(snode, ttns, ttno, env_ref)
+        _, hdiag = hop_expr2(snode, ttns, ttno, env)
+        assert isinstance(hdiag, BlockSparseTensor)
+        qn_mask = ttns.get_qnmask(snode, include_parent=True)
+        np.testing.assert_allclose(hdiag.todense()[qn_mask], hdiag_ref[qn_mask], atol=1e-12)
+
+
+def test_node_block_sparse():
+    ttns = TTNS.random(basis_binary, 0, 5, 1)
+    node = ttns.root.children[0]
+    block = ttns.to_block_sparse(node)
+    assert ttns.to_block_sparse(node) is block
+    # in-place modification of the dense tensor
+    node.tensor[...] = 2 * node.tensor
+    block2 = ttns.to_block_sparse(node)
+    assert block2 is not block
+    np.testing.assert_allclose(block2.todense(), 2 * block.todense())
+    # stored as the blocks
+    ttns.block_sparse = True
+    block3 = ttns.to_block_sparse(node)
+    assert node._tensor is None
+    assert node.shape == block3.shape
+    np.testing.assert_allclose(node.tensor, block3.todense())
+    # back to the dense storage after accessing the tensor
+    assert node._block_tensor is None
+
+
 @pytest.mark.parametrize("basis", [basis_binary, basis_multi_basis])
 def test_push_cano(basis):
     ttns = TTNS.random(basis, 0, 5, 1)
@@ -99,11 +191,28 @@ def test_from_mps():
     np.testing.assert_allclose(e, e_ref)
 
 
+def test_mutual_info_from_mps():
+    mps = Mps.random(model, 1, 10)
+    mps.canonicalise().normalize("mps_only")
+    basis, ttns, ttno = from_mps(mps)
+    mutual_info_mps = mps.calc_2site_mutual_entropy()
+    mutual_info, (entropy_1dof, entropy_2dof) = ttns.calc_2dof_mutual_info()
+    dofs = [b.dof for b in model.basis]
+    assert len(mutual_info) == len(dofs) * (len(dofs) - 1) // 2
+    for (dof1, dof2), value in mutual_info.items():
+        np.testing.assert_allclose(value, mutual_info_mps[dofs.index(dof1), dofs.index(dof2)], atol=1e-10)
+    # the sites form a chain
+    mutual_info_near, _ = ttns.calc_2dof_mutual_info(max_distance=1)
+    assert set(map(frozenset, mutual_info_near)) == {frozenset(dofs[i:i+2]) for i in range(len(dofs) - 1)}
+
+
 @pytest.mark.parametrize("basis_tree", [basis_binary, basis_multi_basis])
 @pytest.mark.parametrize("ite", [False, True])
-def test_gs_heisenberg(basis_tree, ite):
+@pytest.mark.parametrize("n_threads", [1, 4])
+def test_gs_heisenberg(basis_tree, ite, n_threads):
     ham_terms = heisenberg_ops(4)
     ttns = TTNS.random(basis_tree, qntot=0, m_max=20)
+    ttns.optimize_config.environ_n_threads = n_threads
     ttno = TTNO(basis_tree, ham_terms)
     if not ite:
         e1 = optimize_ttns(ttns, ttno)
@@ -121,7 +230,8 @@ def test_gs_heisenberg(basis_tree, ite):
 
 @pytest.mark.parametrize("scheme", [3, 4])
 @pytest.mark.parametrize("m_type", [int, list])
-def test_gs_holstein(scheme, m_type):
+@pytest.mark.parametrize("block_sparse", [False, True])
+def test_gs_holstein(scheme, m_type, block_sparse):
     if scheme == 3:
         model = holstein_model
         basis = holstein_scheme3()
@@ -137,6 +247,7 @@ def test_gs_holstein(scheme, m_type):
         basis = BasisTree(root)
     m = 4
     ttns = TTNS.random(basis, qntot=1, m_max=m)
+    ttns.block_sparse = block_sparse
     ttno = TTNO(basis, model.ham_terms)
     if m_type == list:
         m = ttns.bond_dims
@@ -169,6 +280,22 @@ def test_apply(basis_tree):
     np.testing.assert_allclose(s2.ravel(), op @ s1.ravel())
 
 
+@pytest.mark.parametrize("basis_tree", [basis_binary, basis_multi_basis])
+@pytest.mark.parametrize("algo", ["svd", "zipup"])
+def test_contract(basis_tree, algo):
+    ttns1 = TTNS.random(basis_tree, qntot=0, m_max=4)
+    ttno = TTNO(basis_tree, heisenberg_ops(nspin))
+    s2 = ttno.todense() @ ttns1.todense().ravel()
+    # no truncation
+    ttns1.compress_config = CompressConfig(CompressCriteria.fixed, max_bonddim=64)
+    ttns2 = ttno.contract(ttns1, algo)
+    np.testing.assert_allclose(ttns2.todense().ravel(), s2, atol=1e-10)
+    ttns1.compress_config = CompressConfig(CompressCriteria.fixed, max_bonddim=4)
+    ttns3 = ttno.contract(ttns1, algo)
+    assert max(ttns3.bond_dims) == 4
+    ttns3.check_canonical()
+
+
 def test_compress():
     m1 = 5
     m2 = 4
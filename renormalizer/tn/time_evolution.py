@@ -1,32 +1,35 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
 from math import factorial
 from typing import Union, List, Tuple
 import logging
 
 import scipy
-from scipy import stats
 
 from renormalizer.mps.lib import compressed_sum
 from renormalizer.mps.backend import np, xp
+from renormalizer.mps.block_sparse import BlockSparseTensor
 from renormalizer.mps.matrix import asxp
 from renormalizer.mps.oe_contract_wrap import oe_contract
 from renormalizer.lib import solve_ivp, expm_krylov
 from renormalizer.utils.configs import EvolveMethod
+from renormalizer.utils.utils import lazy_import
 from renormalizer.tn.node import TreeNodeTensor
-from renormalizer.tn.tree import TTNO, TTNS, TTNEnviron, EVOLVE_METHODS
+from renormalizer.tn.tree import TTNO, TTNS, TTNEnviron, EVOLVE_METHODS, environ_executor
 from renormalizer.tn.hop_expr import hop_expr0, hop_expr1, hop_expr2
 
 
+stats = lazy_import("scipy.stats")
+
 logger = logging.getLogger(__name__)
 
 
-def time_derivative_vmf(ttns: TTNS, ttno: TTNO):
+def time_derivative_vmf(ttns: TTNS, ttno: TTNO, executor: Executor = None):
     # todo: benchmark and optimize
-    # parallel over multiple processors?
-    environ_s = TTNEnviron(ttns, TTNO.dummy(ttns.basis))
-    environ_h = TTNEnviron(ttns, ttno)
+    environ_s = TTNEnviron(ttns, TTNO.dummy(ttns.basis), executor=executor)
+    environ_h = TTNEnviron(ttns, ttno, executor=executor)
 
-    deriv_list = []
-    for inode, node in enumerate(ttns.node_list):
+    def node_derivative(inode, node):
+        # independent of the other nodes once the environments are known
         hop = hop_expr1(node, ttns, ttno, environ_h)
         # idx1: children+physical, idx2: parent
         dim_parent = node.shape[-1]
@@ -41,7 +44,13 @@ def time_derivative_vmf(ttns: TTNS, ttno: TTNO):
             ovlp_inv = regularized_inversion(ovlp, ttns.evolve_config.reg_epsilon)
             deriv = oe_contract("bf, bg, fh -> gh", deriv, xp.eye(proj.shape[0]) - proj, asxp(ovlp_inv.T))
         qnmask = ttns.get_qnmask(node).reshape(deriv.shape)
-        deriv_list.append(deriv[qnmask].ravel())
+        return deriv[qnmask].ravel()
+
+    if executor is None:
+        deriv_list = [node_derivative(inode, node) for inode, node in enumerate(ttns.node_list)]
+    else:
+        # parallel over the nodes. NumPy releases the GIL in BLAS calls
+        deriv_list = list(executor.map(node_derivative, range(len(ttns)), ttns.node_list))
     return np.concatenate(deriv_list)
 
 
@@ -53,14 +62,21 @@ def regularized_inversion(m, eps):
 
 
 def evolve_tdvp_vmf(ttns: TTNS, ttno: TTNO, coeff: Union[complex, float], tau: float, first_step=None):
+    n_threads = ttns.evolve_config.vmf_n_threads
+    executor = ThreadPoolExecutor(max_workers=n_threads) if 1 < n_threads else None
+
     def ivp_func(t, params):
         ttns_t = TTNS.from_tensors(ttns, params)
-        return coeff * time_derivative_vmf(ttns_t, ttno)
+        return coeff * time_derivative_vmf(ttns_t, ttno, executor)
 
     init_y = np.concatenate([node.tensor[ttns.get_qnmask(node)].ravel() for node in ttns.node_list])
     atol = ttns.evolve_config.ivp_atol
     rtol = ttns.evolve_config.ivp_rtol
-    sol = solve_ivp(ivp_func, (0, tau), init_y, first_step=first_step, atol=atol, rtol=rtol)
+    try:
+        sol = solve_ivp(ivp_func, (0, tau), init_y, first_step=first_step, atol=atol, rtol=rtol)
+    finally:
+        if executor is not None:
+            executor.shutdown()
     logger.info(f"VMF func called: {sol.nfev}. RKF steps: {len(sol.t)}")
     new_ttns = TTNS.from_tensors(ttns, sol.y[:, -1])
     new_ttns.canonicalise()
@@ -79,7 +95,8 @@ def evolve_prop_and_compress_tdrk4(ttns: TTNS, ttno: TTNO, coeff: Union[complex,
 def evolve_tdvp_ps(ttns: TTNS, ttno: TTNO, coeff: Union[complex, float], tau: float):
     ttns.check_canonical()
     # second order 1-site projector splitting
-    ttne = TTNEnviron(ttns, ttno)
+    with environ_executor(ttns.evolve_config.environ_n_threads) as executor:
+        ttne = TTNEnviron(ttns, ttno, executor=executor, block_sparse=ttns.block_sparse)
 
     # in MPS language: left to right sweep
     local_steps1 = _tdvp_ps_forward(ttns, ttno, ttne, coeff, tau / 2)
@@ -108,7 +125,7 @@ def _tdvp_ps_forward(ttns: TTNS, ttno: TTNO, ttne: TTNEnviron, coeff: Union[comp
         # no children to evolve
         if (not snode.children) or (ichild == len(snode.children) - 1):
             ms, j = evolve_1site(snode, ttns, ttno, ttne, coeff, tau)
-            snode.tensor = ms.reshape(snode.shape)
+            snode.tensor = ms
             local_steps.append(j)
 
             if snode.parent is None:
@@ -148,7 +165,7 @@ def _tdvp_ps_backward(ttns: TTNS, ttno: TTNO, ttne: TTNEnviron, coeff: Union[com
         snode, ichild = stack[-1]
         if ichild == -1:
             ms, j = evolve_1site(snode, ttns, ttno, ttne, coeff, tau)
-            snode.tensor = ms.reshape(snode.shape)
+            snode.tensor = ms
             local_steps.append(j)
         if ichild == len(snode.children) - 1:
             if snode is not ttns.root:
@@ -177,7 +194,8 @@ def _tdvp_ps_backward(ttns: TTNS, ttno: TTNO, ttne: TTNEnviron, coeff: Union[com
 def evolve_tdvp_ps2(ttns: TTNS, ttno: TTNO, coeff: Union[complex, float], tau: float):
     ttns.check_canonical()
     # second order 2-site projector splitting
-    tte = TTNEnviron(ttns, ttno)
+    with environ_executor(ttns.evolve_config.environ_n_threads) as executor:
+        tte = TTNEnviron(ttns, ttno, executor=executor, block_sparse=ttns.block_sparse)
     # in MPS language: left to right sweep
     local_steps1 = _tdvp_ps2_recursion_forward(ttns.root, ttns, ttno, tte, coeff, tau / 2)
     # in MPS language: right to left sweep
@@ -216,7 +234,7 @@ def _tdvp_ps2_recursion_forward(
         if snode is ttns.root and ichild == len(snode.children) - 1:
             continue
         ms, j = evolve_1site(snode, ttns, ttno, ttne, coeff, -tau)
-        snode.tensor = ms.reshape(snode.shape)
+        snode.tensor = ms
         local_steps.append(j)
         # update env
         ttne.update_1site(snode, ttns, ttno)
@@ -235,7 +253,7 @@ def _tdvp_ps2_recursion_backward(
         # backward time evolution for snode
         if not (snode is ttns.root and ichild == len(snode.children) - 1):
             ms, j = evolve_1site(snode, ttns, ttno, ttne, coeff, -tau)
-            snode.tensor = ms.reshape(snode.shape)
+            snode.tensor = ms
             local_steps.append(j)
             # update env
             ttne.update_1site(snode, ttns, ttno)
@@ -265,6 +283,8 @@ def evolve_2site(
     # evolve snode and parent
     ms2 = ttns.merge_with_parent(snode)
     hop, _ = hop_expr2(snode, ttns, ttno, ttne)
+    if ttne.block_sparse:
+        return _expm_krylov_block_sparse(hop, ms2, coeff * tau)
     ms2_t, j = expm_krylov(lambda y: hop(y.reshape(ms2.shape)).ravel(), coeff * tau, ms2.ravel())
     return ms2_t, j
 
@@ -272,10 +292,12 @@ def evolve_2site(
 def evolve_1site(
     snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO, ttne: TTNEnviron, coeff: Union[complex, float], tau: float
 ):
-    ms = snode.tensor
     hop = hop_expr1(snode, ttns, ttno, ttne)
+    if ttne.block_sparse:
+        return _expm_krylov_block_sparse(hop, ttns.to_block_sparse(snode), coeff * tau)
+    ms = snode.tensor
     ms_t, j = expm_krylov(lambda y: hop(y.reshape(ms.shape)).ravel(), coeff * tau, ms.ravel())
-    return ms_t, j
+    return ms_t.reshape(ms.shape), j
 
 
 def evolve_0site(
@@ -287,11 +309,23 @@ def evolve_0site(
     coeff: Union[complex, float],
     tau: float,
 ):
+    if ttne.block_sparse:
+        hop, template = hop_expr0(snode, ttns, ttno, ttne, return_template=True)
+        x = BlockSparseTensor.from_dense(ms, template.qns, template.signs, template.qntot)
+        x_t, j = _expm_krylov_block_sparse(hop, x, coeff * tau)
+        return x_t.todense().ravel(), j
     hop = hop_expr0(snode, ttns, ttno, ttne)
     ms_t, j = expm_krylov(lambda y: hop(y.reshape(ms.shape)).ravel(), coeff * tau, ms.ravel())
     return ms_t, j
 
 
+def _expm_krylov_block_sparse(hop, x: BlockSparseTensor, dt):
+    # the Krylov vectors are the concatenation of the blocks allowed by the symmetry
+    template = BlockSparseTensor.zeros(x.qns, x.signs, x.qntot)
+    x_t, j = expm_krylov(lambda y: hop(template.from_vector(y)).to_vector(template), dt, x.to_vector(template))
+    return template.from_vector(x_t), j
+
+
 EVOLVE_METHODS[EvolveMethod.tdvp_vmf] = evolve_tdvp_vmf
 EVOLVE_METHODS[EvolveMethod.prop_and_compress_tdrk4] = evolve_prop_and_compress_tdrk4
 EVOLVE_METHODS[EvolveMethod.tdvp_ps] = evolve_tdvp_ps
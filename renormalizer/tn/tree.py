@@ -1,25 +1,33 @@
-from typing import List, Dict, Tuple, Union, Callable, Any
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import List, Dict, Tuple, Union, Callable, Any, Set
 import logging
+import os
 
 import scipy
 
 from renormalizer import Op, Mps, Model, OpSum
 from renormalizer.model.basis import BasisSet, BasisDummy
 from renormalizer.mps.backend import np, backend, xp
+from renormalizer.mps import block_sparse
+from renormalizer.mps.block_sparse import BlockSparseTensor
 from renormalizer.mps.matrix import asnumpy, asxp_oe_args, tensordot
 from renormalizer.mps.svd_qn import add_outer, svd_qn, blockrecover, get_qn_mask
 from renormalizer.mps.lib import select_basis
 from renormalizer.mps.mps import normalize
 from renormalizer.mps.oe_contract_wrap import oe_contract
 from renormalizer.utils.configs import CompressConfig, OptimizeConfig, EvolveConfig, EvolveMethod
-from renormalizer.utils import calc_vn_entropy, calc_vn_entropy_dm
+from renormalizer.utils import calc_vn_entropy, iter_vn_entropy
 from renormalizer.tn.node import TreeNodeTensor, TreeNodeBasis, copy_connection, TreeNodeEnviron
 from renormalizer.tn.treebase import Tree, BasisTree, print_as_tree
-from renormalizer.tn.symbolic_ttno import construct_symbolic_ttno, symbolic_mo_to_numeric_mo_general
+from renormalizer.tn.symbolic_ttno import construct_symbolic_ttno, construct_numeric_ttno
 
 
 logger = logging.getLogger(__name__)
 
+# the header file of the tree tensor network dumped into a directory
+TTN_HEADER = "header.npz"
+
 
 class TTNBase(Tree):
     # A tree whose tree node is TreeNodeTensor
@@ -30,13 +38,23 @@ class TTNBase(Tree):
 
     @classmethod
     def load(cls, basis: BasisTree, fname: str, other_attrs=None):
-        npload = np.load(fname, allow_pickle=True)
+        # ``fname`` is a directory if dumped with ``fmt="dir"``.
+        # Then the tensors are memory-mapped and read from the disk on access
+        lazy = os.path.isdir(fname)
+        if lazy:
+            npload = np.load(os.path.join(fname, TTN_HEADER), allow_pickle=True)
+        else:
+            npload = np.load(fname, allow_pickle=True)
         assert npload["version"] == "0.1"
 
         nsites = int(npload["nsites"])
         nodes = []
         for i in range(nsites):
-            tensor = npload[f"tensor_{i}"]
+            if lazy:
+                # copy-on-write because the tensors might be updated inplace
+                tensor = np.load(os.path.join(fname, f"tensor_{i}.npy"), mmap_mode="c")
+            else:
+                tensor = npload[f"tensor_{i}"]
             qn = npload[f"qn_{i}"]
             nodes.append(TreeNodeTensor(tensor, qn))
         copy_connection(basis.node_list, nodes)
@@ -55,7 +73,23 @@ class TTNBase(Tree):
         }
         self.tn2dofs = {tn: bn.dofs for tn, bn in self.tn2bn.items()}
 
-    def dump(self, fname: str, other_attrs=None):
+    def dump(self, fname: str, other_attrs=None, fmt="npz"):
+        """
+        Dump the tree tensor network to the disk.
+
+        Parameters
+        ----------
+        fname: str
+            The file name or the directory name.
+        other_attrs: list of str, optional
+            Other attributes to dump.
+        fmt: str
+            ``"npz"``: all data in a single ``.npz`` file.
+            ``"dir"``: one ``.npy`` file for each tensor and a ``header.npz`` for the other data in the directory.
+            The tensors are then loaded lazily by :meth:`load`.
+        """
+        if fmt not in ["npz", "dir"]:
+            raise ValueError(f"Unknown dump format: {fmt}")
         if other_attrs is None:
             other_attrs = []
 
@@ -68,11 +102,22 @@ class TTNBase(Tree):
             data_dict[attr] = getattr(self, attr)
 
         for i, node in enumerate(self.node_list):
-            data_dict[f"tensor_{i}"] = node.tensor
+            if fmt == "npz":
+                data_dict[f"tensor_{i}"] = node.tensor
             data_dict[f"qn_{i}"] = node.qn
 
         try:
-            np.savez(fname, **data_dict)
+            if fmt == "npz":
+                np.savez(fname, **data_dict)
+            else:
+                os.makedirs(fname, exist_ok=True)
+                for i, node in enumerate(self.node_list):
+                    # the tensor might be memory-mapped from the same file. Don't overwrite the file inplace
+                    tmp_path = os.path.join(fname, f"tensor_{i}.tmp.npy")
+                    np.save(tmp_path, asnumpy(node.tensor))
+                    os.replace(tmp_path, os.path.join(fname, f"tensor_{i}.npy"))
+                # the header is written last
+                np.savez(os.path.join(fname, TTN_HEADER), **data_dict)
         except Exception:
             logger.exception(f"Dump MP failed.")
 
@@ -89,15 +134,15 @@ class TTNBase(Tree):
             Could use ``logger.info`` instead.
         """
         if full:
-            text_list = [str(node.tensor.shape) for node in self.node_list]
+            text_list = [str(node.shape) for node in self.node_list]
         else:
-            text_list = [str(node.tensor.shape[-1]) for node in self.node_list]
+            text_list = [str(node.shape[-1]) for node in self.node_list]
 
         print_as_tree(text_list, self.adj_matrix, print_function)
 
     @property
     def bond_dims(self):
-        return [node.tensor.shape[-1] for node in self]
+        return [node.shape[-1] for node in self]
 
     @property
     def bond_dims_mean(self) -> int:
@@ -138,19 +183,22 @@ class TTNO(TTNBase):
             terms = [terms]
         self.terms: List[Op] = terms
 
+        self.algo = algo
+
         if not root:
-            self.symbolic_ttno, mpoqn = construct_symbolic_ttno(basis, terms, algo=algo)
-            # from renormalizer.mps.symbolic_mpo import _format_symbolic_mpo
-            # print(_format_symbolic_mpo(symbolic_mpo))
+            mpo, mpoqn = construct_numeric_ttno(basis, terms, backend.real_dtype, algo=algo)
             node_list_basis = self.basis.postorder_list()
-            node_list_op = []
-            for impo, (mo, qn) in enumerate(zip(self.symbolic_ttno, mpoqn)):
-                node_basis: TreeNodeBasis = node_list_basis[impo]
-                mo_mat = symbolic_mo_to_numeric_mo_general(node_basis.basis_sets, mo, backend.real_dtype)
-                node_list_op.append(TreeNodeTensor(mo_mat, qn))
+            node_list_op = [TreeNodeTensor(mo_mat, qn) for mo_mat, qn in zip(mpo, mpoqn)]
             root: TreeNodeTensor = copy_connection(node_list_basis, node_list_op)
         super().__init__(basis, root)
 
+    @property
+    def symbolic_ttno(self):
+        # the symbolic matrix operators in postorder. Only constructed on demand for debugging
+        # from renormalizer.mps.symbolic_mpo import _format_symbolic_mpo
+        # print(_format_symbolic_mpo(symbolic_mpo))
+        return construct_symbolic_ttno(self.basis, self.terms, algo=self.algo)[0]
+
     def apply(self, ttns: "TTNS", canonicalise: bool = False) -> "TTNS":
         """
         Apply the operator to the TTNS.
@@ -199,7 +247,7 @@ class TTNO(TTNBase):
             new.canonicalise()
         return new
 
-    def contract(self, ttns: "TTNS", algo="svd") -> "TTNS":
+    def contract(self, ttns: "TTNS", algo=None) -> "TTNS":
         """
         Contract the operator to the TTNS.
         Parameters
@@ -207,18 +255,88 @@ class TTNO(TTNBase):
         ttns: TTNS
             the TTNS to contract the operator to
         algo: str
-            the algorithm to use for the compression after applying the operator
+            the algorithm to use for the compression after applying the operator.
+            ``"svd"``: apply the operator and then compress.
+            ``"zipup"``: truncate node by node from the leaves to the root during the contraction,
+            so that the TTNS with the inflated bond dimension is never formed.
+            Default is ``ttns.compress_config.contract_algo``.
 
         Returns
         -------
         The new TTNS
         """
-        assert algo == "svd", "variational compress not supported yet"
-        new_ttns = self.apply(ttns)
-        new_ttns.canonicalise()
+        if algo is None:
+            algo = ttns.compress_config.contract_algo
+        if algo == "svd":
+            new_ttns = self.apply(ttns)
+            new_ttns.canonicalise()
+        elif algo == "zipup":
+            new_ttns = self._contract_zipup(ttns)
+        else:
+            raise ValueError(f"Unsupported contraction algorithm: {algo}")
         new_ttns.compress()
         return new_ttns
 
+    def _contract_zipup(self, ttns: "TTNS") -> "TTNS":
+        # The truncation during the zip-up is looser because the basis of the parent side
+        # is not orthonormal. The final bond dimension is determined by the SVD compression afterwards
+        new = ttns.metacopy()
+        compress_config = new.compress_config
+        if compress_config.bonddim_should_set:
+            compress_config.set_bonddim(len(new.node_list) + 1)
+        qntot = ttns.qntot + self.qntot
+        # the contracted child bond (new ttns, old ttns, ttno) of each node
+        carry = {}
+        for snode1 in ttns.postorder_list():
+            idx = ttns.node_idx[snode1]
+            snode2, onode = new.node_list[idx], self.node_list[idx]
+            assert len(snode1.children) == len(onode.children)
+
+            indices1 = ttns.get_node_indices(snode1, ttno=self)
+            indices2 = self.get_node_indices(onode)
+            args = [snode1.tensor, indices1, onode.tensor, indices2]
+            output_indices = []
+            for i, child in enumerate(snode1.children):
+                carry_index = ("carry", str(id(child)))
+                args.extend([carry.pop(child), [carry_index, indices1[i], indices2[i]]])
+                output_indices.append(carry_index)
+            bnode = ttns.tn2bn[snode1]
+            for i in range(bnode.n_sets):
+                output_indices.append(("up", str(bnode.dofs[i])))
+            output_indices.extend([indices1[-1], indices2[-1]])
+            args.append(output_indices)
+            res = asnumpy(oe_contract(*asxp_oe_args(args)))
+
+            qn = add_outer(snode1.qn, onode.qn).reshape(-1, ttns.basis.qn_size)
+            if snode1.parent is None:
+                snode2.tensor = res.reshape(res.shape[:-2] + (1,))
+                snode2.qn = qn
+                break
+
+            qnbigl = np.zeros(ttns.basis.qn_size, dtype=int)
+            for child in snode2.children:
+                qnbigl = add_outer(qnbigl, child.qn)
+            for b in bnode.basis_sets:
+                qnbigl = add_outer(qnbigl, b.sigmaqn)
+
+            def m_trunc(sigma):
+                return min(2 * compress_config.compute_m_trunc(sigma, idx, left=False), len(sigma))
+
+            u, s, qnl, v, s, qnr = svd_qn(
+                res.reshape(np.prod(res.shape[:-2]), -1),
+                qnbigl,
+                qntot - qn,
+                qntot,
+                full_matrices=False,
+                m_trunc=m_trunc,
+            )
+            snode2.tensor = u.reshape(res.shape[:-2] + (-1,))
+            snode2.qn = np.array(qnl)
+            carry[snode1] = (s.reshape(-1, 1) * v.T).reshape((-1,) + res.shape[-2:])
+
+        new.check_shape()
+        return new
+
     def todense(self, order: List[BasisSet] = None) -> np.ndarray:
         """
         Convert the TTNO operator to dense matrix.
@@ -269,7 +387,7 @@ class TTNO(TTNBase):
         for node in self.node_list:
             assert isinstance(node, TreeNodeTensor)
             indices = self.get_node_indices(node, prefix_up, prefix_down)
-            indices = [indices[i] for i, s in enumerate(node.tensor.shape) if s != 1]
+            indices = [indices[i] for i, s in enumerate(node.shape) if s != 1]
             tensor = node.tensor.squeeze()
             assert len(indices) == tensor.ndim
             args.extend([tensor, indices])
@@ -305,9 +423,33 @@ class TTNO(TTNBase):
             indices.append((_id, "root", str(all_dofs)))
         else:
             indices.append((_id, str(self.tn2dofs[node.parent]), str(all_dofs)))
-        assert len(indices) == node.tensor.ndim
+        assert len(indices) == node.ndim
         return indices
 
+    def to_block_sparse(self, node: TreeNodeTensor) -> BlockSparseTensor:
+        """
+        The node tensor as a :class:`~renormalizer.mps.block_sparse.BlockSparseTensor`.
+        The children bonds and the up physical bonds are incoming,
+        the down physical bonds and the parent bond are outgoing.
+
+        Parameters
+        ----------
+        node: TreeNodeTensor
+            The node in the TTNO
+
+        Returns
+        -------
+        The node tensor with only the blocks satisfying the symmetry
+        """
+        qns = [child.qn for child in node.children]
+        signs = [1] * len(node.children)
+        for b in self.tn2bn[node].basis_sets:
+            qns.extend([b.sigmaqn, b.sigmaqn])
+            signs.extend([1, -1])
+        qns.append(node.qn)
+        signs.append(-1)
+        return node.to_block_sparse(qns, signs)
+
     def __matmul__(self, other):
         # duplicate with Mpo
         return self.apply(other)
@@ -478,6 +620,9 @@ class TTNS(TTNBase):
 
         self.coeff = 1
         self.check_shape()
+        # whether the environments and the local operators in the sweeps
+        # are constructed by the symmetry blocks. See ``TTNEnviron``
+        self.block_sparse = False
 
         self.compress_config = CompressConfig()
         self.optimize_config = OptimizeConfig()
@@ -490,8 +635,8 @@ class TTNS(TTNBase):
         Assert the shape of the TTNS is consistent with the basis.
         """
         for snode, bnode in zip(self.node_list, self.basis.node_list):
-            assert snode.tensor.ndim == len(snode.children) + bnode.n_sets + 1
-            assert snode.qn.shape[0] == snode.tensor.shape[-1]
+            assert snode.ndim == len(snode.children) + bnode.n_sets + 1
+            assert snode.qn.shape[0] == snode.shape[-1]
             assert snode.qn.shape[1] == bnode.qn_size
             for i, b in enumerate(bnode.basis_sets):
                 assert snode.shape[len(snode.children) + i] == b.nbas
@@ -590,11 +735,38 @@ class TTNS(TTNBase):
             indices.append((_id, "root", str(all_dofs)))
         else:
             indices.append((_id, str(self.tn2dofs[node.parent]), str(all_dofs)))
-        assert len(indices) == node.tensor.ndim
+        assert len(indices) == node.ndim
         return indices
 
+    def to_block_sparse(self, node: TreeNodeTensor) -> BlockSparseTensor:
+        """
+        The node tensor as a :class:`~renormalizer.mps.block_sparse.BlockSparseTensor`.
+        All bonds carry the quantum number of the subtree below the bond.
+        The children bonds and the physical bonds are incoming and the parent bond is outgoing.
+        If ``self.block_sparse`` is set, the node is stored as the blocks afterwards.
+
+        Parameters
+        ----------
+        node: TreeNodeTensor
+            The node in the TTNS
+
+        Returns
+        -------
+        The node tensor with only the blocks satisfying the symmetry
+        """
+        qns = [child.qn for child in node.children]
+        qns.extend(b.sigmaqn for b in self.tn2bn[node].basis_sets)
+        qns.append(node.qn)
+        signs = [1] * (len(qns) - 1) + [-1]
+        return node.to_block_sparse(qns, signs, keep_dense=not self.block_sparse)
+
     def merge_with_parent(self, node):
         # merge a node with its parent
+        if self.block_sparse:
+            # the legs of the node except the parent bond followed by the legs of the parent except the bond in between
+            return block_sparse.tensordot(
+                self.to_block_sparse(node), self.to_block_sparse(node.parent), ([-1], [node.idx_as_child])
+            )
         args = []
         snode_indices = self.get_node_indices(node)
         parent_indices = self.get_node_indices(node.parent)
@@ -620,7 +792,11 @@ class TTNS(TTNBase):
         """
         assert node.parent
         qnbigl, qnbigr, _ = self.get_qnmat(node, include_parent=False)
-        tensor = node.tensor.reshape(-1, node.shape[-1])
+        if self.block_sparse:
+            # qnbigr is the R-block quantum number of the parent bond
+            tensor = self.to_block_sparse(node).flip_leg(-1, self.qntot)
+        else:
+            tensor = node.tensor.reshape(-1, node.shape[-1])
         u, qnlnew, v, qnrnew = svd_qn(tensor, qnbigl, qnbigr, self.qntot, QR=True, system="L", full_matrices=False)
         # could shrink during QR
         node.tensor = u.reshape(list(node.shape[:-1]) + [u.shape[1]])
@@ -679,7 +855,15 @@ class TTNS(TTNBase):
         -------
         The triangular matrix R
         """
-        qnbigl, qnbigr, tensor, shape = moveaxis(self, node, ichild)
+        if self.block_sparse:
+            qnbigl, qnbigr = _moveaxis_qn(self, node, ichild)
+            # the same order of the legs as ``moveaxis``.
+            # The parent bond carries the R-block quantum number
+            axes = [i for i in range(node.ndim) if i != ichild] + [ichild]
+            shape = [node.shape[i] for i in axes]
+            tensor = self.to_block_sparse(node).transpose(axes).flip_leg(-2, self.qntot)
+        else:
+            qnbigl, qnbigr, tensor, shape = moveaxis(self, node, ichild)
 
         # u for node and v for child
         u, qnl, v, qnr = svd_qn(tensor, qnbigl, qnbigr, self.qntot, QR=True, system="L", full_matrices=False)
@@ -1024,8 +1208,7 @@ class TTNS(TTNBase):
             The 1-site entanglement entropy. The key is the index of the site in ``self.node_list``.
         """
         rdm = self.calc_1site_rdm(idx)
-        entropy = {key: calc_vn_entropy_dm(dm) for key, dm in rdm.items()}
-        return entropy
+        return dict(iter_vn_entropy(self._iter_numpy(rdm.items())))
 
     def calc_1dof_rdm(self, dof: Union[Any, List[Any]]=None) -> Dict[Any, np.ndarray]:
         r""" Calculate the reduced density matrix of a single degree of freedom.
@@ -1070,35 +1253,36 @@ class TTNS(TTNBase):
 
     def calc_1dof_entropy(self, dof: Union[Any, List[Any]]=None) -> Dict[Any, float]:
         rdm = self.calc_1dof_rdm(dof)
-        return {key: calc_vn_entropy_dm(dm) for key, dm in rdm.items()}
-
-    def calc_2site_rdm(self, idxs: Union[Tuple[int, int], List[Tuple[int, int]]]=None) -> Dict[Tuple[int, int], np.ndarray]:
-        r""" Calculate 2-site reduced density matrix
+        return dict(iter_vn_entropy(self._iter_numpy(rdm.items())))
 
-        :math:`\rho_{ij} = \textrm{Tr}_{k \neq i, k \neq j} | \Psi \rangle \langle \Psi |`.
+    def iter_2site_rdm(self, idxs: Union[Tuple[int, int], List[Tuple[int, int]]]=None, max_distance: int=None):
+        r""" Iterate over 2-site reduced density matrices without storing them.
 
         Parameters
         ----------
-        idxs: list(tuple), optional 
-        idx1: int
-            site index (in terms of ``self.node_list``) of the first site.
-        idx2: int
-            site index (in terms of ``self.node_list``) of the second site.
-
-        Returns
-        -------
+        idxs: list(tuple), optional
+            The pairs of site indices (in terms of ``self.node_list``).
+            Default is None, which means all pairs.
+        max_distance: int, optional
+            Only calculate the pairs whose distance in the tree is no larger than ``max_distance``.
+
+        Yields
+        ------
+        key : tuple
+            The pair of site indices.
         rdm: np.ndarray
             the 2-site reduced density matrix with ket indices followed by bra indices
         """
         ttno_dummy = TTNO.dummy(self.basis)
         ttne = TTNEnviron(self, ttno_dummy)
 
-        if isinstance(idxs, tuple):
+        if idxs is None:
+            idxs = [(i, j) for i in range(len(self)) for j in range(i+1, len(self))]
+        elif isinstance(idxs, tuple):
             idxs = [idxs]
         else:
             assert isinstance(idxs, list)
 
-        rdm = {}
         for idx_pair in idxs:
             idx1 = idx_pair[0]
             idx2 = idx_pair[1]
@@ -1106,6 +1290,8 @@ class TTNS(TTNBase):
             path = self.find_path(self.node_list[idx1], self.node_list[idx2])
             assert path[0] is self.node_list[idx1]
             assert path[-1] is self.node_list[idx2]
+            if max_distance is not None and max_distance < len(path) - 1:
+                continue
             args = []
             # put the nodes for RDM in the arguments
             for snode in [path[0], path[-1]]:
@@ -1163,88 +1349,130 @@ class TTNS(TTNBase):
                     indices_ket.append(("down", str(dofs)))
                     indices_bra.append(("up", str(dofs)))
             args.append(indices_ket + indices_bra)
-            res = oe_contract(*asxp_oe_args(args))
-            rdm[idx_pair] = res
             # perform the contraction
-        return rdm
+            res = oe_contract(*asxp_oe_args(args))
+            yield idx_pair, res
 
-    def calc_2site_entropy(self, idxs: Union[Tuple[int, int], List[Tuple[int, int]]]) -> Dict[tuple, float]:
+    def calc_2site_rdm(self, idxs: Union[Tuple[int, int], List[Tuple[int, int]]]=None, max_distance: int=None) -> Dict[Tuple[int, int], np.ndarray]:
+        r""" Calculate 2-site reduced density matrix
 
-        if isinstance(idxs, tuple):
-            idxs = [idxs]
-        else:
-            assert isinstance(idxs, list)
+        :math:`\rho_{ij} = \textrm{Tr}_{k \neq i, k \neq j} | \Psi \rangle \langle \Psi |`.
 
-        rdm = self.calc_2site_rdm(idxs)
-        entropy = {key: calc_vn_entropy_dm(dm) for key, dm in rdm.items()}
-        return entropy
+        Parameters
+        ----------
+        idxs: list(tuple), optional 
+            The pairs of site indices (in terms of ``self.node_list``).
+            Default is None, which means all pairs.
+        max_distance: int, optional
+            Only calculate the pairs whose distance in the tree is no larger than ``max_distance``.
 
-    def calc_2dof_rdm(self, dofs: Union[Tuple[Any, Any], List[Tuple[Any, Any]]]) -> Dict[Tuple[Any, Any], np.ndarray]:
+        Returns
+        -------
+        rdm: Dict
+            the 2-site reduced density matrices with ket indices followed by bra indices.
+            The key is the pair of site indices.
+
+        See Also
+        --------
+        iter_2site_rdm : generate the reduced density matrices without storing them.
+        """
+        return dict(self.iter_2site_rdm(idxs, max_distance))
+
+    def calc_2site_entropy(self, idxs: Union[Tuple[int, int], List[Tuple[int, int]]]=None, max_distance: int=None) -> Dict[tuple, float]:
+        return dict(iter_vn_entropy(self._iter_numpy(self.iter_2site_rdm(idxs, max_distance))))
+
+    def iter_2dof_rdm(self, dofs: Union[Tuple[Any, Any], List[Tuple[Any, Any]]]=None, max_distance: int=None):
+        r""" Iterate over the reduced density matrices of pairs of degrees of freedom without storing them.
 
-        if isinstance(dofs, tuple):
+        Parameters
+        ----------
+        dofs: tuple or list of tuple, optional
+            The pairs of degrees of freedom. Default is None, which means all pairs.
+        max_distance: int, optional
+            Only calculate the pairs whose sites are no farther than ``max_distance`` in the tree.
+
+        Yields
+        ------
+        key : tuple
+            The pair of degrees of freedom.
+        rdm: np.ndarray
+            the reduced density matrix with ket indices followed by bra indices
+        """
+        if dofs is None:
+            dof_list = self.basis.dof_list
+            dofs = [(dof1, dof2) for i, dof1 in enumerate(dof_list) for dof2 in dof_list[i+1:]]
+        elif isinstance(dofs, tuple):
             dofs = [dofs]
         else:
             assert isinstance(dofs, list)
-            
-        rdm_ = {}
-        rdm_1site_idx_lst = []
-        rdm_2site_idx_lst = []
-        for dof_pair in dofs:
-            dof1 = dof_pair[0]
-            dof2 = dof_pair[1]
-
-            site_idx1 = self.basis.dof2idx[dof1]
-            site_idx2 = self.basis.dof2idx[dof2]
-            if site_idx1 == site_idx2:
-                rdm_1site_idx_lst.append(site_idx1)
-                rdm_1site_idx_lst.append(site_idx2)
-            else:
-                rdm_2site_idx_lst.append((site_idx1, site_idx2))
-        if len(rdm_1site_idx_lst) > 0:
-            rdm_1sites = self.calc_1site_rdm(rdm_1site_idx_lst)
-        if len(rdm_2site_idx_lst) > 0:
-            rdm_2sites = self.calc_2site_rdm(rdm_2site_idx_lst)
 
+        # the pairs of dofs grouped by the pairs of sites
+        dofs_1site: Dict[int, List] = {}
+        dofs_2site: Dict[Tuple[int, int], List] = {}
         for dof_pair in dofs:
-            dof1 = dof_pair[0]
-            dof2 = dof_pair[1]
-
-            site_idx1 = self.basis.dof2idx[dof1]
-            site_idx2 = self.basis.dof2idx[dof2]
+            site_idx1 = self.basis.dof2idx[dof_pair[0]]
+            site_idx2 = self.basis.dof2idx[dof_pair[1]]
             if site_idx1 == site_idx2:
-                # two dofs on the same site
-                rdm = rdm_1sites[site_idx1]
-                basis_node: TreeNodeBasis = self.basis.node_list[site_idx1]
-                n_sets = basis_node.n_sets
-                basis_idx1 = basis_node.basis_sets.index(self.basis.dof2basis[dof1])
-                basis_idx2 = basis_node.basis_sets.index(self.basis.dof2basis[dof2])
-                assert basis_idx1 != basis_idx2
+                dofs_1site.setdefault(site_idx1, []).append(dof_pair)
             else:
-                # two dofs on different sites
-                rdm = rdm_2sites[(site_idx1, site_idx2)]
-                basis_node1: TreeNodeBasis = self.basis.node_list[site_idx1]
-                basis_node2: TreeNodeBasis = self.basis.node_list[site_idx2]
-                n_sets = basis_node1.n_sets + basis_node2.n_sets
-                basis_idx1 = basis_node1.basis_sets.index(self.basis.dof2basis[dof1])
-                basis_idx2 = basis_node1.n_sets + basis_node2.basis_sets.index(self.basis.dof2basis[dof2])
-
-            indices = [(0, i) for i in range(n_sets)] * 2
-            indices[basis_idx1] = (1, 0)
-            indices[basis_idx2] = (1, 1)
-            indices[n_sets + basis_idx1] = (1, 2)
-            indices[n_sets + basis_idx2] = (1, 3)
-            res = oe_contract(rdm, indices, [(1, i) for i in range(4)])
-            rdm_[dof_pair] = res
-        return rdm_
-
-    def calc_2dof_entropy(self, dofs: Union[Tuple[Any, Any], List[Tuple[Any, Any]]], rdm: Dict[Any, np.ndarray]=None) -> Dict[Tuple[Any, Any], float]:
+                dofs_2site.setdefault((site_idx1, site_idx2), []).append(dof_pair)
+
+        if dofs_1site:
+            for site_idx, rdm in self.calc_1site_rdm(list(dofs_1site)).items():
+                for dof_pair in dofs_1site[site_idx]:
+                    yield dof_pair, self._trace_2dof_rdm(rdm, dof_pair)
+        for site_pair, rdm in self.iter_2site_rdm(list(dofs_2site), max_distance):
+            for dof_pair in dofs_2site[site_pair]:
+                yield dof_pair, self._trace_2dof_rdm(rdm, dof_pair)
+
+    def _trace_2dof_rdm(self, rdm, dof_pair):
+        # trace out the other degrees of freedom on the site(s) of ``dof_pair``
+        dof1, dof2 = dof_pair
+        site_idx1 = self.basis.dof2idx[dof1]
+        site_idx2 = self.basis.dof2idx[dof2]
+        if site_idx1 == site_idx2:
+            # two dofs on the same site
+            basis_node: TreeNodeBasis = self.basis.node_list[site_idx1]
+            n_sets = basis_node.n_sets
+            basis_idx1 = basis_node.basis_sets.index(self.basis.dof2basis[dof1])
+            basis_idx2 = basis_node.basis_sets.index(self.basis.dof2basis[dof2])
+            assert basis_idx1 != basis_idx2
+        else:
+            # two dofs on different sites
+            basis_node1: TreeNodeBasis = self.basis.node_list[site_idx1]
+            basis_node2: TreeNodeBasis = self.basis.node_list[site_idx2]
+            n_sets = basis_node1.n_sets + basis_node2.n_sets
+            basis_idx1 = basis_node1.basis_sets.index(self.basis.dof2basis[dof1])
+            basis_idx2 = basis_node1.n_sets + basis_node2.basis_sets.index(self.basis.dof2basis[dof2])
+
+        indices = [(0, i) for i in range(n_sets)] * 2
+        indices[basis_idx1] = (1, 0)
+        indices[basis_idx2] = (1, 1)
+        indices[n_sets + basis_idx1] = (1, 2)
+        indices[n_sets + basis_idx2] = (1, 3)
+        return oe_contract(rdm, indices, [(1, i) for i in range(4)])
+
+    def calc_2dof_rdm(self, dofs: Union[Tuple[Any, Any], List[Tuple[Any, Any]]]=None, max_distance: int=None) -> Dict[Tuple[Any, Any], np.ndarray]:
+        r""" Calculate the reduced density matrices of pairs of degrees of freedom.
+        See :meth:`iter_2dof_rdm` for the parameters.
+        """
+        return dict(self.iter_2dof_rdm(dofs, max_distance))
+
+    def calc_2dof_entropy(self, dofs: Union[Tuple[Any, Any], List[Tuple[Any, Any]]]=None, rdm: Dict[Any, np.ndarray]=None,
+                          max_distance: int=None) -> Dict[Tuple[Any, Any], float]:
         if rdm is None:
-            rdm = self.calc_2dof_rdm(dofs)
-        
-        entropy = {key: calc_vn_entropy_dm(dm) for key, dm in rdm.items()}
-        return entropy
+            rdm = self.iter_2dof_rdm(dofs, max_distance)
+        else:
+            rdm = rdm.items()
+        return dict(iter_vn_entropy(self._iter_numpy(rdm)))
 
-    def calc_2dof_mutual_info(self, dofs: Union[Tuple[Any, Any], List[Tuple[Any, Any]]], rdm_2dof: Dict[Any, np.ndarray]=None) -> Dict[Tuple[Any, Any], float]:
+    @staticmethod
+    def _iter_numpy(rdms):
+        for key, dm in rdms:
+            yield key, asnumpy(dm)
+
+    def calc_2dof_mutual_info(self, dofs: Union[Tuple[Any, Any], List[Tuple[Any, Any]]]=None, rdm_2dof: Dict[Any, np.ndarray]=None,
+                              max_distance: int=None) -> Dict[Tuple[Any, Any], float]:
         r"""
         Calculate mutual information between two DOFs.
 
@@ -1252,13 +1480,19 @@ class TTNS(TTNBase):
 
         See Chemical Physics 323 (2006) 519–531
 
+        The reduced density matrices are generated by :meth:`iter_2dof_rdm`
+        and diagonalized in batches, so they are never stored at the same time.
+
         Returns
         -------
         mutual_info : float
             mutual information between the two DOFs
         mutual_infos : Dict[Any, float]
         """
-        if isinstance(dofs, tuple):
+        if dofs is None:
+            dof_list = self.basis.dof_list
+            dofs = [(dof1, dof2) for i, dof1 in enumerate(dof_list) for dof2 in dof_list[i+1:]]
+        elif isinstance(dofs, tuple):
             dofs = [dofs]
         else:
             assert isinstance(dofs, list)
@@ -1268,12 +1502,12 @@ class TTNS(TTNBase):
         for dof_pair in dofs:
             dofs_lst.append(dof_pair[0])
             dofs_lst.append(dof_pair[1])
-        entropy_1dof = self.calc_1dof_entropy(dofs_lst)
-        entropy_2dof = self.calc_2dof_entropy(dofs, rdm_2dof)
-        for dof_pair in dofs:
+        entropy_1dof = self.calc_1dof_entropy(list(dict.fromkeys(dofs_lst)))
+        entropy_2dof = self.calc_2dof_entropy(dofs, rdm_2dof, max_distance)
+        for dof_pair, entropy in entropy_2dof.items():
             dof1 = dof_pair[0]
             dof2 = dof_pair[1]
-            mutual_info = (entropy_1dof[dof1] + entropy_1dof[dof2] - entropy_2dof[dof_pair]) / 2
+            mutual_info = (entropy_1dof[dof1] + entropy_1dof[dof2] - entropy) / 2
             mutual_infos[dof_pair] = mutual_info
 
         entropy_tuple = (entropy_1dof, entropy_2dof)
@@ -1338,8 +1572,8 @@ class TTNS(TTNBase):
             indices1 = []
             indices2 = []
             for i, (dim1, dim2) in enumerate(zip(node1.shape, node2.shape)):
-                is_physical_idx = len(node1.children) <= i and i != node1.tensor.ndim - 1
-                is_parent_idx = i == node1.tensor.ndim - 1
+                is_physical_idx = len(node1.children) <= i and i != node1.ndim - 1
+                is_parent_idx = i == node1.ndim - 1
                 if is_physical_idx or (is_parent_idx and node1 is self.root):
                     assert dim1 == dim2
                     new_shape.append(dim1)
@@ -1350,7 +1584,7 @@ class TTNS(TTNBase):
                     new_shape.append(dim1 + dim2)
                     indices1.append(slice(0, dim1))
                     indices2.append(slice(dim1, dim1 + dim2))
-            dtype = np.promote_types(node1.tensor.dtype, node2.tensor.dtype)
+            dtype = np.promote_types(node1.dtype, node2.dtype)
             new_node.tensor = np.zeros(new_shape, dtype=dtype)
             indices1 = tuple(indices1)
             indices2 = tuple(indices2)
@@ -1407,6 +1641,7 @@ class TTNS(TTNBase):
         # node tensor and qn not set
         new = self.__class__(self.basis)
         new.coeff = self.coeff
+        new.block_sparse = self.block_sparse
         new.optimize_config = self.optimize_config.copy()
         new.evolve_config = self.evolve_config.copy()
         new.compress_config = self.compress_config.copy()
@@ -1468,7 +1703,8 @@ class TTNS(TTNBase):
         return res
 
     def update_2site(self, node, tensor, m: Union[int, List[int]] = None, percent: float = 0, cano_parent: bool = True):
-        """cano_parent: set canonical center at parent. to_right = True"""
+        """cano_parent: set canonical center at parent. to_right = True.
+        ``tensor`` could be a ``BlockSparseTensor`` with the legs of ``merge_with_parent``"""
 
         if self.compress_config.bonddim_should_set:
             self.compress_config.set_bonddim(len(self.node_list) + 1)
@@ -1476,8 +1712,12 @@ class TTNS(TTNBase):
         parent = node.parent
         assert parent is not None
         qnbigl, qnbigr, _ = self.get_qnmat(node, include_parent=True)
-        dim1 = np.prod(qnbigl.shape)
-        tensor = asnumpy(tensor.reshape(dim1, -1))
+        if isinstance(tensor, BlockSparseTensor):
+            # the parent bond of the parent carries the R-block quantum number
+            tensor = tensor.flip_leg(-1, self.qntot)
+        else:
+            dim1 = np.prod(qnbigl.shape)
+            tensor = asnumpy(tensor.reshape(dim1, -1))
         # u for snode and v for parent
         # duplicate with MatrixProduct._udpate_mps. Should consider merging when doing e.g. state averaged algorithm.
         u, su, qnlnew, v, sv, qnrnew = svd_qn(tensor, qnbigl, qnbigr, self.qntot)
@@ -1507,7 +1747,7 @@ class TTNS(TTNBase):
         else:
             node.qn = self.qntot - msqn
         assert len(node.qn) == node.shape[-1]
-        shape = list(parent.tensor.shape)
+        shape = list(parent.shape)
         ichild = parent.children.index(node)
         del shape[ichild]
         shape = [-1] + shape
@@ -1548,11 +1788,11 @@ class TTNS(TTNBase):
         vn_entropy: np.ndarray = self.calc_bond_entropy()
         print_as_tree(vn_entropy, self.adj_matrix, print_function)
 
-    def dump(self, fname, other_attrs=None):
+    def dump(self, fname, other_attrs=None, fmt="npz"):
         if other_attrs is None:
             other_attrs = []
         other_attrs = other_attrs + ["coeff"]
-        super().dump(fname, other_attrs)
+        super().dump(fname, other_attrs, fmt)
 
     @property
     def bond_dims_exact(self) -> np.ndarray:
@@ -1577,93 +1817,160 @@ class TTNS(TTNBase):
 class TTNEnviron(Tree):
     """
     A tree whose tree node is ``TreeNodeEnviron``.
+
+    The environments are built level by level: from the leaves to the root for the environments of the children
+    and from the root to the leaves for the environments of the parent.
+    The environments of the same level are independent and are built in parallel if ``executor`` is provided.
+
+    After the TTNS is updated, ``update_1bond``, ``update_1site`` and ``update_2site`` mark the environments
+    depending on the updated nodes as stale. The stale environments are rebuilt only when they are required by
+    ``ensure_1bond``, ``ensure_1site`` or ``ensure_2site`` before constructing the local operators.
+
+    If ``block_sparse`` is set, the environments are stored as
+    :class:`~renormalizer.mps.block_sparse.BlockSparseTensor` and only the blocks allowed by the symmetry
+    are contracted. The bra bond of the environments is in the opposite direction of the ket bond
+    and the operator bond.
     """
-    def __init__(self, ttns: TTNS, ttno: TTNO, build_environ=True):
+    def __init__(self, ttns: TTNS, ttno: TTNO, build_environ=True, executor: Executor = None, block_sparse: bool = False):
         self.basis_ttns = ttns.basis
         self.basis_ttno = ttno.basis
         enodes: List[TreeNodeEnviron] = [TreeNodeEnviron() for _ in range(ttns.size)]
         copy_connection(ttns.node_list, enodes)
         super().__init__(enodes[0])
         assert self.root.parent is None
-        self.root.environ_parent = np.array([1], dtype=backend.real_dtype).reshape([1, 1, 1])
+        self.block_sparse = block_sparse
+        if not block_sparse:
+            self.root.environ_parent = np.array([1], dtype=backend.real_dtype).reshape([1, 1, 1])
+        else:
+            qns = [ttns.root.qn, ttno.root.qn, ttns.root.qn]
+            self.root.environ_parent = BlockSparseTensor.ones_like_boundary(qns, [-1, 1, 1], backend.real_dtype)
+        for enode in self.node_list:
+            enode.environ_children = [None] * len(enode.children)
         # tensor node to basis node. todo: remove duplication?
         self.tn2dofs_ttns = {tn: bn.dofs for tn, bn in zip(self.node_list, self.basis_ttns.node_list)}
         self.tn2dofs_ttno = {tn: bn.dofs for tn, bn in zip(self.node_list, self.basis_ttno.node_list)}
+        # the nodes whose environment to the parent is stale
+        self._stale_children: Set[TreeNodeEnviron] = set()
+        # the nodes whose environment from the parent is stale
+        self._stale_parent: Set[TreeNodeEnviron] = set()
         if build_environ:
-            self.build_children_environ(ttns, ttno)
-            self.build_parent_environ(ttns, ttno)
+            self.build_children_environ(ttns, ttno, executor)
+            self.build_parent_environ(ttns, ttno, executor)
 
-    def build_children_environ(self, ttns, ttno):
+    def build_children_environ(self, ttns, ttno, executor: Executor = None):
         # first run, children environment to the parent.
         # set enode.environ_children
-        snodes: List[TreeNodeTensor] = ttns.postorder_list()
-        for snode in snodes:
-            self.build_children_environ_node(snode, ttns, ttno)
-
-    def build_parent_environ(self, ttns, ttno):
+        # the height of the node. The nodes of the same height are independent
+        height = {}
+        for snode in ttns.postorder_list():
+            height[snode] = max([height[child] + 1 for child in snode.children], default=0)
+        for level in range(max(height.values()) + 1):
+            snodes = [snode for snode in ttns.node_list if height[snode] == level]
+            _map(executor, lambda snode: self.build_children_environ_node(snode, ttns, ttno), snodes)
+
+    def build_parent_environ(self, ttns, ttno, executor: Executor = None):
         # second run, parent environment to children
         # set enode.environ_parent
-        snodes: List[TreeNodeTensor] = ttns.node_list
-        for snode in snodes:
-            for ichild in range(len(snode.children)):
-                self.build_parent_environ_node(snode, ichild, ttns, ttno)
+        snodes: List[TreeNodeTensor] = [ttns.root]
+        while snodes:
+            tasks = [(snode, ichild) for snode in snodes for ichild in range(len(snode.children))]
+            _map(executor, lambda task: self.build_parent_environ_node(task[0], task[1], ttns, ttno), tasks)
+            snodes = [child for snode in snodes for child in snode.children]
 
     def update_1bond(self, snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO):
         # update environ for the bond between snode and snode.parent
-        self.build_children_environ_node(snode, ttns, ttno)
-        self.build_parent_environ_node(snode.parent, snode.idx_as_child, ttns, ttno)
+        self._mark_stale(snode, ttns)
+        self._mark_stale(snode.parent, ttns)
 
     def update_1site(self, snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO):
         # update environ based on snode
-        self.build_children_environ_node(snode, ttns, ttno)
-        for ichild in range(len(snode.children)):
-            self.build_parent_environ_node(snode, ichild, ttns, ttno)
+        self._mark_stale(snode, ttns)
 
     def update_2site(self, snode, ttns, ttno):
         # update environ based on snode and its parent
-        self.build_children_environ_node(snode, ttns, ttno)
-        self.build_children_environ_node(snode.parent, ttns, ttno)
-        for ichild in range(len(snode.parent.children)):
-            self.build_parent_environ_node(snode.parent, ichild, ttns, ttno)
-        for ichild in range(len(snode.children)):
-            self.build_parent_environ_node(snode, ichild, ttns, ttno)
+        self._mark_stale(snode, ttns)
+        self._mark_stale(snode.parent, ttns)
+
+    def ensure_1bond(self, snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO):
+        # the environments for the bond between snode and snode.parent are up to date
+        enode = self.node_list[ttns.node_idx[snode]]
+        self._ensure_to_parent(enode, ttns, ttno)
+        self._ensure_from_parent(enode, ttns, ttno)
+
+    def ensure_1site(self, snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO):
+        # the environments for snode are up to date
+        enode = self.node_list[ttns.node_idx[snode]]
+        for echild in enode.children:
+            self._ensure_to_parent(echild, ttns, ttno)
+        self._ensure_from_parent(enode, ttns, ttno)
+
+    def ensure_2site(self, snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO):
+        # the environments for snode and its parent are up to date
+        enode = self.node_list[ttns.node_idx[snode]]
+        for echild in enode.children + enode.parent.children:
+            if echild is not enode:
+                self._ensure_to_parent(echild, ttns, ttno)
+        self._ensure_from_parent(enode.parent, ttns, ttno)
+
+    def _mark_stale(self, snode: TreeNodeTensor, ttns: TTNS):
+        # mark the environments depending on snode as stale
+        enode = self.node_list[ttns.node_idx[snode]]
+        ancestors = set()
+        while enode is not None:
+            ancestors.add(enode)
+            if enode.parent is not None:
+                self._stale_children.add(enode)
+            enode = enode.parent
+        self._stale_parent.update(enode for enode in self.node_list if enode not in ancestors)
+
+    def _ensure_to_parent(self, enode: TreeNodeEnviron, ttns: TTNS, ttno: TTNO):
+        # rebuild the environment from enode to its parent if stale
+        stack = [enode]
+        stale = []
+        while stack:
+            enode = stack.pop()
+            if enode in self._stale_children:
+                stale.append(enode)
+                stack.extend(enode.children)
+        # children first
+        for enode in reversed(stale):
+            self.build_children_environ_node(ttns.node_list[self.node_idx[enode]], ttns, ttno)
+
+    def _ensure_from_parent(self, enode: TreeNodeEnviron, ttns: TTNS, ttno: TTNO):
+        # rebuild the environment from the parent to enode if stale
+        stale = []
+        while enode in self._stale_parent:
+            stale.append(enode)
+            enode = enode.parent
+        # parent first
+        for enode in reversed(stale):
+            for echild in enode.parent.children:
+                if echild is not enode:
+                    self._ensure_to_parent(echild, ttns, ttno)
+            snode = ttns.node_list[self.node_idx[enode.parent]]
+            self.build_parent_environ_node(snode, enode.idx_as_child, ttns, ttno)
 
     def build_children_environ_node(self, snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO):
         # build the environment from snode to its parent and store the environment in its parent
         if snode.parent is None:
             return
         enode = self.node_list[ttns.node_idx[snode]]
-        onode = ttno.node_list[ttns.node_idx[snode]]
         args = []
         for i, child_tensor in enumerate(enode.environ_children):
             indices = self.get_child_indices(enode, i, ttns, ttno)
             args.extend([child_tensor, indices])
 
-        args.append(snode.tensor.conj())
-        args.append(ttns.get_node_indices(snode, conj=True))
-
-        args.append(onode.tensor)
-        args.append(ttno.get_node_indices(onode))
-
-        args.append(snode.tensor)
-        args.append(ttns.get_node_indices(snode, ttno=ttno))
+        args.extend(self._node_args(snode, ttns, ttno))
 
         # indices for the resulting tensor
         indices = self.get_parent_indices(enode, ttns, ttno)
         args.append(indices)
-        res = oe_contract(*asxp_oe_args(args))
-        if len(enode.parent.environ_children) != len(enode.parent.children):
-            # first run
-            enode.parent.environ_children.append(asnumpy(res))
-        else:
-            # updating
-            ichild = snode.parent.children.index(snode)
-            enode.parent.environ_children[ichild] = asnumpy(res)
+        enode.parent.environ_children[enode.idx_as_child] = self._contract(args)
+        self._stale_children.discard(enode)
 
     def build_parent_environ_node(self, snode: TreeNodeTensor, ichild: int, ttns: TTNS, ttno: TTNO):
         # build the environment from snode to the ith child of snode and store the environment in the child
         enode = self.node_list[ttns.node_idx[snode]]
-        onode = ttno.node_list[ttns.node_idx[snode]]
         args = []
         # children tensor
         for j, child_tensor in enumerate(enode.environ_children):
@@ -1676,21 +1983,36 @@ class TTNEnviron(Tree):
         indices = self.get_parent_indices(enode, ttns, ttno)
         args.extend([enode.environ_parent, indices])
 
-        args.append(snode.tensor.conj())
-        args.append(ttns.get_node_indices(snode, conj=True))
-
-        args.append(onode.tensor)
-        args.append(ttno.get_node_indices(onode))
-
-        args.append(snode.tensor)
-        args.append(ttns.get_node_indices(snode, ttno=ttno))
+        args.extend(self._node_args(snode, ttns, ttno))
 
         # indices for the resulting tensor
         indices = self.get_child_indices(enode, ichild, ttns, ttno)
 
         args.append(indices)
-        res = oe_contract(*asxp_oe_args(args))
-        enode.children[ichild].environ_parent = asnumpy(res)
+        enode.children[ichild].environ_parent = self._contract(args)
+        self._stale_parent.discard(enode.children[ichild])
+
+    def _node_args(self, snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO) -> List:
+        # the bra, the operator and the ket of snode in the interleaved format
+        onode = ttno.node_list[ttns.node_idx[snode]]
+        if self.block_sparse:
+            ket = ttns.to_block_sparse(snode)
+            bra = ket.conj()
+            op = ttno.to_block_sparse(onode)
+        else:
+            ket = snode.tensor
+            bra = ket.conj()
+            op = onode.tensor
+        return [
+            bra, ttns.get_node_indices(snode, conj=True),
+            op, ttno.get_node_indices(onode),
+            ket, ttns.get_node_indices(snode, ttno=ttno),
+        ]
+
+    def _contract(self, args):
+        if self.block_sparse:
+            return block_sparse.contract(*args)
+        return asnumpy(oe_contract(*asxp_oe_args(args)))
 
     def get_child_indices(self, enode, i, ttns, ttno):
         dofs_ttns = self.tn2dofs_ttns[enode]
@@ -1720,6 +2042,20 @@ class TTNEnviron(Tree):
         return indices
 
 
+def environ_executor(n_threads: int):
+    # the thread pool to build the environments of the same level. ``None`` for a single thread
+    if 1 < n_threads:
+        return ThreadPoolExecutor(max_workers=n_threads)
+    return nullcontext()
+
+
+def _map(executor: Executor, func, iterable):
+    # map in the executor if provided. NumPy releases the GIL in BLAS calls
+    if executor is None:
+        return [func(item) for item in iterable]
+    return list(executor.map(func, iterable))
+
+
 def from_mps(mps: Mps) -> Tuple[BasisTree, TTNS, TTNO]:
     # useful function for comparing results with MPS
     mps = mps.copy()
@@ -1769,7 +2105,16 @@ def truncate_tensors(u, s, v, qnl, qnr, m):
 
 def moveaxis(ttns: TTNS, node: TreeNodeTensor, ichild: int):
     # move one of the children indices to the end
+    qnbigl, qnbigr = _moveaxis_qn(ttns, node, ichild)
+    # 2d tensor (node, child)
+    tensor = np.moveaxis(node.tensor, ichild, -1)
+    shape = list(tensor.shape)
+    tensor = tensor.reshape(-1, node.shape[ichild])
+    return qnbigl, qnbigr, tensor, shape
 
+
+def _moveaxis_qn(ttns: TTNS, node: TreeNodeTensor, ichild: int):
+    # the quantum numbers of ``moveaxis``
     # left indices: other children + physical bonds + parent
     qnbigl = np.zeros(ttns.basis.qn_size, dtype=int)
     # other children
@@ -1784,11 +2129,7 @@ def moveaxis(ttns: TTNS, node: TreeNodeTensor, ichild: int):
     qnbigl = add_outer(qnbigl, ttns.qntot - node.qn)
     # right indices: the ith child
     qnbigr = node.children[ichild].qn
-    # 2d tensor (node, child)
-    tensor = np.moveaxis(node.tensor, ichild, -1)
-    shape = list(tensor.shape)
-    tensor = tensor.reshape(-1, node.shape[ichild])
-    return qnbigl, qnbigr, tensor, shape
+    return qnbigl, qnbigr
 
 
 def get_skip_pidx(snode: TreeNodeTensor, ttns: TTNS, ttno: TTNO) -> List[int]:
@@ -7,11 +7,13 @@ import os
 from enum import Enum
 from collections import OrderedDict
 from functools import partial
+from typing import Dict, List, Tuple
 
 from scipy.linalg import logm
 
 from renormalizer.mps import Mpo, Mps, MpDm, ThermalProp, load_thermal_state
-from renormalizer.model import HolsteinModel
+from renormalizer.mps.observable_plan import ObservablePlan
+from renormalizer.model import HolsteinModel, Op
 from renormalizer.utils import TdMpsJob, Quantity, CompressConfig, EvolveConfig
 
 import numpy as np
@@ -20,6 +22,8 @@ logger = logging.getLogger(__name__)
 
 EDGE_THRESHOLD = 1e-4
 
+MEASUREMENTS = ["energy", "rdm", "ph_occupations", "bond_entropy"]
+
 
 class InitElectron(Enum):
     """
@@ -50,6 +54,11 @@ class ChargeDiffusionDynamics(TdMpsJob):
         rdm (bool): whether calculate reduced density matrix and k-space representation for the electron.
             Default is ``False`` because usually the calculation is time consuming.
             Using scheme 4 might partly solve the problem.
+        measure_interval (dict): the interval (in steps) to measure the observables. The keys are
+            ``"energy"``, ``"rdm"``, ``"ph_occupations"`` and ``"bond_entropy"``. The observables not in the dict
+            are measured at every step. The electron occupations are always measured at every step.
+            On skipped steps nothing is appended to the corresponding arrays.
+            For example, ``{"rdm": 10}`` calculates the reduced density matrix at step 0, 10, 20, ...
         dump_dir (str): the directory for logging and numerical result output.
             Also the directory from which to load previous thermal propagated initial state (if exists).
         job_name (str): the name of the calculation job which determines the file name of the logging and numerical result output.
@@ -85,6 +94,21 @@ class ChargeDiffusionDynamics(TdMpsJob):
 
     """
 
+    checkpoint_series = [
+        "evolve_times",
+        "energies",
+        "r_square_array",
+        "e_occupations_array",
+        "ph_occupations_array",
+        "reduced_density_matrices",
+        "k_occupations_array",
+        "eph_vn_entropy_array",
+        "bond_vn_entropy_array",
+        "coherent_length_array",
+    ]
+    # the Hamiltonian with the energy offset of the initial state
+    checkpoint_attrs = ["mpo"]
+
     def __init__(
         self,
         model: HolsteinModel,
@@ -94,6 +118,7 @@ class ChargeDiffusionDynamics(TdMpsJob):
         stop_at_edge: bool = True,
         init_electron=InitElectron.relaxed,
         rdm: bool = False,
+        measure_interval: Dict[str, int] = None,
         dump_dir: str = None,
         job_name: str = None,
     ):
@@ -117,6 +142,15 @@ class ChargeDiffusionDynamics(TdMpsJob):
         self.bond_vn_entropy_array = []
         self.coherent_length_array = []
 
+        if measure_interval is None:
+            measure_interval = {}
+        for key in measure_interval:
+            if key not in MEASUREMENTS:
+                raise ValueError(f"Unknown measurement: {key}. Available: {MEASUREMENTS}")
+        self.measure_interval: Dict[str, int] = measure_interval
+        # the compiled plans for each combination of the observables measured at the same step
+        self._plans: Dict[Tuple[str], Tuple[ObservablePlan, List[int]]] = {}
+
         if dump_dir is not None and job_name is not None:
             self.thermal_dump_path = os.path.join(dump_dir, job_name + '_impdm.npz')
         else:
@@ -198,15 +232,61 @@ class ChargeDiffusionDynamics(TdMpsJob):
         init_mp.canonicalise()
         return init_mp
 
+    def _measured(self, key) -> bool:
+        # the index of the step being processed
+        step = len(self.evolve_times) - 1
+        return step % self.measure_interval.get(key, 1) == 0
+
+    def _observables(self, key) -> List[Op]:
+        e_dofs = self.model.e_dofs
+        if key == "energy":
+            return [self.mpo]
+        elif key == "e_occupations":
+            return [Op(r"a^\dagger a", dof) for dof in e_dofs]
+        elif key == "rdm":
+            # the upper triangle
+            return [Op(r"a^\dagger a", [dof1, dof2]) for idx, dof1 in enumerate(e_dofs) for dof2 in e_dofs[idx:]]
+        elif key == "ph_occupations":
+            return [Op("n", dof) for dof in self.model.v_dofs]
+        else:
+            assert False
+
+    def _get_plan(self, keys: Tuple[str]) -> Tuple[ObservablePlan, List[int]]:
+        # all observables measured at the step share the environments
+        if keys not in self._plans:
+            observables = []
+            offsets = [0]
+            for key in keys:
+                observables.extend(self._observables(key))
+                offsets.append(len(observables))
+            self._plans[keys] = ObservablePlan(self.model, observables), offsets
+        return self._plans[keys]
+
     def process_mps(self, mps):
-        new_energy = mps.expectation(self.mpo)
-        self.energies.append(new_energy)
-        logger.debug(f"Energy: {new_energy}")
-
-        if self.reduced_density_matrices is not None:
-            logger.debug("Calculating reduced density matrix")
-            rdm = mps.calc_edof_rdm()
-            logger.debug("Calculate reduced density matrix finished")
+        keys = []
+        if self._measured("energy"):
+            keys.append("energy")
+        calc_rdm = self.reduced_density_matrices is not None and self._measured("rdm")
+        # the electron occupations are the diagonal of the RDM
+        keys.append("rdm" if calc_rdm else "e_occupations")
+        if self._measured("ph_occupations"):
+            keys.append("ph_occupations")
+        keys = tuple(keys)
+
+        plan, offsets = self._get_plan(keys)
+        expectations = mps.expectations(plan)
+        results = {key: expectations[offsets[i]:offsets[i+1]] for i, key in enumerate(keys)}
+
+        if "energy" in results:
+            new_energy = float(results["energy"][0].real)
+            self.energies.append(new_energy)
+            logger.debug(f"Energy: {new_energy}")
+
+        if calc_rdm:
+            n_e = self.model.n_edofs
+            rdm = np.zeros((n_e, n_e), dtype=complex)
+            rdm[np.triu_indices(n_e)] = results["rdm"]
+            rdm = rdm + np.triu(rdm, k=1).T.conj()
             self.reduced_density_matrices.append(rdm)
 
             # k_space transform matrix
@@ -222,21 +302,19 @@ class ChargeDiffusionDynamics(TdMpsJob):
 
             self.coherent_length_array.append(np.abs(rdm).sum() - np.trace(rdm).real)
 
-        else:
-            rdm = None
-
-        if rdm is not None:
             e_occupations = np.diag(rdm).real
         else:
-            e_occupations = mps.e_occupations
+            e_occupations = results["e_occupations"].real
         self.e_occupations_array.append(e_occupations)
         self.r_square_array.append(calc_r_square(e_occupations))
-        self.ph_occupations_array.append(mps.ph_occupations)
+        if "ph_occupations" in results:
+            self.ph_occupations_array.append(results["ph_occupations"].real)
         logger.info(f"e occupations: {self.e_occupations_array[-1]}")
 
-        bond_vn_entropy = mps.calc_bond_entropy()
-        logger.info(f"bond entropy: {bond_vn_entropy}")
-        self.bond_vn_entropy_array.append(bond_vn_entropy)
+        if self._measured("bond_entropy"):
+            bond_vn_entropy = mps.calc_bond_entropy()
+            logger.info(f"bond entropy: {bond_vn_entropy}")
+            self.bond_vn_entropy_array.append(bond_vn_entropy)
 
     def evolve_single_step(self, evolve_dt):
         old_mps = self.latest_mps
@@ -5,7 +5,7 @@ import os
 
 import scipy.integrate
 
-from renormalizer.mps import MpDm, Mpo, BraKetPair, ThermalProp, load_thermal_state
+from renormalizer.mps import MpDm, Mpo, BraKetPair, ThermalProp, load_thermal_state, evolve_ensemble
 from renormalizer.mps.backend import np
 from renormalizer.utils.constant import mobility2au
 from renormalizer.utils import TdMpsJob, Quantity, EvolveConfig, CompressConfig
@@ -93,6 +93,11 @@ class TransportKubo(TdMpsJob):
         properties (:class:`~renormalizer.property.property.Property`): other properties to calculate during real time evolution.
             Currently only supports Holstein model.
     """
+
+    checkpoint_series = ["evolve_times", "_auto_corr", "_auto_corr_deomposition"]
+    # the Hamiltonian with the energy offset of the initial state
+    checkpoint_attrs = ["h_mpo"]
+
     def __init__(self, model: Model, temperature: Quantity, distance_matrix: np.ndarray = None,
                  insteps: int=1, ievolve_config=None, compress_config=None,
                  evolve_config=None, dump_dir: str=None, job_name: str=None,
@@ -269,19 +274,24 @@ class TransportKubo(TdMpsJob):
             self._auto_corr.append(ft1 + ft2 + ft3 + ft4)
             self._auto_corr_deomposition.append([ft1, ft2, ft3, ft4])
 
+    def get_checkpoint_series(self):
+        series = super().get_checkpoint_series()
+        if self.properties is not None:
+            for prop_str, res in self.properties.prop_res.items():
+                series[f"properties/{prop_str}"] = res
+        return series
+
     def evolve_single_step(self, evolve_dt):
+        # bra and ket are evolved together under the same Hamiltonian
         if self.j_oper2 is None:
             prev_bra_mpdm, prev_ket_mpdm = self.latest_mps
-            prev_ket_mpdm2 = None
-        else:
-            (prev_bra_mpdm, prev_ket_mpdm), (prev_bra_mpdm, prev_ket_mpdm2) = self.latest_mps
-
-        latest_ket_mpdm = prev_ket_mpdm.evolve(self.h_mpo, evolve_dt)
-        latest_bra_mpdm = prev_bra_mpdm.evolve(self.h_mpo, evolve_dt)
-        if self.j_oper2 is None:
+            latest_ket_mpdm, latest_bra_mpdm = evolve_ensemble([prev_ket_mpdm, prev_bra_mpdm], self.h_mpo, evolve_dt)
             return BraKetPair(latest_bra_mpdm, latest_ket_mpdm, self.j_oper)
         else:
-            latest_ket_mpdm2 = prev_ket_mpdm2.evolve(self.h_mpo, evolve_dt)
+            (prev_bra_mpdm, prev_ket_mpdm), (prev_bra_mpdm, prev_ket_mpdm2) = self.latest_mps
+            latest_ket_mpdm, latest_bra_mpdm, latest_ket_mpdm2 = evolve_ensemble(
+                [prev_ket_mpdm, prev_bra_mpdm, prev_ket_mpdm2], self.h_mpo, evolve_dt
+            )
             return BraKetPair(latest_bra_mpdm, latest_ket_mpdm, self.j_oper), \
                    BraKetPair(latest_bra_mpdm, latest_ket_mpdm2, self.j_oper2)
 
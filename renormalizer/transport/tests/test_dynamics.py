@@ -120,6 +120,45 @@ def test_evolve(
     os.remove("test.npz")
 
 
+def test_measure_interval():
+    ph_list = [Phonon.simple_phonon(Quantity(1400, "cm^{-1}"), Quantity(17, "a.u."), 4)]
+    model = HolsteinModel([Mol(Quantity(3.87e-3, "a.u."), ph_list)] * 5, Quantity(0.8, "eV"))
+    ct1 = ChargeDiffusionDynamics(model, stop_at_edge=False, rdm=True)
+    ct1.evolve(2, 6)
+    # the shared plan agrees with the separate measurements
+    mps = ct1.latest_mps
+    assert np.allclose(ct1.energies[-1], mps.expectation(ct1.mpo))
+    assert np.allclose(ct1.reduced_density_matrices[-1], mps.calc_edof_rdm())
+    assert np.allclose(ct1.e_occupations_array[-1], mps.e_occupations)
+    assert np.allclose(ct1.ph_occupations_array[-1], mps.ph_occupations)
+    measure_interval = {"energy": 2, "rdm": 3, "ph_occupations": 4, "bond_entropy": 6}
+    ct2 = ChargeDiffusionDynamics(model, stop_at_edge=False, rdm=True, measure_interval=measure_interval)
+    ct2.evolve(2, 6)
+    assert np.allclose(ct1.e_occupations_array, ct2.e_occupations_array)
+    assert np.allclose(ct1.energies[::2], ct2.energies)
+    assert np.allclose(ct1.reduced_density_matrices[::3], ct2.reduced_density_matrices)
+    assert np.allclose(np.diagonal(ct1.reduced_density_matrices, axis1=1, axis2=2), ct1.e_occupations_array)
+    assert np.allclose(ct1.ph_occupations_array[::4], ct2.ph_occupations_array)
+    assert np.allclose(ct1.bond_vn_entropy_array[::6], ct2.bond_vn_entropy_array)
+    with pytest.raises(ValueError):
+        ChargeDiffusionDynamics(model, measure_interval={"e_occupations": 2})
+
+
+def test_resume(tmp_path):
+    ph_list = [Phonon.simple_phonon(Quantity(1400, "cm^{-1}"), Quantity(17, "a.u."), 4)]
+    model = HolsteinModel([Mol(Quantity(3.87e-3, "a.u."), ph_list)] * 5, Quantity(0.8, "eV"))
+    ct1 = ChargeDiffusionDynamics(model, stop_at_edge=False, dump_dir=str(tmp_path), job_name="test")
+    ct1.enable_checkpoint(compression="gzip")
+    ct1.evolve(2, 5)
+    ct2 = ChargeDiffusionDynamics.resume(ct1.checkpoint.path, model, stop_at_edge=False,
+                                         dump_dir=str(tmp_path), job_name="test")
+    assert ct2.is_similar(ct1)
+    ct1.evolve(2, 5)
+    ct2.evolve(2, 5)
+    assert ct2.is_similar(ct1)
+    assert_iterable_equal(ct1.get_dump_dict(), ct2.get_dump_dict())
+
+
 @pytest.mark.parametrize(
     "mol_num, j_constant_value, elocalex_value, ph_info, ph_phys_dim, evolve_dt, nsteps",
     ([3, 1, 3.87e-3, [[1e-5, 1e-5]], 2, 2, 50],),
@@ -2,7 +2,8 @@
 # Author: Jiajun Ren <jiajunren0522@gmail.com>
 
 from renormalizer.utils.quantity import Quantity
-from renormalizer.utils.utils import sizeof_fmt, cached_property, calc_vn_entropy, calc_vn_entropy_dm
+from renormalizer.utils.utils import sizeof_fmt, cached_property, calc_vn_entropy, calc_vn_entropy_dm, calc_vn_entropy_dms, \
+    iter_vn_entropy
 from renormalizer.utils.configs import (
     CompressCriteria,
     CompressConfig,
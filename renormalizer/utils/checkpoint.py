@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import pickle
+from typing import Dict, List
+
+import numpy as np
+
+from renormalizer.utils.utils import lazy_import
+
+h5py = lazy_import("h5py")
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    r"""
+    Append-only checkpoint of a :class:`~renormalizer.utils.TdMpsJob` in an HDF5 file.
+
+    The layout of the file:
+
+    * ``/series/<name>``: the per-step results, such as ``evolve_times``, stored as extendable arrays.
+      Only the new entries are written for each checkpoint.
+    * ``/attrs/<name>``: the attributes required to resume the job (e.g. the MPO with the energy offset).
+      Written only once.
+    * ``/mps/<step>``: the (pickled) snapshot of ``latest_mps`` at the step, optionally compressed.
+      Only used if all snapshots are kept.
+
+    If only the latest snapshot is kept, the snapshots are written alternately to the two files
+    ``<path>.mps0`` and ``<path>.mps1`` instead. Each of them is written to a temporary file and then
+    moved in place by ``os.replace``, so the snapshot of the last committed step is never overwritten
+    and the disk usage does not grow with the number of steps.
+    HDF5 does not reclaim the space of deleted datasets, so the snapshots are not kept in the main file.
+
+    The step, the length of the series and the snapshot file are committed only after all data of the step
+    is written, so the job can always be resumed from the last complete step.
+
+    Args:
+        path (str): the path of the HDF5 file.
+        compression (str): the HDF5 compression filter for the MPS snapshots, such as ``"gzip"`` and ``"lzf"``.
+            Default is ``None``.
+        keep_mps (str): ``"one"``: keep only the latest snapshot. ``"all"``: keep all snapshots.
+        interval (int): write the checkpoint every ``interval`` steps.
+    """
+
+    def __init__(self, path: str, compression: str = None, keep_mps: str = "one", interval: int = 1):
+        if keep_mps not in ["one", "all"]:
+            raise ValueError(f"keep_mps should be 'one' or 'all'. Got {keep_mps}")
+        self.path = path
+        self.compression = compression
+        self.keep_mps = keep_mps
+        self.interval = interval
+
+    @classmethod
+    def open(cls, path: str) -> "Checkpoint":
+        """
+        Open an existing checkpoint file with the settings stored in the file.
+        """
+        with h5py.File(path, "r") as f:
+            compression = f.attrs["compression"] or None
+            return cls(path, compression, f.attrs["keep_mps"], int(f.attrs["interval"]))
+
+    @property
+    def last_step(self):
+        """
+        The last complete step in the file. ``None`` if nothing has been committed.
+        """
+        try:
+            with h5py.File(self.path, "r") as f:
+                return _get_last_step(f)
+        except FileNotFoundError:
+            return None
+
+    def write(self, step: int, mps, series: Dict[str, List], attrs: Dict):
+        """
+        Write the checkpoint of a step.
+
+        Args:
+            step (int): the index of the step.
+            mps: the MPS (or any picklable object) at the step.
+            series (dict): the per-step results. Only the entries not in the file are written.
+            attrs (dict): attributes to store. Written only if the attribute is not in the file.
+        """
+        with h5py.File(self.path, "a") as f:
+            f.attrs["compression"] = self.compression or ""
+            f.attrs["keep_mps"] = self.keep_mps
+            f.attrs["interval"] = self.interval
+            lengths = _get_lengths(f)
+
+            series_group = f.require_group("series")
+            for name, values in series.items():
+                _append_series(series_group, name, values, lengths.get(name, 0))
+                lengths[name] = len(values)
+
+            attrs_group = f.require_group("attrs")
+            for name, value in attrs.items():
+                if name not in attrs_group:
+                    attrs_group.create_dataset(name, data=_to_bytes(value))
+
+            if self.keep_mps == "all":
+                mps_group = f.require_group("mps")
+                key = _step_key(step)
+                if key in mps_group:
+                    del mps_group[key]
+                mps_group.create_dataset(key, data=_to_bytes(mps), compression=self.compression)
+            else:
+                # the slot not used by the last committed step
+                slot = 1 - int(f.attrs.get("mps_slot", 1))
+                self._write_snapshot(slot, step, mps)
+                f.attrs["mps_slot"] = slot
+
+            # commit
+            f.attrs["lengths"] = json.dumps(lengths)
+            f.attrs["last_step"] = step
+            f.flush()
+
+    def snapshot_path(self, slot: int) -> str:
+        """
+        The path of the snapshot file if only the latest snapshot is kept.
+        """
+        return f"{self.path}.mps{slot}"
+
+    def _write_snapshot(self, slot, step, mps):
+        path = self.snapshot_path(slot)
+        tmp_path = path + ".tmp"
+        with h5py.File(tmp_path, "w") as f:
+            f.attrs["step"] = step
+            f.create_dataset("mps", data=_to_bytes(mps), compression=self.compression)
+        os.replace(tmp_path, path)
+
+    def load(self, step: int = None):
+        """
+        Load the checkpoint.
+
+        Args:
+            step (int): the step of the MPS snapshot. Default is the last complete step.
+
+        Returns:
+            step, mps, series, attrs
+        """
+        with h5py.File(self.path, "r") as f:
+            last_step = _get_last_step(f)
+            if last_step is None:
+                raise ValueError(f"No complete step found in {self.path}")
+            if step is None:
+                step = last_step
+            if "mps_slot" in f.attrs:
+                with h5py.File(self.snapshot_path(int(f.attrs["mps_slot"])), "r") as f_mps:
+                    if int(f_mps.attrs["step"]) != step:
+                        raise ValueError(f"The snapshot of step {step} is not kept in {self.path}")
+                    mps = _from_bytes(f_mps["mps"])
+            else:
+                mps = _from_bytes(f["mps"][_step_key(step)])
+
+            series = {}
+            for name, length in _get_lengths(f).items():
+                if length == 0:
+                    series[name] = []
+                    continue
+                dataset = f["series"][name]
+                if dataset.attrs.get("pickled", False):
+                    series[name] = [_from_bytes(v) for v in dataset[:length]]
+                else:
+                    series[name] = list(dataset[:length])
+
+            attrs = {name: _from_bytes(dataset) for name, dataset in f.get("attrs", {}).items()}
+        return step, mps, series, attrs
+
+
+def _step_key(step):
+    return f"{step:08d}"
+
+
+def _get_last_step(f):
+    if "last_step" not in f.attrs:
+        return None
+    return int(f.attrs["last_step"])
+
+
+def _get_lengths(f) -> Dict[str, int]:
+    if "lengths" not in f.attrs:
+        return {}
+    return json.loads(f.attrs["lengths"])
+
+
+def _to_bytes(obj):
+    return np.frombuffer(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+
+
+def _from_bytes(data):
+    return pickle.loads(np.asarray(data).tobytes())
+
+
+def _append_series(group, name, values, n_committed):
+    if name in group:
+        dataset = group[name]
+        # drop the entries that are not committed
+        dataset.resize(min(n_committed, dataset.shape[0]), axis=0)
+        new_values = values[dataset.shape[0]:]
+        if len(new_values) == 0:
+            return
+        if dataset.attrs.get("pickled", False):
+            _extend(dataset, _pickled_array(new_values))
+            return
+        array = _regular_array(new_values)
+        if array is not None and array.shape[1:] == dataset.shape[1:] \
+                and np.can_cast(array.dtype, dataset.dtype, casting="safe"):
+            _extend(dataset, array)
+            return
+        # not compatible with the dataset (e.g., complex values in a real dataset). Rewrite the series
+        del group[name]
+    _create_series(group, name, values)
+
+
+def _create_series(group, name, values):
+    if len(values) == 0:
+        return
+    array = _regular_array(values)
+    if array is None:
+        dataset = group.create_dataset(name, data=_pickled_array(values), maxshape=(None,), chunks=True)
+        dataset.attrs["pickled"] = True
+    else:
+        group.create_dataset(name, data=array, maxshape=(None,) + array.shape[1:], chunks=True)
+
+
+def _extend(dataset, array):
+    n = dataset.shape[0]
+    dataset.resize(n + len(array), axis=0)
+    if array.dtype == object:
+        # variable-length entries are written one by one
+        for i, v in enumerate(array):
+            dataset[n + i] = v
+    else:
+        dataset[n:] = array
+
+
+def _regular_array(values):
+    # values with the same shape and numeric dtype. Otherwise None.
+    try:
+        array = np.array(values)
+    except ValueError:
+        return None
+    if array.dtype.kind not in "biufc" or len(array) == 0:
+        return None
+    return array
+
+
+def _pickled_array(values):
+    array = np.empty(len(values), dtype=h5py.vlen_dtype(np.uint8))
+    for i, v in enumerate(values):
+        array[i] = _to_bytes(v)
+    return array
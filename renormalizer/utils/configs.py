@@ -109,6 +109,13 @@ class CompressConfig:
 
     dump_matrix_dir : str, optional
         The directory to dump matrix when matrix is larger than ``dump_matrix_size``.
+        Also used to dump the environments when ``environ_mem_limit`` is exceeded.
+
+    environ_mem_limit : int or float, optional
+        The total bytes threshold of the environments held in memory by :class:`~renormalizer.mps.lib.Environ`.
+        When exceeded, the least recently used environments are dumped to ``dump_matrix_dir``
+        and are loaded back (possibly in advance along the sweep direction) upon access.
+        The default is ``np.inf``, i.e., all environments are kept in memory.
 
     ofs : `OFS`, optional
         Whether optimize the DOF ordering by OFS. The default value is ``None`` which means does not perform OFS.
@@ -118,6 +125,24 @@ class CompressConfig:
         for and only for ab initio Hamiltonian constructed by the experimental
         ``renormalizer.model.h_qc.qc_model``. Default is ``False``.
 
+    svd_method : str, optional
+        The SVD algorithm in `MatrixProduct.compress`. The default is ``exact``.
+
+        - ``exact``: the full thin SVD of each quantum number block.
+        - ``randomized``: the randomized truncated SVD of each block when the number
+          of singular values to keep is fixed in advance,
+          that is, ``criteria`` is `CompressCriteria.fixed` or the bond dimension is set temporarily.
+          Otherwise the exact SVD is used, because the threshold criteria requires all singular values.
+          Falls back to the exact SVD for small blocks and flat spectra.
+          Useful when the bond dimension to compress is much larger than the result,
+          such as after `Mpo.apply`.
+          Only the leading singular values are computed, so the singular values
+          recorded by the compression (for example, for the bond entropy) are truncated.
+
+    contract_algo : str, optional
+        The default algorithm of `Mpo.contract` to compress ``mpo @ mps``.
+        The default is ``svd``. See `Mpo.contract` for the available algorithms.
+
     See Also
     --------
     CompressCriteria : Compression criteria
@@ -136,8 +161,11 @@ class CompressConfig:
         vguess_m = (5,5),
         dump_matrix_size = np.inf,
         dump_matrix_dir = "./",
+        environ_mem_limit = np.inf,
         ofs: OFS = None,
-        ofs_swap_jw: bool = False
+        ofs_swap_jw: bool = False,
+        svd_method: str = "exact",
+        contract_algo: str = "svd",
     ):
         # two sets of criteria here: threshold and max_bonddimension
         # `criteria` is to determine which to use
@@ -170,10 +198,16 @@ class CompressConfig:
 
         self.dump_matrix_size = dump_matrix_size
         self.dump_matrix_dir = dump_matrix_dir
+        self.environ_mem_limit = environ_mem_limit
 
         self.ofs: OFS = ofs
         self.ofs_swap_jw: bool = ofs_swap_jw
 
+        if svd_method not in ["exact", "randomized"]:
+            raise ValueError(f"Unknown svd method {svd_method}")
+        self.svd_method: str = svd_method
+        self.contract_algo: str = contract_algo
+
     @property
     def threshold(self):
         return self._threshold
@@ -204,6 +238,15 @@ class CompressConfig:
         bond_idx = idx + 1 if left else idx
         return min(self.max_dims[bond_idx], len(sigma))
 
+    def max_m_trunc(self, idx: int, left: bool):
+        # the upper bound of the truncated bond dimension. ``None`` if not known before the SVD.
+        # For `CompressCriteria.both` the bound is known, yet the threshold criteria requires the norm
+        # of all singular values, so it is not regarded as known either
+        if self.criteria is not CompressCriteria.fixed:
+            return None
+        assert self.max_dims is not None
+        return self.max_dims[idx + 1 if left else idx]
+
     def compute_m_trunc(self, sigma: np.ndarray, idx: int, left: bool) -> int:
         if self.criteria is CompressCriteria.threshold:
             trunc = self._threshold_m_trunc(sigma)
@@ -273,6 +316,26 @@ class OptimizeConfig:
         CompressCriteria.fixed with the int as the max_bonddim.
         The second element is the percent to choose the renormalied basis from
         each symmetry block to avoid trapping into local minimum.
+
+        ``precision`` is the floating point precision of each sweep in the procedure,
+        ``"float32"`` or ``"float64"``. The MPS, the MPO and the environments are
+        cast when the precision changes, so the early sweeps can run in single precision
+        and the final sweeps refine the result in double precision.
+        The sweeps beyond the list and ``None`` entries use the precision of the backend.
+        Default is ``None``, all sweeps in the precision of the backend.
+
+        If ``sparse_mpo`` is ``True``, the MPO sites are contracted as
+        :class:`~renormalizer.mps.sparse_mo.SparseMo` in the environment updates
+        and, with the ``"1site"`` method, in the iterative eigensolver.
+        If ``block_sparse`` is ``True``, the environments, the MPO sites, the trial vectors of the
+        iterative eigensolver and the optimized sites are :class:`~renormalizer.mps.block_sparse.BlockSparseTensor`
+        and only the blocks allowed by the symmetry are contracted.
+        The direct eigensolver for small sites still works with the dense arrays.
+        Both are only used for a single MPO without ``omega`` and can not be set at the same time.
+        Default is ``False``.
+
+        ``environ_n_threads`` is the number of threads to build the environments of a tree tensor network
+        in :func:`~renormalizer.tn.gs.optimize_ttns`. Default is 1.
     """
 
     def __init__(self, procedure=None):
@@ -292,6 +355,25 @@ class OptimizeConfig:
         # inverse = 1.0 or -1.0
         # -1.0 to get the largest eigenvalue
         self.inverse = 1.0
+        # the precision of each sweep. For example ``["float32"] * 3 + ["float64"] * 2``
+        self.precision = None
+        # contract the MPO sites as a list of local operators
+        self.sparse_mpo = False
+        # contract the symmetry allowed blocks only
+        self.block_sparse = False
+        # number of threads to build the environments of the same level of a tree.
+        # NumPy releases the GIL in BLAS calls
+        self.environ_n_threads: int = 1
+
+    def sweep_dtype(self, isweep: int, default_dtype):
+        """
+        The real dtype of the ``isweep`` th sweep.
+        """
+        if self.precision is None or len(self.precision) <= isweep or self.precision[isweep] is None:
+            return default_dtype
+        if self.precision[isweep] not in ["float32", "float64"]:
+            raise ValueError(f"precision should be 'float32' or 'float64'. Got {self.precision[isweep]}")
+        return np.dtype(self.precision[isweep]).type
 
     def copy(self):
         new = self.__class__.__new__(self.__class__)
@@ -384,6 +466,12 @@ class EvolveConfig:
         self.force_ovlp: bool = force_ovlp
         # auto switch between mu_vmf and vmf for a higher efficiency
         self.vmf_auto_switch: bool = True
+        # number of threads to evaluate the time derivatives of the sites in VMF.
+        # NumPy releases the GIL in BLAS calls.
+        # Consider limiting the BLAS threads when using multiple threads here
+        self.vmf_n_threads: int = 1
+        # number of threads to build the environments of the same level of a tree in TDVP-PS/PS2
+        self.environ_n_threads: int = 1
 
     @property
     def is_tdvp(self):
@@ -4,9 +4,11 @@ from itertools import product
 from typing import List
 
 import numpy as np
-import qutip
 
 from renormalizer.model import Op
+from renormalizer.utils.utils import lazy_import
+
+qutip = lazy_import("qutip")
 
 
 def get_clist(nsites, ph_levels):
@@ -7,18 +7,32 @@ import json
 import os
 import logging
 from datetime import datetime
+from typing import Dict, List
 
 import numpy as np
 
 # this file shouldn't import anything from the `mps` module. IOW it's mps agnostic
 from renormalizer.utils.configs import EvolveConfig
+from renormalizer.utils.checkpoint import Checkpoint
+from renormalizer.utils.utils import get_git_commit_hash
 
 logger = logging.getLogger(__name__)
 
 
 class TdMpsJob(object):
+
+    #: attributes of the per-step results (lists growing by one entry for each step).
+    #: Stored as time series in the checkpoint.
+    checkpoint_series: List[str] = ["evolve_times"]
+    #: attributes set by ``init_mps`` that are required to resume the job.
+    checkpoint_attrs: List[str] = []
+
+    # the checkpoint file to resume from. Set by `resume`
+    _resume_path: str = None
+
     def __init__(self, evolve_config: EvolveConfig = None, dump_mps: str=None, dump_dir: str=None, job_name: str=None):
         logger.info(f"Creating TDMPS job. dump_dir: {dump_dir}. job_name: {job_name}")
+        logger.info("Git Commit Hash: %s", get_git_commit_hash())
         if evolve_config is None:
             logger.debug("using default evolve config")
             self.evolve_config: EvolveConfig = EvolveConfig()
@@ -39,6 +53,11 @@ class TdMpsJob(object):
         self._dump_mps = None
         self.dump_dir = dump_dir
         self.job_name = job_name
+        self.checkpoint: Checkpoint = None
+        if self._resume_path is not None:
+            self._load_checkpoint(self._resume_path)
+            logger.info("TDMPS job resumed.")
+            return
         mps = self.init_mps()
         logger.info(f"Initial MPS: {str(mps)}")
         if mps is None:
@@ -47,6 +66,78 @@ class TdMpsJob(object):
         self.process_mps(mps)
         logger.info("TDMPS job created.")
 
+    @classmethod
+    def resume(cls, path: str, *args, **kwargs):
+        """
+        Resume the job from the last complete step in the checkpoint file.
+        ``init_mps`` and ``process_mps`` for the initial state are not called and the job continues
+        to write checkpoints to the file.
+
+        Args:
+            path (str): the path of the checkpoint file. See :meth:`enable_checkpoint`.
+            args, kwargs: the arguments to construct the job.
+
+        Returns:
+            the resumed job.
+        """
+        job = cls.__new__(cls)
+        job._resume_path = path
+        job.__init__(*args, **kwargs)
+        return job
+
+    def enable_checkpoint(self, path: str = None, compression: str = None, keep_mps: str = "one", interval: int = 1):
+        """
+        Write checkpoints of the job during the evolution, and the current state is written immediately.
+        The job can be resumed by :meth:`resume` from the checkpoint.
+
+        Args:
+            path (str): the path of the HDF5 checkpoint file.
+                Default is ``job_name + "_checkpoint.h5"`` in ``dump_dir``.
+            compression (str): the HDF5 compression filter for the MPS snapshots, such as ``"gzip"``.
+            keep_mps (str): ``"one"``: keep only the latest MPS snapshot, which is stored next to the checkpoint
+                file in ``path + ".mps0"`` and ``path + ".mps1"``. ``"all"``: keep all snapshots in the checkpoint file.
+            interval (int): write the checkpoint every ``interval`` steps.
+        """
+        if path is None:
+            if not self._defined_output_path:
+                raise ValueError("Dump dir or job name not set")
+            os.makedirs(self.dump_dir, exist_ok=True)
+            path = os.path.join(self.dump_dir, self.job_name + "_checkpoint.h5")
+        self.checkpoint = Checkpoint(path, compression, keep_mps, interval)
+        self.write_checkpoint()
+
+    def get_checkpoint_series(self) -> Dict[str, list]:
+        """
+        The per-step results to store in the checkpoint.
+        The lists are restored in-place when the job is resumed.
+
+        :return: a dict of the lists.
+        """
+        series = {}
+        for name in self.checkpoint_series:
+            value = getattr(self, name)
+            if value is not None:
+                series[name] = value
+        return series
+
+    def write_checkpoint(self):
+        if self.checkpoint is None:
+            raise ValueError("Checkpoint not enabled")
+        attrs = {name: getattr(self, name) for name in self.checkpoint_attrs}
+        self.checkpoint.write(len(self.evolve_times) - 1, self.latest_mps, self.get_checkpoint_series(), attrs)
+
+    def _load_checkpoint(self, path):
+        logger.info(f"Resuming TDMPS job from {path}")
+        self.checkpoint = Checkpoint.open(path)
+        step, mps, series, attrs = self.checkpoint.load()
+        for name, value in attrs.items():
+            setattr(self, name, value)
+        for name, value in self.get_checkpoint_series().items():
+            value[:] = series.get(name, [])
+        assert len(self.evolve_times) == step + 1
+        self.latest_mps = mps
+        logger.info(f"Resumed at step {step}, time {self.latest_evolve_time}. MPS: {mps}")
+
     def init_mps(self):
         """
         :return: initial mps of the system
@@ -156,6 +247,13 @@ class TdMpsJob(object):
                 dump_wall_time = datetime.now()
                 logger.info(f"Dumping time cost {dump_wall_time - evolution_wall_time}")
 
+            # checkpoint
+            if self.checkpoint is not None and (len(self.evolve_times) - 1) % self.checkpoint.interval == 0:
+                try:
+                    self.write_checkpoint()
+                except IOError:  # never quit calculation because of IOError
+                    logger.exception("writing checkpoint failed with IOError")
+
         logger.info(f"{len(wall_times)-1} steps of evolution complete!")
         logger.info(
             "Normal termination. Time cost: %s" % (wall_times[-1] - wall_times[0])
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import pytest
+
+from renormalizer.utils import TdMpsJob
+from renormalizer.utils.checkpoint import Checkpoint
+
+
+class RotationJob(TdMpsJob):
+    # a toy job rotating a 2d vector
+
+    checkpoint_series = ["evolve_times", "results", "vectors"]
+    checkpoint_attrs = ["rotation"]
+
+    def __init__(self, dump_dir, job_name):
+        self.n_init = 0
+        self.rotation = None
+        self.results = []
+        self.vectors = []
+        super().__init__(dump_dir=dump_dir, job_name=job_name)
+
+    def init_mps(self):
+        self.n_init += 1
+        self.rotation = np.array([[0, -1], [1, 0]])
+        return np.array([1., 0.])
+
+    def process_mps(self, mps):
+        self.results.append(mps[0] + 1j * mps[1])
+        self.vectors.append(mps)
+
+    def evolve_single_step(self, evolve_dt):
+        return self.rotation @ self.latest_mps
+
+    def get_dump_dict(self):
+        return {"results": self.results}
+
+
+@pytest.mark.parametrize("keep_mps", ["one", "all"])
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_resume(tmp_path, keep_mps, compression):
+    job = RotationJob(str(tmp_path), "rotation")
+    job.enable_checkpoint(compression=compression, keep_mps=keep_mps)
+    path = os.path.join(tmp_path, "rotation_checkpoint.h5")
+    assert Checkpoint(path).last_step == 0
+    job.evolve(evolve_dt=0.1, nsteps=3)
+    assert job.checkpoint.last_step == 3
+
+    resumed = RotationJob.resume(path, str(tmp_path), "rotation")
+    # the initial state is not calculated again
+    assert resumed.n_init == 0
+    assert np.allclose(resumed.rotation, job.rotation)
+    assert np.allclose(resumed.latest_mps, job.latest_mps)
+    assert np.allclose(resumed.evolve_times, job.evolve_times)
+    assert np.allclose(resumed.results, job.results)
+
+    job.evolve(evolve_dt=0.1, nsteps=2)
+    resumed.evolve(evolve_dt=0.1, nsteps=2)
+    assert np.allclose(resumed.results, job.results)
+    assert np.allclose(resumed.vectors, job.vectors)
+    _, _, series, _ = Checkpoint(path).load()
+    assert len(series["results"]) == 6
+    if keep_mps == "all":
+        assert np.allclose(Checkpoint(path).load(1)[1], [0, 1])
+
+
+def test_uncommitted(tmp_path):
+    path = os.path.join(tmp_path, "checkpoint.h5")
+    ckpt = Checkpoint(path, interval=2)
+    series = {"a": [1., 2.], "b": [np.zeros(2), np.ones(3)]}
+    ckpt.write(1, "mps1", series, {"c": "c"})
+    # results that are not committed are dropped
+    series["a"].extend([3j, 4j])
+    series["b"].append(np.ones(4))
+    step, mps, loaded, attrs = ckpt.load()
+    assert step == 1 and mps == "mps1" and attrs == {"c": "c"}
+    assert loaded["a"] == [1., 2.] and len(loaded["b"]) == 2
+    ckpt.write(3, "mps3", series, {"c": "d"})
+    step, mps, loaded, attrs = ckpt.load()
+    assert step == 3 and mps == "mps3" and attrs == {"c": "c"}
+    assert np.allclose(loaded["a"], [1, 2, 3j, 4j])
+    assert [len(b) for b in loaded["b"]] == [2, 3, 4]
+
+
+def test_disk_usage(tmp_path):
+    # the disk usage does not grow with the number of steps if only the latest snapshot is kept
+    path = os.path.join(tmp_path, "checkpoint.h5")
+    ckpt = Checkpoint(path)
+    mps = np.random.rand(200_000)
+    series = {"a": []}
+
+    def disk_usage():
+        files = [path, ckpt.snapshot_path(0), ckpt.snapshot_path(1)]
+        return sum(os.path.getsize(f) for f in files if os.path.exists(f))
+
+    sizes = []
+    for step in range(20):
+        series["a"].append(step)
+        ckpt.write(step, mps + step, series, {})
+        sizes.append(disk_usage())
+    assert sizes[-1] - sizes[4] < mps.nbytes / 10
+    step, loaded_mps, loaded, _ = ckpt.load()
+    assert step == 19 and np.allclose(loaded_mps, mps + 19)
+    assert loaded["a"] == list(range(20))
+    with pytest.raises(ValueError):
+        ckpt.load(18)
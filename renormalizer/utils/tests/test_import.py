@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# the time budget of `import renormalizer` in seconds. Wall-clock time depends
+# on the machine and its load, so the timing check only runs when it is set
+IMPORT_TIME_BUDGET = os.environ.get("RENO_IMPORT_TIME_BUDGET")
+
+# the heavy dependencies only required by a few functions
+LAZY_MODULES = ["sympy", "h5py", "qutip", "scipy.stats", "scipy.integrate"]
+
+SCRIPT = f"""
+import json, sys, time
+time1 = time.perf_counter()
+import renormalizer
+time2 = time.perf_counter()
+print(json.dumps([time2 - time1, [m for m in {LAZY_MODULES} if m in sys.modules]]))
+"""
+
+
+def run_import():
+    env = dict(os.environ, RENO_LOG_LEVEL="40")
+    output = subprocess.check_output([sys.executable, "-c", SCRIPT], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def test_import():
+    _, imported = run_import()
+    assert imported == []
+
+
+@pytest.mark.skipif(IMPORT_TIME_BUDGET is None, reason="RENO_IMPORT_TIME_BUDGET not set")
+def test_import_time():
+    # the fastest of several runs to reduce the noise
+    import_time = min(run_import()[0] for _ in range(3))
+    assert import_time < float(IMPORT_TIME_BUDGET)
+
+
+def test_lazy_import():
+    from renormalizer.model.basis import sp
+    assert sp.sympify("x + 1").free_symbols == {sp.Symbol("x")}
@@ -4,7 +4,11 @@
 """
 useful utilities
 """
-from typing import List, Union
+import importlib
+import subprocess
+import types
+from functools import lru_cache
+from typing import List, Union, Iterable, Tuple, Any
 
 
 import numpy as np
@@ -20,6 +24,42 @@ def sizeof_fmt(num, suffix="B"):
     return "%.1f%s%s" % (num, "Yi", suffix)
 
 
+@lru_cache(None)
+def get_git_commit_hash():
+    # called when a job starts rather than at import time to avoid the subprocess for every process
+    try:
+        commit_hash = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.PIPE)
+        return commit_hash.strip().decode('utf-8')
+    # FileNotFoundError for windows
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "Unknown"
+
+
+class LazyModule(types.ModuleType):
+    """
+    A module that is imported on the first attribute access.
+    Used for heavy optional dependencies that are only required by a few functions,
+    so that ``import renormalizer`` does not pay for them.
+    """
+
+    def __getattr__(self, name):
+        module = importlib.import_module(self.__name__)
+        # later access does not go through ``__getattr__``
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    Import the module lazily.
+
+    >>> sp = lazy_import("sympy")
+    >>> sp.Symbol("x").name
+    'x'
+    """
+    return LazyModule(name)
+
+
 class cached_property():
     """
     A property that is only computed once per instance and then replaces itself
@@ -56,3 +96,35 @@ def calc_vn_entropy_dm(dm: np.ndarray) -> float:
     dm = dm.reshape((dim, dim))
     w, v = scipy.linalg.eigh(dm)
     return calc_vn_entropy(w)
+
+
+def calc_vn_entropy_dms(dms: List[np.ndarray]) -> np.ndarray:
+    # calculate Von Neumann entropy for a list of density matrices.
+    # The density matrices with the same shape are diagonalized together by stacked ``eigvalsh``
+    entropy = np.zeros(len(dms))
+    groups = {}
+    for i, dm in enumerate(dms):
+        groups.setdefault(dm.shape, []).append(i)
+    for shape, idx in groups.items():
+        dim = int(np.prod(shape[:len(shape) // 2]))
+        w = np.linalg.eigvalsh(np.array([dms[i] for i in idx]).reshape(-1, dim, dim))
+        assert np.allclose(w[w<0], 0)
+        p = w / w.sum(axis=1, keepdims=True)
+        plogp = np.zeros_like(p)
+        mask = 0 < p
+        plogp[mask] = p[mask] * np.log(p[mask])
+        entropy[idx] = -plogp.sum(axis=1)
+    return entropy
+
+
+def iter_vn_entropy(rdms: Iterable[Tuple[Any, np.ndarray]], batch_size: int = 256):
+    # calculate Von Neumann entropy for ``(key, density matrix)`` pairs from an iterable.
+    # The density matrices are diagonalized in batches of ``batch_size`` and then discarded
+    keys, dms = [], []
+    for key, dm in rdms:
+        keys.append(key)
+        dms.append(dm)
+        if len(dms) == batch_size:
+            yield from zip(keys, calc_vn_entropy_dms(dms))
+            keys, dms = [], []
+    yield from zip(keys, calc_vn_entropy_dms(dms))